@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import logging
+import sys
+import time
+from distutils.util import strtobool
+
+import numpy as np
+
+from banded_dtw import batch_dtw_org_to_trg, dtw_org_to_trg
+
+
+def random_pairs(n_pairs, min_len, max_len, dim, seed=1):
+    """FUNCTION TO GENERATE RANDOM SEQUENCE PAIRS, TARGET IS A TIME-WARPED NOISY VERSION OF ORIGINAL
+
+    Return:
+        (list): original sequences
+        (list): target sequences
+    """
+    rng = np.random.RandomState(seed)
+    org_list = []
+    trg_list = []
+    for _ in range(n_pairs):
+        T_org = rng.randint(min_len, max_len+1)
+        T_trg = int(np.clip(T_org*rng.uniform(0.8, 1.25), min_len, max_len))
+        org = np.abs(np.cumsum(rng.randn(T_org, dim), 0)) + 1e-3
+        warp = np.clip(np.round(np.sort(rng.uniform(0, T_org-1, T_trg))).astype(np.int64), 0, T_org-1)
+        org_list.append(org)
+        trg_list.append(org[warp] + np.abs(0.1*rng.randn(T_trg, dim)))
+    return org_list, trg_list
+
+
+def pad_batch(seq_list):
+    lens = np.array([x.shape[0] for x in seq_list])
+    batch = np.zeros((len(seq_list), np.max(lens), seq_list[0].shape[1]))
+    for i, x in enumerate(seq_list):
+        batch[i,:lens[i]] = x
+    return batch, lens
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark of in-repo banded / batched dtw against dtw_c extension.")
+    parser.add_argument("--n_pairs", default=32,
+                        type=int, help="number of sequence pairs")
+    parser.add_argument("--min_len", default=100,
+                        type=int, help="minimum number of frames")
+    parser.add_argument("--max_len", default=400,
+                        type=int, help="maximum number of frames")
+    parser.add_argument("--dim", default=80,
+                        type=int, help="feature dimension")
+    parser.add_argument("--batch_size", default=8,
+                        type=int, help="number of pairs per batched dtw")
+    parser.add_argument("--band", default=None,
+                        type=int, help="Sakoe-Chiba band width in frames (if not set, no band)")
+    parser.add_argument("--check", default=False,
+                        type=strtobool, help="flag to fail if the results without band differ from dtw_c")
+    parser.add_argument("--tol", default=1e-6,
+                        type=float, help="tolerance of distance values for --check")
+    args = parser.parse_args()
+    if args.check and args.band is not None:
+        logging.basicConfig(level=logging.INFO)
+        logging.error("--check compares the unbanded dtw, --band should not be set.")
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S')
+
+    org_list, trg_list = random_pairs(args.n_pairs, args.min_len, args.max_len, args.dim)
+
+    mismatch = False
+    for mcd in [-1, 0, 1]:
+        logging.info("mcd=%d" % mcd)
+        results = {}
+
+        start = time.time()
+        results["single"] = [dtw_org_to_trg(org, trg, mcd=mcd, band=args.band) for org, trg in zip(org_list, trg_list)]
+        logging.info("banded_dtw single: %.3f sec" % (time.time() - start))
+
+        start = time.time()
+        results["batch"] = []
+        for i in range(0, args.n_pairs, args.batch_size):
+            org, org_lens = pad_batch(org_list[i:i+args.batch_size])
+            trg, trg_lens = pad_batch(trg_list[i:i+args.batch_size])
+            results["batch"].extend(zip(*batch_dtw_org_to_trg(org, trg, org_lens, trg_lens, mcd=mcd, band=args.band)))
+        logging.info("banded_dtw batch %d: %.3f sec" % (args.batch_size, time.time() - start))
+
+        try:
+            from dtw_c import dtw_c as dtw
+        except ImportError:
+            if args.check:
+                logging.error("dtw_c is not installed, parity cannot be checked.")
+                sys.exit(1)
+            logging.warning("dtw_c is not installed, comparison is skipped.")
+            continue
+        start = time.time()
+        results["dtw_c"] = [dtw.dtw_org_to_trg(np.array(org, dtype=np.float64), np.array(trg, dtype=np.float64), mcd=mcd) \
+                                for org, trg in zip(org_list, trg_list)]
+        logging.info("dtw_c: %.3f sec" % (time.time() - start))
+
+        for key in ["single", "batch"]:
+            twf_match = []
+            value_diff = []
+            n_diff = 0
+            for res, ref in zip(results[key], results["dtw_c"]):
+                twf = np.array(ref[1])
+                twf_match.append(np.mean(res[1][:,0] == twf[:,0]))
+                value_diff.append(max(np.abs(res[2] - ref[2]), np.abs(res[3] - ref[3])))
+                if res[1].shape != twf.shape or np.any(res[1] != twf) \
+                        or np.max(np.abs(res[0] - np.array(ref[0]))) > args.tol or value_diff[-1] > args.tol:
+                    n_diff += 1
+            logging.info("%s vs dtw_c: twf match %.2f %%, value abs. diff %.6f (max %.6f), %d / %d pairs differ" % (key,
+                100*np.mean(twf_match), np.mean(value_diff), np.max(value_diff), n_diff, args.n_pairs))
+            if n_diff > 0:
+                mismatch = True
+
+    if args.check:
+        if mismatch:
+            logging.error("banded_dtw differs from dtw_c.")
+            sys.exit(1)
+        logging.info("banded_dtw matches dtw_c.")
+
+
+if __name__ == "__main__":
+    main()
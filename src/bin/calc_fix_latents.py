@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+
+import argparse
+import logging
+import os
+import sys
+from distutils.util import strtobool
+
+import numpy as np
+import soundfile as sf
+import torch
+import torch.nn.functional as F
+
+from utils import find_files
+from utils import read_hdf5
+from utils import read_txt
+from utils import write_hdf5
+from devices import get_device, device_context
+from checkpoint_io import load_model_states
+from dataset import spcidx_crop_range
+
+from vcneuvoco import GRU_VAE_ENCODER, optimize_for_inference
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    # decode setting
+    parser.add_argument("--feats", required=True,
+                        type=str, help="list or directory of feature files (training and development)")
+    parser.add_argument("--model", required=True,
+                        type=str, help="model file of the fixed encoders, i.e., --gen_model of fine-tuning")
+    parser.add_argument("--config", required=True,
+                        type=str, help="configure file of --model")
+    parser.add_argument("--string_path", default="/log_1pmelmagsp",
+                        type=str, help="path of input features in the feature files")
+    parser.add_argument("--string_path_fix", default="/lat_fix",
+                        type=str, help="path of latents in the feature files, speaker posteriors are written to <path>_spk")
+    parser.add_argument("--waveforms", default=None,
+                        type=str, help="list or directory of waveform files of --feats, to trim the frames to the waveform "\
+                            "length as in training (if not set, all frames of the features)")
+    parser.add_argument("--upsampling_factor", default=None,
+                        type=int, help="number of samples per frame of --waveforms (if not set, from config)")
+    parser.add_argument("--spcidx", default=True,
+                        type=strtobool, help="flag to encode the speech segment cropped as in training (/spcidx_range)")
+    parser.add_argument("--n_utt", default=1,
+                        type=int, help="number of utterances of a mixed-length batch, only the valid frames are computed")
+    parser.add_argument("--GPU_device", default=None,
+                        type=int, help="selection of GPU device")
+    parser.add_argument("--device", default=None,
+                        type=str, help="compute device, cuda or cpu (if not set, cuda if available, otherwise cpu)")
+    parser.add_argument("--n_threads", default=0,
+                        type=int, help="number of cpu intra-op threads (if set 0, available cores)")
+    parser.add_argument("--n_interop_threads", default=0,
+                        type=int, help="number of cpu inter-op threads (if set 0, 1 thread)")
+    parser.add_argument("--verbose", default=1,
+                        type=int, help="log level")
+    args = parser.parse_args()
+
+    if args.GPU_device is not None:
+        os.environ["CUDA_DEVICE_ORDER"]     = "PCI_BUS_ID"
+        os.environ["CUDA_VISIBLE_DEVICES"]  = str(args.GPU_device)
+
+    # set log level
+    if args.verbose > 0:
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
+                            datefmt='%m/%d/%Y %I:%M:%S')
+    else:
+        logging.basicConfig(level=logging.WARN,
+                            format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
+                            datefmt='%m/%d/%Y %I:%M:%S')
+        logging.warn("logging is disabled.")
+
+    # load config
+    config = torch.load(args.config)
+
+    # get file list
+    if os.path.isdir(args.feats):
+        feat_list = sorted(find_files(args.feats, "*.h5"))
+    elif os.path.isfile(args.feats):
+        feat_list = read_txt(args.feats)
+    else:
+        logging.error("--feats should be directory or list.")
+        sys.exit(1)
+    if args.waveforms is not None:
+        if os.path.isdir(args.waveforms):
+            wav_list = sorted(find_files(args.waveforms, "*.wav"))
+        elif os.path.isfile(args.waveforms):
+            wav_list = read_txt(args.waveforms)
+        else:
+            logging.error("--waveforms should be directory or list.")
+            sys.exit(1)
+        assert(len(wav_list)==len(feat_list))
+        upsampling_factor = args.upsampling_factor if args.upsampling_factor is not None \
+                                else getattr(config, "upsampling_factor", None)
+        if upsampling_factor is None:
+            logging.error("--upsampling_factor is needed with --waveforms.")
+            sys.exit(1)
+    else:
+        wav_list = None
+
+    n_spk = len(config.spk_list.split('@'))
+
+    device = get_device(args.device, n_threads=args.n_threads, n_interop_threads=args.n_interop_threads)
+    with device_context(device), torch.no_grad():
+        # the same frozen copies as model_encoder_melsp_fix / model_encoder_excit_fix of fine-tuning
+        model_encoder_melsp = GRU_VAE_ENCODER(
+            in_dim=config.mel_dim,
+            n_spk=n_spk,
+            lat_dim=config.lat_dim,
+            hidden_layers=config.hidden_layers_enc,
+            hidden_units=config.hidden_units_enc,
+            kernel_size=config.kernel_size_enc,
+            dilation_size=config.dilation_size_enc,
+            causal_conv=config.causal_conv_enc,
+            pad_first=True,
+            right_size=config.right_size_enc)
+        logging.info(model_encoder_melsp)
+        model_encoder_excit = GRU_VAE_ENCODER(
+            in_dim=config.mel_dim,
+            n_spk=n_spk,
+            lat_dim=config.lat_dim_e,
+            hidden_layers=config.hidden_layers_enc,
+            hidden_units=config.hidden_units_enc,
+            kernel_size=config.kernel_size_enc,
+            dilation_size=config.dilation_size_enc,
+            causal_conv=config.causal_conv_enc,
+            pad_first=True,
+            right_size=config.right_size_enc)
+        logging.info(model_encoder_excit)
+        checkpoint, weight_norm_folded = load_model_states(args.model, map_location=device)
+        if weight_norm_folded:
+            model_encoder_melsp.remove_weight_norm()
+            model_encoder_excit.remove_weight_norm()
+        model_encoder_melsp.load_state_dict(checkpoint["model_encoder_melsp"])
+        model_encoder_excit.load_state_dict(checkpoint["model_encoder_excit"])
+        model_encoder_melsp.to(device)
+        model_encoder_excit.to(device)
+        optimize_for_inference(model_encoder_melsp)
+        optimize_for_inference(model_encoder_excit)
+
+        for idx in range(0, len(feat_list), args.n_utt):
+            feat_files = feat_list[idx:idx+args.n_utt]
+            # the frames of the training dataset (FeatureDatasetCycMceplf0WavVAE): trimmed to the waveform length,
+            # then cropped to the speech segment, where the encoders start with zero states
+            feats = [None]*len(feat_files)
+            frm_ranges = [None]*len(feat_files)
+            for i, feat_file in enumerate(feat_files):
+                feat = read_hdf5(feat_file, args.string_path)
+                frm_len = feat.shape[0]
+                if wav_list is not None:
+                    frm_len = min(frm_len, sf.info(wav_list[idx+i]).frames // upsampling_factor)
+                if args.spcidx:
+                    frm_ranges[i] = spcidx_crop_range(read_hdf5(feat_file, '/spcidx_range')[0], frm_len)
+                else:
+                    frm_ranges[i] = (0, frm_len)
+                feats[i] = torch.FloatTensor(feat[frm_ranges[i][0]:frm_ranges[i][1]]).to(device)
+            lengths = [feat.shape[0] for feat in feats]
+            # each cropped utterance with replicate padding of the receptive field, i.e., the frames of segmented training
+            # with the carried hidden states, then zero padding of the batch
+            feat_in = [None]*len(feats)
+            feat_in_e = [None]*len(feats)
+            for i, feat in enumerate(feats):
+                feat_in[i] = F.pad(F.pad(feat.t().unsqueeze(0), (model_encoder_melsp.pad_left,model_encoder_melsp.pad_right), "replicate"),
+                                (0,max(lengths)-lengths[i]))[0].t()
+                feat_in_e[i] = F.pad(F.pad(feat.t().unsqueeze(0), (model_encoder_excit.pad_left,model_encoder_excit.pad_right), "replicate"),
+                                (0,max(lengths)-lengths[i]))[0].t()
+            spk_logits, qz_alpha, _, _ = model_encoder_melsp(torch.stack(feat_in), sampling=False, lengths=lengths)
+            spk_logits_e, qz_alpha_e, _, _ = model_encoder_excit(torch.stack(feat_in_e), sampling=False, lengths=lengths)
+            assert(qz_alpha.shape[1]==max(lengths))
+            lat_fix = torch.cat((qz_alpha, qz_alpha_e), 2).cpu().data.numpy()
+            spk_post = torch.cat((F.softmax(spk_logits, dim=-1), F.softmax(spk_logits_e, dim=-1)), 2).cpu().data.numpy()
+            for i, feat_file in enumerate(feat_files):
+                write_hdf5(feat_file, args.string_path_fix, lat_fix[i,:lengths[i]])
+                write_hdf5(feat_file, args.string_path_fix+"_spk", spk_post[i,:lengths[i]])
+                write_hdf5(feat_file, args.string_path_fix+"_range", np.array(frm_ranges[i], dtype=np.int64))
+                logging.info("%s %s %s %s" % (feat_file, str(frm_ranges[i]), str(lat_fix[i,:lengths[i]].shape),
+                                str(spk_post[i,:lengths[i]].shape)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import copy
+import logging
+import sys
+from distutils.util import strtobool
+
+import torch
+import torch.nn.functional as F
+from torch.distributions.one_hot_categorical import OneHotCategorical
+
+from devices import get_device
+from checkpoint_io import load_model_states
+from vcneuvoco import GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF, optimize_for_inference
+from vcneuvoco import decode_mu_law_torch, MIN_CLAMP, MAX_CLAMP
+from sparse_gru import replace_sparse_gru
+
+
+def generate_reference(model, c, pad_first=True):
+    """FUNCTION TO SAMPLE MULTIBAND WAVEFORM CODES WITH THE FULL GRU LAYERS, CONCATENATED OUTPUTS, AND SHIFTED LPC HISTORY
+
+    The original implementation of GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF.generate(),
+    which should draw the same codes under the same seed.
+
+    Args:
+        model (GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF): waveform model
+        c (Tensor): conditioning features (B x T_frm x C)
+        pad_first (bool): flag to replicate-pad the receptive field of the input conv.
+
+    Return:
+        (Tensor): multiband waveform (B x n_bands x T)
+    """
+    upsampling_factor = model.upsampling_factor
+
+    c_pad = (model.n_quantize // 2) // model.cf_dim
+    f_pad = (model.n_quantize // 2) % model.cf_dim
+
+    B = c.shape[0]
+
+    # Input
+    if pad_first:
+        c = F.pad(c.transpose(1,2), (model.pad_left,model.pad_right), "replicate").transpose(1,2)
+    if model.scale_in_flag:
+        c = model.conv_s_c(model.conv(model.scale_in(c.transpose(1,2)))).transpose(1,2)
+    else:
+        c = model.conv_s_c(model.conv(c.transpose(1,2))).transpose(1,2)
+
+    if model.lpc > 0:
+        x_c_lpc = torch.empty(B,1,model.n_bands,model.lpc, dtype=torch.long, device=c.device).fill_(c_pad) # B x 1 x n_bands x K
+        x_f_lpc = torch.empty(B,1,model.n_bands,model.lpc, dtype=torch.long, device=c.device).fill_(f_pad) # B x 1 x n_bands x K
+    T = c.shape[1]*upsampling_factor
+
+    c_f = c[:,:1]
+    out, h = model.gru(torch.cat((c_f,model.embed_c_wav(torch.empty(B,1,model.n_bands, dtype=torch.long, device=c.device).fill_(c_pad)).reshape(B,1,-1),
+                                    model.embed_f_wav(torch.empty(B,1,model.n_bands, dtype=torch.long, device=c.device).fill_(f_pad)).reshape(B,1,-1)),2))
+    out, h_2 = model.gru_2(torch.cat((c_f,out), 2))
+    if model.lpc > 0:
+        # coarse part
+        signs_c, scales_c, logits_c = model.out(out.transpose(1,2)) # B x 1 x n_bands x K or 32
+        if model.emb_flag:
+            dist = OneHotCategorical(F.softmax(torch.clamp(logits_c + torch.sum(model.logits(x_c_lpc)*(signs_c*scales_c).unsqueeze(-1)\
+                        *model.logits_c(x_c_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+        else:
+            dist = OneHotCategorical(F.softmax(torch.clamp(logits_c + torch.sum((signs_c*scales_c).unsqueeze(-1)*model.logits(x_c_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+        # B x 1 x n_bands x 256, B x 1 x n_bands x K x 256 --> B x 1 x n_bands x 2 x 256
+        x_c_out = x_c_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
+        x_c_lpc[:,:,:,1:] = x_c_lpc[:,:,:,:-1]
+        x_c_lpc[:,:,:,0] = x_c_wav
+        # fine part
+        embed_x_c_wav = model.embed_c_wav(x_c_wav).reshape(B,1,-1)
+        out, h_f = model.gru_f(torch.cat((c_f, embed_x_c_wav, out), 2))
+        signs_f, scales_f, logits_f = model.out_f(out.transpose(1,2)) # B x 1 x n_bands x K or 32
+        if model.emb_flag:
+            dist = OneHotCategorical(F.softmax(torch.clamp(logits_f + torch.sum(model.logits(x_f_lpc)*(signs_f*scales_f).unsqueeze(-1)\
+                        *model.logits_f(x_f_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+        else:
+            dist = OneHotCategorical(F.softmax(torch.clamp(logits_f + torch.sum((signs_f*scales_f).unsqueeze(-1)*model.logits(x_f_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+        x_f_out = x_f_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
+        x_f_lpc[:,:,:,1:] = x_f_lpc[:,:,:,:-1]
+        x_f_lpc[:,:,:,0] = x_f_wav
+    else:
+        # coarse part
+        dist = OneHotCategorical(F.softmax(torch.clamp(model.out(out.transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+        x_c_out = x_c_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
+        # fine part
+        embed_x_c_wav = model.embed_c_wav(x_c_wav).reshape(B,1,-1)
+        out, h_f = model.gru_f(torch.cat((c_f, embed_x_c_wav, out), 2))
+        dist = OneHotCategorical(F.softmax(torch.clamp(model.out_f(out.transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+        x_f_out = x_f_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
+
+    if model.lpc > 0:
+        for t in range(1,T):
+            if t % upsampling_factor  == 0:
+                idx_t_f = t//upsampling_factor
+                c_f = c[:,idx_t_f:idx_t_f+1]
+
+            out, h = model.gru(torch.cat((c_f, embed_x_c_wav, model.embed_f_wav(x_f_wav).reshape(B,1,-1)),2), h)
+            out, h_2 = model.gru_2(torch.cat((c_f,out), 2), h_2)
+
+            # coarse part
+            signs_c, scales_c, logits_c = model.out(out.transpose(1,2)) # B x 1 x n_bands x K or 32
+            if model.emb_flag:
+                dist = OneHotCategorical(F.softmax(torch.clamp(logits_c + torch.sum(model.logits(x_c_lpc)*(signs_c*scales_c).unsqueeze(-1)\
+                            *model.logits_c(x_c_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+            else:
+                dist = OneHotCategorical(F.softmax(torch.clamp(logits_c + torch.sum((signs_c*scales_c).unsqueeze(-1)*model.logits(x_c_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+            x_c_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands x 2
+            x_c_out = torch.cat((x_c_out, x_c_wav), 1) # B x t+1 x n_bands
+            x_c_lpc[:,:,:,1:] = x_c_lpc[:,:,:,:-1]
+            x_c_lpc[:,:,:,0] = x_c_wav
+
+            # fine part
+            embed_x_c_wav = model.embed_c_wav(x_c_wav).reshape(B,1,-1)
+            out, h_f = model.gru_f(torch.cat((c_f, embed_x_c_wav, out), 2), h_f)
+            signs_f, scales_f, logits_f = model.out_f(out.transpose(1,2)) # B x 1 x n_bands x K or 32
+            if model.emb_flag:
+                dist = OneHotCategorical(F.softmax(torch.clamp(logits_f + torch.sum(model.logits(x_f_lpc)*(signs_f*scales_f).unsqueeze(-1)\
+                            *model.logits_f(x_f_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+            else:
+                dist = OneHotCategorical(F.softmax(torch.clamp(logits_f + torch.sum((signs_f*scales_f).unsqueeze(-1)*model.logits(x_f_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+            x_f_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
+            x_f_out = torch.cat((x_f_out, x_f_wav), 1) # B x t+1 x n_bands
+            x_f_lpc[:,:,:,1:] = x_f_lpc[:,:,:,:-1]
+            x_f_lpc[:,:,:,0] = x_f_wav
+    else:
+        for t in range(1,T):
+            if t % upsampling_factor  == 0:
+                idx_t_f = t//upsampling_factor
+                c_f = c[:,idx_t_f:idx_t_f+1]
+
+            out, h = model.gru(torch.cat((c_f, embed_x_c_wav, model.embed_f_wav(x_f_wav).reshape(B,1,-1)),2), h)
+            out, h_2 = model.gru_2(torch.cat((c_f,out),2), h_2)
+
+            # coarse part
+            dist = OneHotCategorical(F.softmax(torch.clamp(model.out(out.transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+            x_c_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
+            x_c_out = torch.cat((x_c_out, x_c_wav), 1) # B x t+1 x n_bands
+
+            # fine part
+            embed_x_c_wav = model.embed_c_wav(x_c_wav).reshape(B,1,-1)
+            out, h_f = model.gru_f(torch.cat((c_f, embed_x_c_wav, out), 2), h_f)
+            dist = OneHotCategorical(F.softmax(torch.clamp(model.out_f(out.transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+            x_f_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
+            x_f_out = torch.cat((x_f_out, x_f_wav), 1) # B x t+1 x n_bands
+
+    if model.n_quantize == 65536:
+        return ((x_c_out*model.cf_dim+x_f_out).transpose(1,2).float() - 32768.0) / 32768.0 # B x T x n_bands --> B x n_bands x T
+    else:
+        return decode_mu_law_torch((x_c_out*model.cf_dim+x_f_out).transpose(1,2).float(), mu=model.n_quantize) # B x T x n_bands --> B x n_bands x T
+
+
+def sample(model, c, seed, reference=False):
+    """FUNCTION TO SAMPLE WAVEFORM WITH A FIXED SEED
+
+    Return:
+        (Tensor): multiband waveform (B x n_bands x T)
+    """
+    torch.manual_seed(seed)
+    with torch.no_grad():
+        if reference:
+            return generate_reference(model, c)
+        return model.generate(c)
+
+
+def compare(name, output, output_ref):
+    """FUNCTION TO COMPARE SAMPLED WAVEFORM WITH THE REFERENCE SAMPLER
+
+    The mu-law / 16-bit decoding of the codes is one-to-one, so equal outputs are equal codes.
+
+    Return:
+        (bool): True if all of the samples are equal
+    """
+    if output.shape != output_ref.shape:
+        logging.error("%s: shape %s differs from reference %s" % (name, str(output.shape), str(output_ref.shape)))
+        return False
+    equal = output == output_ref # B x n_bands x T
+    if bool(torch.all(equal)):
+        logging.info("%s: all of %d samples are equal to reference" % (name, equal.numel()))
+        return True
+    first = torch.nonzero(~torch.all(torch.all(equal, 0), 0))[0].item()
+    logging.error("%s: %.2f %% of samples are equal to reference, first mismatch at sample %d" % (name,
+        100*torch.mean(equal.float()).item(), first))
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="check that generate() draws the same waveform codes as the reference sampler under the same seed.")
+    parser.add_argument("--config", required=True,
+                        type=str, help="path of model config")
+    parser.add_argument("--checkpoint", default=None,
+                        type=str, help="path of model checkpoint (if not set, random initialization)")
+    parser.add_argument("--n_frames", default=20,
+                        type=int, help="number of frames of random conditioning features")
+    parser.add_argument("--batch_size", default=2,
+                        type=int, help="number of sequences")
+    parser.add_argument("--double", default=True,
+                        type=strtobool, help="flag to sample in float64, so that rounding does not flip the codes")
+    parser.add_argument("--inference_opt", default=True,
+                        type=strtobool, help="flag to also check the model after optimize_for_inference / "
+                            "replace_sparse_gru (cpu) as in decoding")
+    parser.add_argument("--seed", default=1,
+                        type=int, help="seed number")
+    parser.add_argument("--device", default=None,
+                        type=str, help="compute device, cuda or cpu (if not set, cuda if available, otherwise cpu)")
+    parser.add_argument("--verbose", default=1,
+                        type=int, help="log level")
+    args = parser.parse_args()
+
+    # set log level
+    if args.verbose > 0:
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
+                            datefmt='%m/%d/%Y %I:%M:%S')
+    else:
+        logging.basicConfig(level=logging.WARN,
+                            format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
+                            datefmt='%m/%d/%Y %I:%M:%S')
+        logging.warn("logging is disabled.")
+
+    torch.manual_seed(args.seed)
+    config = torch.load(args.config)
+    device = get_device(args.device)
+
+    model = GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF(
+        feat_dim=config.mcep_dim+config.excit_dim,
+        upsampling_factor=config.upsampling_factor,
+        hidden_units=config.hidden_units_wave,
+        hidden_units_2=config.hidden_units_wave_2,
+        kernel_size=config.kernel_size_wave,
+        dilation_size=config.dilation_size_wave,
+        n_quantize=config.n_quantize,
+        causal_conv=config.causal_conv_wave,
+        right_size=config.right_size,
+        n_bands=config.n_bands,
+        pad_first=True,
+        mid_dim=config.mid_dim,
+        emb_flag=True,
+        lpc=config.lpc)
+    logging.info(model)
+    if args.checkpoint is not None:
+        checkpoint, weight_norm_folded = load_model_states(args.checkpoint, map_location=device)
+        if weight_norm_folded:
+            model.remove_weight_norm()
+        model.load_state_dict(checkpoint["model_waveform"])
+    model.remove_weight_norm()
+    model.to(device)
+    model.eval()
+    for param in model.parameters():
+        param.requires_grad = False
+    if args.double:
+        model.double()
+
+    c = torch.randn(args.batch_size, args.n_frames, config.mcep_dim+config.excit_dim, device=device)
+    if args.double:
+        c = c.double()
+
+    # reference: full GRU layers, concatenated outputs, shifted LPC history
+    output_ref = sample(model, c, args.seed, reference=True)
+
+    # ring buffers + GRUStep + lookup tables, built in every call and cached as in decoding
+    results = [compare("generate", sample(model, c, args.seed), output_ref)]
+    model.build_gru_steps()
+    results.append(compare("generate (cached gru_steps)", sample(model, c, args.seed), output_ref))
+    model.gru_steps = None
+
+    if args.inference_opt:
+        model_opt = copy.deepcopy(model)
+        optimize_for_inference(model_opt)
+        if device.type == "cpu":
+            replace_sparse_gru(model_opt)
+        model_opt.build_gru_steps()
+        results.append(compare("generate (inference optimized)", sample(model_opt, c, args.seed), output_ref))
+
+    if not all(results):
+        logging.error("generate() differs from the reference sampler.")
+        sys.exit(1)
+    logging.info("generate() matches the reference sampler.")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,14 +24,18 @@ from utils import read_hdf5
 from utils import read_txt
 from utils import check_hdf5
 from utils import write_hdf5
+from devices import get_device, device_context
+from checkpoint_io import load_model_states
 
 #import matplotlib.pyplot as plt
 
 import soundfile as sf
 
 from vcneuvoco import GRU_VAE_ENCODER, GRU_SPEC_DECODER
-from vcneuvoco import SPKID_TRANSFORM_LAYER
-from dtw_c import dtw_c as dtw
+from vcneuvoco import SPKID_TRANSFORM_LAYER, optimize_for_inference
+from sparse_gru import replace_sparse_gru
+from precision import autocast_methods
+from eval_metrics import DTWEvalPool
 
 #import pysptk as ps
 #import pyworld as pw
@@ -70,7 +74,7 @@ def main():
     parser.add_argument("--spk_trg", required=True,
                         type=str, help="speaker target")
     parser.add_argument("--n_gpus", default=N_GPUS,
-                        type=int, help="number of gpus")
+                        type=int, help="number of gpus (number of parallel processes in case of cpu)")
     parser.add_argument("--string_path", required=True,
                         type=str, help="directory to save generated samples")
     # other setting
@@ -86,6 +90,18 @@ def main():
                         type=int, help="selection of GPU device")
     parser.add_argument("--GPU_device_str", default=None,
                         type=str, help="selection of GPU device")
+    parser.add_argument("--device", default=None,
+                        type=str, help="compute device, cuda or cpu (if not set, cuda if available, otherwise cpu)")
+    parser.add_argument("--n_threads", default=0,
+                        type=int, help="number of cpu intra-op threads per process (if set 0, available cores / n_gpus)")
+    parser.add_argument("--n_interop_threads", default=0,
+                        type=int, help="number of cpu inter-op threads per process (if set 0, 1 thread)")
+    parser.add_argument("--n_eval_workers", default=1,
+                        type=int, help="number of processes of DTW-based metrics per decoding process (if set 0, computed in the decoding process)")
+    parser.add_argument("--sparse_gru", default=True,
+                        type=strtobool, help="use block-sparse recurrent matrix-vector product of sparsified gru layers on cpu")
+    parser.add_argument("--precision", default="fp32",
+                        type=str, help="compute precision, fp32 or bf16 (autocast)")
     parser.add_argument("--verbose", default=VERBOSE,
                         type=int, help="log level")
     args = parser.parse_args()
@@ -171,7 +187,9 @@ def main():
             lsd_cvlist_cyc=None, lsdstd_cvlist_cyc=None,
             lsd_cvlist=None, lsdstd_cvlist=None,
             lat_dist_rmse_list=None, lat_dist_cosim_list=None):
-        with torch.cuda.device(gpu):
+        device = get_device(args.device, gpu=gpu, n_threads=args.n_threads, n_interop_threads=args.n_interop_threads,
+                        n_procs=args.n_gpus)
+        with device_context(device):
             # define model and load parameters
             with torch.no_grad():
                 model_encoder_melsp = GRU_VAE_ENCODER(
@@ -219,22 +237,28 @@ def main():
                     conv_emb_flag=True,
                     spkidtr_dim=config.spkidtr_dim)
                 logging.info(model_spkidtr)
-                model_encoder_melsp.load_state_dict(torch.load(args.model)["model_encoder_melsp"])
-                model_decoder_melsp.load_state_dict(torch.load(args.model)["model_decoder_melsp"])
-                model_encoder_excit.load_state_dict(torch.load(args.model)["model_encoder_excit"])
-                model_spkidtr.load_state_dict(torch.load(args.model)["model_spkidtr"])
-                model_encoder_melsp.cuda()
-                model_decoder_melsp.cuda()
-                model_encoder_excit.cuda()
-                model_spkidtr.cuda()
+                checkpoint, weight_norm_folded = load_model_states(args.model, map_location=device)
+                if weight_norm_folded:
+                    model_encoder_melsp.remove_weight_norm()
+                    model_decoder_melsp.remove_weight_norm()
+                    model_encoder_excit.remove_weight_norm()
+                    model_spkidtr.remove_weight_norm()
+                model_encoder_melsp.load_state_dict(checkpoint["model_encoder_melsp"])
+                model_decoder_melsp.load_state_dict(checkpoint["model_decoder_melsp"])
+                model_encoder_excit.load_state_dict(checkpoint["model_encoder_excit"])
+                model_spkidtr.load_state_dict(checkpoint["model_spkidtr"])
+                model_encoder_melsp.to(device)
+                model_decoder_melsp.to(device)
+                model_encoder_excit.to(device)
+                model_spkidtr.to(device)
                 model_encoder_melsp.eval()
                 model_decoder_melsp.eval()
                 model_encoder_excit.eval()
                 model_spkidtr.eval()
-                model_encoder_melsp.remove_weight_norm()
-                model_decoder_melsp.remove_weight_norm()
-                model_encoder_excit.remove_weight_norm()
-                model_spkidtr.remove_weight_norm()
+                optimize_for_inference(model_encoder_melsp)
+                optimize_for_inference(model_decoder_melsp)
+                optimize_for_inference(model_encoder_excit)
+                optimize_for_inference(model_spkidtr)
                 for param in model_encoder_melsp.parameters():
                     param.requires_grad = False
                 for param in model_decoder_melsp.parameters():
@@ -243,6 +267,14 @@ def main():
                     param.requires_grad = False
                 for param in model_spkidtr.parameters():
                     param.requires_grad = False
+                if args.sparse_gru and device.type == "cpu":
+                    replace_sparse_gru(model_encoder_melsp)
+                    replace_sparse_gru(model_decoder_melsp)
+                    replace_sparse_gru(model_encoder_excit)
+                autocast_methods(model_encoder_melsp, device, args.precision)
+                autocast_methods(model_decoder_melsp, device, args.precision)
+                autocast_methods(model_encoder_excit, device, args.precision)
+                autocast_methods(model_spkidtr, device, args.precision)
             count = 0
             pad_left = (model_encoder_melsp.pad_left + model_decoder_melsp.pad_left)*2
             pad_right = (model_encoder_melsp.pad_right + model_decoder_melsp.pad_right)*2
@@ -257,6 +289,7 @@ def main():
             melfb_t = np.linalg.pinv(librosa.filters.mel(args.fs, args.fftl, n_mels=config.mel_dim))
             temp = 0.675
             logging.info(f'temp: {temp}')
+            dtw_eval_pool = DTWEvalPool(args.n_eval_workers)
             for feat_file in feat_list:
                 # convert melsp
                 spk_src = os.path.basename(os.path.dirname(feat_file))
@@ -275,7 +308,7 @@ def main():
 
                 logging.info("generate")
                 with torch.no_grad():
-                    feat = F.pad(torch.FloatTensor(feat_org).cuda().unsqueeze(0).transpose(1,2), (pad_left,pad_right), "replicate").transpose(1,2)
+                    feat = F.pad(torch.FloatTensor(feat_org).to(device).unsqueeze(0).transpose(1,2), (pad_left,pad_right), "replicate").transpose(1,2)
 
                     spk_logits, _, lat_src, _ = model_encoder_melsp(feat, sampling=False)
                     spk_logits_e, _, lat_src_e, _ = model_encoder_excit(feat, sampling=False)
@@ -291,17 +324,17 @@ def main():
                         logging.info(torch.mean(F.softmax(spk_logits_e[:,outpad_lefts[0]:], dim=-1), 1))
 
                     if trg_exist:
-                        spk_trg_logits, _, lat_trg, _ = model_encoder_melsp(F.pad(torch.FloatTensor(feat_trg).cuda().unsqueeze(0).transpose(1,2),
+                        spk_trg_logits, _, lat_trg, _ = model_encoder_melsp(F.pad(torch.FloatTensor(feat_trg).to(device).unsqueeze(0).transpose(1,2),
                                                                         (model_encoder_melsp.pad_left,model_encoder_melsp.pad_right), "replicate").transpose(1,2), sampling=False)
-                        spk_trg_logits_e, _, lat_trg_e, _ = model_encoder_excit(F.pad(torch.FloatTensor(feat_trg).cuda().unsqueeze(0).transpose(1,2),
+                        spk_trg_logits_e, _, lat_trg_e, _ = model_encoder_excit(F.pad(torch.FloatTensor(feat_trg).to(device).unsqueeze(0).transpose(1,2),
                                                                         (model_encoder_excit.pad_left,model_encoder_excit.pad_right), "replicate").transpose(1,2), sampling=False)
                         logging.info('target spkpost')
                         logging.info(torch.mean(F.softmax(spk_trg_logits, dim=-1), 1))
                         logging.info('target spkpost_e')
                         logging.info(torch.mean(F.softmax(spk_trg_logits_e, dim=-1), 1))
 
-                    _, src_code = model_spkidtr((torch.ones((1, lat_src_e.shape[1]))*src_idx).cuda().long())
-                    _, trg_code = model_spkidtr((torch.ones((1, lat_src_e.shape[1]))*trg_idx).cuda().long())
+                    _, src_code = model_spkidtr((torch.ones((1, lat_src_e.shape[1]))*src_idx).to(device).long())
+                    _, trg_code = model_spkidtr((torch.ones((1, lat_src_e.shape[1]))*trg_idx).to(device).long())
                     lat_cat = torch.cat((lat_src_e, lat_src), 2)
                     
                     _, cvmelsp_src, _ = model_decoder_melsp(lat_cat, y=src_code, temp=temp)
@@ -321,7 +354,7 @@ def main():
                     else:
                         logging.info(torch.mean(F.softmax(spk_logits_e[:,outpad_lefts[2]:], dim=-1), 1))
 
-                    _, src_code = model_spkidtr((torch.ones((1, lat_cv_e.shape[1]))*src_idx).cuda().long())
+                    _, src_code = model_spkidtr((torch.ones((1, lat_cv_e.shape[1]))*src_idx).to(device).long())
                     lat_cat = torch.cat((lat_cv_e, lat_cv), 2)
     
                     _, cvmelsp_cyc, _ = model_decoder_melsp(lat_cat, y=src_code, temp=temp)
@@ -384,34 +417,10 @@ def main():
 
                     spcidx_trg = np.array(read_hdf5(file_trg, "/spcidx_range")[0])
 
-                    _, twf_melsp, _, _ = dtw.dtw_org_to_trg(np.array(melsp_cv_rest[spcidx], \
-                                                dtype=np.float64), np.array(melsp_trg_rest[spcidx_trg], dtype=np.float64), mcd=-1)
-                    twf_melsp = np.array(twf_melsp[:,0])
-                    lsd_arr = np.sqrt(np.mean((20*(np.log10(np.clip(melsp_cv_rest[spcidx][twf_melsp], a_min=1e-16, a_max=None))\
-                                                             -np.log10(np.clip(melsp_trg_rest[spcidx_trg], a_min=1e-16, a_max=None))))**2, axis=-1))
-                    lsd_mean = np.mean(lsd_arr)
-                    lsd_std = np.std(lsd_arr)
-                    logging.info("lsd_trg: %.6f dB +- %.6f" % (lsd_mean, lsd_std))
-                    lsd_cvlist.append(lsd_mean)
-                    lsdstd_cvlist.append(lsd_std)
-
-                    spcidx_src = torch.LongTensor(spcidx).cuda()
-                    spcidx_trg = torch.LongTensor(spcidx_trg).cuda()
-
-                    trj_lat_src = np.array(torch.index_select(lat_src[0],0,spcidx_src).cpu().data.numpy(), dtype=np.float64)
-                    trj_lat_trg = np.array(torch.index_select(lat_trg[0],0,spcidx_trg).cpu().data.numpy(), dtype=np.float64)
-                    aligned_lat_srctrg, _, _, _ = dtw.dtw_org_to_trg(trj_lat_src, trj_lat_trg)
-                    lat_dist_srctrg = np.mean(np.sqrt(np.mean((aligned_lat_srctrg-trj_lat_trg)**2, axis=0)))
-                    _, _, lat_cdist_srctrg, _ = dtw.dtw_org_to_trg(trj_lat_trg, trj_lat_src, mcd=0)
-                    aligned_lat_trgsrc, _, _, _ = dtw.dtw_org_to_trg(trj_lat_trg, trj_lat_src)
-                    lat_dist_trgsrc = np.mean(np.sqrt(np.mean((aligned_lat_trgsrc-trj_lat_src)**2, axis=0)))
-                    _, _, lat_cdist_trgsrc, _ = dtw.dtw_org_to_trg(trj_lat_src, trj_lat_trg, mcd=0)
-                    logging.info("%lf %lf %lf %lf" % (lat_dist_srctrg, lat_cdist_srctrg, lat_dist_trgsrc, lat_cdist_trgsrc))
-                    lat_dist_rmse = (lat_dist_srctrg+lat_dist_trgsrc)/2
-                    lat_dist_cosim = (lat_cdist_srctrg+lat_cdist_trgsrc)/2
-                    lat_dist_rmse_list.append(lat_dist_rmse)
-                    lat_dist_cosim_list.append(lat_dist_cosim)
-                    logging.info("lat_dist: %.6f %.6f" % (lat_dist_rmse, lat_dist_cosim))
+                    # DTW-based metrics are computed by eval pool while decoding the next utterances
+                    trj_lat_src = torch.index_select(lat_src[0],0,torch.LongTensor(spcidx).to(device)).cpu().data.numpy()
+                    trj_lat_trg = torch.index_select(lat_trg[0],0,torch.LongTensor(spcidx_trg).to(device)).cpu().data.numpy()
+                    dtw_eval_pool.submit(feat_file, melsp_cv_rest[spcidx], melsp_trg_rest[spcidx_trg], trj_lat_src, trj_lat_trg)
 
                 lsd_arr = np.sqrt(np.mean((20*(np.log10(np.clip(melsp_cyc_rest[spcidx], a_min=1e-16, a_max=None))\
                                                          -np.log10(np.clip(melsp_rest[spcidx], a_min=1e-16, a_max=None))))**2, axis=-1))
@@ -476,6 +485,17 @@ def main():
                 count += 1
                 #if count >= 3:
                 #    break
+            for feat_file, metrics in dtw_eval_pool.collect():
+                logging.info(feat_file)
+                logging.info("lsd_trg: %.6f dB +- %.6f" % (metrics["melsp_dB"], metrics["melsp_dB_std"]))
+                lsd_cvlist.append(metrics["melsp_dB"])
+                lsdstd_cvlist.append(metrics["melsp_dB_std"])
+                logging.info("%lf %lf %lf %lf" % (metrics["lat_dist_srctrg"], metrics["lat_cdist_srctrg"],
+                    metrics["lat_dist_trgsrc"], metrics["lat_cdist_trgsrc"]))
+                lat_dist_rmse_list.append(metrics["lat_dist_rmse"])
+                lat_dist_cosim_list.append(metrics["lat_dist_cossim"])
+                logging.info("lat_dist: %.6f %.6f" % (metrics["lat_dist_rmse"], metrics["lat_dist_cossim"]))
+            dtw_eval_pool.close()
 
 
     with mp.Manager() as manager:
@@ -25,10 +25,11 @@ from utils import read_hdf5
 from utils import read_txt
 from utils import check_hdf5
 from utils import write_hdf5
+from checkpoint_io import load_model_states
 
 import matplotlib.pyplot as plt
 
-from vcneuvoco import SPKID_TRANSFORM_LAYER
+from vcneuvoco import SPKID_TRANSFORM_LAYER, optimize_for_inference
 
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
@@ -112,8 +113,11 @@ def main():
             conv_emb_flag=True,
             spkidtr_dim=config.spkidtr_dim)
         logging.info(model_spkidtr)
-        model_spkidtr.load_state_dict(torch.load(args.model, map_location=device)["model_spkidtr"])
-        model_spkidtr.eval()
+        checkpoint, weight_norm_folded = load_model_states(args.model, map_location=device)
+        if weight_norm_folded:
+            model_spkidtr.remove_weight_norm()
+        model_spkidtr.load_state_dict(checkpoint["model_spkidtr"])
+        optimize_for_inference(model_spkidtr)
         for param in model_spkidtr.parameters():
             param.requires_grad = False
 
@@ -24,7 +24,11 @@ import matplotlib.pyplot as plt
 
 from utils import find_files
 from utils import read_txt, read_hdf5, shape_hdf5
-from vcneuvoco import GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF
+from devices import get_device, device_context
+from checkpoint_io import load_model_states
+from vcneuvoco import GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF, optimize_for_inference
+from sparse_gru import replace_sparse_gru
+from precision import autocast_methods
 #from vcneuvoco_ import GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF
 
 import torch.nn.functional as F
@@ -71,13 +75,15 @@ def pad_list(batch_list, pad_value=0.0):
     return batch_pad
 
 
-def decode_generator(feat_list, upsampling_factor=120, string_path='/feat_mceplf0cap', batch_size=1, excit_dim=0, n_enc=None):
+def decode_generator(feat_list, upsampling_factor=120, string_path='/feat_mceplf0cap', batch_size=1, excit_dim=0, n_enc=None,
+        device=torch.device("cpu")):
     """DECODE BATCH GENERATOR
 
     Args:
         wav_list (str): list including wav files
         batch_size (int): batch size in decoding
         upsampling_factor (int): upsampling factor
+        device (torch.device): compute device of the output batch
 
     Return:
         (object): generator instance
@@ -140,9 +146,7 @@ def decode_generator(feat_list, upsampling_factor=120, string_path='/feat_mceplf
             batch_feat = pad_list(batch_feat)
 
             # convert to torch variable
-            batch_feat = torch.FloatTensor(batch_feat)
-            if torch.cuda.is_available():
-                batch_feat = batch_feat.cuda()
+            batch_feat = torch.FloatTensor(batch_feat).to(device)
 
             yield feat_ids, (batch_feat, n_samples_list)
 
@@ -163,7 +167,7 @@ def main():
     parser.add_argument("--batch_size", default=1,
                         type=int, help="number of batch size in decoding")
     parser.add_argument("--n_gpus", default=1,
-                        type=int, help="number of gpus")
+                        type=int, help="number of gpus (number of parallel processes in case of cpu)")
     parser.add_argument("--wlat_res_flag", default=False,
                         type=strtobool, help="use latent features for bridge refinement layers")
     # other setting
@@ -177,6 +181,18 @@ def main():
                         type=int, help="selection of GPU device")
     parser.add_argument("--GPU_device_str", default=None,
                         type=str, help="selection of GPU device")
+    parser.add_argument("--device", default=None,
+                        type=str, help="compute device, cuda or cpu (if not set, cuda if available, otherwise cpu)")
+    parser.add_argument("--n_threads", default=0,
+                        type=int, help="number of cpu intra-op threads per process (if set 0, available cores / n_gpus)")
+    parser.add_argument("--n_interop_threads", default=0,
+                        type=int, help="number of cpu inter-op threads per process (if set 0, 1 thread)")
+    parser.add_argument("--time_samples", default=False,
+                        type=strtobool, help="measure the time of every generated sample")
+    parser.add_argument("--sparse_gru", default=True,
+                        type=strtobool, help="use block-sparse recurrent matrix-vector product of sparsified gru layers on cpu")
+    parser.add_argument("--precision", default="fp32",
+                        type=str, help="compute precision, fp32 or bf16 (autocast)")
     parser.add_argument("--verbose", default=1,
                         type=int, help="log level")
     parser.add_argument("--n_enc", default=None,
@@ -240,7 +256,9 @@ def main():
 
     # define gpu decode function
     def gpu_decode(feat_list, gpu):
-        with torch.cuda.device(gpu):
+        device = get_device(args.device, gpu=gpu, n_threads=args.n_threads, n_interop_threads=args.n_interop_threads,
+                        n_procs=args.n_gpus)
+        with device_context(device):
             with torch.no_grad():
                 model_waveform = GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF(
                     feat_dim=config.mcep_dim+config.excit_dim,
@@ -258,12 +276,19 @@ def main():
                     emb_flag=True,
                     lpc=config.lpc)
                 logging.info(model_waveform)
-                model_waveform.cuda()
-                model_waveform.load_state_dict(torch.load(args.checkpoint)["model_waveform"])
-                model_waveform.remove_weight_norm()
+                model_waveform.to(device)
+                checkpoint, weight_norm_folded = load_model_states(args.checkpoint, map_location=device)
+                if weight_norm_folded:
+                    model_waveform.remove_weight_norm()
+                model_waveform.load_state_dict(checkpoint["model_waveform"])
+                optimize_for_inference(model_waveform)
                 model_waveform.eval()
                 for param in model_waveform.parameters():
                     param.requires_grad = False
+                if args.sparse_gru and device.type == "cpu":
+                    replace_sparse_gru(model_waveform)
+                model_waveform.build_gru_steps()
+                autocast_methods(model_waveform, device, args.precision, methods=("generate",))
                 torch.backends.cudnn.benchmark = True
 
                 # define generator
@@ -278,14 +303,15 @@ def main():
                     upsampling_factor=config.upsampling_factor,
                     excit_dim=config.excit_dim,
                     n_enc=args.n_enc,
-                    string_path=string_path)
+                    string_path=string_path,
+                    device=device)
 
                 # decode
                 time_sample = []
                 n_samples = []
                 n_samples_t = []
                 count = 0
-                pqmf = PQMF(config.n_bands).cuda()
+                pqmf = PQMF(config.n_bands).to(device)
                 print(f'{pqmf.subbands} {pqmf.A} {pqmf.taps} {pqmf.cutoff_ratio} {pqmf.beta}')
                 for feat_ids, (batch_feat, n_samples_list) in generator:
                     logging.info("decoding start")
@@ -293,7 +319,7 @@ def main():
                     logging.info(batch_feat.shape)
 
                     #batch_feat = F.pad(batch_feat.transpose(1,2), (model_waveform.pad_left,model_waveform.pad_right), "replicate").transpose(1,2)
-                    samples = model_waveform.generate(batch_feat)
+                    samples = model_waveform.generate(batch_feat, time_samples=args.time_samples)
                     logging.info(samples.shape) # B x n_bands x T//n_bands
                     samples = pqmf.synthesis(samples)[:,0].cpu().data.numpy() # B x 1 x T --> B x T
                     logging.info(samples.shape)
@@ -39,7 +39,8 @@ import sys
 import torch
 from vcneuvoco import GRU_VAE_ENCODER, GRU_SPEC_DECODER
 from vcneuvoco import GRU_SPK, SPKID_TRANSFORM_LAYER
-from vcneuvoco import GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF, decode_mu_law
+from vcneuvoco import GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF, decode_mu_law, optimize_for_inference
+from vcneuvoco import embedding_input_table
 from pqmf import PQMF
 
 from scipy.signal import firwin
@@ -224,11 +225,11 @@ def main():
     model_encoder_excit.load_state_dict(torch.load(args.model, map_location=device)["model_encoder_excit"])
     model_spkidtr.load_state_dict(torch.load(args.model, map_location=device)["model_spkidtr"])
     model.load_state_dict(torch.load(args.model, map_location=device)["model_waveform"])
-    model_encoder_melsp.remove_weight_norm()
-    model_decoder_melsp.remove_weight_norm()
-    model_encoder_excit.remove_weight_norm()
-    model_spkidtr.remove_weight_norm()
-    model.remove_weight_norm()
+    optimize_for_inference(model_encoder_melsp, fold=False)
+    optimize_for_inference(model_decoder_melsp, fold=False)
+    optimize_for_inference(model_encoder_excit, fold=False)
+    optimize_for_inference(model_spkidtr, fold=False)
+    optimize_for_inference(model, fold=False)
     model_encoder_melsp.eval()
     model_decoder_melsp.eval()
     model_encoder_excit.eval()
@@ -267,10 +268,6 @@ def main():
     #PyTorch = (hidden_dim*3,in_dim*3)
     #Keras = (in_dim*3,hidden_dim*3)
 
-    #embedding coarse and fine
-    E_coarse = model.embed_c_wav.weight.data.numpy()
-    E_fine = model.embed_f_wav.weight.data.numpy()
-
     #gru_main weight_input
     W = model.gru.weight_ih_l0.permute(1,0).data.numpy()
     #dump coarse_embed pre-computed input_weight contribution for all classes
@@ -278,9 +275,7 @@ def main():
     print("printing layer " + name)
     W_bands = W[cond_size:-embed_size_bands]
     # n_bands x embed_dict_size x hidden_size
-    weights = np.expand_dims(np.dot(E_coarse, W_bands[:embed_size]), axis=0)
-    for i in range(1,model.n_bands):
-        weights = np.r_[weights, np.expand_dims(np.dot(E_coarse, W_bands[embed_size*i:embed_size*(i+1)]), axis=0)]
+    weights = embedding_input_table(model.embed_c_wav.weight, torch.from_numpy(W_bands), model.n_bands).data.numpy()
     printVector(f, weights, name + '_weights')
     f.write('const EmbeddingLayer {} = {{\n   {}_weights,\n   {}, {}\n}};\n\n'
             .format(name, name, weights.shape[0], weights.shape[1]))
@@ -291,9 +286,7 @@ def main():
     print("printing layer " + name)
     W_bands = W[-embed_size_bands:]
     # n_bands x embed_dict_size x hidden_size
-    weights = np.expand_dims(np.dot(E_fine, W_bands[:embed_size]), axis=0)
-    for i in range(1,model.n_bands):
-        weights = np.r_[weights, np.expand_dims(np.dot(E_fine, W_bands[embed_size*i:embed_size*(i+1)]), axis=0)]
+    weights = embedding_input_table(model.embed_f_wav.weight, torch.from_numpy(W_bands), model.n_bands).data.numpy()
     printVector(f, weights, name + '_weights')
     f.write('const EmbeddingLayer {} = {{\n   {}_weights,\n   {}, {}\n}};\n\n'
             .format(name, name, weights.shape[0], weights.shape[1]))
@@ -342,9 +335,7 @@ def main():
     print("printing layer " + name)
     W_bands = W[cond_size:-model.hidden_units_2]
     # n_bands x embed_dict_size x hidden_size
-    weights = np.expand_dims(np.dot(E_coarse, W_bands[:embed_size]), axis=0)
-    for i in range(1,model.n_bands):
-        weights = np.r_[weights, np.expand_dims(np.dot(E_coarse, W_bands[embed_size*i:embed_size*(i+1)]), axis=0)]
+    weights = embedding_input_table(model.embed_c_wav.weight, torch.from_numpy(W_bands), model.n_bands).data.numpy()
     printVector(f, weights, name + '_weights')
     f.write('const EmbeddingLayer {} = {{\n   {}_weights,\n   {}, {}\n}};\n\n'
             .format(name, name, weights.shape[0], weights.shape[1]))
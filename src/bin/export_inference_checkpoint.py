@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+
+import logging
+
+from checkpoint_io import export_inference_checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="export weights-only inference artifact of checkpoint.")
+
+    parser.add_argument("--checkpoint", required=True,
+                        type=str, help="path of checkpoint")
+    parser.add_argument("--outfile", default=None,
+                        type=str, help="path of inference artifact (default: checkpoint-N.inf.pkl)")
+    parser.add_argument("--verbose", default=1,
+                        type=int, help="log message level")
+
+    args = parser.parse_args()
+
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    # set log level
+    if args.verbose > 0:
+        logging.basicConfig(level=logging.INFO if args.verbose == 1 else logging.DEBUG,
+                            format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
+                            datefmt='%m/%d/%Y %I:%M:%S')
+    else:
+        logging.basicConfig(level=logging.WARN,
+                            format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
+                            datefmt='%m/%d/%Y %I:%M:%S')
+        logging.warn("logging is disabled.")
+
+    export_inference_checkpoint(args.checkpoint, args.outfile)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,8 @@ import torch
 
 import logging
 
+from checkpoint_io import read_checkpoint_meta
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -51,7 +53,11 @@ def main():
         logging.getLogger().addHandler(logging.StreamHandler())
         logging.warn("logging is disabled.")
 
-    checkpoint = torch.load(os.path.join(args.expdir, "checkpoint-last.pkl"), map_location=torch.device("cpu"))
+    checkpoint_path = os.path.join(args.expdir, "checkpoint-last.pkl")
+    checkpoint = read_checkpoint_meta(checkpoint_path)
+    if checkpoint is None:
+        # checkpoint without metadata sidecar
+        checkpoint = torch.load(checkpoint_path, map_location=torch.device("cpu"))
     last_epoch = checkpoint["iterations"]
     min_idx_epoch = checkpoint["min_idx"]+1
     logging.info(args.expdir)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+from collections import defaultdict
+import logging
+import os
+import sys
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+from utils import find_files
+from utils import read_hdf5
+from utils import read_txt
+from devices import get_device
+from checkpoint_io import load_model_states
+from precision import autocast, deviation_report
+from dataset import FeatureDatasetNeuVoco
+from vcneuvoco import GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF, encode_mu_law
+from vcneuvoco import GRU_VAE_ENCODER, GRU_SPEC_DECODER, SPKID_TRANSFORM_LAYER
+
+
+def get_list(path, pattern):
+    if os.path.isdir(path):
+        return sorted(find_files(path, pattern))
+    elif os.path.isfile(path):
+        return read_txt(path)
+    logging.error("%s should be directory or list." % path)
+    sys.exit(1)
+
+
+def load_models(models, checkpoint_path, device):
+    """FUNCTION TO LOAD MODELS FOR INFERENCE
+
+    Args:
+        models (dict): model instance of each checkpoint key
+        checkpoint_path (str): path of checkpoint
+        device (torch.device): compute device
+    """
+    checkpoint, weight_norm_folded = load_model_states(checkpoint_path, map_location=device)
+    for key, model in models.items():
+        if weight_norm_folded:
+            model.remove_weight_norm()
+        model.load_state_dict(checkpoint[key])
+        model.to(device)
+        model.eval()
+        model.remove_weight_norm()
+        for param in model.parameters():
+            param.requires_grad = False
+
+
+def wavernn_losses(args, config, device):
+    """FUNCTION TO COMPUTE PER-UTTERANCE TEACHER-FORCED LOSSES OF MWDLP VOCODER IN FP32 AND LOW-PRECISION
+
+    Return:
+        (dict): per-utterance losses of each precision
+    """
+    model_waveform = GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF(
+        feat_dim=config.mcep_dim+config.excit_dim,
+        upsampling_factor=config.upsampling_factor,
+        hidden_units=config.hidden_units_wave,
+        hidden_units_2=config.hidden_units_wave_2,
+        kernel_size=config.kernel_size_wave,
+        dilation_size=config.dilation_size_wave,
+        n_quantize=config.n_quantize,
+        causal_conv=config.causal_conv_wave,
+        right_size=config.right_size,
+        n_bands=config.n_bands,
+        pad_first=True,
+        mid_dim=config.mid_dim,
+        emb_flag=True,
+        lpc=config.lpc)
+    logging.info(model_waveform)
+    load_models({"model_waveform": model_waveform}, args.checkpoint, device)
+
+    wav_list = get_list(args.waveforms, "*.wav")[:args.n_utt]
+    feat_list = get_list(args.feats, "*.h5")[:args.n_utt]
+    assert len(wav_list) == len(feat_list)
+    with_excit = 'mel' in config.string_path and getattr(config, "with_excit", False)
+    dataset = FeatureDatasetNeuVoco(wav_list, feat_list, lambda x: x, lambda x: x, config.upsampling_factor,
+                    config.string_path, wav_transform=lambda x: encode_mu_law(x, config.n_quantize), n_bands=config.n_bands,
+                        with_excit=with_excit, cf_dim=config.cf_dim, spcidx=True, pad_left=model_waveform.pad_left,
+                            pad_right=model_waveform.pad_right, string_path_ft=getattr(config, "string_path_ft", None))
+    dataloader = DataLoader(dataset, batch_size=1, shuffle=False, num_workers=0)
+    c_pad = (config.n_quantize // 2) // config.cf_dim
+    f_pad = (config.n_quantize // 2) % config.cf_dim
+
+    losses = {"fp32": defaultdict(list), args.precision: defaultdict(list)}
+    with torch.no_grad():
+        for batch in dataloader:
+            slen = batch['slen'][0].item()
+            flen = batch['flen'][0].item()
+            logging.info("%s %d %d" % (batch['featfile'][0], slen, flen))
+            x_c = batch['x_c'][:,:slen].to(device).long()
+            x_f = batch['x_f'][:,:slen].to(device).long()
+            feat = F.pad(batch['feat'][:,:flen].to(device).transpose(1,2),
+                        (model_waveform.pad_left,model_waveform.pad_right), "replicate").transpose(1,2)
+            x_c_prev = F.pad(x_c[:,:-1], (0, 0, 1, 0), "constant", c_pad)
+            x_f_prev = F.pad(x_f[:,:-1], (0, 0, 1, 0), "constant", f_pad)
+            kwargs = {}
+            if config.lpc > 0:
+                kwargs["x_c_lpc"] = F.pad(x_c[:,:-1], (0, 0, config.lpc, 0), "constant", c_pad)
+                kwargs["x_f_lpc"] = F.pad(x_f[:,:-1], (0, 0, config.lpc, 0), "constant", f_pad)
+            for precision in losses.keys():
+                with autocast(device, precision):
+                    x_c_output, x_f_output = model_waveform(feat, x_c_prev, x_f_prev, x_c, **kwargs)[:2]
+                x_c_output = x_c_output.float()[0,:slen] # T x n_bands x cf_dim
+                x_f_output = x_f_output.float()[0,:slen]
+                for name, output, target in [("ce_c", x_c_output, x_c[0]), ("ce_f", x_f_output, x_f[0])]:
+                    losses[precision][name].append(F.cross_entropy(output.reshape(-1, config.cf_dim),
+                                                        target.reshape(-1)).item())
+                    losses[precision][name.replace("ce", "err")].append(torch.mean(torch.sum(100*torch.abs(F.softmax(output, dim=-1)
+                                                        - F.one_hot(target, num_classes=config.cf_dim).float()), -1)).item())
+    return losses
+
+
+def cyclevae_losses(args, config, device):
+    """FUNCTION TO COMPUTE PER-UTTERANCE RECONSTRUCTION LOSSES OF MEL-SPECTROGRAM CYCLEVAE IN FP32 AND LOW-PRECISION
+
+    Return:
+        (dict): per-utterance losses of each precision
+    """
+    spk_list = config.spk_list.split('@')
+    n_spk = len(spk_list)
+    model_encoder_melsp = GRU_VAE_ENCODER(
+        in_dim=config.mel_dim,
+        n_spk=n_spk,
+        lat_dim=config.lat_dim,
+        hidden_layers=config.hidden_layers_enc,
+        hidden_units=config.hidden_units_enc,
+        kernel_size=config.kernel_size_enc,
+        dilation_size=config.dilation_size_enc,
+        causal_conv=config.causal_conv_enc,
+        pad_first=True,
+        right_size=config.right_size_enc)
+    model_decoder_melsp = GRU_SPEC_DECODER(
+        feat_dim=config.lat_dim+config.lat_dim_e,
+        out_dim=config.mel_dim,
+        n_spk=(config.emb_spk_dim//config.n_weight_emb)*config.n_weight_emb,
+        hidden_layers=config.hidden_layers_dec,
+        hidden_units=config.hidden_units_dec,
+        kernel_size=config.kernel_size_dec,
+        dilation_size=config.dilation_size_dec,
+        causal_conv=config.causal_conv_dec,
+        pad_first=True,
+        right_size=config.right_size_dec,
+        red_dim_upd=config.mel_dim,
+        pdf_gauss=True)
+    model_encoder_excit = GRU_VAE_ENCODER(
+        in_dim=config.mel_dim,
+        n_spk=n_spk,
+        lat_dim=config.lat_dim_e,
+        hidden_layers=config.hidden_layers_enc,
+        hidden_units=config.hidden_units_enc,
+        kernel_size=config.kernel_size_enc,
+        dilation_size=config.dilation_size_enc,
+        causal_conv=config.causal_conv_enc,
+        pad_first=True,
+        right_size=config.right_size_enc)
+    model_spkidtr = SPKID_TRANSFORM_LAYER(
+        n_spk=n_spk,
+        emb_dim=config.emb_spk_dim,
+        n_weight_emb=config.n_weight_emb,
+        conv_emb_flag=True,
+        spkidtr_dim=config.spkidtr_dim)
+    load_models({"model_encoder_melsp": model_encoder_melsp, "model_decoder_melsp": model_decoder_melsp,
+                "model_encoder_excit": model_encoder_excit, "model_spkidtr": model_spkidtr}, args.checkpoint, device)
+
+    pad_left = model_encoder_melsp.pad_left + model_decoder_melsp.pad_left
+    pad_right = model_encoder_melsp.pad_right + model_decoder_melsp.pad_right
+    outpad_left = pad_left - model_encoder_melsp.pad_left
+    outpad_right = pad_right - model_encoder_melsp.pad_right
+    temp = 0.675
+
+    losses = {"fp32": defaultdict(list), args.precision: defaultdict(list)}
+    with torch.no_grad():
+        for feat_file in get_list(args.feats, "*.h5")[:args.n_utt]:
+            logging.info(feat_file)
+            src_idx = spk_list.index(os.path.basename(os.path.dirname(feat_file)))
+            feat_org = read_hdf5(feat_file, "/log_1pmelmagsp")
+            spcidx = np.array(read_hdf5(feat_file, "/spcidx_range")[0])
+            melsp_rest = (np.exp(np.array(feat_org, dtype=np.float64))-1)/10000
+            feat = F.pad(torch.FloatTensor(feat_org).to(device).unsqueeze(0).transpose(1,2),
+                        (pad_left,pad_right), "replicate").transpose(1,2)
+            for precision in losses.keys():
+                # identical sampling noise of decoder for both precisions
+                torch.manual_seed(args.seed)
+                with autocast(device, precision):
+                    spk_logits, _, lat_src, _ = model_encoder_melsp(feat, sampling=False)
+                    spk_logits_e, _, lat_src_e, _ = model_encoder_excit(feat, sampling=False)
+                    _, src_code = model_spkidtr((torch.ones((1, lat_src_e.shape[1]))*src_idx).to(device).long())
+                    _, melsp_rec, _ = model_decoder_melsp(torch.cat((lat_src_e, lat_src), 2), y=src_code, temp=temp)
+                if outpad_right > 0:
+                    spk_logits = spk_logits[:,outpad_left:-outpad_right]
+                    spk_logits_e = spk_logits_e[:,outpad_left:-outpad_right]
+                else:
+                    spk_logits = spk_logits[:,outpad_left:]
+                    spk_logits_e = spk_logits_e[:,outpad_left:]
+                spk_trg = torch.LongTensor([src_idx]*spk_logits.shape[1]).to(device)
+                losses[precision]["ce_spk"].append(F.cross_entropy(spk_logits[0].float(), spk_trg).item())
+                losses[precision]["ce_spk_e"].append(F.cross_entropy(spk_logits_e[0].float(), spk_trg).item())
+                melsp_rec_rest = (np.exp(np.array(melsp_rec[0].float().cpu().data.numpy(), dtype=np.float64))-1)/10000
+                lsd_arr = np.sqrt(np.mean((20*(np.log10(np.clip(melsp_rec_rest[spcidx], a_min=1e-16, a_max=None))\
+                                                -np.log10(np.clip(melsp_rest[spcidx], a_min=1e-16, a_max=None))))**2, axis=-1))
+                losses[precision]["lsd_rec"].append(np.mean(lsd_arr))
+    return losses
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="report of per-loss deviation of low-precision (bf16) inference from fp32 on a fixed evaluation set.")
+    parser.add_argument("--model_type", default="wavernn",
+                        type=str, help="wavernn (mwdlp vocoder) or cyclevae (mel-spectrogram cyclevae)")
+    parser.add_argument("--feats", required=True,
+                        type=str, help="list or directory of evaluation feat files")
+    parser.add_argument("--waveforms", default=None,
+                        type=str, help="list or directory of evaluation wav files (wavernn)")
+    parser.add_argument("--checkpoint", required=True,
+                        type=str, help="model checkpoint")
+    parser.add_argument("--config", required=True,
+                        type=str, help="model config")
+    parser.add_argument("--n_utt", default=20,
+                        type=int, help="number of first utterances of the sorted list to be evaluated")
+    parser.add_argument("--precision", default="bf16",
+                        type=str, help="low-precision to be compared with fp32")
+    parser.add_argument("--outfile", default=None,
+                        type=str, help="path of report text file")
+    parser.add_argument("--seed", default=1,
+                        type=int, help="seed number")
+    parser.add_argument("--device", default=None,
+                        type=str, help="compute device, cuda or cpu (if not set, cuda if available, otherwise cpu)")
+    parser.add_argument("--n_threads", default=0,
+                        type=int, help="number of cpu intra-op threads (if set 0, available cores)")
+    parser.add_argument("--verbose", default=1,
+                        type=int, help="log level")
+    args = parser.parse_args()
+
+    # set log level
+    if args.verbose > 0:
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
+                            datefmt='%m/%d/%Y %I:%M:%S')
+    else:
+        logging.basicConfig(level=logging.WARN,
+                            format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
+                            datefmt='%m/%d/%Y %I:%M:%S')
+        logging.warn("logging is disabled.")
+
+    torch.manual_seed(args.seed)
+    config = torch.load(args.config)
+    device = get_device(args.device, n_threads=args.n_threads)
+
+    # a silent fallback to fp32 would report zero deviation
+    try:
+        autocast(device, args.precision)
+    except RuntimeError as e:
+        logging.error(str(e))
+        sys.exit(1)
+
+    if args.model_type == "wavernn":
+        if args.waveforms is None:
+            logging.error("--waveforms is needed for wavernn.")
+            sys.exit(1)
+        losses = wavernn_losses(args, config, device)
+    elif args.model_type == "cyclevae":
+        losses = cyclevae_losses(args, config, device)
+    else:
+        logging.error("--model_type should be wavernn or cyclevae.")
+        sys.exit(1)
+
+    report = deviation_report(losses["fp32"], losses[args.precision], name=args.precision)
+    logging.info("precision deviation (%d utterances)\n%s" % (len(losses["fp32"][list(losses["fp32"].keys())[0]]), report))
+    if args.outfile is not None:
+        with open(args.outfile, "w") as f:
+            f.write(report+"\n")
+
+
+if __name__ == "__main__":
+    main()
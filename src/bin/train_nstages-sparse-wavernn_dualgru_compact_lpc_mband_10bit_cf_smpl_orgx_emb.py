@@ -27,7 +27,7 @@ import torch
 from pqmf import PQMF
 
 from torchvision import transforms
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 
 import torch.nn.functional as F
 
@@ -42,6 +42,16 @@ from vcneuvoco import decode_mu_law_torch, MultiResolutionSTFTLoss
 import torch_optimizer as optim
 
 from dataset import FeatureDatasetNeuVoco, padding
+from segmenter import BatchSegmenter, index_delete
+from feature_cache import SharedFeatureCache, default_cache_dir
+from devices import get_device
+from checkpoint_io import AsyncCheckpointWriter
+from sparsity import BlockSparsity, parse_extra_densities
+from precision import autocast_methods
+from distributed import init_distributed, ShardedSampler, synchronize_epochs
+from distributed import broadcast_parameters, all_reduce_gradients, all_gather_lists_
+from profiling import StepProfiler
+from eval_service import EVAL_MODES, SnapshotQueue, eval_subset_indices, load_snapshot, subset_tags
 
 #import warnings
 #warnings.filterwarnings('ignore')
@@ -87,56 +97,28 @@ def data_generator(dataloader, device, batch_size, upsampling_factor, limit_coun
             #logging.info(spcidx_s)
             featfiles = batch['featfile']
             #cs = batch['c'].to(device)
-            n_batch_utt = feat.size(0)
-
-            len_frm = max_flen
-            x_ss = 0
-            f_ss = 0
-            x_bs = batch_size*upsampling_factor_bands
-            f_bs = batch_size
-            delta = batch_size*upsampling_factor_bands
-            delta_frm = batch_size
-            slens_acc = np.array(slens)
-            flens_acc = np.array(flens)
+
+            segmenter = BatchSegmenter(flens, batch_size, slens=slens, upsampling_factor_bands=upsampling_factor_bands)
             while True:
-                del_index_utt = []
-                idx_select = []
-                idx_select_full = []
-                for i in range(n_batch_utt):
-                    if flens_acc[i] <= 0:
-                        del_index_utt.append(i)
+                del_index_utt = segmenter.update()
                 if len(del_index_utt) > 0:
-                    x = torch.FloatTensor(np.delete(x.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    xs = torch.FloatTensor(np.delete(xs.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    xs_c = torch.LongTensor(np.delete(xs_c.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    xs_f = torch.LongTensor(np.delete(xs_f.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    #cs = torch.LongTensor(np.delete(cs.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    feat = torch.FloatTensor(np.delete(feat.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    featfiles = np.delete(featfiles, del_index_utt, axis=0)
-                    slens_acc = np.delete(slens_acc, del_index_utt, axis=0)
-                    flens_acc = np.delete(flens_acc, del_index_utt, axis=0)
-                    #spcidx_s = np.delete(spcidx_s, del_index_utt, axis=0)
-                    n_batch_utt -= len(del_index_utt)
-                for i in range(n_batch_utt):
-                    if flens_acc[i] < f_bs:
-                        idx_select.append(i)
-                if len(idx_select) > 0:
-                    idx_select_full = torch.LongTensor(np.delete(np.arange(n_batch_utt), idx_select, axis=0)).to(device)
-                    idx_select = torch.LongTensor(idx_select).to(device)
+                    x = segmenter.shrink(x)
+                    xs = segmenter.shrink(xs)
+                    xs_c = segmenter.shrink(xs_c)
+                    xs_f = segmenter.shrink(xs_f)
+                    feat = segmenter.shrink(feat)
+                    featfiles = segmenter.shrink(featfiles)
+                n_batch_utt = segmenter.n_batch_utt
+                idx_select, idx_select_full = segmenter.select_short(device)
+                x_bs, f_bs, x_ss, f_ss = segmenter.x_bs, segmenter.f_bs, segmenter.x_ss, segmenter.f_ss
+                slens_acc, flens_acc = segmenter.slens_acc, segmenter.flens_acc
                 yield x, xs, xs_c, xs_f, feat, c_idx, idx, featfiles, x_bs, f_bs, x_ss, f_ss, n_batch_utt, del_index_utt, max_slen, \
                     max_flen, idx_select, idx_select_full, slens_acc, flens_acc
-                for i in range(n_batch_utt):
-                    slens_acc[i] -= delta
-                    flens_acc[i] -= delta_frm
 
                 count += 1
                 if limit_count is not None and count > limit_count:
                     break
-                len_frm -= delta_frm
-                if len_frm > 0:
-                    x_ss += delta
-                    f_ss += delta_frm
-                else:
+                if not segmenter.advance():
                     break
 
             if limit_count is not None and count > limit_count:
@@ -150,19 +132,21 @@ def data_generator(dataloader, device, batch_size, upsampling_factor, limit_coun
         yield [], [], [], [], [], -1, -1, [], [], [], [], [], [], [], [], [], [], [], [], []
 
 
-def save_checkpoint(checkpoint_dir, model_waveform, optimizer,
+def save_checkpoint(checkpoint_writer, model_waveform, optimizer,
     min_eval_loss_ce_avg, min_eval_loss_ce_avg_std, min_eval_loss_err_avg, min_eval_loss_err_avg_std,
         min_eval_loss_l1_avg, min_eval_loss_l1_fb, err_flag,
-        iter_idx, min_idx, numpy_random_state, torch_random_state, iterations):
+        iter_idx, min_idx, numpy_random_state, torch_random_state, iterations, eval_loss=None):
     """FUNCTION TO SAVE CHECKPOINT
 
     Args:
-        checkpoint_dir (str): directory to save checkpoint
+        checkpoint_writer (AsyncCheckpointWriter): background checkpoint writer
         model (torch.nn.Module): pytorch model instance
         optimizer (Optimizer): pytorch optimizer instance
         iterations (int): number of current iterations
+        eval_loss (float): development loss of current iterations for checkpoint retention
     """
-    model_waveform.cpu()
+    if checkpoint_writer is None: # not rank 0 of data-parallel training
+        return
     checkpoint = {
         "model_waveform": model_waveform.state_dict(),
         "optimizer": optimizer.state_dict(),
@@ -179,65 +163,17 @@ def save_checkpoint(checkpoint_dir, model_waveform, optimizer,
         "numpy_random_state": numpy_random_state,
         "torch_random_state": torch_random_state,
         "iterations": iterations}
-    if not os.path.exists(checkpoint_dir):
-        os.makedirs(checkpoint_dir)
-    torch.save(checkpoint, checkpoint_dir + "/checkpoint-%d.pkl" % iterations)
-    torch.save(checkpoint, checkpoint_dir + "/checkpoint-last.pkl")
-    model_waveform.cuda()
-    logging.info("%d-iter and last checkpoints created." % iterations)
+    checkpoint_writer.save(checkpoint, iterations, eval_loss=eval_loss, keep=[min_idx+1])
 
 
 def write_to_tensorboard(writer, steps, loss):
     """Write to tensorboard."""
+    if writer is None:
+        return
     for key, value in loss.items():
         writer.add_scalar(key, value, steps)
 
 
-## Based on lpcnet.py [https://github.com/mozilla/LPCNet/blob/master/src/lpcnet.py]
-## Modified to accomodate PyTorch model and n-stages of sparsification
-def sparsify(model_waveform, iter_idx, t_start, t_end, interval, densities, densities_p=None):
-    if iter_idx < t_start or ((iter_idx-t_start) % interval != 0 and iter_idx < t_end):
-        pass
-    else:
-        logging.info('sparsify: %ld %ld %ld %ld' % (iter_idx, t_start, t_end, interval))
-        p = model_waveform.gru.weight_hh_l0 #recurrent
-        nb = p.shape[0] // p.shape[1]
-        N = p.shape[0] // nb
-        N_16 = N // 16
-        ones = torch.diag(torch.ones(N, device=p.device))
-        if densities_p is not None:
-            for k in range(nb):
-                density = densities[k]
-                if iter_idx < t_end:
-                    r = 1 - (iter_idx-t_start)/(t_end - t_start)
-                    density = densities_p[k] - (densities_p[k]-densities[k])*(1 - r)**5
-                logging.info('%ld: %lf %lf %lf' % (k+1, densities_p[k], densities[k], density))
-                #recurrent weight
-                A = p[k*N:(k+1)*N, :]
-                #horizontal block structure (16) in input part, in real-time simultaneously computed for each 16 output using 2 registers (256x2 bits)
-                L = (A - torch.diag(torch.diag(A))).transpose(1, 0).reshape(N, N_16, 16)
-                S = torch.sum(L*L, -1)
-                SS, _ = torch.sort(S.reshape(-1))
-                thresh = SS[round(N*N_16*(1-density))]
-                mask = torch.clamp(torch.repeat_interleave((S>=thresh).float(), 16, dim=1) + ones, max=1).transpose(1,0)
-                p[k*N:(k+1)*N, :] = p[k*N:(k+1)*N, :]*mask # outputxinput
-        else:
-            for k in range(nb):
-                density = densities[k]
-                if iter_idx < t_end:
-                    r = 1 - (iter_idx-t_start)/(t_end - t_start)
-                    density = 1 - (1-densities[k])*(1 - r)**5
-                logging.info('%ld: 1 %lf %lf' % (k+1, densities[k], density))
-                #recurrent weight
-                A = p[k*N:(k+1)*N, :]
-                L = (A - torch.diag(torch.diag(A))).transpose(1, 0).reshape(N, N_16, 16)
-                S = torch.sum(L*L, -1)
-                SS, _ = torch.sort(S.reshape(-1))
-                thresh = SS[round(N*N_16*(1-density))]
-                mask = torch.clamp(torch.repeat_interleave((S>=thresh).float(), 16, dim=1) + ones, max=1).transpose(1,0)
-                p[k*N:(k+1)*N, :] = p[k*N:(k+1)*N, :]*mask
-
-
 def main():
     parser = argparse.ArgumentParser()
     # path setting
@@ -283,6 +219,16 @@ def main():
                         type=float, help="dropout probability")
     parser.add_argument("--n_workers", default=2,
                         type=int, help="batch size (if set 0, utterance batch will be used)")
+    parser.add_argument("--cache_size", default=0,
+                        type=float, help="memory budget [MB] of shared in-memory feature cache (if set 0, no cache will be used)")
+    parser.add_argument("--cache_dir", default=None,
+                        type=str, help="directory of shared feature cache, should be on tmpfs (default: /dev/shm/featcache_<hash of expdir>)")
+    parser.add_argument("--persistent_workers", default=False,
+                        type=strtobool, help="flag to keep dataloader workers alive across epochs")
+    parser.add_argument("--ckpt_keep_best", default=0,
+                        type=int, help="number of best checkpoints by development loss to be kept (if this and ckpt_keep_last are 0, keep all)")
+    parser.add_argument("--ckpt_keep_last", default=0,
+                        type=int, help="number of last checkpoints to be kept (if this and ckpt_keep_best are 0, keep all)")
     parser.add_argument("--n_quantize", default=1024,
                         type=int, help="batch size (if set 0, utterance batch will be used)")
     parser.add_argument("--causal_conv_wave", default=False,
@@ -297,6 +243,8 @@ def main():
                         type=int, help="interval in finishing densitiy sparsify")
     parser.add_argument("--densities", default="0.05-0.05-0.2",
                         type=str, help="final densitiy of reset, update, new hidden gate matrices")
+    parser.add_argument("--sparse_extra", default="",
+                        type=str, help="additional matrices to be sparsified and their final densities, separated by @, e.g., gru.weight_ih_l0:0.5@out.weight:0.25")
     parser.add_argument("--n_bands", default=10,
                         type=int, help="number of bands")
     parser.add_argument("--fs", default=24000,
@@ -322,6 +270,27 @@ def main():
                         type=str, help="model path to restart training")
     parser.add_argument("--GPU_device", default=None,
                         type=int, help="selection of GPU device")
+    parser.add_argument("--device", default=None,
+                        type=str, help="compute device, cuda or cpu (if not set, cuda if available, otherwise cpu)")
+    parser.add_argument("--n_threads", default=0,
+                        type=int, help="number of cpu intra-op threads (if set 0, available cores minus dataloader workers)")
+    parser.add_argument("--n_interop_threads", default=0,
+                        type=int, help="number of cpu inter-op threads (if set 0, 1 thread)")
+    parser.add_argument("--precision", default="fp32",
+                        type=str, help="compute precision, fp32 or bf16 (autocast with fp32 master weights)")
+    parser.add_argument("--dist_backend", default="gloo",
+                        type=str, help="backend of data-parallel training, launched with WORLD_SIZE > 1 (gloo for cpu nodes)")
+    parser.add_argument("--profile", default=False,
+                        type=strtobool, help="flag to report time breakdown of training steps every log_interval_steps")
+    parser.add_argument("--profile_trace_start", default=10,
+                        type=int, help="number of profiled steps before torch.profiler trace")
+    parser.add_argument("--profile_trace_steps", default=0,
+                        type=int, help="number of steps of torch.profiler trace in expdir/profile (if set 0, no trace)")
+    parser.add_argument("--eval_mode", default="inline",
+                        type=str, help="inline: evaluate in training, trainer: evaluate fixed subset and leave full evaluation "\
+                            "of checkpoints to evaluator, evaluator: evaluate checkpoints of trainer with the same expdir and n_threads")
+    parser.add_argument("--n_eval_subset", default=10,
+                        type=int, help="number of fixed development utterances of fast proxy evaluation in trainer mode")
     parser.add_argument("--verbose", default=1,
                         type=int, help="log level")
     args = parser.parse_args()
@@ -330,6 +299,14 @@ def main():
         os.environ["CUDA_DEVICE_ORDER"]     = "PCI_BUS_ID"
         os.environ["CUDA_VISIBLE_DEVICES"]  = str(args.GPU_device)
 
+    # data-parallel processes (if launched with WORLD_SIZE > 1)
+    rank, world_size, local_world_size = init_distributed(args.dist_backend)
+    if args.eval_mode not in EVAL_MODES:
+        raise ValueError("eval_mode should be one of %s, got %s." % (str(EVAL_MODES), args.eval_mode))
+    if args.eval_mode == "evaluator" and world_size > 1:
+        raise ValueError("evaluator should be launched as a single process.")
+    log_name = "eval.log" if args.eval_mode == "evaluator" else "train.log"
+
     # make experimental directory
     if not os.path.exists(args.expdir):
         os.makedirs(args.expdir)
@@ -339,30 +316,34 @@ def main():
         logging.basicConfig(level=logging.INFO,
                             format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
                             datefmt='%m/%d/%Y %I:%M:%S',
-                            filename=args.expdir + "/train.log")
+                            filename=args.expdir + "/" + log_name)
         logging.getLogger().addHandler(logging.StreamHandler())
     elif args.verbose > 1:
         logging.basicConfig(level=logging.DEBUG,
                             format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
                             datefmt='%m/%d/%Y %I:%M:%S',
-                            filename=args.expdir + "/train.log")
+                            filename=args.expdir + "/" + log_name)
         logging.getLogger().addHandler(logging.StreamHandler())
     else:
         logging.basicConfig(level=logging.WARN,
                             format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
                             datefmt='%m/%d/%Y %I:%M:%S',
-                            filename=args.expdir + "/train.log")
+                            filename=args.expdir + "/" + log_name)
         logging.getLogger().addHandler(logging.StreamHandler())
         logging.warn("logging is disabled.")
+    if rank > 0:
+        # log of rank 0 only
+        logging.getLogger().setLevel(logging.WARN)
+    elif world_size > 1:
+        logging.info("data-parallel training with %d processes, %s backend" % (world_size, args.dist_backend))
 
     # fix seed
     os.environ['PYTHONHASHSEED'] = str(args.seed)
     np.random.seed(args.seed)
     torch.manual_seed(args.seed)
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    if str(device) == "cpu":
-        raise ValueError('ERROR: Training by CPU is not acceptable.')
+    device = get_device(args.device, n_threads=args.n_threads, n_interop_threads=args.n_interop_threads,
+                    n_procs=local_world_size, n_workers=args.n_workers)
 
     torch.backends.cudnn.benchmark = True #faster
 
@@ -401,7 +382,8 @@ def main():
     args.half_n_quantize = args.n_quantize // 2
     args.c_pad = args.half_n_quantize // args.cf_dim
     args.f_pad = args.half_n_quantize % args.cf_dim
-    torch.save(args, args.expdir + "/model.conf")
+    if args.eval_mode != "evaluator": # model.conf of the training process
+        torch.save(args, args.expdir + "/model.conf")
 
     # define network
     model_waveform = GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF(
@@ -462,21 +444,18 @@ def main():
     criterion_l1 = torch.nn.L1Loss(reduction='none')
     indices_1hot = torch.FloatTensor(np.arange(args.cf_dim))
 
-    # send to gpu
-    if torch.cuda.is_available():
-        model_waveform.cuda()
-        pqmf.cuda()
-        criterion_stft.cuda()
-        criterion_stft_fb.cuda()
-        criterion_ce.cuda()
-        criterion_l1.cuda()
-        indices_1hot = indices_1hot.cuda()
-        if args.pretrained is None:
-            mean_stats = mean_stats.cuda()
-            scale_stats = scale_stats.cuda()
-    else:
-        logging.error("gpu is not available. please check the setting.")
-        sys.exit(1)
+    # send to device
+    model_waveform.to(device)
+    autocast_methods(model_waveform, device, args.precision)
+    pqmf.to(device)
+    criterion_stft.to(device)
+    criterion_stft_fb.to(device)
+    criterion_ce.to(device)
+    criterion_l1.to(device)
+    indices_1hot = indices_1hot.to(device)
+    if args.pretrained is None:
+        mean_stats = mean_stats.to(device)
+        scale_stats = scale_stats.to(device)
     logging.info(indices_1hot)
     logging.info(criterion_stft.fft_sizes)
     logging.info(criterion_stft.hop_sizes)
@@ -528,13 +507,13 @@ def main():
 
     # resume
     if args.pretrained is not None and args.resume is None:
-        checkpoint = torch.load(args.pretrained)
+        checkpoint = torch.load(args.pretrained, map_location=device)
         model_waveform.load_state_dict(checkpoint["model_waveform"], strict=False)
         epoch_idx = checkpoint["iterations"]
         logging.info("pretrained from %d-iter checkpoint." % epoch_idx)
         epoch_idx = 0
     elif args.resume is not None:
-        checkpoint = torch.load(args.resume)
+        checkpoint = torch.load(args.resume, map_location=device)
         model_waveform.load_state_dict(checkpoint["model_waveform"])
         optimizer.load_state_dict(checkpoint["optimizer"])
         epoch_idx = checkpoint["iterations"]
@@ -568,14 +547,57 @@ def main():
     assert len(wav_list) == len(feat_list)
     batch_size_utt = 8
     logging.info("number of training_data -- batch_size = %d -- %d" % (len(feat_list), batch_size_utt))
-    dataset = FeatureDatasetNeuVoco(wav_list, feat_list, pad_wav_transform, pad_feat_transform, args.upsampling_factor, 
-                    args.string_path, wav_transform=wav_transform, n_bands=args.n_bands, with_excit=with_excit, cf_dim=args.cf_dim, spcidx=True,
-                        pad_left=model_waveform.pad_left, pad_right=model_waveform.pad_right, worgx_band_flag=True, worgx_flag=True, pad_wav_org_transform=pad_wav_org_transform)
-    dataloader = DataLoader(dataset, batch_size=batch_size_utt, shuffle=True, num_workers=args.n_workers)
-    #generator = data_generator(dataloader, device, args.batch_size, args.upsampling_factor, limit_count=1, n_bands=args.n_bands)
-    #generator = data_generator(dataloader, device, args.batch_size, args.upsampling_factor, limit_count=5, n_bands=args.n_bands)
-    #generator = data_generator(dataloader, device, args.batch_size, args.upsampling_factor, limit_count=20, n_bands=args.n_bands)
-    generator = data_generator(dataloader, device, args.batch_size, args.upsampling_factor, limit_count=None, n_bands=args.n_bands)
+    if args.cache_size > 0:
+        if args.cache_dir is None:
+            args.cache_dir = default_cache_dir(args.expdir)
+        cache = SharedFeatureCache(args.cache_dir, max_mbytes=args.cache_size)
+    else:
+        cache = None
+    # replicate the initial / resumed models of rank 0
+    broadcast_parameters([model_waveform])
+    snapshot_queue = SnapshotQueue(args.expdir)
+    if rank == 0 and args.eval_mode != "evaluator":
+        checkpoint_writer = AsyncCheckpointWriter(args.expdir, keep_best=args.ckpt_keep_best, keep_last=args.ckpt_keep_last,
+                                retained=snapshot_queue.retained if args.eval_mode == "trainer" else None)
+        if args.eval_mode == "trainer":
+            snapshot_queue.begin_training()
+    else:
+        checkpoint_writer = None
+    persistent_workers = args.persistent_workers and args.n_workers > 0
+    if args.eval_mode != "evaluator": # the evaluator only reads the development set
+        dataset = FeatureDatasetNeuVoco(wav_list, feat_list, pad_wav_transform, pad_feat_transform, args.upsampling_factor, 
+                        args.string_path, wav_transform=wav_transform, n_bands=args.n_bands, with_excit=with_excit, cf_dim=args.cf_dim, spcidx=True,
+                            pad_left=model_waveform.pad_left, pad_right=model_waveform.pad_right, worgx_band_flag=True, worgx_flag=True, pad_wav_org_transform=pad_wav_org_transform, cache=cache)
+        sampler = ShardedSampler(dataset, shuffle=True, seed=args.seed)
+        sampler.set_epoch(epoch_idx) # continue the shuffling order when resuming
+        dataloader = DataLoader(dataset, batch_size=batch_size_utt, sampler=sampler, num_workers=args.n_workers,
+                        persistent_workers=persistent_workers)
+        #generator = data_generator(dataloader, device, args.batch_size, args.upsampling_factor, limit_count=1, n_bands=args.n_bands)
+        #generator = data_generator(dataloader, device, args.batch_size, args.upsampling_factor, limit_count=5, n_bands=args.n_bands)
+        #generator = data_generator(dataloader, device, args.batch_size, args.upsampling_factor, limit_count=20, n_bands=args.n_bands)
+        def idle_step():
+            """Training step without batch after the pass of this rank ended, as the other ranks' steps"""
+            nonlocal iter_idx, idx_stage
+            optimizer.zero_grad()
+            all_reduce_gradients(module_list)
+            for param in module_list:
+                if param.requires_grad:
+                    grad_norm = param.grad.norm()
+                    if torch.isnan(grad_norm) or torch.isinf(grad_norm):
+                        logging.info("explode grad")
+                        optimizer.zero_grad()
+                        return
+            torch.nn.utils.clip_grad_norm_(model_waveform.parameters(), 10)
+            optimizer.step()
+            with torch.no_grad():
+                if idx_stage < args.n_stage-1 and iter_idx + 1 == t_starts[idx_stage+1]:
+                    idx_stage += 1
+                sparsity_waveform.step(iter_idx + 1)
+            iter_idx += 1
+            profiler.step(iter_idx)
+        generator = synchronize_epochs(data_generator(dataloader, device, args.batch_size, args.upsampling_factor, limit_count=None, n_bands=args.n_bands), idle_step)
+    else:
+        generator = None
 
     # define generator evaluation
     if os.path.isdir(args.waveforms_eval):
@@ -604,12 +626,31 @@ def main():
     logging.info("number of evaluation_data -- batch_size_eval = %d -- %d" % (n_eval_data, batch_size_utt_eval))
     dataset_eval = FeatureDatasetNeuVoco(wav_list_eval, feat_list_eval, pad_wav_transform, pad_feat_transform, args.upsampling_factor, 
                     args.string_path, wav_transform=wav_transform, n_bands=args.n_bands, with_excit=with_excit, cf_dim=args.cf_dim, spcidx=True,
-                        pad_left=model_waveform.pad_left, pad_right=model_waveform.pad_right, worgx_band_flag=True, worgx_flag=True, pad_wav_org_transform=pad_wav_org_transform)
-    dataloader_eval = DataLoader(dataset_eval, batch_size=batch_size_utt_eval, shuffle=False, num_workers=args.n_workers)
+                        pad_left=model_waveform.pad_left, pad_right=model_waveform.pad_right, worgx_band_flag=True, worgx_flag=True, pad_wav_org_transform=pad_wav_org_transform, cache=cache)
+    if args.eval_mode == "trainer":
+        # fast proxy, the full evaluation of the checkpoints is done by the evaluator process
+        dataset_eval = Subset(dataset_eval, eval_subset_indices(n_eval_data, args.n_eval_subset))
+        logging.info("number of evaluation_data of trainer -- %d" % (len(dataset_eval)))
+    dataloader_eval = DataLoader(dataset_eval, batch_size=batch_size_utt_eval, sampler=ShardedSampler(dataset_eval, shuffle=False),
+                    num_workers=args.n_workers,
+                    persistent_workers=persistent_workers)
     #generator_eval = data_generator(dataloader_eval, device, args.batch_size, args.upsampling_factor, limit_count=1, n_bands=args.n_bands)
     generator_eval = data_generator(dataloader_eval, device, args.batch_size, args.upsampling_factor, limit_count=None, n_bands=args.n_bands)
 
-    writer = SummaryWriter(args.expdir)
+    if rank == 0:
+        writer = SummaryWriter(args.expdir)
+    else:
+        writer = None
+    profiler = StepProfiler(device, writer=writer, enabled=args.profile, log_interval=args.log_interval_steps,
+                    trace_dir=os.path.join(args.expdir, "profile"), trace_start=args.profile_trace_start,
+                        trace_steps=args.profile_trace_steps)
+    profiler.time_modules({
+        "waveform": model_waveform})
+    profiler.time_modules({
+        "loss_stft": criterion_stft,
+        "loss_stft_fb": criterion_stft_fb,
+        "loss_ce": criterion_ce,
+        "loss_l1": criterion_l1})
     total_train_loss = defaultdict(list)
     total_eval_loss = defaultdict(list)
 
@@ -661,6 +702,8 @@ def main():
     logging.info(args.interval)
     logging.info(densities)
     idx_stage = 0
+    sparsity_waveform = BlockSparsity(model_waveform, t_starts, t_ends, densities, args.interval,
+        extra_densities=parse_extra_densities(args.sparse_extra, "waveform", ["waveform"]))
 
     # train
     total = 0
@@ -759,28 +802,40 @@ def main():
     logging.info("Training data")
     while True:
         start = time.time()
-        batch_x_fb, batch_x, batch_x_c, batch_x_f, batch_feat, c_idx, utt_idx, featfile, x_bs, f_bs, x_ss, f_ss, n_batch_utt, \
-            del_index_utt, max_slen, max_flen, idx_select, idx_select_full, slens_acc, flens_acc = next(generator)
+        if args.eval_mode == "evaluator":
+            # wait for the next snapshot of the training process, and evaluate it as its epoch summary
+            checkpoint_path = snapshot_queue.next()
+            if checkpoint_path is None:
+                break
+            snapshot_meta = load_snapshot(checkpoint_path, {"model_waveform": model_waveform}, device)
+            iter_idx = snapshot_meta["iter_idx"]
+            epoch_idx = snapshot_meta["iterations"] - 1
+            c_idx = -1
+        else:
+            batch_x_fb, batch_x, batch_x_c, batch_x_f, batch_feat, c_idx, utt_idx, featfile, x_bs, f_bs, x_ss, f_ss, n_batch_utt, \
+                del_index_utt, max_slen, max_flen, idx_select, idx_select_full, slens_acc, flens_acc = next(generator)
+        profiler.lap("data")
         if c_idx < 0: # summarize epoch
             # save current epoch model
             numpy_random_state = np.random.get_state()
             torch_random_state = torch.get_rng_state()
-            # report current epoch
-            text_log = "(EPOCH:%d) average optimization loss = %.6f (+- %.6f) %.6f (+- %.6f) %% "\
-                    "%.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% , %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f)" % (epoch_idx + 1,
-                    np.mean(loss_ce_avg), np.std(loss_ce_avg), np.mean(loss_err_avg), np.std(loss_err_avg),
-                        np.mean(loss_ce_c_avg), np.std(loss_ce_c_avg), np.mean(loss_err_c_avg), np.std(loss_err_c_avg),
-                            np.mean(loss_ce_f_avg), np.std(loss_ce_f_avg), np.mean(loss_err_f_avg), np.std(loss_err_f_avg),
-                                np.mean(loss_fro_avg), np.std(loss_fro_avg), np.mean(loss_l1_avg), np.std(loss_l1_avg),
-                                    np.mean(loss_fro_fb), np.std(loss_fro_fb), np.mean(loss_l1_fb), np.std(loss_l1_fb))
-            for i in range(args.n_bands):
-                text_log += " [%d] %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% , %.6f (+- %.6f) %.6f (+- %.6f)" % (i+1,
-                        np.mean(loss_ce[i]), np.std(loss_ce[i]), np.mean(loss_err[i]), np.std(loss_err[i]),
-                            np.mean(loss_ce_f[i]), np.std(loss_ce_f[i]), np.mean(loss_err_f[i]), np.std(loss_err_f[i]),
-                                np.mean(loss_fro[i]), np.std(loss_fro[i]), np.mean(loss_l1[i]), np.std(loss_l1[i]))
-            logging.info("%s ;; (%.3f min., %.3f sec / batch)" % (text_log, total / 60.0, total / iter_count))
-            logging.info("estimated time until max. step = {0.days:02}:{0.hours:02}:{0.minutes:02}:"\
-            "{0.seconds:02}".format(relativedelta(seconds=int((args.step_count - (iter_idx + 1)) * total))))
+            if args.eval_mode != "evaluator": # no training steps in the evaluator
+                # report current epoch
+                text_log = "(EPOCH:%d) average optimization loss = %.6f (+- %.6f) %.6f (+- %.6f) %% "\
+                        "%.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% , %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f)" % (epoch_idx + 1,
+                        np.mean(loss_ce_avg), np.std(loss_ce_avg), np.mean(loss_err_avg), np.std(loss_err_avg),
+                            np.mean(loss_ce_c_avg), np.std(loss_ce_c_avg), np.mean(loss_err_c_avg), np.std(loss_err_c_avg),
+                                np.mean(loss_ce_f_avg), np.std(loss_ce_f_avg), np.mean(loss_err_f_avg), np.std(loss_err_f_avg),
+                                    np.mean(loss_fro_avg), np.std(loss_fro_avg), np.mean(loss_l1_avg), np.std(loss_l1_avg),
+                                        np.mean(loss_fro_fb), np.std(loss_fro_fb), np.mean(loss_l1_fb), np.std(loss_l1_fb))
+                for i in range(args.n_bands):
+                    text_log += " [%d] %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% , %.6f (+- %.6f) %.6f (+- %.6f)" % (i+1,
+                            np.mean(loss_ce[i]), np.std(loss_ce[i]), np.mean(loss_err[i]), np.std(loss_err[i]),
+                                np.mean(loss_ce_f[i]), np.std(loss_ce_f[i]), np.mean(loss_err_f[i]), np.std(loss_err_f[i]),
+                                    np.mean(loss_fro[i]), np.std(loss_fro[i]), np.mean(loss_l1[i]), np.std(loss_l1[i]))
+                logging.info("%s ;; (%.3f min., %.3f sec / batch)" % (text_log, total / 60.0, total / max(iter_count, 1)))
+                logging.info("estimated time until max. step = {0.days:02}:{0.hours:02}:{0.minutes:02}:"\
+                "{0.seconds:02}".format(relativedelta(seconds=int((args.step_count - (iter_idx + 1)) * total))))
             # compute loss in evaluation data
             total = 0
             iter_count = 0
@@ -857,6 +912,14 @@ def main():
                         batch_x_c = batch_x_c[:,:x_es]
                         batch_x_f = batch_x_f[:,:x_es]
                         batch_x_fb = batch_x_fb[:,:x_es*args.n_bands]
+                    # widen compact waveform codes to int64 only for the current segment (embedding indices and loss targets)
+                    batch_x_c_prev = batch_x_c_prev.long()
+                    batch_x_f_prev = batch_x_f_prev.long()
+                    if args.lpc > 0:
+                        batch_x_c_lpc = batch_x_c_lpc.long()
+                        batch_x_f_lpc = batch_x_f_lpc.long()
+                    batch_x_c = batch_x_c.long()
+                    batch_x_f = batch_x_f.long()
                     if f_ss_pad_left >= 0 and f_es_pad_right <= max_flen: # pad left and right available
                         batch_feat = batch_feat[:,f_ss_pad_left:f_es_pad_right]
                     elif f_es_pad_right <= max_flen: # pad right available, left need additional replicate
@@ -868,9 +931,9 @@ def main():
 
                     if f_ss > 0:
                         if len(del_index_utt) > 0:
-                            h_x = torch.FloatTensor(np.delete(h_x.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                            h_x_2 = torch.FloatTensor(np.delete(h_x_2.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                            h_f = torch.FloatTensor(np.delete(h_f.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
+                            h_x = index_delete(h_x, del_index_utt, dim=1)
+                            h_x_2 = index_delete(h_x_2, del_index_utt, dim=1)
+                            h_f = index_delete(h_f, del_index_utt, dim=1)
                         if args.lpc > 0:
                             batch_x_c_output, batch_x_f_output, h_x, h_x_2, h_f \
                                 = model_waveform(batch_feat, batch_x_c_prev, batch_x_f_prev, batch_x_c, h=h_x, h_2=h_x_2, h_f=h_f,
@@ -1075,11 +1138,15 @@ def main():
                     logging.info("%s (%.3f sec)" % (text_log, time.time() - start))
                     iter_count += 1
                     total += time.time() - start
+            # per-utterance development losses of all ranks
+            all_gather_lists_(total_eval_loss, loss_ce_avg, loss_err_avg, loss_ce_c_avg, loss_err_c_avg, loss_ce_f_avg, loss_err_f_avg, loss_fro_avg,
+                loss_l1_avg, loss_fro_fb, loss_l1_fb, loss_ce, loss_err, loss_ce_f, loss_err_f, loss_fro,
+                loss_l1)
             logging.info('sme %d' % (epoch_idx + 1))
             for key in total_eval_loss.keys():
                 total_eval_loss[key] = np.mean(total_eval_loss[key])
                 logging.info(f"(Steps: {iter_idx}) {key} = {total_eval_loss[key]:.4f}.")
-            write_to_tensorboard(writer, iter_idx, total_eval_loss)
+            write_to_tensorboard(writer, iter_idx, subset_tags(total_eval_loss) if args.eval_mode == "trainer" else total_eval_loss)
             total_eval_loss = defaultdict(list)
             eval_loss_ce_avg = np.mean(loss_ce_avg)
             eval_loss_ce_avg_std = np.std(loss_ce_avg)
@@ -1197,12 +1264,15 @@ def main():
                 logging.info("%s min_idx=%d" % (text_log, min_idx+1))
             #if ((epoch_idx + 1) % args.save_interval_epoch == 0) or (epoch_min_flag):
             #    logging.info('save epoch:%d' % (epoch_idx+1))
-            #    save_checkpoint(args.expdir, model_waveform, optimizer, numpy_random_state, torch_random_state, epoch_idx + 1)
-            logging.info('save epoch:%d' % (epoch_idx+1))
-            save_checkpoint(args.expdir, model_waveform, optimizer,
-                min_eval_loss_ce_avg, min_eval_loss_ce_avg_std, min_eval_loss_err_avg, min_eval_loss_err_avg_std,
-                    min_eval_loss_l1_avg, min_eval_loss_l1_fb, err_flag,
-                    iter_idx, min_idx, numpy_random_state, torch_random_state, epoch_idx + 1)
+            #    save_checkpoint(checkpoint_writer, model_waveform, optimizer, numpy_random_state, torch_random_state, epoch_idx + 1, eval_loss=eval_loss_ce_avg)
+            if args.eval_mode != "evaluator":
+                logging.info('save epoch:%d' % (epoch_idx+1))
+                save_checkpoint(checkpoint_writer, model_waveform, optimizer,
+                    min_eval_loss_ce_avg, min_eval_loss_ce_avg_std, min_eval_loss_err_avg, min_eval_loss_err_avg_std,
+                        min_eval_loss_l1_avg, min_eval_loss_l1_fb, err_flag,
+                        iter_idx, min_idx, numpy_random_state, torch_random_state, epoch_idx + 1, eval_loss=eval_loss_ce_avg)
+            else:
+                snapshot_queue.report(epoch_idx + 1, eval_loss_ce_avg)
             total = 0
             iter_count = 0
             loss_ce_avg = []
@@ -1233,13 +1303,17 @@ def main():
             if args.lpc > 0:
                 for param in model_waveform.logits.parameters():
                     param.requires_grad = False
+            if args.eval_mode == "evaluator":
+                continue
             # start next epoch
             if iter_idx < args.step_count:
                 start = time.time()
                 logging.info("==%d EPOCH==" % (epoch_idx+1))
                 logging.info("Training data")
+                profiler.skip() # exclude epoch summary and evaluation
                 batch_x_fb, batch_x, batch_x_c, batch_x_f, batch_feat, c_idx, utt_idx, featfile, x_bs, f_bs, x_ss, f_ss, n_batch_utt, \
                     del_index_utt, max_slen, max_flen, idx_select, idx_select_full, slens_acc, flens_acc = next(generator)
+                profiler.lap("data")
             else:
                 break
         # feedforward and backpropagate current batch
@@ -1292,6 +1366,14 @@ def main():
             batch_x_f = batch_x_f[:,:x_es]
             batch_x = batch_x[:,:x_es]
             batch_x_fb = batch_x_fb[:,:x_es*args.n_bands]
+        # widen compact waveform codes to int64 only for the current segment (embedding indices and loss targets)
+        batch_x_c_prev = batch_x_c_prev.long()
+        batch_x_f_prev = batch_x_f_prev.long()
+        if args.lpc > 0:
+            batch_x_c_lpc = batch_x_c_lpc.long()
+            batch_x_f_lpc = batch_x_f_lpc.long()
+        batch_x_c = batch_x_c.long()
+        batch_x_f = batch_x_f.long()
         if f_ss_pad_left >= 0 and f_es_pad_right <= max_flen: # pad left and right available
             batch_feat = batch_feat[:,f_ss_pad_left:f_es_pad_right]
         elif f_es_pad_right <= max_flen: # pad right available, left need additional replicate
@@ -1301,11 +1383,12 @@ def main():
         else: # pad left and right need additional replicate
             batch_feat = F.pad(batch_feat[:,:max_flen].transpose(1,2), (-f_ss_pad_left,f_es_pad_right-max_flen), "replicate").transpose(1,2)
 
+        profiler.lap("slicing")
         if f_ss > 0:
             if len(del_index_utt) > 0:
-                h_x = torch.FloatTensor(np.delete(h_x.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                h_x_2 = torch.FloatTensor(np.delete(h_x_2.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                h_f = torch.FloatTensor(np.delete(h_f.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
+                h_x = index_delete(h_x, del_index_utt, dim=1)
+                h_x_2 = index_delete(h_x_2, del_index_utt, dim=1)
+                h_f = index_delete(h_f, del_index_utt, dim=1)
             if args.lpc > 0:
                 batch_x_c_output, batch_x_f_output, h_x, h_x_2, h_f \
                     = model_waveform(batch_feat, batch_x_c_prev, batch_x_f_prev, batch_x_c, h=h_x, h_2=h_x_2, h_f=h_f,
@@ -1344,6 +1427,7 @@ def main():
         #    logging.info(check_samples)
 
         # handle short ending
+        profiler.lap("forward")
         batch_loss = 0
         if len(idx_select) > 0:
             logging.info('len_idx_select: '+str(len(idx_select)))
@@ -1445,9 +1529,10 @@ def main():
                 batch_x_f_output = torch.index_select(batch_x_f_output,0,idx_select_full)
                 batch_x_output = torch.index_select(batch_x_output,0,idx_select_full)
                 batch_x_output_fb = torch.index_select(batch_x_output_fb,0,idx_select_full)
-            elif batch_loss > 0:
+            elif batch_loss > 0 or world_size > 1: # every rank takes part in the gradient all-reduce
                 optimizer.zero_grad()
                 batch_loss.backward()
+                all_reduce_gradients(module_list)
                 flag = False
                 for name, param in model_waveform.named_parameters():
                     if param.requires_grad:
@@ -1464,10 +1549,7 @@ def main():
                 with torch.no_grad():
                     if idx_stage < args.n_stage-1 and iter_idx + 1 == t_starts[idx_stage+1]:
                         idx_stage += 1
-                    if idx_stage > 0:
-                        sparsify(model_waveform, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                    else:
-                        sparsify(model_waveform, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
+                    sparsity_waveform.step(iter_idx + 1)
 
                 logging.info("batch loss select %.3f (%.3f sec)" % (batch_loss.item(), time.time() - start))
                 iter_idx += 1
@@ -1483,6 +1565,7 @@ def main():
                     write_to_tensorboard(writer, iter_idx, total_train_loss)
                     total_train_loss = defaultdict(list)
                 total += time.time() - start
+                profiler.step(iter_idx)
                 continue
             else:
                 continue
@@ -1572,8 +1655,11 @@ def main():
         #logging.info(model_waveform.logits_c.weight[:,0])
         #logging.info(model_waveform.logits_f.weight[:,0])
 
+        profiler.lap("loss")
         optimizer.zero_grad()
         batch_loss.backward()
+        all_reduce_gradients(module_list)
+        profiler.lap("backward")
         flag = False
         for name, param in model_waveform.named_parameters():
             if param.requires_grad:
@@ -1586,6 +1672,7 @@ def main():
             continue
         torch.nn.utils.clip_grad_norm_(model_waveform.parameters(), 10)
         optimizer.step()
+        profiler.lap("optimizer")
 
         #logging.info(model_waveform.logits_c.weight[:,0])
         #logging.info(model_waveform.logits_f.weight[:,0])
@@ -1598,10 +1685,8 @@ def main():
         with torch.no_grad():
             if idx_stage < args.n_stage-1 and iter_idx + 1 == t_starts[idx_stage+1]:
                 idx_stage += 1
-            if idx_stage > 0:
-                sparsify(model_waveform, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-            else:
-                sparsify(model_waveform, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
+            sparsity_waveform.step(iter_idx + 1)
+        profiler.lap("sparsify")
 
         text_log = "batch loss [%d] %d %d %d %d %d : %.3f %.3f %% %.3f %.3f %% %.3f %.3f %% , %.3f %.3f , %.3f %.3f" % (c_idx+1, max_slen, x_ss, x_bs,
             f_ss, f_bs, batch_loss_ce_avg, batch_loss_err_avg, batch_loss_ce_c_avg, batch_loss_err_c_avg,
@@ -1623,9 +1708,17 @@ def main():
             write_to_tensorboard(writer, iter_idx, total_train_loss)
             total_train_loss = defaultdict(list)
         total += time.time() - start
+        profiler.step(iter_idx)
 
 
     logging.info("Maximum step is reached, please check the development optimum index, or continue training by increasing maximum step.")
+    profiler.close()
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+        if args.eval_mode == "trainer":
+            snapshot_queue.end_training()
+    if cache is not None:
+        cache.clear()
 
 
 if __name__ == "__main__":
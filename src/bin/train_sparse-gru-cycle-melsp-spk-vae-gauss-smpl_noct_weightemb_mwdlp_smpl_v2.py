@@ -26,7 +26,7 @@ import torch
 from pqmf import PQMF
 
 from torchvision import transforms
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 
 from decimal import Decimal
 
@@ -44,9 +44,20 @@ from vcneuvoco import decode_mu_law_torch, MultiResolutionSTFTLoss
 import torch_optimizer as optim
 
 from dataset import FeatureDatasetCycMceplf0WavVAE, FeatureDatasetEvalCycMceplf0WavVAE, padding
+from segmenter import BatchSegmenter, index_delete
+from feature_cache import SharedFeatureCache, default_cache_dir
+from devices import get_device
+from checkpoint_io import AsyncCheckpointWriter
+from sparsity import BlockSparsity, parse_extra_densities
+from precision import autocast_methods
+from distributed import init_distributed, ShardedSampler, synchronize_epochs, broadcast_object
+from distributed import broadcast_parameters, all_reduce_gradients, all_gather_lists_
+from profiling import StepProfiler
+from memory import checkpoint_modules, MemoryMeter, auto_batch_size
+from eval_service import EVAL_MODES, SnapshotQueue, eval_subset_indices, load_snapshot, subset_tags
 
 import librosa
-from dtw_c import dtw_c as dtw
+from eval_metrics import DTWEvalPool
 
 #np.set_printoptions(threshold=np.inf)
 #torch.set_printoptions(threshold=np.inf)
@@ -90,61 +101,40 @@ def train_generator(dataloader, device, batch_size, n_cv, upsampling_factor, lim
                 sc_cv[i] = batch['src_trg_codes_list'][i][:,:max_flen].to(device)
             featfiles = batch['featfile']
             spk_cv = batch['pair_spk_list']
-            n_batch_utt = feat.size(0)
+            if 'lat_fix' in batch:
+                lat_fix = batch['lat_fix'][:,:max_flen].to(device)
+            else:
+                lat_fix = None
 
-            len_frm = max_flen
-            x_ss = 0
-            f_ss = 0
-            x_bs = batch_size*upsampling_factor_bands
-            f_bs = batch_size
-            delta = batch_size*upsampling_factor_bands
-            delta_frm = batch_size
-            slens_acc = np.array(slens)
-            flens_acc = np.array(flens)
+            segmenter = BatchSegmenter(flens, batch_size, slens=slens, upsampling_factor_bands=upsampling_factor_bands)
             while True:
-                del_index_utt = []
-                idx_select = []
-                idx_select_full = []
-                for i in range(n_batch_utt):
-                    if flens_acc[i] <= 0:
-                        del_index_utt.append(i)
+                del_index_utt = segmenter.update()
                 if len(del_index_utt) > 0:
-                    slens = np.delete(slens, del_index_utt, axis=0)
-                    flens = np.delete(flens, del_index_utt, axis=0)
-                    x = torch.FloatTensor(np.delete(x.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    xs = torch.FloatTensor(np.delete(xs.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    xs_c = torch.LongTensor(np.delete(xs_c.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    xs_f = torch.LongTensor(np.delete(xs_f.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    feat = torch.FloatTensor(np.delete(feat.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    feat_magsp = torch.FloatTensor(np.delete(feat_magsp.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    sc = torch.LongTensor(np.delete(sc.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    for j in range(n_cv):
-                        sc_cv[j] = torch.LongTensor(np.delete(sc_cv[j].cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                        spk_cv[j] = np.delete(spk_cv[j], del_index_utt, axis=0)
-                    featfiles = np.delete(featfiles, del_index_utt, axis=0)
-                    slens_acc = np.delete(slens_acc, del_index_utt, axis=0)
-                    flens_acc = np.delete(flens_acc, del_index_utt, axis=0)
-                    n_batch_utt -= len(del_index_utt)
-                for i in range(n_batch_utt):
-                    if flens_acc[i] < f_bs:
-                        idx_select.append(i)
-                if len(idx_select) > 0:
-                    idx_select_full = torch.LongTensor(np.delete(np.arange(n_batch_utt), idx_select, axis=0)).to(device)
-                    idx_select = torch.LongTensor(idx_select).to(device)
+                    slens = segmenter.shrink(slens)
+                    flens = segmenter.shrink(flens)
+                    x = segmenter.shrink(x)
+                    xs = segmenter.shrink(xs)
+                    xs_c = segmenter.shrink(xs_c)
+                    xs_f = segmenter.shrink(xs_f)
+                    feat = segmenter.shrink(feat)
+                    feat_magsp = segmenter.shrink(feat_magsp)
+                    sc = segmenter.shrink(sc)
+                    sc_cv = segmenter.shrink_list(sc_cv)
+                    spk_cv = segmenter.shrink_list(spk_cv)
+                    featfiles = segmenter.shrink(featfiles)
+                    if lat_fix is not None:
+                        lat_fix = segmenter.shrink(lat_fix)
+                n_batch_utt = segmenter.n_batch_utt
+                idx_select, idx_select_full = segmenter.select_short(device)
+                x_bs, f_bs, x_ss, f_ss = segmenter.x_bs, segmenter.f_bs, segmenter.x_ss, segmenter.f_ss
+                slens_acc, flens_acc = segmenter.slens_acc, segmenter.flens_acc
                 yield x, xs, xs_c, xs_f, feat, feat_magsp, sc, sc_cv, c_idx, idx, featfiles, x_bs, x_ss, f_bs, f_ss, slens, flens, \
-                    n_batch_utt, del_index_utt, max_slen, max_flen, spk_cv, idx_select, idx_select_full, slens_acc, flens_acc
-                for i in range(n_batch_utt):
-                    slens_acc[i] -= delta
-                    flens_acc[i] -= delta_frm
+                    n_batch_utt, del_index_utt, max_slen, max_flen, spk_cv, idx_select, idx_select_full, slens_acc, flens_acc, lat_fix
 
                 count += 1
                 if limit_count is not None and count > limit_count:
                     break
-                len_frm -= delta_frm
-                if len_frm > 0:
-                    x_ss += delta
-                    f_ss += delta_frm
-                else:
+                if not segmenter.advance():
                     break
 
             if limit_count is not None and count > limit_count:
@@ -155,7 +145,7 @@ def train_generator(dataloader, device, batch_size, n_cv, upsampling_factor, lim
             #if c_idx > 2:
             #    break
 
-        yield [], [], [], [], [], [], [], [], -1, -1, [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], []
+        yield [], [], [], [], [], [], [], [], -1, -1, [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], []
 
 
 def eval_generator(dataloader, device, batch_size, upsampling_factor, limit_count=None, spcidx=True, n_bands=4):
@@ -208,72 +198,47 @@ def eval_generator(dataloader, device, batch_size, upsampling_factor, limit_coun
                 sc_full = batch['src_code_full'][:,:max_flen_full].to(device)
                 sc_cv_full = batch['src_trg_code_full'][:,:max_flen_full].to(device)
 
-            len_frm = max_flen
-            x_ss = 0
-            f_ss = 0
-            x_bs = batch_size*upsampling_factor_bands
-            f_bs = batch_size
-            delta = batch_size*upsampling_factor_bands
-            delta_frm = batch_size
-            slens_acc = np.array(slens)
-            flens_acc = np.array(flens)
+            segmenter = BatchSegmenter(flens, batch_size, slens=slens, upsampling_factor_bands=upsampling_factor_bands)
             while True:
-                del_index_utt = []
-                idx_select = []
-                idx_select_full = []
-                for i in range(n_batch_utt):
-                    if flens_acc[i] <= 0:
-                        del_index_utt.append(i)
+                del_index_utt = segmenter.update()
                 if len(del_index_utt) > 0:
-                    slens = np.delete(slens, del_index_utt, axis=0)
-                    flens = np.delete(flens, del_index_utt, axis=0)
-                    flens_trg = np.delete(flens_trg, del_index_utt, axis=0)
-                    flens_spc_src = np.delete(flens_spc_src, del_index_utt, axis=0)
-                    flens_spc_src_trg = np.delete(flens_spc_src_trg, del_index_utt, axis=0)
-                    x = torch.FloatTensor(np.delete(x.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    xs = torch.FloatTensor(np.delete(xs.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    xs_c = torch.LongTensor(np.delete(xs_c.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    xs_f = torch.LongTensor(np.delete(xs_f.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    feat = torch.FloatTensor(np.delete(feat.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    feat_magsp = torch.FloatTensor(np.delete(feat_magsp.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    feat_trg = torch.FloatTensor(np.delete(feat_trg.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    sc = torch.LongTensor(np.delete(sc.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    sc_cv = torch.LongTensor(np.delete(sc_cv.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    spcidx_src = torch.LongTensor(np.delete(spcidx_src.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    spcidx_src_trg = torch.LongTensor(np.delete(spcidx_src_trg.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    spk_cv = np.delete(spk_cv, del_index_utt, axis=0)
-                    file_src_trg_flag = np.delete(file_src_trg_flag, del_index_utt, axis=0)
-                    featfiles = np.delete(featfiles, del_index_utt, axis=0)
-                    slens_acc = np.delete(slens_acc, del_index_utt, axis=0)
-                    flens_acc = np.delete(flens_acc, del_index_utt, axis=0)
-                    n_batch_utt -= len(del_index_utt)
-                for i in range(n_batch_utt):
-                    if flens_acc[i] < f_bs:
-                        idx_select.append(i)
-                if len(idx_select) > 0:
-                    idx_select_full = torch.LongTensor(np.delete(np.arange(n_batch_utt), idx_select, axis=0)).to(device)
-                    idx_select = torch.LongTensor(idx_select).to(device)
+                    slens = segmenter.shrink(slens)
+                    flens = segmenter.shrink(flens)
+                    flens_trg = segmenter.shrink(flens_trg)
+                    flens_spc_src = segmenter.shrink(flens_spc_src)
+                    flens_spc_src_trg = segmenter.shrink(flens_spc_src_trg)
+                    x = segmenter.shrink(x)
+                    xs = segmenter.shrink(xs)
+                    xs_c = segmenter.shrink(xs_c)
+                    xs_f = segmenter.shrink(xs_f)
+                    feat = segmenter.shrink(feat)
+                    feat_magsp = segmenter.shrink(feat_magsp)
+                    feat_trg = segmenter.shrink(feat_trg)
+                    sc = segmenter.shrink(sc)
+                    sc_cv = segmenter.shrink(sc_cv)
+                    spcidx_src = segmenter.shrink(spcidx_src)
+                    spcidx_src_trg = segmenter.shrink(spcidx_src_trg)
+                    spk_cv = segmenter.shrink(spk_cv)
+                    file_src_trg_flag = segmenter.shrink(file_src_trg_flag)
+                    featfiles = segmenter.shrink(featfiles)
+                n_batch_utt = segmenter.n_batch_utt
+                idx_select, idx_select_full = segmenter.select_short(device)
+                x_bs, f_bs, x_ss, f_ss = segmenter.x_bs, segmenter.f_bs, segmenter.x_ss, segmenter.f_ss
+                slens_acc, flens_acc = segmenter.slens_acc, segmenter.flens_acc
                 if spcidx:
                     yield x, xs, xs_c, xs_f, feat, feat_magsp, feat_trg, sc, sc_cv, c_idx, idx, featfiles, x_bs, x_ss, f_bs, f_ss, slens, flens, \
                         n_batch_utt, del_index_utt, max_slen, max_flen, spk_cv, file_src_trg_flag, spcidx_src, \
-                            spcidx_src_trg, flens_spc_src, flens_spc_src_trg, feat_full, sc_full, sc_cv_full, \
+                            spcidx_src_trg, flens_spc_src, flens_spc_src_trg, feat_full, sc_full, sc_cv_full, flens_full, flens_trg, \
                                 idx_select, idx_select_full, slens_acc, flens_acc
                 else:
                     yield x, xs, xs_c, xs_f, feat, feat_magsp, feat_trg, sc, sc_cv, c_idx, idx, featfiles, x_bs, x_ss, f_bs, f_ss, slens, flens, \
                         n_batch_utt, del_index_utt, max_slen, max_flen, spk_cv, file_src_trg_flag, spcidx_src, \
                             spcidx_src_trg, flens_spc_src, flens_spc_src_trg, idx_select, idx_select_full, slens_acc, flens_acc
-                for i in range(n_batch_utt):
-                    slens_acc[i] -= delta
-                    flens_acc[i] -= delta_frm
 
                 count += 1
                 if limit_count is not None and count > limit_count:
                     break
-                len_frm -= delta_frm
-                if len_frm > 0:
-                    x_ss += delta
-                    f_ss += delta_frm
-                else:
+                if not segmenter.advance():
                     break
 
             if limit_count is not None and count > limit_count:
@@ -290,30 +255,25 @@ def eval_generator(dataloader, device, batch_size, upsampling_factor, limit_coun
             yield [], [], [], [], [], [], [], [], [], -1, -1, [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], []
 
 
-def save_checkpoint(checkpoint_dir, model_encoder_melsp_fix, model_encoder_melsp, model_decoder_melsp,
+def save_checkpoint(checkpoint_writer, model_encoder_melsp_fix, model_encoder_melsp, model_decoder_melsp,
         model_encoder_excit_fix, model_encoder_excit, model_spkidtr, model_classifier,
         model_waveform, min_eval_loss_melsp_dB, min_eval_loss_melsp_dB_std, min_eval_loss_melsp_cv,
         min_eval_loss_melsp, min_eval_loss_gauss_cv, min_eval_loss_gauss,
         min_eval_loss_melsp_dB_src_trg, min_eval_loss_melsp_dB_src_trg_std, min_eval_loss_gv_src_trg,
         min_eval_loss_ce_avg, min_eval_loss_ce_avg_std, min_eval_loss_err_avg, min_eval_loss_err_avg_std,
         min_eval_loss_l1_avg, min_eval_loss_l1_fb, err_flag, err_flag_count,
-        iter_idx, min_idx, optimizer, numpy_random_state, torch_random_state, iterations):
+        iter_idx, min_idx, optimizer, numpy_random_state, torch_random_state, iterations, eval_loss=None):
     """FUNCTION TO SAVE CHECKPOINT
 
     Args:
-        checkpoint_dir (str): directory to save checkpoint
+        checkpoint_writer (AsyncCheckpointWriter): background checkpoint writer
         model (torch.nn.Module): pytorch model instance
         optimizer (Optimizer): pytorch optimizer instance
         iterations (int): number of current iterations
+        eval_loss (float): development loss of current iterations for checkpoint retention
     """
-    model_encoder_melsp_fix.cpu()
-    model_encoder_melsp.cpu()
-    model_decoder_melsp.cpu()
-    model_encoder_excit_fix.cpu()
-    model_encoder_excit.cpu()
-    model_spkidtr.cpu()
-    model_classifier.cpu()
-    model_waveform.cpu()
+    if checkpoint_writer is None: # not rank 0 of data-parallel training
+        return
     checkpoint = {
         "model_encoder_melsp_fix": model_encoder_melsp_fix.state_dict(),
         "model_encoder_melsp": model_encoder_melsp.state_dict(),
@@ -347,72 +307,17 @@ def save_checkpoint(checkpoint_dir, model_encoder_melsp_fix, model_encoder_melsp
         "numpy_random_state": numpy_random_state,
         "torch_random_state": torch_random_state,
         "iterations": iterations}
-    if not os.path.exists(checkpoint_dir):
-        os.makedirs(checkpoint_dir)
-    torch.save(checkpoint, checkpoint_dir + "/checkpoint-%d.pkl" % iterations)
-    torch.save(checkpoint, checkpoint_dir + "/checkpoint-last.pkl")
-    model_encoder_melsp_fix.cuda()
-    model_encoder_melsp.cuda()
-    model_decoder_melsp.cuda()
-    model_encoder_excit_fix.cuda()
-    model_encoder_excit.cuda()
-    model_spkidtr.cuda()
-    model_classifier.cuda()
-    model_waveform.cuda()
-    logging.info("%d-iter and last checkpoints created." % iterations)
+    checkpoint_writer.save(checkpoint, iterations, eval_loss=eval_loss, keep=[min_idx+1])
 
 
 def write_to_tensorboard(writer, steps, loss):
     """Write to tensorboard."""
+    if writer is None:
+        return
     for key, value in loss.items():
         writer.add_scalar(key, value, steps)
 
 
-## Based on lpcnet.py [https://github.com/mozilla/LPCNet/blob/master/src/lpcnet.py]
-## Modified to accomodate PyTorch model and n-stages of sparsification
-def sparsify(model, iter_idx, t_start, t_end, interval, densities, densities_p=None):
-    if iter_idx < t_start or ((iter_idx-t_start) % interval != 0 and iter_idx < t_end):
-        pass
-    else:
-        logging.info('sparsify: %ld %ld %ld %ld' % (iter_idx, t_start, t_end, interval))
-        p = model.gru.weight_hh_l0 #recurrent
-        nb = p.shape[0] // p.shape[1]
-        N = p.shape[0] // nb
-        N_16 = N // 16
-        ones = torch.diag(torch.ones(N, device=p.device))
-        if densities_p is not None:
-            for k in range(nb):
-                density = densities[k]
-                if iter_idx < t_end:
-                    r = 1 - (iter_idx-t_start)/(t_end - t_start)
-                    density = densities_p[k] - (densities_p[k]-densities[k])*(1 - r)**5
-                logging.info('%ld: %lf %lf %lf' % (k+1, densities_p[k], densities[k], density))
-                #recurrent weight
-                A = p[k*N:(k+1)*N, :]
-                #horizontal block structure (16) in input part, in real-time simultaneously computed for each 16 output using 2 registers (256x2 bits)
-                L = (A - torch.diag(torch.diag(A))).transpose(1, 0).reshape(N, N_16, 16)
-                S = torch.sum(L*L, -1)
-                SS, _ = torch.sort(S.reshape(-1))
-                thresh = SS[round(N*N_16*(1-density))]
-                mask = torch.clamp(torch.repeat_interleave((S>=thresh).float(), 16, dim=1) + ones, max=1).transpose(1,0)
-                p[k*N:(k+1)*N, :] = p[k*N:(k+1)*N, :]*mask # outputxinput
-        else:
-            for k in range(nb):
-                density = densities[k]
-                if iter_idx < t_end:
-                    r = 1 - (iter_idx-t_start)/(t_end - t_start)
-                    density = 1 - (1-densities[k])*(1 - r)**5
-                logging.info('%ld: 1 %lf %lf' % (k+1, densities[k], density))
-                #recurrent weight
-                A = p[k*N:(k+1)*N, :]
-                L = (A - torch.diag(torch.diag(A))).transpose(1, 0).reshape(N, N_16, 16)
-                S = torch.sum(L*L, -1)
-                SS, _ = torch.sort(S.reshape(-1))
-                thresh = SS[round(N*N_16*(1-density))]
-                mask = torch.clamp(torch.repeat_interleave((S>=thresh).float(), 16, dim=1) + ones, max=1).transpose(1,0)
-                p[k*N:(k+1)*N, :] = p[k*N:(k+1)*N, :]*mask
-
-
 def main():
     parser = argparse.ArgumentParser()
     # path setting
@@ -486,6 +391,21 @@ def main():
                         type=float, help="dropout probability")
     parser.add_argument("--n_workers", default=2,
                         type=int, help="batch size (if set 0, utterance batch will be used)")
+    parser.add_argument("--cache_size", default=0,
+                        type=float, help="memory budget [MB] of shared in-memory feature cache (if set 0, no cache will be used)")
+    parser.add_argument("--cache_dir", default=None,
+                        type=str, help="directory of shared feature cache, should be on tmpfs (default: /dev/shm/featcache_<hash of expdir>)")
+    parser.add_argument("--persistent_workers", default=False,
+                        type=strtobool, help="flag to keep dataloader workers alive across epochs")
+    parser.add_argument("--memory_budget", default=0,
+                        type=float, help="memory budget [MB] of the training process, the utterance batch and the frame segment "\
+                            "(--batch_size) are picked by probing the models (if set 0, not used), recorded in model.conf")
+    parser.add_argument("--ckpt_keep_best", default=0,
+                        type=int, help="number of best checkpoints by development loss to be kept (if this and ckpt_keep_last are 0, keep all)")
+    parser.add_argument("--ckpt_keep_last", default=0,
+                        type=int, help="number of last checkpoints to be kept (if this and ckpt_keep_best are 0, keep all)")
+    parser.add_argument("--n_eval_workers", default=2,
+                        type=int, help="number of processes of DTW-based evaluation metrics (if set 0, computed in the training process)")
     parser.add_argument("--n_half_cyc", default=2,
                         type=int, help="batch size (if set 0, utterance batch will be used)")
     parser.add_argument("--causal_conv_enc", default=False,
@@ -514,6 +434,8 @@ def main():
                         type=int, help="interval in finishing densitiy sparsify")
     parser.add_argument("--densities", default="0.685-0.685-0.88",
                         type=str, help="final densitiy of reset, update, new hidden gate matrices")
+    parser.add_argument("--sparse_extra", default="",
+                        type=str, help="additional matrices to be sparsified and their final densities, separated by @, e.g., decoder_melsp.gru.weight_ih_l0:0.5@out.weight:0.25, names scoped with a model (encoder_melsp, encoder_excit, decoder_melsp) are only for that model")
     parser.add_argument("--fftl", default=2048,
                         type=int, help="kernel size of dilated causal convolution")
     parser.add_argument("--fs", default=24000,
@@ -539,6 +461,33 @@ def main():
     #                    type=str, help="model path to restart training")
     parser.add_argument("--GPU_device", default=None,
                         type=int, help="selection of GPU device")
+    parser.add_argument("--device", default=None,
+                        type=str, help="compute device, cuda or cpu (if not set, cuda if available, otherwise cpu)")
+    parser.add_argument("--n_threads", default=0,
+                        type=int, help="number of cpu intra-op threads (if set 0, available cores minus dataloader workers)")
+    parser.add_argument("--n_interop_threads", default=0,
+                        type=int, help="number of cpu inter-op threads (if set 0, 1 thread)")
+    parser.add_argument("--precision", default="fp32",
+                        type=str, help="compute precision, fp32 or bf16 (autocast with fp32 master weights)")
+    parser.add_argument("--dist_backend", default="gloo",
+                        type=str, help="backend of data-parallel training, launched with WORLD_SIZE > 1 (gloo for cpu nodes)")
+    parser.add_argument("--profile", default=False,
+                        type=strtobool, help="flag to report time breakdown of training steps every log_interval_steps")
+    parser.add_argument("--profile_trace_start", default=10,
+                        type=int, help="number of profiled steps before torch.profiler trace")
+    parser.add_argument("--profile_trace_steps", default=0,
+                        type=int, help="number of steps of torch.profiler trace in expdir/profile (if set 0, no trace)")
+    parser.add_argument("--grad_checkpoint", default=False,
+                        type=strtobool, help="flag to recompute activations of encoders, spkidtr, decoder, and waveform model "\
+                            "in backward (less memory for longer segments / larger batches, more compute)")
+    parser.add_argument("--string_path_fix", default=None,
+                        type=str, help="path of precomputed latents of the fixed encoders in the feature files (calc_fix_latents.py "\
+                            "with gen_model), if set, the fixed encoders are not computed in the training steps")
+    parser.add_argument("--eval_mode", default="inline",
+                        type=str, help="inline: evaluate in training, trainer: evaluate fixed subset and leave full evaluation "\
+                            "of checkpoints to evaluator, evaluator: evaluate checkpoints of trainer with the same expdir and n_threads")
+    parser.add_argument("--n_eval_subset", default=10,
+                        type=int, help="number of fixed development utterances of fast proxy evaluation in trainer mode")
     parser.add_argument("--verbose", default=1,
                         type=int, help="log level")
     args = parser.parse_args()
@@ -547,6 +496,14 @@ def main():
         os.environ["CUDA_DEVICE_ORDER"]     = "PCI_BUS_ID"
         os.environ["CUDA_VISIBLE_DEVICES"]  = str(args.GPU_device)
 
+    # data-parallel processes (if launched with WORLD_SIZE > 1)
+    rank, world_size, local_world_size = init_distributed(args.dist_backend)
+    if args.eval_mode not in EVAL_MODES:
+        raise ValueError("eval_mode should be one of %s, got %s." % (str(EVAL_MODES), args.eval_mode))
+    if args.eval_mode == "evaluator" and world_size > 1:
+        raise ValueError("evaluator should be launched as a single process.")
+    log_name = "eval.log" if args.eval_mode == "evaluator" else "train.log"
+
     # make experimental directory
     if not os.path.exists(args.expdir):
         os.makedirs(args.expdir)
@@ -556,30 +513,34 @@ def main():
         logging.basicConfig(level=logging.INFO,
                             format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
                             datefmt='%m/%d/%Y %I:%M:%S',
-                            filename=args.expdir + "/train.log")
+                            filename=args.expdir + "/" + log_name)
         logging.getLogger().addHandler(logging.StreamHandler())
     elif args.verbose > 1:
         logging.basicConfig(level=logging.DEBUG,
                             format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
                             datefmt='%m/%d/%Y %I:%M:%S',
-                            filename=args.expdir + "/train.log")
+                            filename=args.expdir + "/" + log_name)
         logging.getLogger().addHandler(logging.StreamHandler())
     else:
         logging.basicConfig(level=logging.WARN,
                             format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
                             datefmt='%m/%d/%Y %I:%M:%S',
-                            filename=args.expdir + "/train.log")
+                            filename=args.expdir + "/" + log_name)
         logging.getLogger().addHandler(logging.StreamHandler())
         logging.warn("logging is disabled.")
+    if rank > 0:
+        # log of rank 0 only
+        logging.getLogger().setLevel(logging.WARN)
+    elif world_size > 1:
+        logging.info("data-parallel training with %d processes, %s backend" % (world_size, args.dist_backend))
 
     # fix seed
     os.environ['PYTHONHASHSEED'] = str(args.seed)
     np.random.seed(args.seed)
     torch.manual_seed(args.seed)
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    if str(device) == "cpu":
-        raise ValueError('ERROR: Training by CPU is not acceptable.')
+    device = get_device(args.device, n_threads=args.n_threads, n_interop_threads=args.n_interop_threads,
+                    n_procs=local_world_size, n_workers=args.n_workers)
 
     torch.backends.cudnn.benchmark = True #faster
 
@@ -592,6 +553,15 @@ def main():
     assert(n_spk_data == len(wav_eval_src_list))
     logging.info(f'{n_spk} {n_spk_data}')
 
+    # memory-budgeted batch sizes of this expdir are kept in resumed training / evaluator, with or without --memory_budget
+    args.batch_size_utt = None
+    if (args.resume is not None or args.eval_mode == "evaluator") and os.path.isfile(args.expdir + "/model.conf"):
+        config = torch.load(args.expdir + "/model.conf")
+        if getattr(config, "batch_size_utt", None) is not None:
+            args.batch_size = config.batch_size
+            args.batch_size_utt = config.batch_size_utt
+            logging.info("batch sizes of model.conf: %d utterance(s) x %d frames" % (args.batch_size_utt, args.batch_size))
+
     # save args as conf
     args.string_path = "/log_1pmelmagsp"
     args.n_quantize = 1024
@@ -613,7 +583,9 @@ def main():
     args.interval = max(math.ceil(args.interval * args.factor),1)
     args.step_count = max(math.ceil(args.t_end * 3.43),1)
     logging.info(f'{args.t_start} {args.t_end} {args.interval} {args.step_count}')
-    torch.save(args, args.expdir + "/model.conf")
+    if args.eval_mode != "evaluator" and (args.memory_budget <= 0 or args.batch_size_utt is not None):
+        # model.conf of the training process, saved after probing if the batch sizes are still to be picked
+        torch.save(args, args.expdir + "/model.conf")
 
     # define network
     model_encoder_melsp_fix = GRU_VAE_ENCODER(
@@ -754,29 +726,41 @@ def main():
     p_spk = torch.ones(n_spk)/n_spk
     melfb_t = torch.FloatTensor(np.linalg.pinv(librosa.filters.mel(args.fs, args.fftl, n_mels=args.mel_dim)).T)
 
-    # send to gpu
-    if torch.cuda.is_available():
-        model_encoder_melsp_fix.cuda()
-        model_encoder_melsp.cuda()
-        model_decoder_melsp.cuda()
-        model_encoder_excit_fix.cuda()
-        model_encoder_excit.cuda()
-        model_spkidtr.cuda()
-        model_classifier.cuda()
-        model_waveform.cuda()
-        pqmf.cuda()
-        criterion_gauss.cuda()
-        criterion_ce.cuda()
-        criterion_l1.cuda()
-        criterion_l2.cuda()
-        criterion_stft.cuda()
-        criterion_stft_fb.cuda()
-        indices_1hot = indices_1hot.cuda()
-        melfb_t = melfb_t.cuda()
-        p_spk = p_spk.cuda()
-    else:
-        logging.error("gpu is not available. please check the setting.")
-        sys.exit(1)
+    # send to device
+    model_encoder_melsp_fix.to(device)
+    model_encoder_melsp.to(device)
+    model_decoder_melsp.to(device)
+    model_encoder_excit_fix.to(device)
+    model_encoder_excit.to(device)
+    model_spkidtr.to(device)
+    model_classifier.to(device)
+    model_waveform.to(device)
+    autocast_methods(model_encoder_melsp_fix, device, args.precision)
+    autocast_methods(model_encoder_melsp, device, args.precision)
+    autocast_methods(model_decoder_melsp, device, args.precision)
+    autocast_methods(model_encoder_excit_fix, device, args.precision)
+    autocast_methods(model_encoder_excit, device, args.precision)
+    autocast_methods(model_spkidtr, device, args.precision)
+    autocast_methods(model_classifier, device, args.precision)
+    autocast_methods(model_waveform, device, args.precision)
+    if args.grad_checkpoint:
+        # after autocast, so that the recomputation in backward is in the same precision
+        checkpoint_modules({
+            "encoder_melsp": model_encoder_melsp,
+            "encoder_excit": model_encoder_excit,
+            "spkidtr": model_spkidtr,
+            "decoder_melsp": model_decoder_melsp,
+            "waveform": model_waveform})
+    pqmf.to(device)
+    criterion_gauss.to(device)
+    criterion_ce.to(device)
+    criterion_l1.to(device)
+    criterion_l2.to(device)
+    criterion_stft.to(device)
+    criterion_stft_fb.to(device)
+    indices_1hot = indices_1hot.to(device)
+    melfb_t = melfb_t.to(device)
+    p_spk = p_spk.to(device)
     logits_p_spk = torch.log(p_spk)
 
     logging.info(p_spk)
@@ -826,7 +810,7 @@ def main():
     logging.info('Trainable Parameters (waveform): %.3f million' % parameters)
 
     if args.resume is None:
-        checkpoint = torch.load(args.gen_model)
+        checkpoint = torch.load(args.gen_model, map_location=device)
         model_encoder_melsp_fix.load_state_dict(checkpoint["model_encoder_melsp"])
         model_encoder_melsp.load_state_dict(checkpoint["model_encoder_melsp"])
         model_decoder_melsp.load_state_dict(checkpoint["model_decoder_melsp"], strict=False)
@@ -836,7 +820,7 @@ def main():
         model_classifier.load_state_dict(checkpoint["model_classifier"], strict=False)
         epoch_idx = checkpoint["iterations"]
         logging.info("gen_model from %d-iter checkpoint." % epoch_idx)
-        checkpoint = torch.load(args.gen_model_waveform)
+        checkpoint = torch.load(args.gen_model_waveform, map_location=device)
         model_waveform.load_state_dict(checkpoint["model_waveform"])
         epoch_idx = checkpoint["iterations"]
         logging.info("gen_model_waveform from %d-iter checkpoint." % epoch_idx)
@@ -897,7 +881,7 @@ def main():
 
     # resume
     if args.resume is not None:
-        checkpoint = torch.load(args.resume)
+        checkpoint = torch.load(args.resume, map_location=device)
         model_encoder_melsp_fix.load_state_dict(checkpoint["model_encoder_melsp_fix"])
         model_encoder_melsp.load_state_dict(checkpoint["model_encoder_melsp"])
         model_decoder_melsp.load_state_dict(checkpoint["model_decoder_melsp"])
@@ -947,21 +931,172 @@ def main():
         sys.exit(1)
     assert(len(feat_list) == len(wav_list))
     n_data = len(feat_list)
-    if n_data >= 225:
+    if args.batch_size_utt is not None:
+        batch_size_utt = args.batch_size_utt
+    elif n_data >= 225:
         batch_size_utt = round(n_data/150)
         if batch_size_utt > 30:
             batch_size_utt = 30
     else:
         batch_size_utt = 1
     logging.info("number of training_data -- batch_size = %d -- %d " % (n_data, batch_size_utt))
-    dataset = FeatureDatasetCycMceplf0WavVAE(feat_list, pad_feat_transform, spk_list, stats_list,
-                args.n_half_cyc, args.string_path, magsp=True, worgx_flag=True,
-                    wav_list=wav_list, pad_wav_transform=pad_wav_transform, wav_transform=wav_transform, pad_wav_org_transform=pad_wav_org_transform,
-                        cf_dim=args.cf_dim, upsampling_factor=args.upsampling_factor, n_bands=args.n_bands)
-    dataloader = DataLoader(dataset, batch_size=batch_size_utt, shuffle=True, num_workers=args.n_workers)
-    #generator = train_generator(dataloader, device, args.batch_size, n_cv, args.upsampling_factor, limit_count=1, n_bands=args.n_bands)
-    #generator = train_generator(dataloader, device, args.batch_size, n_cv, args.upsampling_factor, limit_count=20, n_bands=args.n_bands)
-    generator = train_generator(dataloader, device, args.batch_size, n_cv, args.upsampling_factor, limit_count=None, n_bands=args.n_bands)
+
+    enc_pad_left = model_encoder_melsp.pad_left
+    enc_pad_right = model_encoder_melsp.pad_right
+    logging.info(f'enc_pad_left: {enc_pad_left}')
+    logging.info(f'enc_pad_right: {enc_pad_right}')
+    dec_pad_left = model_decoder_melsp.pad_left
+    dec_pad_right = model_decoder_melsp.pad_right
+    logging.info(f'dec_pad_left: {dec_pad_left}')
+    logging.info(f'dec_pad_right: {dec_pad_right}')
+    wav_pad_left = model_waveform.pad_left
+    wav_pad_right = model_waveform.pad_right
+    logging.info(f'wav_pad_left: {wav_pad_left}')
+    logging.info(f'wav_pad_right: {wav_pad_right}')
+    dec_enc_pad_left = dec_pad_left + wav_pad_left + enc_pad_left
+    dec_enc_pad_right = dec_pad_right + wav_pad_right + enc_pad_right
+    first_pad_left = (enc_pad_left + dec_pad_left + wav_pad_left)*args.n_half_cyc
+    first_pad_right = (enc_pad_right + dec_pad_right + wav_pad_right)*args.n_half_cyc
+    logging.info(f'first_pad_left: {first_pad_left}')
+    logging.info(f'first_pad_right: {first_pad_right}')
+    outpad_lefts = [None]*args.n_half_cyc*3
+    outpad_rights = [None]*args.n_half_cyc*3
+    outpad_lefts[0] = first_pad_left-enc_pad_left
+    outpad_rights[0] = first_pad_right-enc_pad_right
+    for i in range(1,args.n_half_cyc*3):
+        if i % 3 == 2:
+            outpad_lefts[i] = outpad_lefts[i-1]-wav_pad_left
+            outpad_rights[i] = outpad_rights[i-1]-wav_pad_right
+        elif i % 3 == 1:
+            outpad_lefts[i] = outpad_lefts[i-1]-dec_pad_left
+            outpad_rights[i] = outpad_rights[i-1]-dec_pad_right
+        else:
+            outpad_lefts[i] = outpad_lefts[i-1]-enc_pad_left
+            outpad_rights[i] = outpad_rights[i-1]-enc_pad_right
+    logging.info(outpad_lefts)
+    logging.info(outpad_rights)
+
+    def probe_batch(n_utt, n_frames, mark):
+        """FUNCTION TO RUN ONE TRAINING FORWARD / BACKWARD OF SYNTHETIC UTTERANCES FOR MEMORY-BUDGETED BATCH SIZING
+
+        The utterances are of pad_len frames, as loaded by the data generator, and the encoders, spkidtr, melsp decoder,
+        and waveform model are run on their first segment as in the training steps, i.e., reconstruction and conversion,
+        then cyclic reconstruction from the converted melsp.
+        """
+        upsampling_factor_bands = args.upsampling_factor // args.n_bands
+        feat = torch.randn(n_utt, args.pad_len, args.mel_dim, device=device).abs()
+        feat_magsp = torch.randn(n_utt, args.pad_len, args.fftl//2+1, device=device).abs()
+        x = torch.zeros(n_utt, args.pad_len*args.upsampling_factor, dtype=torch.long, device=device)
+        xs = torch.zeros(n_utt, args.pad_len*upsampling_factor_bands, args.n_bands, dtype=torch.long, device=device)
+        xs_c = torch.randint(args.cf_dim, xs.shape, device=device)
+        xs_f = torch.randint(args.cf_dim, xs.shape, device=device)
+        x_bs = n_frames*upsampling_factor_bands
+        x_c_prev = xs_c[:,:x_bs]
+        x_f_prev = xs_f[:,:x_bs]
+        x_c = xs_c[:,1:x_bs+1]
+        x_c_lpc = xs_c[:,:x_bs+args.lpc-1] if args.lpc > 0 else None
+        x_f_lpc = xs_f[:,:x_bs+args.lpc-1] if args.lpc > 0 else None
+        loss = 0
+        feat_in = feat[:,:n_frames+first_pad_left+first_pad_right]
+        idx_in = 0
+        for i in range(0,args.n_half_cyc,2):
+            for k in range(2): # reconstruction & conversion, then cyclic reconstruction
+                _, qz_alpha_in, z_in, _ = model_encoder_melsp(feat_in, outpad_right=outpad_rights[idx_in])
+                _, qz_alpha_e_in, z_e_in, _ = model_encoder_excit(feat_in, outpad_right=outpad_rights[idx_in])
+                loss += qz_alpha_in.mean() + qz_alpha_e_in.mean()
+                z_cat = torch.cat((z_e_in, z_in), 2)
+                idx_in += 1
+                sc_in = torch.zeros(n_utt*(2-k), z_cat.shape[1], dtype=torch.long, device=device)
+                _, spk_code_in = model_spkidtr(sc_in)
+                _, melsp_rec, _ = model_decoder_melsp(z_cat.repeat(2-k,1,1), y=spk_code_in, outpad_right=outpad_rights[idx_in])
+                idx_in += 1
+                if k == 0:
+                    melsp_rec, melsp_cv = torch.chunk(melsp_rec, 2, 0)
+                outputs = model_waveform(melsp_rec, x_c_prev, x_f_prev, x_c, outpad_left=outpad_lefts[idx_in], outpad_right=outpad_rights[idx_in],
+                                x_c_lpc=x_c_lpc, x_f_lpc=x_f_lpc, ret_mid_feat=True, ret_mid_smpl=True)
+                idx_in += 1
+                loss += melsp_rec.mean() + sum([output.mean() for output in outputs if output.requires_grad])
+                if k == 0:
+                    if wav_pad_right > 0:
+                        feat_in = melsp_cv[:,wav_pad_left:-wav_pad_right].detach()
+                    else:
+                        feat_in = melsp_cv[:,wav_pad_left:].detach()
+        mark()
+        loss.backward()
+        mark()
+        del feat, feat_magsp, x, xs, xs_c, xs_f
+
+    if args.memory_budget > 0 and args.batch_size_utt is None and args.eval_mode != "evaluator":
+        if rank == 0:
+            # optimizer states (RAdam: exp_avg, exp_avg_sq) are created in the first step, after the probes
+            states_mb = 2*sum([param.numel()*param.element_size() for param in module_list if param.requires_grad])/1048576
+            with torch.random.fork_rng(devices=[device] if device.type == "cuda" else []):
+                batch_size_utt, args.batch_size, _ = auto_batch_size(probe_batch, device, args.memory_budget, batch_size_utt,
+                    args.batch_size, args.pad_len-first_pad_left-first_pad_right, extra_mb=states_mb)
+            optimizer.zero_grad()
+        batch_size_utt, args.batch_size = broadcast_object([batch_size_utt, args.batch_size])
+        args.batch_size_utt = batch_size_utt
+        logging.info("memory-budgeted batch sizes -- %d utterance(s) x %d frames" % (args.batch_size_utt, args.batch_size))
+        if rank == 0:
+            torch.save(args, args.expdir + "/model.conf")
+    if args.cache_size > 0:
+        if args.cache_dir is None:
+            args.cache_dir = default_cache_dir(args.expdir)
+        cache = SharedFeatureCache(args.cache_dir, max_mbytes=args.cache_size)
+    else:
+        cache = None
+    # replicate the initial / resumed models of rank 0
+    broadcast_parameters([model_encoder_melsp_fix, model_encoder_melsp, model_decoder_melsp, model_encoder_excit_fix, model_encoder_excit, model_spkidtr, model_classifier, model_waveform])
+    snapshot_queue = SnapshotQueue(args.expdir)
+    if rank == 0 and args.eval_mode != "evaluator":
+        checkpoint_writer = AsyncCheckpointWriter(args.expdir, keep_best=args.ckpt_keep_best, keep_last=args.ckpt_keep_last,
+                                retained=snapshot_queue.retained if args.eval_mode == "trainer" else None)
+        if args.eval_mode == "trainer":
+            snapshot_queue.begin_training()
+    else:
+        checkpoint_writer = None
+    dtw_eval_pool = DTWEvalPool(args.n_eval_workers)
+    persistent_workers = args.persistent_workers and args.n_workers > 0
+    if args.eval_mode != "evaluator": # the evaluator only reads the development set
+        dataset = FeatureDatasetCycMceplf0WavVAE(feat_list, pad_feat_transform, spk_list, stats_list,
+                    args.n_half_cyc, args.string_path, magsp=True, worgx_flag=True,
+                        wav_list=wav_list, pad_wav_transform=pad_wav_transform, wav_transform=wav_transform, pad_wav_org_transform=pad_wav_org_transform,
+                            cf_dim=args.cf_dim, upsampling_factor=args.upsampling_factor, n_bands=args.n_bands, cache=cache,
+                                lat_fix_path=args.string_path_fix)
+        sampler = ShardedSampler(dataset, shuffle=True, seed=args.seed)
+        sampler.set_epoch(epoch_idx) # continue the shuffling order when resuming
+        dataloader = DataLoader(dataset, batch_size=batch_size_utt, sampler=sampler, num_workers=args.n_workers,
+                        persistent_workers=persistent_workers)
+        #generator = train_generator(dataloader, device, args.batch_size, n_cv, args.upsampling_factor, limit_count=1, n_bands=args.n_bands)
+        #generator = train_generator(dataloader, device, args.batch_size, n_cv, args.upsampling_factor, limit_count=20, n_bands=args.n_bands)
+        def idle_step():
+            """Training step without batch after the pass of this rank ended, as the other ranks' steps"""
+            nonlocal iter_idx, idx_stage
+            optimizer.zero_grad()
+            all_reduce_gradients(module_list)
+            for param in module_list:
+                if param.requires_grad:
+                    grad_norm = param.grad.norm()
+                    if torch.isnan(grad_norm) or torch.isinf(grad_norm):
+                        logging.info("explode grad")
+                        optimizer.zero_grad()
+                        return
+            torch.nn.utils.clip_grad_norm_(model_encoder_melsp.parameters(), 10)
+            torch.nn.utils.clip_grad_norm_(model_encoder_excit.parameters(), 10)
+            torch.nn.utils.clip_grad_norm_(model_decoder_melsp.parameters(), 10)
+            torch.nn.utils.clip_grad_norm_(model_spkidtr.parameters(), 10)
+            optimizer.step()
+            with torch.no_grad():
+                if idx_stage < args.n_stage-1 and iter_idx + 1 == t_starts[idx_stage+1]:
+                    idx_stage += 1
+                sparsity_encoder_melsp.step(iter_idx + 1)
+                sparsity_encoder_excit.step(iter_idx + 1)
+                sparsity_decoder_melsp.step(iter_idx + 1)
+            iter_idx += 1
+            profiler.step(iter_idx)
+        generator = synchronize_epochs(train_generator(dataloader, device, args.batch_size, n_cv, args.upsampling_factor, limit_count=None, n_bands=args.n_bands), idle_step)
+    else:
+        generator = None
 
     # define generator evaluation
     feat_list_eval_src_list = [None]*n_spk_data
@@ -986,7 +1121,7 @@ def main():
     dataset_eval = FeatureDatasetEvalCycMceplf0WavVAE(feat_list_eval_src_list, pad_feat_transform, spk_list,
                     stats_list, args.string_path, magsp=True, worgx_flag=True, n_spk_data=n_spk_data,
                         wav_list=wav_list_eval_src_list, pad_wav_transform=pad_wav_transform, wav_transform=wav_transform, pad_wav_org_transform=pad_wav_org_transform,
-                            cf_dim=args.cf_dim, upsampling_factor=args.upsampling_factor, n_bands=args.n_bands)
+                            cf_dim=args.cf_dim, upsampling_factor=args.upsampling_factor, n_bands=args.n_bands, cache=cache)
     n_eval_data = len(dataset_eval.file_list_src)
     if n_eval_data >= 15:
         batch_size_utt_eval = round(n_eval_data/10)
@@ -995,11 +1130,40 @@ def main():
     else:
         batch_size_utt_eval = 1
     logging.info("number of evaluation_data -- batch_size_eval = %d -- %d" % (n_eval_data, batch_size_utt_eval))
-    dataloader_eval = DataLoader(dataset_eval, batch_size=batch_size_utt_eval, shuffle=False, num_workers=args.n_workers)
+    if args.eval_mode == "trainer":
+        # fast proxy, the full evaluation of the checkpoints is done by the evaluator process
+        dataset_eval = Subset(dataset_eval, eval_subset_indices(n_eval_data, args.n_eval_subset))
+        logging.info("number of evaluation_data of trainer -- %d" % (len(dataset_eval)))
+    dataloader_eval = DataLoader(dataset_eval, batch_size=batch_size_utt_eval, sampler=ShardedSampler(dataset_eval, shuffle=False),
+                    num_workers=args.n_workers,
+                    persistent_workers=persistent_workers)
     #generator_eval = eval_generator(dataloader_eval, device, args.batch_size, args.upsampling_factor, limit_count=1, n_bands=args.n_bands)
     generator_eval = eval_generator(dataloader_eval, device, args.batch_size, args.upsampling_factor, limit_count=None, n_bands=args.n_bands)
 
-    writer = SummaryWriter(args.expdir)
+    if rank == 0:
+        writer = SummaryWriter(args.expdir)
+    else:
+        writer = None
+    profiler = StepProfiler(device, writer=writer, enabled=args.profile, log_interval=args.log_interval_steps,
+                    trace_dir=os.path.join(args.expdir, "profile"), trace_start=args.profile_trace_start,
+                        trace_steps=args.profile_trace_steps)
+    memory_meter = MemoryMeter(device, writer=writer, log_interval=args.log_interval_steps)
+    profiler.time_modules({
+        "encoder_melsp_fix": model_encoder_melsp_fix,
+        "encoder_melsp": model_encoder_melsp,
+        "decoder_melsp": model_decoder_melsp,
+        "encoder_excit_fix": model_encoder_excit_fix,
+        "encoder_excit": model_encoder_excit,
+        "spkidtr": model_spkidtr,
+        "classifier": model_classifier,
+        "waveform": model_waveform}, methods=("forward", "gen_mid_feat_smpl"))
+    profiler.time_modules({
+        "loss_gauss": criterion_gauss,
+        "loss_ce": criterion_ce,
+        "loss_l1": criterion_l1,
+        "loss_l2": criterion_l2,
+        "loss_stft": criterion_stft,
+        "loss_stft_fb": criterion_stft_fb})
     total_train_loss = defaultdict(list)
     total_eval_loss = defaultdict(list)
 
@@ -1058,45 +1222,18 @@ def main():
     #idx_stage = args.n_stage - 1
     #logging.info(idx_stage)
     idx_stage = 0
+    sparse_models = ["encoder_melsp", "encoder_excit", "decoder_melsp"]
+    sparsity_encoder_melsp = BlockSparsity(model_encoder_melsp, t_starts, t_ends, densities, args.interval,
+        extra_densities=parse_extra_densities(args.sparse_extra, "encoder_melsp", sparse_models))
+    sparsity_encoder_excit = BlockSparsity(model_encoder_excit, t_starts, t_ends, densities, args.interval,
+        extra_densities=parse_extra_densities(args.sparse_extra, "encoder_excit", sparse_models))
+    sparsity_decoder_melsp = BlockSparsity(model_decoder_melsp, t_starts, t_ends, densities, args.interval,
+        extra_densities=parse_extra_densities(args.sparse_extra, "decoder_melsp", sparse_models))
 
     # train
     logging.info(f'n_cyc: {args.n_half_cyc}')
     logging.info(f'n_rec: {n_rec}')
     logging.info(f'n_cv: {n_cv}')
-    enc_pad_left = model_encoder_melsp.pad_left
-    enc_pad_right = model_encoder_melsp.pad_right
-    logging.info(f'enc_pad_left: {enc_pad_left}')
-    logging.info(f'enc_pad_right: {enc_pad_right}')
-    dec_pad_left = model_decoder_melsp.pad_left
-    dec_pad_right = model_decoder_melsp.pad_right
-    logging.info(f'dec_pad_left: {dec_pad_left}')
-    logging.info(f'dec_pad_right: {dec_pad_right}')
-    wav_pad_left = model_waveform.pad_left
-    wav_pad_right = model_waveform.pad_right
-    logging.info(f'wav_pad_left: {wav_pad_left}')
-    logging.info(f'wav_pad_right: {wav_pad_right}')
-    dec_enc_pad_left = dec_pad_left + wav_pad_left + enc_pad_left
-    dec_enc_pad_right = dec_pad_right + wav_pad_right + enc_pad_right
-    first_pad_left = (enc_pad_left + dec_pad_left + wav_pad_left)*args.n_half_cyc
-    first_pad_right = (enc_pad_right + dec_pad_right + wav_pad_right)*args.n_half_cyc
-    logging.info(f'first_pad_left: {first_pad_left}')
-    logging.info(f'first_pad_right: {first_pad_right}')
-    outpad_lefts = [None]*args.n_half_cyc*3
-    outpad_rights = [None]*args.n_half_cyc*3
-    outpad_lefts[0] = first_pad_left-enc_pad_left
-    outpad_rights[0] = first_pad_right-enc_pad_right
-    for i in range(1,args.n_half_cyc*3):
-        if i % 3 == 2:
-            outpad_lefts[i] = outpad_lefts[i-1]-wav_pad_left
-            outpad_rights[i] = outpad_rights[i-1]-wav_pad_right
-        elif i % 3 == 1:
-            outpad_lefts[i] = outpad_lefts[i-1]-dec_pad_left
-            outpad_rights[i] = outpad_rights[i-1]-dec_pad_right
-        else:
-            outpad_lefts[i] = outpad_lefts[i-1]-enc_pad_left
-            outpad_rights[i] = outpad_rights[i-1]-enc_pad_right
-    logging.info(outpad_lefts)
-    logging.info(outpad_rights)
     batch_feat_in = [None]*args.n_half_cyc*3
     batch_sc_in = [None]*args.n_half_cyc*3
     batch_sc_cv_in = [None]*n_cv*2
@@ -1578,67 +1715,82 @@ def main():
     logging.info("Training data")
     while True:
         start = time.time()
-        batch_x_fb, batch_x, batch_x_c, batch_x_f, batch_feat, batch_feat_magsp, batch_sc, batch_sc_cv_data, c_idx, utt_idx, featfile, \
-            x_bs, x_ss, f_bs, f_ss, slens, flens, n_batch_utt, del_index_utt, max_slen, max_flen, spk_cv, idx_select, idx_select_full, slens_acc, flens_acc = next(generator)
+        if args.eval_mode == "evaluator":
+            # wait for the next snapshot of the training process, and evaluate it as its epoch summary
+            checkpoint_path = snapshot_queue.next()
+            if checkpoint_path is None:
+                break
+            snapshot_meta = load_snapshot(checkpoint_path, {"model_encoder_melsp_fix": model_encoder_melsp_fix, "model_encoder_melsp": model_encoder_melsp,
+                "model_decoder_melsp": model_decoder_melsp, "model_encoder_excit_fix": model_encoder_excit_fix,
+                "model_encoder_excit": model_encoder_excit, "model_spkidtr": model_spkidtr,
+                "model_classifier": model_classifier, "model_waveform": model_waveform}, device)
+            iter_idx = snapshot_meta["iter_idx"]
+            epoch_idx = snapshot_meta["iterations"] - 1
+            c_idx = -1
+        else:
+            batch_x_fb, batch_x, batch_x_c, batch_x_f, batch_feat, batch_feat_magsp, batch_sc, batch_sc_cv_data, c_idx, utt_idx, featfile, \
+                x_bs, x_ss, f_bs, f_ss, slens, flens, n_batch_utt, del_index_utt, max_slen, max_flen, spk_cv, idx_select, idx_select_full, slens_acc, flens_acc, batch_lat_fix = next(generator)
+        profiler.lap("data")
         if c_idx < 0: # summarize epoch
             # save current epoch model
             numpy_random_state = np.random.get_state()
             torch_random_state = torch.get_rng_state()
-            # report current epoch
-            text_log = "(EPOCH:%d) average optimization loss = %.6f (+- %.6f) ; " % (epoch_idx + 1, np.mean(loss_sc_feat_in), np.std(loss_sc_feat_in))
-            for i in range(args.n_half_cyc):
-                if i % 2 == 0:
-                    text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; "\
-                            "%.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " \
-                            "%.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %.6f (+- %.6f) dB , %.6f (+- %.6f) %.6f (+- %.6f) %.6f (+- %.6f) dB ; "\
-                            "%.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; "\
-                            "%.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% ; %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " % (i+1,
-                        np.mean(loss_elbo[i]), np.std(loss_elbo[i]), np.mean(loss_px[i]), np.std(loss_px[i]),
-                        np.mean(loss_qy_py[i]), np.std(loss_qy_py[i]), np.mean(loss_qy_py_err[i]), np.std(loss_qy_py_err[i]), np.mean(loss_qz_pz[i]), np.std(loss_qz_pz[i]),
-                        np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]),
-                        np.mean(loss_sc_z[i]), np.std(loss_sc_z[i]),
-                        np.mean(loss_sc_feat[i]), np.std(loss_sc_feat[i]), np.mean(loss_sc_feat_cv[i//2]), np.std(loss_sc_feat_cv[i//2]),
-                        np.mean(loss_sc_feat_magsp[i]), np.std(loss_sc_feat_magsp[i]), np.mean(loss_sc_feat_magsp_cv[i//2]), np.std(loss_sc_feat_magsp_cv[i//2]),
-                        np.mean(loss_gauss[i]), np.std(loss_gauss[i]), np.mean(loss_gauss_cv[i//2]), np.std(loss_gauss_cv[i//2]),
-                        np.mean(loss_melsp[i]), np.std(loss_melsp[i]), np.mean(loss_melsp_cv[i//2]), np.std(loss_melsp_cv[i//2]), np.mean(loss_melsp_dB[i]), np.std(loss_melsp_dB[i]),
-                        np.mean(loss_magsp[i]), np.std(loss_magsp[i]), np.mean(loss_magsp_cv[i//2]), np.std(loss_magsp_cv[i//2]), np.mean(loss_magsp_dB[i]), np.std(loss_magsp_dB[i]),
-                        np.mean(loss_seg_conv[i]), np.std(loss_seg_conv[i]), np.mean(loss_conv_sc[i]), np.std(loss_conv_sc[i]),
-                        np.mean(loss_h[i]), np.std(loss_h[i]), np.mean(loss_mid_smpl[i]), np.std(loss_mid_smpl[i]),
-                        np.mean(loss_ce_avg[i]), np.std(loss_ce_avg[i]), np.mean(loss_err_avg[i]), np.std(loss_err_avg[i]),
-                            np.mean(loss_ce_c_avg[i]), np.std(loss_ce_c_avg[i]), np.mean(loss_err_c_avg[i]), np.std(loss_err_c_avg[i]),
-                                np.mean(loss_ce_f_avg[i]), np.std(loss_ce_f_avg[i]), np.mean(loss_err_f_avg[i]), np.std(loss_err_f_avg[i]),
-                                    np.mean(loss_fro_avg[i]), np.std(loss_fro_avg[i]), np.mean(loss_l1_avg[i]), np.std(loss_l1_avg[i]),
-                                        np.mean(loss_fro_fb[i]), np.std(loss_fro_fb[i]), np.mean(loss_l1_fb[i]), np.std(loss_l1_fb[i]))
-                else:
-                    text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; "\
-                            "%.6f (+- %.6f) , %.6f (+- %.6f) , %.6f (+- %.6f) ; " \
-                            "%.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) dB , %.6f (+- %.6f) %.6f (+- %.6f) dB ; "\
-                            "%.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; "\
-                            "%.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% , %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " % (i+1,
-                        np.mean(loss_elbo[i]), np.std(loss_elbo[i]), np.mean(loss_px[i]), np.std(loss_px[i]),
-                        np.mean(loss_lat_cossim[i]), np.std(loss_lat_cossim[i]), np.mean(loss_lat_rmse[i]), np.std(loss_lat_rmse[i]),
-                        np.mean(loss_qy_py[i]), np.std(loss_qy_py[i]), np.mean(loss_qy_py_err[i]), np.std(loss_qy_py_err[i]), np.mean(loss_qz_pz[i]), np.std(loss_qz_pz[i]),
-                        np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]), 
-                        np.mean(loss_sc_z[i]), np.std(loss_sc_z[i]),
-                        np.mean(loss_sc_feat[i]), np.std(loss_sc_feat[i]), np.mean(loss_sc_feat_magsp[i]), np.std(loss_sc_feat_magsp[i]),
-                        np.mean(loss_gauss[i]), np.std(loss_gauss[i]), np.mean(loss_melsp[i]), np.std(loss_melsp[i]), np.mean(loss_melsp_dB[i]), np.std(loss_melsp_dB[i]),
-                        np.mean(loss_magsp[i]), np.std(loss_magsp[i]), np.mean(loss_magsp_dB[i]), np.std(loss_magsp_dB[i]),
-                        np.mean(loss_seg_conv[i]), np.std(loss_seg_conv[i]), np.mean(loss_conv_sc[i]), np.std(loss_conv_sc[i]),
-                        np.mean(loss_h[i]), np.std(loss_h[i]), np.mean(loss_mid_smpl[i]), np.std(loss_mid_smpl[i]),
-                        np.mean(loss_ce_avg[i]), np.std(loss_ce_avg[i]), np.mean(loss_err_avg[i]), np.std(loss_err_avg[i]),
-                            np.mean(loss_ce_c_avg[i]), np.std(loss_ce_c_avg[i]), np.mean(loss_err_c_avg[i]), np.std(loss_err_c_avg[i]),
-                                np.mean(loss_ce_f_avg[i]), np.std(loss_ce_f_avg[i]), np.mean(loss_err_f_avg[i]), np.std(loss_err_f_avg[i]),
-                                    np.mean(loss_fro_avg[i]), np.std(loss_fro_avg[i]), np.mean(loss_l1_avg[i]), np.std(loss_l1_avg[i]),
-                                        np.mean(loss_fro_fb[i]), np.std(loss_fro_fb[i]), np.mean(loss_l1_fb[i]), np.std(loss_l1_fb[i]))
-                for j in range(args.n_bands):
-                    text_log += "[%d-%d] %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% , %.6f (+- %.6f) %.6f (+- %.6f) " % (i+1, j+1,
-                            np.mean(loss_ce[i][j]), np.std(loss_ce[i][j]), np.mean(loss_err[i][j]), np.std(loss_err[i][j]),
-                                np.mean(loss_ce_f[i][j]), np.std(loss_ce_f[i][j]), np.mean(loss_err_f[i][j]), np.std(loss_err_f[i][j]),
-                                    np.mean(loss_fro[i][j]), np.std(loss_fro[i][j]), np.mean(loss_l1[i][j]), np.std(loss_l1[i][j]))
-                text_log += ";; "
-            logging.info("%s (%.3f min., %.3f sec / batch)" % (text_log, total / 60.0, total / iter_count))
-            logging.info("estimated time until max. steps = {0.days:02}:{0.hours:02}:{0.minutes:02}:"\
-            "{0.seconds:02}".format(relativedelta(seconds=int((args.step_count - (iter_idx + 1)) * total))))
+            if args.eval_mode != "evaluator": # no training steps in the evaluator
+                # report current epoch
+                text_log = "(EPOCH:%d) average optimization loss = %.6f (+- %.6f) ; " % (epoch_idx + 1, np.mean(loss_sc_feat_in), np.std(loss_sc_feat_in))
+                for i in range(args.n_half_cyc):
+                    if i % 2 == 0:
+                        text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; "\
+                                "%.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " \
+                                "%.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %.6f (+- %.6f) dB , %.6f (+- %.6f) %.6f (+- %.6f) %.6f (+- %.6f) dB ; "\
+                                "%.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; "\
+                                "%.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% ; %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " % (i+1,
+                            np.mean(loss_elbo[i]), np.std(loss_elbo[i]), np.mean(loss_px[i]), np.std(loss_px[i]),
+                            np.mean(loss_qy_py[i]), np.std(loss_qy_py[i]), np.mean(loss_qy_py_err[i]), np.std(loss_qy_py_err[i]), np.mean(loss_qz_pz[i]), np.std(loss_qz_pz[i]),
+                            np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]),
+                            np.mean(loss_sc_z[i]), np.std(loss_sc_z[i]),
+                            np.mean(loss_sc_feat[i]), np.std(loss_sc_feat[i]), np.mean(loss_sc_feat_cv[i//2]), np.std(loss_sc_feat_cv[i//2]),
+                            np.mean(loss_sc_feat_magsp[i]), np.std(loss_sc_feat_magsp[i]), np.mean(loss_sc_feat_magsp_cv[i//2]), np.std(loss_sc_feat_magsp_cv[i//2]),
+                            np.mean(loss_gauss[i]), np.std(loss_gauss[i]), np.mean(loss_gauss_cv[i//2]), np.std(loss_gauss_cv[i//2]),
+                            np.mean(loss_melsp[i]), np.std(loss_melsp[i]), np.mean(loss_melsp_cv[i//2]), np.std(loss_melsp_cv[i//2]), np.mean(loss_melsp_dB[i]), np.std(loss_melsp_dB[i]),
+                            np.mean(loss_magsp[i]), np.std(loss_magsp[i]), np.mean(loss_magsp_cv[i//2]), np.std(loss_magsp_cv[i//2]), np.mean(loss_magsp_dB[i]), np.std(loss_magsp_dB[i]),
+                            np.mean(loss_seg_conv[i]), np.std(loss_seg_conv[i]), np.mean(loss_conv_sc[i]), np.std(loss_conv_sc[i]),
+                            np.mean(loss_h[i]), np.std(loss_h[i]), np.mean(loss_mid_smpl[i]), np.std(loss_mid_smpl[i]),
+                            np.mean(loss_ce_avg[i]), np.std(loss_ce_avg[i]), np.mean(loss_err_avg[i]), np.std(loss_err_avg[i]),
+                                np.mean(loss_ce_c_avg[i]), np.std(loss_ce_c_avg[i]), np.mean(loss_err_c_avg[i]), np.std(loss_err_c_avg[i]),
+                                    np.mean(loss_ce_f_avg[i]), np.std(loss_ce_f_avg[i]), np.mean(loss_err_f_avg[i]), np.std(loss_err_f_avg[i]),
+                                        np.mean(loss_fro_avg[i]), np.std(loss_fro_avg[i]), np.mean(loss_l1_avg[i]), np.std(loss_l1_avg[i]),
+                                            np.mean(loss_fro_fb[i]), np.std(loss_fro_fb[i]), np.mean(loss_l1_fb[i]), np.std(loss_l1_fb[i]))
+                    else:
+                        text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; "\
+                                "%.6f (+- %.6f) , %.6f (+- %.6f) , %.6f (+- %.6f) ; " \
+                                "%.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) dB , %.6f (+- %.6f) %.6f (+- %.6f) dB ; "\
+                                "%.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; "\
+                                "%.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% , %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " % (i+1,
+                            np.mean(loss_elbo[i]), np.std(loss_elbo[i]), np.mean(loss_px[i]), np.std(loss_px[i]),
+                            np.mean(loss_lat_cossim[i]), np.std(loss_lat_cossim[i]), np.mean(loss_lat_rmse[i]), np.std(loss_lat_rmse[i]),
+                            np.mean(loss_qy_py[i]), np.std(loss_qy_py[i]), np.mean(loss_qy_py_err[i]), np.std(loss_qy_py_err[i]), np.mean(loss_qz_pz[i]), np.std(loss_qz_pz[i]),
+                            np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]), 
+                            np.mean(loss_sc_z[i]), np.std(loss_sc_z[i]),
+                            np.mean(loss_sc_feat[i]), np.std(loss_sc_feat[i]), np.mean(loss_sc_feat_magsp[i]), np.std(loss_sc_feat_magsp[i]),
+                            np.mean(loss_gauss[i]), np.std(loss_gauss[i]), np.mean(loss_melsp[i]), np.std(loss_melsp[i]), np.mean(loss_melsp_dB[i]), np.std(loss_melsp_dB[i]),
+                            np.mean(loss_magsp[i]), np.std(loss_magsp[i]), np.mean(loss_magsp_dB[i]), np.std(loss_magsp_dB[i]),
+                            np.mean(loss_seg_conv[i]), np.std(loss_seg_conv[i]), np.mean(loss_conv_sc[i]), np.std(loss_conv_sc[i]),
+                            np.mean(loss_h[i]), np.std(loss_h[i]), np.mean(loss_mid_smpl[i]), np.std(loss_mid_smpl[i]),
+                            np.mean(loss_ce_avg[i]), np.std(loss_ce_avg[i]), np.mean(loss_err_avg[i]), np.std(loss_err_avg[i]),
+                                np.mean(loss_ce_c_avg[i]), np.std(loss_ce_c_avg[i]), np.mean(loss_err_c_avg[i]), np.std(loss_err_c_avg[i]),
+                                    np.mean(loss_ce_f_avg[i]), np.std(loss_ce_f_avg[i]), np.mean(loss_err_f_avg[i]), np.std(loss_err_f_avg[i]),
+                                        np.mean(loss_fro_avg[i]), np.std(loss_fro_avg[i]), np.mean(loss_l1_avg[i]), np.std(loss_l1_avg[i]),
+                                            np.mean(loss_fro_fb[i]), np.std(loss_fro_fb[i]), np.mean(loss_l1_fb[i]), np.std(loss_l1_fb[i]))
+                    for j in range(args.n_bands):
+                        text_log += "[%d-%d] %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) %.6f (+- %.6f) %% , %.6f (+- %.6f) %.6f (+- %.6f) " % (i+1, j+1,
+                                np.mean(loss_ce[i][j]), np.std(loss_ce[i][j]), np.mean(loss_err[i][j]), np.std(loss_err[i][j]),
+                                    np.mean(loss_ce_f[i][j]), np.std(loss_ce_f[i][j]), np.mean(loss_err_f[i][j]), np.std(loss_err_f[i][j]),
+                                        np.mean(loss_fro[i][j]), np.std(loss_fro[i][j]), np.mean(loss_l1[i][j]), np.std(loss_l1[i][j]))
+                    text_log += ";; "
+                logging.info("%s (%.3f min., %.3f sec / batch)" % (text_log, total / 60.0, total / max(iter_count, 1)))
+                logging.info("estimated time until max. steps = {0.days:02}:{0.hours:02}:{0.minutes:02}:"\
+                "{0.seconds:02}".format(relativedelta(seconds=int((args.step_count - (iter_idx + 1)) * total))))
             # compute loss in evaluation data
             total = 0
             iter_count = 0
@@ -1722,7 +1874,7 @@ def main():
                         batch_sc_cv_data, c_idx, utt_idx, featfile, \
                         x_bs, x_ss, f_bs, f_ss, slens, flens, n_batch_utt, del_index_utt, max_slen, max_flen, spk_cv, src_trg_flag, \
                             spcidx_src, spcidx_src_trg, flens_spc_src, flens_spc_src_trg, \
-                                batch_feat_data_full, batch_sc_data_full, batch_sc_cv_data_full, \
+                                batch_feat_data_full, batch_sc_data_full, batch_sc_cv_data_full, flens_full, flens_trg, \
                                     idx_select, idx_select_full, slens_acc, flens_acc = next(generator_eval)
                     if c_idx < 0:
                         break
@@ -1784,6 +1936,14 @@ def main():
                         batch_x_f = batch_x_f[:,:x_es]
                         batch_x = batch_x[:,:x_es]
                         batch_x_fb = batch_x_fb[:,:x_es*args.n_bands]
+                    # widen compact waveform codes to int64 only for the current segment (embedding indices and loss targets)
+                    batch_x_c_prev = batch_x_c_prev.long()
+                    batch_x_f_prev = batch_x_f_prev.long()
+                    if args.lpc > 0:
+                        batch_x_c_lpc = batch_x_c_lpc.long()
+                        batch_x_f_lpc = batch_x_f_lpc.long()
+                    batch_x_c = batch_x_c.long()
+                    batch_x_f = batch_x_f.long()
 
                     # handle first pad for input on melsp flow
                     flag_cv = True
@@ -1871,53 +2031,34 @@ def main():
                             i_cv = i//2
                             j = i+1
                             if len(del_index_utt) > 0:
-                                h_feat_in_sc = torch.FloatTensor(np.delete(h_feat_in_sc.cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_feat_magsp_in_sc = torch.FloatTensor(np.delete(h_feat_magsp_in_sc.cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_x_org = torch.FloatTensor(np.delete(h_x_org.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                                h_x_2_org = torch.FloatTensor(np.delete(h_x_2_org.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                                h_f_org = torch.FloatTensor(np.delete(h_f_org.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                                h_z[i] = torch.FloatTensor(np.delete(h_z[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z_e[i] = torch.FloatTensor(np.delete(h_z_e[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z_fix = torch.FloatTensor(np.delete(h_z_fix.cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z_e_fix = torch.FloatTensor(np.delete(h_z_e_fix.cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_melsp[i] = torch.FloatTensor(np.delete(h_melsp[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_melsp_cv[i_cv] = torch.FloatTensor(np.delete(h_melsp_cv[i_cv].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z_sc[i] = torch.FloatTensor(np.delete(h_z_sc[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_feat_sc[i] = torch.FloatTensor(np.delete(h_feat_sc[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_feat_cv_sc[i_cv] = torch.FloatTensor(np.delete(h_feat_cv_sc[i_cv].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_feat_magsp_sc[i] = torch.FloatTensor(np.delete(h_feat_magsp_sc[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_feat_magsp_cv_sc[i_cv] = torch.FloatTensor(np.delete(h_feat_magsp_cv_sc[i_cv].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_x[i] = torch.FloatTensor(np.delete(h_x[i].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                                h_x_2[i] = torch.FloatTensor(np.delete(h_x_2[i].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                                h_f[i] = torch.FloatTensor(np.delete(h_f[i].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                                h_z[j] = torch.FloatTensor(np.delete(h_z[j].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z_e[j] = torch.FloatTensor(np.delete(h_z_e[j].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_melsp[j] = torch.FloatTensor(np.delete(h_melsp[j].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z_sc[j] = torch.FloatTensor(np.delete(h_z_sc[j].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_feat_sc[j] = torch.FloatTensor(np.delete(h_feat_sc[j].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_feat_magsp_sc[j] = torch.FloatTensor(np.delete(h_feat_magsp_sc[j].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_x[j] = torch.FloatTensor(np.delete(h_x[j].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                                h_x_2[j] = torch.FloatTensor(np.delete(h_x_2[j].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                                h_f[j] = torch.FloatTensor(np.delete(h_f[j].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
+                                h_feat_in_sc = index_delete(h_feat_in_sc, del_index_utt, dim=1)
+                                h_feat_magsp_in_sc = index_delete(h_feat_magsp_in_sc, del_index_utt, dim=1)
+                                h_x_org = index_delete(h_x_org, del_index_utt, dim=1)
+                                h_x_2_org = index_delete(h_x_2_org, del_index_utt, dim=1)
+                                h_f_org = index_delete(h_f_org, del_index_utt, dim=1)
+                                h_z[i] = index_delete(h_z[i], del_index_utt, dim=1)
+                                h_z_e[i] = index_delete(h_z_e[i], del_index_utt, dim=1)
+                                h_z_fix = index_delete(h_z_fix, del_index_utt, dim=1)
+                                h_z_e_fix = index_delete(h_z_e_fix, del_index_utt, dim=1)
+                                h_melsp[i] = index_delete(h_melsp[i], del_index_utt, dim=1)
+                                h_melsp_cv[i_cv] = index_delete(h_melsp_cv[i_cv], del_index_utt, dim=1)
+                                h_z_sc[i] = index_delete(h_z_sc[i], del_index_utt, dim=1)
+                                h_feat_sc[i] = index_delete(h_feat_sc[i], del_index_utt, dim=1)
+                                h_feat_cv_sc[i_cv] = index_delete(h_feat_cv_sc[i_cv], del_index_utt, dim=1)
+                                h_feat_magsp_sc[i] = index_delete(h_feat_magsp_sc[i], del_index_utt, dim=1)
+                                h_feat_magsp_cv_sc[i_cv] = index_delete(h_feat_magsp_cv_sc[i_cv], del_index_utt, dim=1)
+                                h_x[i] = index_delete(h_x[i], del_index_utt, dim=1)
+                                h_x_2[i] = index_delete(h_x_2[i], del_index_utt, dim=1)
+                                h_f[i] = index_delete(h_f[i], del_index_utt, dim=1)
+                                h_z[j] = index_delete(h_z[j], del_index_utt, dim=1)
+                                h_z_e[j] = index_delete(h_z_e[j], del_index_utt, dim=1)
+                                h_melsp[j] = index_delete(h_melsp[j], del_index_utt, dim=1)
+                                h_z_sc[j] = index_delete(h_z_sc[j], del_index_utt, dim=1)
+                                h_feat_sc[j] = index_delete(h_feat_sc[j], del_index_utt, dim=1)
+                                h_feat_magsp_sc[j] = index_delete(h_feat_magsp_sc[j], del_index_utt, dim=1)
+                                h_x[j] = index_delete(h_x[j], del_index_utt, dim=1)
+                                h_x_2[j] = index_delete(h_x_2[j], del_index_utt, dim=1)
+                                h_f[j] = index_delete(h_f[j], del_index_utt, dim=1)
                             qy_logits[i], qz_alpha[i], z[i], h_z[i] = model_encoder_melsp(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in], h=h_z[i], sampling=False)
                             qy_logits_e[i], qz_alpha_e[i], z_e[i], h_z_e[i] = model_encoder_excit(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in], h=h_z_e[i], sampling=False)
                             _, qz_alpha_fix, z_fix, h_z_fix = model_encoder_melsp_fix(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in], h=h_z_fix)
@@ -1939,14 +2080,16 @@ def main():
                             qz_alpha_e_fix = qz_alpha_e_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
                             ## speaker embeddings
                             idx_in += 1
-                            weight_in, spk_code_in = model_spkidtr(batch_sc_in[idx_in])
-                            weight_cv_in, spk_cv_code_in = model_spkidtr(batch_sc_cv_in[i_cv_in])
+                            weight_in, spk_code_in = model_spkidtr(torch.cat((batch_sc_in[idx_in], batch_sc_cv_in[i_cv_in]), 0))
+                            weight_in, weight_cv_in = torch.chunk(weight_in, 2, 0)
+                            spk_code_in, spk_cv_code_in = torch.chunk(spk_code_in, 2, 0)
                             ## melsp reconstruction & conversion
                             i_cv_in += 1
-                            batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat, y=spk_code_in,
-                                                outpad_right=outpad_rights[idx_in], h=h_melsp[i])
-                            batch_pdf_cv[i_cv], batch_melsp_cv[i_cv], h_melsp_cv[i_cv] = model_decoder_melsp(z_cat, y=spk_cv_code_in,
-                                                outpad_right=outpad_rights[idx_in], h=h_melsp_cv[i_cv])
+                            batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat.repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0),
+                                                outpad_right=outpad_rights[idx_in], h=torch.cat((h_melsp[i], h_melsp_cv[i_cv]), 1))
+                            batch_pdf_rec[i], batch_pdf_cv[i_cv] = torch.chunk(batch_pdf_rec[i], 2, 0)
+                            batch_melsp_rec[i], batch_melsp_cv[i_cv] = torch.chunk(batch_melsp_rec[i], 2, 0)
+                            h_melsp[i], h_melsp_cv[i_cv] = torch.chunk(h_melsp[i], 2, 1)
                             ## waveform reconstruction
                             idx_in += 1
                             batch_x_c_output_noclamp[i], batch_x_f_output_noclamp[i], batch_seg_conv[i], batch_conv_sc[i], \
@@ -1976,10 +2119,12 @@ def main():
                             batch_melsp_cv[i_cv] = batch_melsp_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                             batch_magsp_rec[i] = torch.matmul((torch.exp(batch_melsp_rec[i])-1)/10000, melfb_t)
                             batch_magsp_cv[i_cv] = torch.matmul((torch.exp(batch_melsp_cv[i_cv])-1)/10000, melfb_t)
-                            batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=batch_melsp_rec[i], h=h_feat_sc[i])
-                            batch_feat_cv_sc[i_cv], h_feat_cv_sc[i_cv] = model_classifier(feat=batch_melsp_cv[i_cv], h=h_feat_cv_sc[i_cv])
-                            batch_feat_magsp_rec_sc[i], h_feat_magsp_sc[i] = model_classifier(feat_aux=batch_magsp_rec[i], h=h_feat_magsp_sc[i])
-                            batch_feat_magsp_cv_sc[i_cv], h_feat_magsp_cv_sc[i_cv] = model_classifier(feat_aux=batch_magsp_cv[i_cv], h=h_feat_magsp_cv_sc[i_cv])
+                            batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=torch.cat((batch_melsp_rec[i], batch_melsp_cv[i_cv]), 0), h=torch.cat((h_feat_sc[i], h_feat_cv_sc[i_cv]), 1))
+                            batch_feat_rec_sc[i], batch_feat_cv_sc[i_cv] = torch.chunk(batch_feat_rec_sc[i], 2, 0)
+                            h_feat_sc[i], h_feat_cv_sc[i_cv] = torch.chunk(h_feat_sc[i], 2, 1)
+                            batch_feat_magsp_rec_sc[i], h_feat_magsp_sc[i] = model_classifier(feat_aux=torch.cat((batch_magsp_rec[i], batch_magsp_cv[i_cv]), 0), h=torch.cat((h_feat_magsp_sc[i], h_feat_magsp_cv_sc[i_cv]), 1))
+                            batch_feat_magsp_rec_sc[i], batch_feat_magsp_cv_sc[i_cv] = torch.chunk(batch_feat_magsp_rec_sc[i], 2, 0)
+                            h_feat_magsp_sc[i], h_feat_magsp_cv_sc[i_cv] = torch.chunk(h_feat_magsp_sc[i], 2, 1)
                             ## cyclic reconstruction
                             idx_in += 1
                             qy_logits[j], qz_alpha[j], z[j], h_z[j] = model_encoder_melsp(cv_feat, outpad_right=outpad_rights[idx_in], h=h_z[j], sampling=False)
@@ -2033,15 +2178,17 @@ def main():
                                 pair_exist = True
                                 break
                         batch_melsp_data_full = F.pad(batch_melsp_data_full.transpose(1,2), (first_pad_left_eval_utt,first_pad_right_eval_utt), "replicate").transpose(1,2)
-                        _, _, trj_lat_src, _ = model_encoder_melsp(batch_melsp_data_full, sampling=False)
-                        _, _, trj_lat_src_e, _ = model_encoder_excit(batch_melsp_data_full, sampling=False)
+                        # valid frames of the encoder outputs of the mixed-length batch, i.e., with the receptive fields of the decoders
+                        flens_full_enc = flens_full + first_pad_left_eval_utt_dec + first_pad_right_eval_utt_dec
+                        _, _, trj_lat_src, _ = model_encoder_melsp(batch_melsp_data_full, sampling=False, lengths=flens_full_enc)
+                        _, _, trj_lat_src_e, _ = model_encoder_excit(batch_melsp_data_full, sampling=False, lengths=flens_full_enc)
                         batch_sc_data_full = F.pad(batch_sc_data_full.unsqueeze(1).float(), (first_pad_left_eval_utt_dec,first_pad_right_eval_utt_dec), "replicate").squeeze(1).long()
                         batch_sc_cv_data_full = F.pad(batch_sc_cv_data_full.unsqueeze(1).float(), (first_pad_left_eval_utt_dec,first_pad_right_eval_utt_dec), "replicate").squeeze(1).long()
                         z_cat = torch.cat((trj_lat_src_e, trj_lat_src), 2)
-                        _, trj_spk_code = model_spkidtr(batch_sc_data_full)
-                        _, trj_spk_cv_code = model_spkidtr(batch_sc_cv_data_full)
-                        _, trj_src_src, _ = model_decoder_melsp(z_cat, y=trj_spk_code)
-                        _, trj_src_trg, _ = model_decoder_melsp(z_cat, y=trj_spk_cv_code)
+                        _, trj_spk_code = model_spkidtr(torch.cat((batch_sc_data_full, batch_sc_cv_data_full), 0))
+                        trj_spk_code, trj_spk_cv_code = torch.chunk(trj_spk_code, 2, 0)
+                        _, trj_src_src, _ = model_decoder_melsp(z_cat, y=trj_spk_code, lengths=flens_full)
+                        _, trj_src_trg, _ = model_decoder_melsp(z_cat, y=trj_spk_cv_code, lengths=flens_full)
 
                         for k in range(n_batch_utt):
                             spk_src = os.path.basename(os.path.dirname(featfile[k]))
@@ -2058,52 +2205,18 @@ def main():
                             else:
                                 trj_lat_src = z_cat[:,dec_pad_left:]
                             batch_melsp_trg_data_in = F.pad(batch_melsp_trg_data.transpose(1,2), (enc_pad_left,enc_pad_right), "replicate").transpose(1,2)
-                            _, _, trj_lat_trg, _ = model_encoder_melsp(batch_melsp_trg_data_in, sampling=False)
-                            _, _, trj_lat_trg_e, _ = model_encoder_excit(batch_melsp_trg_data_in, sampling=False)
+                            _, _, trj_lat_trg, _ = model_encoder_melsp(batch_melsp_trg_data_in, sampling=False, lengths=flens_trg)
+                            _, _, trj_lat_trg_e, _ = model_encoder_excit(batch_melsp_trg_data_in, sampling=False, lengths=flens_trg)
                             trj_lat_trg = torch.cat((trj_lat_trg_e, trj_lat_trg), 2)
 
                             for k in range(n_batch_utt):
                                 if src_trg_flag[k]:
-                                    # spcidx lat
-                                    trj_lat_src_ = np.array(torch.index_select(trj_lat_src[k],0,spcidx_src[k,:flens_spc_src[k]]).cpu().data.numpy(), dtype=np.float64)
-                                    trj_lat_trg_ = np.array(torch.index_select(trj_lat_trg[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]]).cpu().data.numpy(), dtype=np.float64)
-                                    # spcidx melsp, excit, trg
-                                    trj_src_trg_ = (torch.exp(torch.index_select(trj_src_trg[k],0,spcidx_src[k,:flens_spc_src[k]]))-1)/10000
-                                    trj_trg_ = (torch.exp(torch.index_select(batch_melsp_trg_data[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]]))-1)/10000
-                                    # spec dtw
-                                    # MCD of spectral
-                                    _, twf_melsp, _, _ = dtw.dtw_org_to_trg(\
-                                        np.array(trj_src_trg_.cpu().data.numpy(), dtype=np.float64), \
-                                        np.array(trj_trg_.cpu().data.numpy(), dtype=np.float64), mcd=-1)
-                                    twf_melsp = torch.LongTensor(twf_melsp[:,0]).cuda()
-                                    batch_melsp_dB_src_trg = torch.mean(torch.sqrt(torch.mean((20*(torch.log10(torch.clamp(torch.index_select(trj_src_trg_,0,twf_melsp), min=1e-16))
-                                                                -torch.log10(torch.clamp(trj_trg_, min=1e-16))))**2, -1))).item()
-                                    # time-warping of latent source-to-target for RMSE
-                                    aligned_lat_srctrg1, _, _, _ = dtw.dtw_org_to_trg(trj_lat_src_, trj_lat_trg_)
-                                    batch_lat_dist_srctrg1 = np.mean(np.sqrt(np.mean((\
-                                        aligned_lat_srctrg1-trj_lat_trg_)**2, axis=0)))
-                                    # Cos-sim of latent source-to-target
-                                    _, _, batch_lat_cdist_srctrg1, _ = dtw.dtw_org_to_trg(\
-                                        trj_lat_trg_, trj_lat_src_, mcd=0)
-                                    # time-warping of latent target-to-source for RMSE
-                                    aligned_lat_srctrg2, _, _, _ = dtw.dtw_org_to_trg(trj_lat_trg_, trj_lat_src_)
-                                    batch_lat_dist_srctrg2 = np.mean(np.sqrt(np.mean((\
-                                        aligned_lat_srctrg2-trj_lat_src_)**2, axis=0)))
-                                    # Cos-sim of latent target-to-source
-                                    _, _, batch_lat_cdist_srctrg2, _ = dtw.dtw_org_to_trg(\
-                                        trj_lat_src_, trj_lat_trg_, mcd=0)
-                                    # RMSE
-                                    batch_lat_dist_rmse = (batch_lat_dist_srctrg1+batch_lat_dist_srctrg2)/2
-                                    # Cos-sim
-                                    batch_lat_dist_cossim = (batch_lat_cdist_srctrg1+batch_lat_cdist_srctrg2)/2
-                                    loss_melsp_dB_src_trg.append(batch_melsp_dB_src_trg)
-                                    loss_lat_dist_rmse.append(batch_lat_dist_rmse)
-                                    loss_lat_dist_cossim.append(batch_lat_dist_cossim)
-                                    total_eval_loss["eval/loss_melsp_dB_src_trg"].append(batch_melsp_dB_src_trg)
-                                    total_eval_loss["eval/loss_lat_dist_rmse"].append(batch_lat_dist_rmse)
-                                    total_eval_loss["eval/loss_lat_dist_cossim"].append(batch_lat_dist_cossim)
-                                    logging.info('acc cv %s %s %.3f dB %.3f %.3f' % (featfile[k], spk_cv[k],
-                                        batch_melsp_dB_src_trg, batch_lat_dist_rmse, batch_lat_dist_cossim))
+                                    # spcidx lat, melsp, trg; DTW-based metrics are computed by eval pool
+                                    trj_lat_src_ = torch.index_select(trj_lat_src[k],0,spcidx_src[k,:flens_spc_src[k]]).cpu().data.numpy()
+                                    trj_lat_trg_ = torch.index_select(trj_lat_trg[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]]).cpu().data.numpy()
+                                    trj_src_trg_ = ((torch.exp(torch.index_select(trj_src_trg[k],0,spcidx_src[k,:flens_spc_src[k]]))-1)/10000).cpu().data.numpy()
+                                    trj_trg_ = ((torch.exp(torch.index_select(batch_melsp_trg_data[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]]))-1)/10000).cpu().data.numpy()
+                                    dtw_eval_pool.submit((featfile[k], spk_cv[k]), trj_src_trg_, trj_trg_, trj_lat_src_, trj_lat_trg_)
                         idx_in = 0
                         i_cv_in = 0
                         for i in range(0,n_half_cyc_eval,2):
@@ -2130,14 +2243,16 @@ def main():
                             qz_alpha_e_fix = qz_alpha_e_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
                             ## speaker embeddings
                             idx_in += 1
-                            weight_in, spk_code_in = model_spkidtr(batch_sc_in[idx_in])
-                            weight_cv_in, spk_cv_code_in = model_spkidtr(batch_sc_cv_in[i_cv_in])
+                            weight_in, spk_code_in = model_spkidtr(torch.cat((batch_sc_in[idx_in], batch_sc_cv_in[i_cv_in]), 0))
+                            weight_in, weight_cv_in = torch.chunk(weight_in, 2, 0)
+                            spk_code_in, spk_cv_code_in = torch.chunk(spk_code_in, 2, 0)
                             ## melsp reconstruction & conversion
                             i_cv_in += 1
-                            batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat, y=spk_code_in,
-                                                outpad_right=outpad_rights[idx_in])
-                            batch_pdf_cv[i_cv], batch_melsp_cv[i_cv], h_melsp_cv[i_cv] = model_decoder_melsp(z_cat, y=spk_cv_code_in,
+                            batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat.repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0),
                                                 outpad_right=outpad_rights[idx_in])
+                            batch_pdf_rec[i], batch_pdf_cv[i_cv] = torch.chunk(batch_pdf_rec[i], 2, 0)
+                            batch_melsp_rec[i], batch_melsp_cv[i_cv] = torch.chunk(batch_melsp_rec[i], 2, 0)
+                            h_melsp[i], h_melsp_cv[i_cv] = torch.chunk(h_melsp[i], 2, 1)
                             ## waveform reconstruction
                             idx_in += 1
                             batch_x_c_output_noclamp[i], batch_x_f_output_noclamp[i], batch_seg_conv[i], batch_conv_sc[i], \
@@ -2167,10 +2282,12 @@ def main():
                             batch_melsp_cv[i_cv] = batch_melsp_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                             batch_magsp_rec[i] = torch.matmul((torch.exp(batch_melsp_rec[i])-1)/10000, melfb_t)
                             batch_magsp_cv[i_cv] = torch.matmul((torch.exp(batch_melsp_cv[i_cv])-1)/10000, melfb_t)
-                            batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=batch_melsp_rec[i])
-                            batch_feat_cv_sc[i_cv], h_feat_cv_sc[i_cv] = model_classifier(feat=batch_melsp_cv[i_cv])
-                            batch_feat_magsp_rec_sc[i], h_feat_magsp_sc[i] = model_classifier(feat_aux=batch_magsp_rec[i])
-                            batch_feat_magsp_cv_sc[i_cv], h_feat_magsp_cv_sc[i_cv] = model_classifier(feat_aux=batch_magsp_cv[i_cv])
+                            batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=torch.cat((batch_melsp_rec[i], batch_melsp_cv[i_cv]), 0))
+                            batch_feat_rec_sc[i], batch_feat_cv_sc[i_cv] = torch.chunk(batch_feat_rec_sc[i], 2, 0)
+                            h_feat_sc[i], h_feat_cv_sc[i_cv] = torch.chunk(h_feat_sc[i], 2, 1)
+                            batch_feat_magsp_rec_sc[i], h_feat_magsp_sc[i] = model_classifier(feat_aux=torch.cat((batch_magsp_rec[i], batch_magsp_cv[i_cv]), 0))
+                            batch_feat_magsp_rec_sc[i], batch_feat_magsp_cv_sc[i_cv] = torch.chunk(batch_feat_magsp_rec_sc[i], 2, 0)
+                            h_feat_magsp_sc[i], h_feat_magsp_cv_sc[i_cv] = torch.chunk(h_feat_magsp_sc[i], 2, 1)
                             ## cyclic reconstruction
                             idx_in += 1
                             qy_logits[j], qz_alpha[j], z[j], h_z[j] = model_encoder_melsp(cv_feat, outpad_right=outpad_rights[idx_in], sampling=False)
@@ -2861,6 +2978,26 @@ def main():
                     logging.info("%s (%.3f sec)" % (text_log, time.time() - start))
                     iter_count += 1
                     total += time.time() - start
+            # DTW-based metrics of the converted / target pairs
+            for (featfile_k, spk_cv_k), metrics in dtw_eval_pool.collect():
+                loss_melsp_dB_src_trg.append(metrics["melsp_dB"])
+                loss_lat_dist_rmse.append(metrics["lat_dist_rmse"])
+                loss_lat_dist_cossim.append(metrics["lat_dist_cossim"])
+                total_eval_loss["eval/loss_melsp_dB_src_trg"].append(metrics["melsp_dB"])
+                total_eval_loss["eval/loss_lat_dist_rmse"].append(metrics["lat_dist_rmse"])
+                total_eval_loss["eval/loss_lat_dist_cossim"].append(metrics["lat_dist_cossim"])
+                logging.info('acc cv %s %s %.3f dB %.3f %.3f' % (featfile_k, spk_cv_k,
+                    metrics["melsp_dB"], metrics["lat_dist_rmse"], metrics["lat_dist_cossim"]))
+            # per-utterance development losses of all ranks
+            all_gather_lists_(total_eval_loss, loss_melsp_dB_src_trg, loss_lat_dist_rmse, loss_lat_dist_cossim, gv_src_src, gv_src_trg, loss_sc_feat_in,
+                loss_sc_feat_magsp_in, loss_elbo, loss_px, loss_qy_py, loss_qy_py_err, loss_qz_pz,
+                loss_qy_py_e, loss_qy_py_err_e, loss_qz_pz_e, loss_lat_cossim, loss_lat_rmse, loss_sc_z,
+                loss_sc_feat, loss_sc_feat_cv, loss_sc_feat_magsp, loss_sc_feat_magsp_cv, loss_gauss,
+                loss_melsp, loss_gauss_cv, loss_melsp_cv, loss_melsp_dB, loss_magsp, loss_magsp_cv,
+                loss_magsp_dB, loss_ce_avg, loss_err_avg, loss_ce_c_avg, loss_err_c_avg, loss_ce_f_avg,
+                loss_err_f_avg, loss_fro_avg, loss_l1_avg, loss_fro_fb, loss_l1_fb, loss_seg_conv,
+                loss_conv_sc, loss_h, loss_mid_smpl, loss_ce, loss_err, loss_ce_f, loss_err_f, loss_fro,
+                loss_l1)
             tmp_gv_1 = []
             tmp_gv_2 = []
             for j in range(n_spk):
@@ -2878,7 +3015,7 @@ def main():
             for key in total_eval_loss.keys():
                 total_eval_loss[key] = np.mean(total_eval_loss[key])
                 logging.info(f"(Steps: {iter_idx}) {key} = {total_eval_loss[key]:.4f}.")
-            write_to_tensorboard(writer, iter_idx, total_eval_loss)
+            write_to_tensorboard(writer, iter_idx, subset_tags(total_eval_loss) if args.eval_mode == "trainer" else total_eval_loss)
             total_eval_loss = defaultdict(list)
             eval_loss_sc_feat_in = np.mean(loss_sc_feat_in)
             eval_loss_sc_feat_in_std = np.std(loss_sc_feat_in)
@@ -3212,22 +3349,24 @@ def main():
                     text_log += ";; "
                 logging.info("%s min_idx=%d" % (text_log, min_idx+1))
             #if ((epoch_idx + 1) % args.save_interval_epoch == 0) or (epoch_min_flag):
-            if True:
+            if args.eval_mode != "evaluator":
                 logging.info('save epoch:%d' % (epoch_idx+1))
                 if model_waveform.use_weight_norm:
                     torch.nn.utils.remove_weight_norm(model_waveform.scale_in)
-                save_checkpoint(args.expdir, model_encoder_melsp_fix, model_encoder_melsp, model_decoder_melsp,
+                save_checkpoint(checkpoint_writer, model_encoder_melsp_fix, model_encoder_melsp, model_decoder_melsp,
                     model_encoder_excit_fix, model_encoder_excit, model_spkidtr, model_classifier,
                     model_waveform, min_eval_loss_melsp_dB[0], min_eval_loss_melsp_dB_std[0], min_eval_loss_melsp_cv[0],
                     min_eval_loss_melsp[0], min_eval_loss_gauss_cv[0], min_eval_loss_gauss[0],
                     min_eval_loss_melsp_dB_src_trg, min_eval_loss_melsp_dB_src_trg_std, min_eval_loss_gv_src_trg,
                     min_eval_loss_ce_avg[0], min_eval_loss_ce_avg_std[0], min_eval_loss_err_avg[0], min_eval_loss_err_avg_std[0],
                     min_eval_loss_l1_avg[0], min_eval_loss_l1_fb[0], err_flag, err_flag_count,
-                    iter_idx, min_idx, optimizer, numpy_random_state, torch_random_state, epoch_idx + 1)
+                    iter_idx, min_idx, optimizer, numpy_random_state, torch_random_state, epoch_idx + 1, eval_loss=eval_loss_ce_avg[0])
                 if model_waveform.use_weight_norm:
                     torch.nn.utils.weight_norm(model_waveform.scale_in)
                 for param in model_waveform.scale_in.parameters():
                     param.requires_grad = False
+            else:
+                snapshot_queue.report(epoch_idx + 1, eval_loss_ce_avg[0])
             total = 0
             iter_count = 0
             loss_sc_feat_in = []
@@ -3304,13 +3443,18 @@ def main():
                 param.requires_grad = True
             for param in model_classifier.parameters():
                 param.requires_grad = True
+            if args.eval_mode == "evaluator":
+                continue
             # start next epoch
             if iter_idx < args.step_count:
                 start = time.time()
                 logging.info("==%d EPOCH==" % (epoch_idx+1))
                 logging.info("Training data")
+                profiler.skip() # exclude epoch summary and evaluation
+                memory_meter.skip()
                 batch_x_fb, batch_x, batch_x_c, batch_x_f, batch_feat, batch_feat_magsp, batch_sc, batch_sc_cv_data, c_idx, utt_idx, featfile, \
-                    x_bs, x_ss, f_bs, f_ss, slens, flens, n_batch_utt, del_index_utt, max_slen, max_flen, spk_cv, idx_select, idx_select_full, slens_acc, flens_acc = next(generator)
+                    x_bs, x_ss, f_bs, f_ss, slens, flens, n_batch_utt, del_index_utt, max_slen, max_flen, spk_cv, idx_select, idx_select_full, slens_acc, flens_acc, batch_lat_fix = next(generator)
+                profiler.lap("data")
             else:
                 break
         # feedforward and backpropagate current batch
@@ -3373,6 +3517,14 @@ def main():
             batch_x_f = batch_x_f[:,:x_es]
             batch_x = batch_x[:,:x_es]
             batch_x_fb = batch_x_fb[:,:x_es*args.n_bands]
+        # widen compact waveform codes to int64 only for the current segment (embedding indices and loss targets)
+        batch_x_c_prev = batch_x_c_prev.long()
+        batch_x_f_prev = batch_x_f_prev.long()
+        if args.lpc > 0:
+            batch_x_c_lpc = batch_x_c_lpc.long()
+            batch_x_f_lpc = batch_x_f_lpc.long()
+        batch_x_c = batch_x_c.long()
+        batch_x_f = batch_x_f.long()
 
         # handle first pad for input on melsp flow
         flag_cv = True
@@ -3452,6 +3604,7 @@ def main():
         for i in range(n_cv):
             batch_sc_cv[i] = batch_sc_cv_data[i][:,f_ss:f_es]
 
+        profiler.lap("slicing")
         if f_ss > 0:
             idx_in = 0
             i_cv_in = 0
@@ -3459,57 +3612,40 @@ def main():
                 i_cv = i//2
                 j = i+1
                 if len(del_index_utt) > 0:
-                    h_feat_in_sc = torch.FloatTensor(np.delete(h_feat_in_sc.cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_feat_magsp_in_sc = torch.FloatTensor(np.delete(h_feat_magsp_in_sc.cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_x_org = torch.FloatTensor(np.delete(h_x_org.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                    h_x_2_org = torch.FloatTensor(np.delete(h_x_2_org.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                    h_f_org = torch.FloatTensor(np.delete(h_f_org.cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                    h_z[i] = torch.FloatTensor(np.delete(h_z[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z_e[i] = torch.FloatTensor(np.delete(h_z_e[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z_fix = torch.FloatTensor(np.delete(h_z_fix.cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z_e_fix = torch.FloatTensor(np.delete(h_z_e_fix.cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_melsp[i] = torch.FloatTensor(np.delete(h_melsp[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_melsp_cv[i_cv] = torch.FloatTensor(np.delete(h_melsp_cv[i_cv].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z_sc[i] = torch.FloatTensor(np.delete(h_z_sc[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_feat_sc[i] = torch.FloatTensor(np.delete(h_feat_sc[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_feat_cv_sc[i_cv] = torch.FloatTensor(np.delete(h_feat_cv_sc[i_cv].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_feat_magsp_sc[i] = torch.FloatTensor(np.delete(h_feat_magsp_sc[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_feat_magsp_cv_sc[i_cv] = torch.FloatTensor(np.delete(h_feat_magsp_cv_sc[i_cv].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_x[i] = torch.FloatTensor(np.delete(h_x[i].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                    h_x_2[i] = torch.FloatTensor(np.delete(h_x_2[i].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                    h_f[i] = torch.FloatTensor(np.delete(h_f[i].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                    h_z[j] = torch.FloatTensor(np.delete(h_z[j].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z_e[j] = torch.FloatTensor(np.delete(h_z_e[j].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_melsp[j] = torch.FloatTensor(np.delete(h_melsp[j].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z_sc[j] = torch.FloatTensor(np.delete(h_z_sc[j].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_feat_sc[j] = torch.FloatTensor(np.delete(h_feat_sc[j].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_feat_magsp_sc[j] = torch.FloatTensor(np.delete(h_feat_magsp_sc[j].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_x[j] = torch.FloatTensor(np.delete(h_x[j].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                    h_x_2[j] = torch.FloatTensor(np.delete(h_x_2[j].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
-                    h_f[j] = torch.FloatTensor(np.delete(h_f[j].cpu().data.numpy(), del_index_utt, axis=1)).to(device)
+                    h_feat_in_sc = index_delete(h_feat_in_sc, del_index_utt, dim=1)
+                    h_feat_magsp_in_sc = index_delete(h_feat_magsp_in_sc, del_index_utt, dim=1)
+                    h_x_org = index_delete(h_x_org, del_index_utt, dim=1)
+                    h_x_2_org = index_delete(h_x_2_org, del_index_utt, dim=1)
+                    h_f_org = index_delete(h_f_org, del_index_utt, dim=1)
+                    h_z[i] = index_delete(h_z[i], del_index_utt, dim=1)
+                    h_z_e[i] = index_delete(h_z_e[i], del_index_utt, dim=1)
+                    if batch_lat_fix is None:
+                        h_z_fix = index_delete(h_z_fix, del_index_utt, dim=1)
+                        h_z_e_fix = index_delete(h_z_e_fix, del_index_utt, dim=1)
+                    h_melsp[i] = index_delete(h_melsp[i], del_index_utt, dim=1)
+                    h_melsp_cv[i_cv] = index_delete(h_melsp_cv[i_cv], del_index_utt, dim=1)
+                    h_z_sc[i] = index_delete(h_z_sc[i], del_index_utt, dim=1)
+                    h_feat_sc[i] = index_delete(h_feat_sc[i], del_index_utt, dim=1)
+                    h_feat_cv_sc[i_cv] = index_delete(h_feat_cv_sc[i_cv], del_index_utt, dim=1)
+                    h_feat_magsp_sc[i] = index_delete(h_feat_magsp_sc[i], del_index_utt, dim=1)
+                    h_feat_magsp_cv_sc[i_cv] = index_delete(h_feat_magsp_cv_sc[i_cv], del_index_utt, dim=1)
+                    h_x[i] = index_delete(h_x[i], del_index_utt, dim=1)
+                    h_x_2[i] = index_delete(h_x_2[i], del_index_utt, dim=1)
+                    h_f[i] = index_delete(h_f[i], del_index_utt, dim=1)
+                    h_z[j] = index_delete(h_z[j], del_index_utt, dim=1)
+                    h_z_e[j] = index_delete(h_z_e[j], del_index_utt, dim=1)
+                    h_melsp[j] = index_delete(h_melsp[j], del_index_utt, dim=1)
+                    h_z_sc[j] = index_delete(h_z_sc[j], del_index_utt, dim=1)
+                    h_feat_sc[j] = index_delete(h_feat_sc[j], del_index_utt, dim=1)
+                    h_feat_magsp_sc[j] = index_delete(h_feat_magsp_sc[j], del_index_utt, dim=1)
+                    h_x[j] = index_delete(h_x[j], del_index_utt, dim=1)
+                    h_x_2[j] = index_delete(h_x_2[j], del_index_utt, dim=1)
+                    h_f[j] = index_delete(h_f[j], del_index_utt, dim=1)
                 qy_logits[i], qz_alpha[i], z[i], h_z[i] = model_encoder_melsp(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in], h=h_z[i])
                 qy_logits_e[i], qz_alpha_e[i], z_e[i], h_z_e[i] = model_encoder_excit(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in], h=h_z_e[i])
-                _, qz_alpha_fix, z_fix, h_z_fix = model_encoder_melsp_fix(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in], h=h_z_fix)
-                _, qz_alpha_e_fix, z_e_fix, h_z_e_fix = model_encoder_excit_fix(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in], h=h_z_e_fix)
+                if batch_lat_fix is None:
+                    _, qz_alpha_fix, z_fix, h_z_fix = model_encoder_melsp_fix(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in], h=h_z_fix)
+                    _, qz_alpha_e_fix, z_e_fix, h_z_e_fix = model_encoder_excit_fix(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in], h=h_z_e_fix)
                 batch_feat_in_sc, h_feat_in_sc = model_classifier(feat=batch_melsp, h=h_feat_in_sc)
                 batch_feat_magsp_in_sc, h_feat_magsp_in_sc = model_classifier(feat_aux=batch_magsp, h=h_feat_magsp_in_sc)
                 seg_conv, conv_sc, out, out_2, out_f, signs_c, scales_c, logits_c, signs_f, scales_f, logits_f, x_c_output, x_f_output, h_x_org, h_x_2_org, h_f_org \
@@ -3523,18 +3659,23 @@ def main():
                 qz_alpha[i] = qz_alpha[i][:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
                 qy_logits_e[i] = qy_logits_e[i][:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
                 qz_alpha_e[i] = qz_alpha_e[i][:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
-                qz_alpha_fix = qz_alpha_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
-                qz_alpha_e_fix = qz_alpha_e_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
+                if batch_lat_fix is None:
+                    qz_alpha_fix = qz_alpha_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
+                    qz_alpha_e_fix = qz_alpha_e_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
+                else: # precomputed latents of the fixed encoders
+                    qz_alpha_fix, qz_alpha_e_fix = torch.split(batch_lat_fix[:,f_ss:f_es], [args.lat_dim*2, args.lat_dim_e*2], dim=-1)
                 ## speaker embeddings
                 idx_in += 1
-                weight_in, spk_code_in = model_spkidtr(batch_sc_in[idx_in])
-                weight_cv_in, spk_cv_code_in = model_spkidtr(batch_sc_cv_in[i_cv_in])
+                weight_in, spk_code_in = model_spkidtr(torch.cat((batch_sc_in[idx_in], batch_sc_cv_in[i_cv_in]), 0))
+                weight_in, weight_cv_in = torch.chunk(weight_in, 2, 0)
+                spk_code_in, spk_cv_code_in = torch.chunk(spk_code_in, 2, 0)
                 ## melsp reconstruction & conversion
                 i_cv_in += 1
-                batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat, y=spk_code_in,
-                                    outpad_right=outpad_rights[idx_in], h=h_melsp[i])
-                batch_pdf_cv[i_cv], batch_melsp_cv[i_cv], h_melsp_cv[i_cv] = model_decoder_melsp(z_cat, y=spk_cv_code_in,
-                                    outpad_right=outpad_rights[idx_in], h=h_melsp_cv[i_cv])
+                batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat.repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0),
+                                    outpad_right=outpad_rights[idx_in], h=torch.cat((h_melsp[i], h_melsp_cv[i_cv]), 1))
+                batch_pdf_rec[i], batch_pdf_cv[i_cv] = torch.chunk(batch_pdf_rec[i], 2, 0)
+                batch_melsp_rec[i], batch_melsp_cv[i_cv] = torch.chunk(batch_melsp_rec[i], 2, 0)
+                h_melsp[i], h_melsp_cv[i_cv] = torch.chunk(h_melsp[i], 2, 1)
                 ## waveform reconstruction
                 idx_in += 1
                 batch_x_c_output_noclamp[i], batch_x_f_output_noclamp[i], batch_seg_conv[i], batch_conv_sc[i], \
@@ -3564,10 +3705,12 @@ def main():
                 batch_melsp_cv[i_cv] = batch_melsp_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                 batch_magsp_rec[i] = torch.matmul((torch.exp(batch_melsp_rec[i])-1)/10000, melfb_t)
                 batch_magsp_cv[i_cv] = torch.matmul((torch.exp(batch_melsp_cv[i_cv])-1)/10000, melfb_t)
-                batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=batch_melsp_rec[i], h=h_feat_sc[i])
-                batch_feat_cv_sc[i_cv], h_feat_cv_sc[i_cv] = model_classifier(feat=batch_melsp_cv[i_cv], h=h_feat_cv_sc[i_cv])
-                batch_feat_magsp_rec_sc[i], h_feat_magsp_sc[i] = model_classifier(feat_aux=batch_magsp_rec[i], h=h_feat_magsp_sc[i])
-                batch_feat_magsp_cv_sc[i_cv], h_feat_magsp_cv_sc[i_cv] = model_classifier(feat_aux=batch_magsp_cv[i_cv], h=h_feat_magsp_cv_sc[i_cv])
+                batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=torch.cat((batch_melsp_rec[i], batch_melsp_cv[i_cv]), 0), h=torch.cat((h_feat_sc[i], h_feat_cv_sc[i_cv]), 1))
+                batch_feat_rec_sc[i], batch_feat_cv_sc[i_cv] = torch.chunk(batch_feat_rec_sc[i], 2, 0)
+                h_feat_sc[i], h_feat_cv_sc[i_cv] = torch.chunk(h_feat_sc[i], 2, 1)
+                batch_feat_magsp_rec_sc[i], h_feat_magsp_sc[i] = model_classifier(feat_aux=torch.cat((batch_magsp_rec[i], batch_magsp_cv[i_cv]), 0), h=torch.cat((h_feat_magsp_sc[i], h_feat_magsp_cv_sc[i_cv]), 1))
+                batch_feat_magsp_rec_sc[i], batch_feat_magsp_cv_sc[i_cv] = torch.chunk(batch_feat_magsp_rec_sc[i], 2, 0)
+                h_feat_magsp_sc[i], h_feat_magsp_cv_sc[i_cv] = torch.chunk(h_feat_magsp_sc[i], 2, 1)
                 ## cyclic reconstruction
                 idx_in += 1
                 qy_logits[j], qz_alpha[j], z[j], h_z[j] = model_encoder_melsp(cv_feat, outpad_right=outpad_rights[idx_in], h=h_z[j])
@@ -3621,8 +3764,9 @@ def main():
                 j = i+1
                 qy_logits[i], qz_alpha[i], z[i], h_z[i] = model_encoder_melsp(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in])
                 qy_logits_e[i], qz_alpha_e[i], z_e[i], h_z_e[i] = model_encoder_excit(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in])
-                _, qz_alpha_fix, z_fix, h_z_fix = model_encoder_melsp_fix(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in])
-                _, qz_alpha_e_fix, z_e_fix, h_z_e_fix = model_encoder_excit_fix(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in])
+                if batch_lat_fix is None:
+                    _, qz_alpha_fix, z_fix, h_z_fix = model_encoder_melsp_fix(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in])
+                    _, qz_alpha_e_fix, z_e_fix, h_z_e_fix = model_encoder_excit_fix(batch_feat_in[idx_in], outpad_right=outpad_rights[idx_in])
                 batch_feat_in_sc, h_feat_in_sc = model_classifier(feat=batch_melsp)
                 batch_feat_magsp_in_sc, h_feat_magsp_in_sc = model_classifier(feat_aux=batch_magsp)
                 seg_conv, conv_sc, out, out_2, out_f, signs_c, scales_c, logits_c, signs_f, scales_f, logits_f, x_c_output, x_f_output, h_x_org, h_x_2_org, h_f_org \
@@ -3636,18 +3780,23 @@ def main():
                 qz_alpha[i] = qz_alpha[i][:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
                 qy_logits_e[i] = qy_logits_e[i][:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
                 qz_alpha_e[i] = qz_alpha_e[i][:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
-                qz_alpha_fix = qz_alpha_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
-                qz_alpha_e_fix = qz_alpha_e_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
+                if batch_lat_fix is None:
+                    qz_alpha_fix = qz_alpha_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
+                    qz_alpha_e_fix = qz_alpha_e_fix[:,outpad_lefts[idx_in]:feat_len-outpad_rights[idx_in]]
+                else: # precomputed latents of the fixed encoders
+                    qz_alpha_fix, qz_alpha_e_fix = torch.split(batch_lat_fix[:,f_ss:f_es], [args.lat_dim*2, args.lat_dim_e*2], dim=-1)
                 ## speaker embeddings
                 idx_in += 1
-                weight_in, spk_code_in = model_spkidtr(batch_sc_in[idx_in])
-                weight_cv_in, spk_cv_code_in = model_spkidtr(batch_sc_cv_in[i_cv_in])
+                weight_in, spk_code_in = model_spkidtr(torch.cat((batch_sc_in[idx_in], batch_sc_cv_in[i_cv_in]), 0))
+                weight_in, weight_cv_in = torch.chunk(weight_in, 2, 0)
+                spk_code_in, spk_cv_code_in = torch.chunk(spk_code_in, 2, 0)
                 ## melsp reconstruction & conversion
                 i_cv_in += 1
-                batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat, y=spk_code_in,
-                                    outpad_right=outpad_rights[idx_in])
-                batch_pdf_cv[i_cv], batch_melsp_cv[i_cv], h_melsp_cv[i_cv] = model_decoder_melsp(z_cat, y=spk_cv_code_in,
+                batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat.repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0),
                                     outpad_right=outpad_rights[idx_in])
+                batch_pdf_rec[i], batch_pdf_cv[i_cv] = torch.chunk(batch_pdf_rec[i], 2, 0)
+                batch_melsp_rec[i], batch_melsp_cv[i_cv] = torch.chunk(batch_melsp_rec[i], 2, 0)
+                h_melsp[i], h_melsp_cv[i_cv] = torch.chunk(h_melsp[i], 2, 1)
                 ## waveform reconstruction
                 idx_in += 1
                 batch_x_c_output_noclamp[i], batch_x_f_output_noclamp[i], batch_seg_conv[i], batch_conv_sc[i], \
@@ -3677,10 +3826,12 @@ def main():
                 batch_melsp_cv[i_cv] = batch_melsp_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                 batch_magsp_rec[i] = torch.matmul((torch.exp(batch_melsp_rec[i])-1)/10000, melfb_t)
                 batch_magsp_cv[i_cv] = torch.matmul((torch.exp(batch_melsp_cv[i_cv])-1)/10000, melfb_t)
-                batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=batch_melsp_rec[i])
-                batch_feat_cv_sc[i_cv], h_feat_cv_sc[i_cv] = model_classifier(feat=batch_melsp_cv[i_cv])
-                batch_feat_magsp_rec_sc[i], h_feat_magsp_sc[i] = model_classifier(feat_aux=batch_magsp_rec[i])
-                batch_feat_magsp_cv_sc[i_cv], h_feat_magsp_cv_sc[i_cv] = model_classifier(feat_aux=batch_magsp_cv[i_cv])
+                batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=torch.cat((batch_melsp_rec[i], batch_melsp_cv[i_cv]), 0))
+                batch_feat_rec_sc[i], batch_feat_cv_sc[i_cv] = torch.chunk(batch_feat_rec_sc[i], 2, 0)
+                h_feat_sc[i], h_feat_cv_sc[i_cv] = torch.chunk(h_feat_sc[i], 2, 1)
+                batch_feat_magsp_rec_sc[i], h_feat_magsp_sc[i] = model_classifier(feat_aux=torch.cat((batch_magsp_rec[i], batch_magsp_cv[i_cv]), 0))
+                batch_feat_magsp_rec_sc[i], batch_feat_magsp_cv_sc[i_cv] = torch.chunk(batch_feat_magsp_rec_sc[i], 2, 0)
+                h_feat_magsp_sc[i], h_feat_magsp_cv_sc[i_cv] = torch.chunk(h_feat_magsp_sc[i], 2, 1)
                 ## cyclic reconstruction
                 idx_in += 1
                 qy_logits[j], qz_alpha[j], z[j], h_z[j] = model_encoder_melsp(cv_feat, outpad_right=outpad_rights[idx_in])
@@ -3736,6 +3887,7 @@ def main():
             logging.info(weight_in[i,0])
             logging.info(weight_cv_in[i,0])
 
+        profiler.lap("forward")
         # Losses computation
         batch_loss = 0
 
@@ -4098,6 +4250,7 @@ def main():
             else:
                 optimizer.zero_grad()
                 batch_loss.backward()
+                all_reduce_gradients(module_list)
                 flag = False
                 explode_model = ""
                 for name, param in model_encoder_melsp.named_parameters():
@@ -4146,14 +4299,9 @@ def main():
                 with torch.no_grad():
                     if idx_stage < args.n_stage-1 and iter_idx + 1 == t_starts[idx_stage+1]:
                         idx_stage += 1
-                    if idx_stage > 0:
-                        sparsify(model_encoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                        sparsify(model_encoder_excit, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                        sparsify(model_decoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                    else:
-                        sparsify(model_encoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
-                        sparsify(model_encoder_excit, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
-                        sparsify(model_decoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
+                    sparsity_encoder_melsp.step(iter_idx + 1)
+                    sparsity_encoder_excit.step(iter_idx + 1)
+                    sparsity_decoder_melsp.step(iter_idx + 1)
 
                 text_log = "batch loss_select %lf " % (batch_loss.item())
                 logging.info("%s (%.3f sec)" % (text_log, time.time() - start))
@@ -4171,6 +4319,8 @@ def main():
                     write_to_tensorboard(writer, iter_idx, total_train_loss)
                     total_train_loss = defaultdict(list)
                 total += time.time() - start
+                memory_meter.step(iter_idx, batch_melsp.shape[0]*batch_melsp.shape[1])
+                profiler.step(iter_idx)
                 continue
 
         # loss_compute
@@ -4472,8 +4622,11 @@ def main():
 
         logging.info(model_spkidtr.embed_spk.weight[:4][:,:4])
 
+        profiler.lap("loss")
         optimizer.zero_grad()
         batch_loss.backward()
+        all_reduce_gradients(module_list)
+        profiler.lap("backward")
         flag = False
         explode_model = ""
         for name, param in model_encoder_melsp.named_parameters():
@@ -4547,20 +4700,17 @@ def main():
         torch.nn.utils.clip_grad_norm_(model_decoder_melsp.parameters(), 10)
         torch.nn.utils.clip_grad_norm_(model_spkidtr.parameters(), 10)
         optimizer.step()
+        profiler.lap("optimizer")
 
         logging.info(model_spkidtr.embed_spk.weight[:4][:,:4])
 
         with torch.no_grad():
             if idx_stage < args.n_stage-1 and iter_idx + 1 == t_starts[idx_stage+1]:
                 idx_stage += 1
-            if idx_stage > 0:
-                sparsify(model_encoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                sparsify(model_encoder_excit, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                sparsify(model_decoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-            else:
-                sparsify(model_encoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
-                sparsify(model_encoder_excit, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
-                sparsify(model_decoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
+            sparsity_encoder_melsp.step(iter_idx + 1)
+            sparsity_encoder_excit.step(iter_idx + 1)
+            sparsity_decoder_melsp.step(iter_idx + 1)
+        profiler.lap("sparsify")
 
         text_log = "batch loss [%d] %d %d %d %d %.3f %.3f " % (c_idx+1, x_ss, x_bs, f_ss, f_bs, batch_loss_sc_feat_in.item(), batch_loss_sc_feat_magsp_in.item())
         for i in range(args.n_half_cyc):
@@ -4607,9 +4757,19 @@ def main():
             write_to_tensorboard(writer, iter_idx, total_train_loss)
             total_train_loss = defaultdict(list)
         total += time.time() - start
+        memory_meter.step(iter_idx, batch_melsp.shape[0]*batch_melsp.shape[1])
+        profiler.step(iter_idx)
 
 
     logging.info("Maximum step is reached, please check the development optimum index, or continue training by increasing maximum step.")
+    profiler.close()
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+        if args.eval_mode == "trainer":
+            snapshot_queue.end_training()
+    dtw_eval_pool.close()
+    if cache is not None:
+        cache.clear()
 
 
 if __name__ == "__main__":
@@ -22,7 +22,7 @@ import numpy as np
 import six
 import torch
 from torchvision import transforms
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 
 from decimal import Decimal
 
@@ -38,8 +38,18 @@ from vcneuvoco import kl_laplace, kl_categorical_categorical_logits, GaussLoss
 import torch_optimizer as optim
 
 from dataset import FeatureDatasetCycMceplf0WavVAE, FeatureDatasetEvalCycMceplf0WavVAE, padding
-
-from dtw_c import dtw_c as dtw
+from segmenter import BatchSegmenter, index_delete
+from feature_cache import SharedFeatureCache, default_cache_dir
+from devices import get_device
+from checkpoint_io import AsyncCheckpointWriter
+from sparsity import BlockSparsity, parse_extra_densities
+from precision import autocast_methods
+from distributed import init_distributed, ShardedSampler, synchronize_epochs
+from distributed import broadcast_parameters, all_reduce_gradients, all_gather_lists_
+from profiling import StepProfiler
+from eval_service import EVAL_MODES, SnapshotQueue, eval_subset_indices, load_snapshot, subset_tags
+
+from eval_metrics import DTWEvalPool
 
 #np.set_printoptions(threshold=np.inf)
 #torch.set_printoptions(threshold=np.inf)
@@ -73,49 +83,29 @@ def train_generator(dataloader, device, batch_size, n_cv, limit_count=None):
                 feat_cv[i] = batch['feat_cv_list'][i][:,:max_flen].to(device)
             featfiles = batch['featfile']
             spk_cv = batch['pair_spk_list']
-            n_batch_utt = feat.size(0)
 
-            len_frm = max_flen
-            f_ss = 0
-            f_bs = batch_size
-            delta_frm = batch_size
-            flens_acc = np.array(flens)
+            segmenter = BatchSegmenter(flens, batch_size)
             while True:
-                del_index_utt = []
-                idx_select = []
-                idx_select_full = []
-                for i in range(n_batch_utt):
-                    if flens_acc[i] <= 0:
-                        del_index_utt.append(i)
+                del_index_utt = segmenter.update()
                 if len(del_index_utt) > 0:
-                    flens = np.delete(flens, del_index_utt, axis=0)
-                    feat = torch.FloatTensor(np.delete(feat.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    sc = torch.LongTensor(np.delete(sc.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    for j in range(n_cv):
-                        sc_cv[j] = torch.LongTensor(np.delete(sc_cv[j].cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                        feat_cv[j] = torch.FloatTensor(np.delete(feat_cv[j].cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                        spk_cv[j] = np.delete(spk_cv[j], del_index_utt, axis=0)
-                    featfiles = np.delete(featfiles, del_index_utt, axis=0)
-                    flens_acc = np.delete(flens_acc, del_index_utt, axis=0)
-                    n_batch_utt -= len(del_index_utt)
-                for i in range(n_batch_utt):
-                    if flens_acc[i] < f_bs:
-                        idx_select.append(i)
-                if len(idx_select) > 0:
-                    idx_select_full = torch.LongTensor(np.delete(np.arange(n_batch_utt), idx_select, axis=0)).to(device)
-                    idx_select = torch.LongTensor(idx_select).to(device)
+                    flens = segmenter.shrink(flens)
+                    feat = segmenter.shrink(feat)
+                    sc = segmenter.shrink(sc)
+                    sc_cv = segmenter.shrink_list(sc_cv)
+                    feat_cv = segmenter.shrink_list(feat_cv)
+                    spk_cv = segmenter.shrink_list(spk_cv)
+                    featfiles = segmenter.shrink(featfiles)
+                n_batch_utt = segmenter.n_batch_utt
+                idx_select, idx_select_full = segmenter.select_short(device)
+                f_bs, f_ss = segmenter.f_bs, segmenter.f_ss
+                flens_acc = segmenter.flens_acc
                 yield feat, sc, sc_cv, feat_cv, c_idx, idx, featfiles, f_bs, f_ss, flens, \
                     n_batch_utt, del_index_utt, max_flen, spk_cv, idx_select, idx_select_full, flens_acc
-                for i in range(n_batch_utt):
-                    flens_acc[i] -= delta_frm
 
                 count += 1
                 if limit_count is not None and count > limit_count:
                     break
-                len_frm -= delta_frm
-                if len_frm > 0:
-                    f_ss += delta_frm
-                else:
+                if not segmenter.advance():
                     break
 
             if limit_count is not None and count > limit_count:
@@ -172,60 +162,41 @@ def eval_generator(dataloader, device, batch_size, limit_count=None, spcidx=True
                 sc_full = batch['src_code_full'][:,:max_flen_full].to(device)
                 sc_cv_full = batch['src_trg_code_full'][:,:max_flen_full].to(device)
 
-            len_frm = max_flen
-            f_ss = 0
-            f_bs = batch_size
-            delta_frm = batch_size
-            flens_acc = np.array(flens)
+            segmenter = BatchSegmenter(flens, batch_size)
             while True:
-                del_index_utt = []
-                idx_select = []
-                idx_select_full = []
-                for i in range(n_batch_utt):
-                    if flens_acc[i] <= 0:
-                        del_index_utt.append(i)
+                del_index_utt = segmenter.update()
                 if len(del_index_utt) > 0:
-                    flens = np.delete(flens, del_index_utt, axis=0)
-                    flens_trg = np.delete(flens_trg, del_index_utt, axis=0)
-                    flens_spc_src = np.delete(flens_spc_src, del_index_utt, axis=0)
-                    flens_spc_src_trg = np.delete(flens_spc_src_trg, del_index_utt, axis=0)
-                    feat = torch.FloatTensor(np.delete(feat.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    feat_trg = torch.FloatTensor(np.delete(feat_trg.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    sc = torch.LongTensor(np.delete(sc.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    sc_cv = torch.LongTensor(np.delete(sc_cv.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    feat_cv = torch.FloatTensor(np.delete(feat_cv.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    spcidx_src = torch.LongTensor(np.delete(spcidx_src.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    spcidx_src_trg = torch.LongTensor(np.delete(spcidx_src_trg.cpu().data.numpy(), del_index_utt, axis=0)).to(device)
-                    spk_cv = np.delete(spk_cv, del_index_utt, axis=0)
-                    file_src_trg_flag = np.delete(file_src_trg_flag, del_index_utt, axis=0)
-                    featfiles = np.delete(featfiles, del_index_utt, axis=0)
-                    flens_acc = np.delete(flens_acc, del_index_utt, axis=0)
-                    n_batch_utt -= len(del_index_utt)
-                for i in range(n_batch_utt):
-                    if flens_acc[i] < f_bs:
-                        idx_select.append(i)
-                if len(idx_select) > 0:
-                    idx_select_full = torch.LongTensor(np.delete(np.arange(n_batch_utt), idx_select, axis=0)).to(device)
-                    idx_select = torch.LongTensor(idx_select).to(device)
+                    flens = segmenter.shrink(flens)
+                    flens_trg = segmenter.shrink(flens_trg)
+                    flens_spc_src = segmenter.shrink(flens_spc_src)
+                    flens_spc_src_trg = segmenter.shrink(flens_spc_src_trg)
+                    feat = segmenter.shrink(feat)
+                    feat_trg = segmenter.shrink(feat_trg)
+                    sc = segmenter.shrink(sc)
+                    sc_cv = segmenter.shrink(sc_cv)
+                    feat_cv = segmenter.shrink(feat_cv)
+                    spcidx_src = segmenter.shrink(spcidx_src)
+                    spcidx_src_trg = segmenter.shrink(spcidx_src_trg)
+                    spk_cv = segmenter.shrink(spk_cv)
+                    file_src_trg_flag = segmenter.shrink(file_src_trg_flag)
+                    featfiles = segmenter.shrink(featfiles)
+                n_batch_utt = segmenter.n_batch_utt
+                idx_select, idx_select_full = segmenter.select_short(device)
+                f_bs, f_ss = segmenter.f_bs, segmenter.f_ss
                 if spcidx:
                     yield feat, feat_trg, sc, sc_cv, feat_cv, c_idx, idx, featfiles, f_bs, f_ss, flens, \
                         n_batch_utt, del_index_utt, max_flen, spk_cv, file_src_trg_flag, spcidx_src, \
-                            spcidx_src_trg, flens_spc_src, flens_spc_src_trg, feat_full, sc_full, sc_cv_full, \
+                            spcidx_src_trg, flens_spc_src, flens_spc_src_trg, feat_full, sc_full, sc_cv_full, flens_full, flens_trg, \
                                 idx_select, idx_select_full
                 else:
                     yield feat, feat_trg, sc, sc_cv, feat_cv, c_idx, idx, featfiles, f_bs, f_ss, flens, \
                         n_batch_utt, del_index_utt, max_flen, spk_cv, file_src_trg_flag, spcidx_src, \
                             spcidx_src_trg, flens_spc_src, flens_spc_src_trg, idx_select, idx_select_full
-                for i in range(n_batch_utt):
-                    flens_acc[i] -= delta_frm
 
                 count += 1
                 if limit_count is not None and count > limit_count:
                     break
-                len_frm -= delta_frm
-                if len_frm > 0:
-                    f_ss += delta_frm
-                else:
+                if not segmenter.advance():
                     break
 
             if limit_count is not None and count > limit_count:
@@ -242,25 +213,22 @@ def eval_generator(dataloader, device, batch_size, limit_count=None, spcidx=True
             yield [], [], [], [], [], -1, -1, [], [], [], [], [], [], [], [], [], [], [], [], [], [], []
 
 
-def save_checkpoint(checkpoint_dir, model_encoder_melsp, model_decoder_melsp, model_encoder_excit, model_decoder_excit,
+def save_checkpoint(checkpoint_writer, model_encoder_melsp, model_decoder_melsp, model_encoder_excit, model_decoder_excit,
         model_spkidtr, model_classifier, min_eval_loss_melsp_dB, min_eval_loss_melsp_dB_std, min_eval_loss_melsp_cv,
         min_eval_loss_melsp, min_eval_loss_gauss_cv, min_eval_loss_gauss,
         min_eval_loss_melsp_dB_src_trg, min_eval_loss_melsp_dB_src_trg_std, min_eval_loss_gv_src_trg,
-        iter_idx, min_idx, optimizer, numpy_random_state, torch_random_state, iterations):
+        iter_idx, min_idx, optimizer, numpy_random_state, torch_random_state, iterations, eval_loss=None):
     """FUNCTION TO SAVE CHECKPOINT
 
     Args:
-        checkpoint_dir (str): directory to save checkpoint
+        checkpoint_writer (AsyncCheckpointWriter): background checkpoint writer
         model (torch.nn.Module): pytorch model instance
         optimizer (Optimizer): pytorch optimizer instance
         iterations (int): number of current iterations
+        eval_loss (float): development loss of current iterations for checkpoint retention
     """
-    model_encoder_melsp.cpu()
-    model_decoder_melsp.cpu()
-    model_encoder_excit.cpu()
-    model_decoder_excit.cpu()
-    model_spkidtr.cpu()
-    model_classifier.cpu()
+    if checkpoint_writer is None: # not rank 0 of data-parallel training
+        return
     checkpoint = {
         "model_encoder_melsp": model_encoder_melsp.state_dict(),
         "model_decoder_melsp": model_decoder_melsp.state_dict(),
@@ -284,70 +252,17 @@ def save_checkpoint(checkpoint_dir, model_encoder_melsp, model_decoder_melsp, mo
         "numpy_random_state": numpy_random_state,
         "torch_random_state": torch_random_state,
         "iterations": iterations}
-    if not os.path.exists(checkpoint_dir):
-        os.makedirs(checkpoint_dir)
-    torch.save(checkpoint, checkpoint_dir + "/checkpoint-%d.pkl" % iterations)
-    torch.save(checkpoint, checkpoint_dir + "/checkpoint-last.pkl")
-    model_encoder_melsp.cuda()
-    model_decoder_melsp.cuda()
-    model_encoder_excit.cuda()
-    model_decoder_excit.cuda()
-    model_spkidtr.cuda()
-    model_classifier.cuda()
-    logging.info("%d-iter and last checkpoints created." % iterations)
+    checkpoint_writer.save(checkpoint, iterations, eval_loss=eval_loss, keep=[min_idx+1])
 
 
 def write_to_tensorboard(writer, steps, loss):
     """Write to tensorboard."""
+    if writer is None:
+        return
     for key, value in loss.items():
         writer.add_scalar(key, value, steps)
 
 
-## Based on lpcnet.py [https://github.com/mozilla/LPCNet/blob/master/src/lpcnet.py]
-## Modified to accomodate PyTorch model and n-stages of sparsification
-def sparsify(model, iter_idx, t_start, t_end, interval, densities, densities_p=None):
-    if iter_idx < t_start or ((iter_idx-t_start) % interval != 0 and iter_idx < t_end):
-        pass
-    else:
-        logging.info('sparsify: %ld %ld %ld %ld' % (iter_idx, t_start, t_end, interval))
-        p = model.gru.weight_hh_l0 #recurrent
-        nb = p.shape[0] // p.shape[1]
-        N = p.shape[0] // nb
-        N_16 = N // 16
-        ones = torch.diag(torch.ones(N, device=p.device))
-        if densities_p is not None:
-            for k in range(nb):
-                density = densities[k]
-                if iter_idx < t_end:
-                    r = 1 - (iter_idx-t_start)/(t_end - t_start)
-                    density = densities_p[k] - (densities_p[k]-densities[k])*(1 - r)**5
-                logging.info('%ld: %lf %lf %lf' % (k+1, densities_p[k], densities[k], density))
-                #recurrent weight
-                A = p[k*N:(k+1)*N, :]
-                #horizontal block structure (16) in input part, in real-time simultaneously computed for each 16 output using 2 registers (256x2 bits)
-                L = (A - torch.diag(torch.diag(A))).transpose(1, 0).reshape(N, N_16, 16)
-                S = torch.sum(L*L, -1)
-                SS, _ = torch.sort(S.reshape(-1))
-                thresh = SS[round(N*N_16*(1-density))]
-                mask = torch.clamp(torch.repeat_interleave((S>=thresh).float(), 16, dim=1) + ones, max=1).transpose(1,0)
-                p[k*N:(k+1)*N, :] = p[k*N:(k+1)*N, :]*mask # outputxinput
-        else:
-            for k in range(nb):
-                density = densities[k]
-                if iter_idx < t_end:
-                    r = 1 - (iter_idx-t_start)/(t_end - t_start)
-                    density = 1 - (1-densities[k])*(1 - r)**5
-                logging.info('%ld: 1 %lf %lf' % (k+1, densities[k], density))
-                #recurrent weight
-                A = p[k*N:(k+1)*N, :]
-                L = (A - torch.diag(torch.diag(A))).transpose(1, 0).reshape(N, N_16, 16)
-                S = torch.sum(L*L, -1)
-                SS, _ = torch.sort(S.reshape(-1))
-                thresh = SS[round(N*N_16*(1-density))]
-                mask = torch.clamp(torch.repeat_interleave((S>=thresh).float(), 16, dim=1) + ones, max=1).transpose(1,0)
-                p[k*N:(k+1)*N, :] = p[k*N:(k+1)*N, :]*mask
-
-
 def main():
     parser = argparse.ArgumentParser()
     # path setting
@@ -415,6 +330,18 @@ def main():
                         type=float, help="dropout probability")
     parser.add_argument("--n_workers", default=2,
                         type=int, help="batch size (if set 0, utterance batch will be used)")
+    parser.add_argument("--cache_size", default=0,
+                        type=float, help="memory budget [MB] of shared in-memory feature cache (if set 0, no cache will be used)")
+    parser.add_argument("--cache_dir", default=None,
+                        type=str, help="directory of shared feature cache, should be on tmpfs (default: /dev/shm/featcache_<hash of expdir>)")
+    parser.add_argument("--persistent_workers", default=False,
+                        type=strtobool, help="flag to keep dataloader workers alive across epochs")
+    parser.add_argument("--ckpt_keep_best", default=0,
+                        type=int, help="number of best checkpoints by development loss to be kept (if this and ckpt_keep_last are 0, keep all)")
+    parser.add_argument("--ckpt_keep_last", default=0,
+                        type=int, help="number of last checkpoints to be kept (if this and ckpt_keep_best are 0, keep all)")
+    parser.add_argument("--n_eval_workers", default=2,
+                        type=int, help="number of processes of DTW-based evaluation metrics (if set 0, computed in the training process)")
     parser.add_argument("--n_half_cyc", default=2,
                         type=int, help="batch size (if set 0, utterance batch will be used)")
     parser.add_argument("--causal_conv_enc", default=False,
@@ -439,6 +366,8 @@ def main():
                         type=int, help="interval in finishing densitiy sparsify")
     parser.add_argument("--densities", default="0.685-0.685-0.88",
                         type=str, help="final densitiy of reset, update, new hidden gate matrices")
+    parser.add_argument("--sparse_extra", default="",
+                        type=str, help="additional matrices to be sparsified and their final densities, separated by @, e.g., decoder_melsp.gru.weight_ih_l0:0.5@out.weight:0.25, names scoped with a model (encoder_melsp, encoder_excit, decoder_melsp) are only for that model")
     # other setting
     parser.add_argument("--pad_len", default=3000,
                         type=int, help="seed number")
@@ -456,6 +385,27 @@ def main():
     #                    type=str, help="model path to restart training")
     parser.add_argument("--GPU_device", default=None,
                         type=int, help="selection of GPU device")
+    parser.add_argument("--device", default=None,
+                        type=str, help="compute device, cuda or cpu (if not set, cuda if available, otherwise cpu)")
+    parser.add_argument("--n_threads", default=0,
+                        type=int, help="number of cpu intra-op threads (if set 0, available cores minus dataloader workers)")
+    parser.add_argument("--n_interop_threads", default=0,
+                        type=int, help="number of cpu inter-op threads (if set 0, 1 thread)")
+    parser.add_argument("--precision", default="fp32",
+                        type=str, help="compute precision, fp32 or bf16 (autocast with fp32 master weights)")
+    parser.add_argument("--dist_backend", default="gloo",
+                        type=str, help="backend of data-parallel training, launched with WORLD_SIZE > 1 (gloo for cpu nodes)")
+    parser.add_argument("--profile", default=False,
+                        type=strtobool, help="flag to report time breakdown of training steps every log_interval_steps")
+    parser.add_argument("--profile_trace_start", default=10,
+                        type=int, help="number of profiled steps before torch.profiler trace")
+    parser.add_argument("--profile_trace_steps", default=0,
+                        type=int, help="number of steps of torch.profiler trace in expdir/profile (if set 0, no trace)")
+    parser.add_argument("--eval_mode", default="inline",
+                        type=str, help="inline: evaluate in training, trainer: evaluate fixed subset and leave full evaluation "\
+                            "of checkpoints to evaluator, evaluator: evaluate checkpoints of trainer with the same expdir and n_threads")
+    parser.add_argument("--n_eval_subset", default=10,
+                        type=int, help="number of fixed development utterances of fast proxy evaluation in trainer mode")
     parser.add_argument("--verbose", default=1,
                         type=int, help="log level")
     args = parser.parse_args()
@@ -464,6 +414,14 @@ def main():
         os.environ["CUDA_DEVICE_ORDER"]     = "PCI_BUS_ID"
         os.environ["CUDA_VISIBLE_DEVICES"]  = str(args.GPU_device)
 
+    # data-parallel processes (if launched with WORLD_SIZE > 1)
+    rank, world_size, local_world_size = init_distributed(args.dist_backend)
+    if args.eval_mode not in EVAL_MODES:
+        raise ValueError("eval_mode should be one of %s, got %s." % (str(EVAL_MODES), args.eval_mode))
+    if args.eval_mode == "evaluator" and world_size > 1:
+        raise ValueError("evaluator should be launched as a single process.")
+    log_name = "eval.log" if args.eval_mode == "evaluator" else "train.log"
+
     # make experimental directory
     if not os.path.exists(args.expdir):
         os.makedirs(args.expdir)
@@ -473,30 +431,34 @@ def main():
         logging.basicConfig(level=logging.INFO,
                             format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
                             datefmt='%m/%d/%Y %I:%M:%S',
-                            filename=args.expdir + "/train.log")
+                            filename=args.expdir + "/" + log_name)
         logging.getLogger().addHandler(logging.StreamHandler())
     elif args.verbose > 1:
         logging.basicConfig(level=logging.DEBUG,
                             format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
                             datefmt='%m/%d/%Y %I:%M:%S',
-                            filename=args.expdir + "/train.log")
+                            filename=args.expdir + "/" + log_name)
         logging.getLogger().addHandler(logging.StreamHandler())
     else:
         logging.basicConfig(level=logging.WARN,
                             format='%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s',
                             datefmt='%m/%d/%Y %I:%M:%S',
-                            filename=args.expdir + "/train.log")
+                            filename=args.expdir + "/" + log_name)
         logging.getLogger().addHandler(logging.StreamHandler())
         logging.warn("logging is disabled.")
+    if rank > 0:
+        # log of rank 0 only
+        logging.getLogger().setLevel(logging.WARN)
+    elif world_size > 1:
+        logging.info("data-parallel training with %d processes, %s backend" % (world_size, args.dist_backend))
 
     # fix seed
     os.environ['PYTHONHASHSEED'] = str(args.seed)
     np.random.seed(args.seed)
     torch.manual_seed(args.seed)
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    if str(device) == "cpu":
-        raise ValueError('ERROR: Training by CPU is not acceptable.')
+    device = get_device(args.device, n_threads=args.n_threads, n_interop_threads=args.n_interop_threads,
+                    n_procs=local_world_size, n_workers=args.n_workers)
 
     torch.backends.cudnn.benchmark = True #faster
 
@@ -515,7 +477,8 @@ def main():
 
     # save args as conf
     args.string_path = "/log_1pmelmagsp"
-    torch.save(args, args.expdir + "/model.conf")
+    if args.eval_mode != "evaluator": # model.conf of the training process
+        torch.save(args, args.expdir + "/model.conf")
 
     # define network
     model_encoder_melsp = GRU_VAE_ENCODER(
@@ -595,28 +558,30 @@ def main():
 
     p_spk = torch.ones(n_spk)/n_spk
 
-    # send to gpu
-    if torch.cuda.is_available():
-        model_encoder_melsp.cuda()
-        model_decoder_melsp.cuda()
-        model_encoder_excit.cuda()
-        model_decoder_excit.cuda()
-        model_classifier.cuda()
-        model_spkidtr.cuda()
-        criterion_gauss.cuda()
-        criterion_ce.cuda()
-        criterion_l1.cuda()
-        criterion_l2.cuda()
-        mean_stats = mean_stats.cuda()
-        scale_stats = scale_stats.cuda()
-        mean_cap = mean_cap.cuda()
-        scale_cap = scale_cap.cuda()
-        mean_full = mean_full.cuda()
-        scale_full = scale_full.cuda()
-        p_spk = p_spk.cuda()
-    else:
-        logging.error("gpu is not available. please check the setting.")
-        sys.exit(1)
+    # send to device
+    model_encoder_melsp.to(device)
+    model_decoder_melsp.to(device)
+    model_encoder_excit.to(device)
+    model_decoder_excit.to(device)
+    model_classifier.to(device)
+    model_spkidtr.to(device)
+    autocast_methods(model_encoder_melsp, device, args.precision)
+    autocast_methods(model_decoder_melsp, device, args.precision)
+    autocast_methods(model_encoder_excit, device, args.precision)
+    autocast_methods(model_decoder_excit, device, args.precision)
+    autocast_methods(model_classifier, device, args.precision)
+    autocast_methods(model_spkidtr, device, args.precision)
+    criterion_gauss.to(device)
+    criterion_ce.to(device)
+    criterion_l1.to(device)
+    criterion_l2.to(device)
+    mean_stats = mean_stats.to(device)
+    scale_stats = scale_stats.to(device)
+    mean_cap = mean_cap.to(device)
+    scale_cap = scale_cap.to(device)
+    mean_full = mean_full.to(device)
+    scale_full = scale_full.to(device)
+    p_spk = p_spk.to(device)
     logits_p_spk = torch.log(p_spk)
 
     logging.info(p_spk)
@@ -737,7 +702,7 @@ def main():
 
     # resume
     if args.resume is not None:
-        checkpoint = torch.load(args.resume)
+        checkpoint = torch.load(args.resume, map_location=device)
         model_encoder_melsp.load_state_dict(checkpoint["model_encoder_melsp"])
         model_decoder_melsp.load_state_dict(checkpoint["model_decoder_melsp"])
         model_encoder_excit.load_state_dict(checkpoint["model_encoder_excit"])
@@ -774,12 +739,50 @@ def main():
     else:
         batch_size_utt = 1
     logging.info("number of training_data -- batch_size = %d -- %d " % (n_data, batch_size_utt))
-    dataset = FeatureDatasetCycMceplf0WavVAE(feat_list, pad_feat_transform, spk_list, stats_list,
-                    args.n_half_cyc, args.string_path, excit_dim=args.full_excit_dim)
-    dataloader = DataLoader(dataset, batch_size=batch_size_utt, shuffle=True, num_workers=args.n_workers)
-    #generator = train_generator(dataloader, device, args.batch_size, n_cv, limit_count=1)
-    #generator = train_generator(dataloader, device, args.batch_size, n_cv, limit_count=20)
-    generator = train_generator(dataloader, device, args.batch_size, n_cv, limit_count=None)
+    if args.cache_size > 0:
+        if args.cache_dir is None:
+            args.cache_dir = default_cache_dir(args.expdir)
+        cache = SharedFeatureCache(args.cache_dir, max_mbytes=args.cache_size)
+    else:
+        cache = None
+    # replicate the initial / resumed models of rank 0
+    broadcast_parameters([model_encoder_melsp, model_decoder_melsp, model_encoder_excit, model_decoder_excit, model_spkidtr, model_classifier])
+    snapshot_queue = SnapshotQueue(args.expdir)
+    if rank == 0 and args.eval_mode != "evaluator":
+        checkpoint_writer = AsyncCheckpointWriter(args.expdir, keep_best=args.ckpt_keep_best, keep_last=args.ckpt_keep_last,
+                                retained=snapshot_queue.retained if args.eval_mode == "trainer" else None)
+        if args.eval_mode == "trainer":
+            snapshot_queue.begin_training()
+    else:
+        checkpoint_writer = None
+    dtw_eval_pool = DTWEvalPool(args.n_eval_workers)
+    persistent_workers = args.persistent_workers and args.n_workers > 0
+    if args.eval_mode != "evaluator": # the evaluator only reads the development set
+        dataset = FeatureDatasetCycMceplf0WavVAE(feat_list, pad_feat_transform, spk_list, stats_list,
+                        args.n_half_cyc, args.string_path, excit_dim=args.full_excit_dim, cache=cache)
+        sampler = ShardedSampler(dataset, shuffle=True, seed=args.seed)
+        sampler.set_epoch(epoch_idx) # continue the shuffling order when resuming
+        dataloader = DataLoader(dataset, batch_size=batch_size_utt, sampler=sampler, num_workers=args.n_workers,
+                        persistent_workers=persistent_workers)
+        #generator = train_generator(dataloader, device, args.batch_size, n_cv, limit_count=1)
+        #generator = train_generator(dataloader, device, args.batch_size, n_cv, limit_count=20)
+        def idle_step():
+            """Training step without batch after the pass of this rank ended, as the other ranks' steps"""
+            nonlocal iter_idx, idx_stage
+            optimizer.zero_grad()
+            all_reduce_gradients(module_list)
+            optimizer.step()
+            with torch.no_grad():
+                if idx_stage < args.n_stage-1 and iter_idx + 1 == t_starts[idx_stage+1]:
+                    idx_stage += 1
+                sparsity_encoder_melsp.step(iter_idx + 1)
+                sparsity_encoder_excit.step(iter_idx + 1)
+                sparsity_decoder_melsp.step(iter_idx + 1)
+            iter_idx += 1
+            profiler.step(iter_idx)
+        generator = synchronize_epochs(train_generator(dataloader, device, args.batch_size, n_cv, limit_count=None), idle_step)
+    else:
+        generator = None
 
     # define generator evaluation
     feat_list_eval_src_list = [None]*n_spk
@@ -792,7 +795,7 @@ def main():
             logging.error("%s should be directory or list." % (feat_eval_src_list[i]))
             sys.exit(1)
     dataset_eval = FeatureDatasetEvalCycMceplf0WavVAE(feat_list_eval_src_list, pad_feat_transform, spk_list, \
-                    stats_list, args.string_path, excit_dim=args.full_excit_dim)
+                    stats_list, args.string_path, excit_dim=args.full_excit_dim, cache=cache)
     n_eval_data = len(dataset_eval.file_list_src)
     if n_eval_data >= 15:
         batch_size_utt_eval = round(n_eval_data/10)
@@ -801,11 +804,35 @@ def main():
     else:
         batch_size_utt_eval = 1
     logging.info("number of evaluation_data -- batch_size_eval = %d -- %d" % (n_eval_data, batch_size_utt_eval))
-    dataloader_eval = DataLoader(dataset_eval, batch_size=batch_size_utt_eval, shuffle=False, num_workers=args.n_workers)
+    if args.eval_mode == "trainer":
+        # fast proxy, the full evaluation of the checkpoints is done by the evaluator process
+        dataset_eval = Subset(dataset_eval, eval_subset_indices(n_eval_data, args.n_eval_subset))
+        logging.info("number of evaluation_data of trainer -- %d" % (len(dataset_eval)))
+    dataloader_eval = DataLoader(dataset_eval, batch_size=batch_size_utt_eval, sampler=ShardedSampler(dataset_eval, shuffle=False),
+                    num_workers=args.n_workers,
+                    persistent_workers=persistent_workers)
     #generator_eval = eval_generator(dataloader_eval, device, args.batch_size, limit_count=1)
     generator_eval = eval_generator(dataloader_eval, device, args.batch_size, limit_count=None)
 
-    writer = SummaryWriter(args.expdir)
+    if rank == 0:
+        writer = SummaryWriter(args.expdir)
+    else:
+        writer = None
+    profiler = StepProfiler(device, writer=writer, enabled=args.profile, log_interval=args.log_interval_steps,
+                    trace_dir=os.path.join(args.expdir, "profile"), trace_start=args.profile_trace_start,
+                        trace_steps=args.profile_trace_steps)
+    profiler.time_modules({
+        "encoder_melsp": model_encoder_melsp,
+        "decoder_melsp": model_decoder_melsp,
+        "encoder_excit": model_encoder_excit,
+        "decoder_excit": model_decoder_excit,
+        "spkidtr": model_spkidtr,
+        "classifier": model_classifier})
+    profiler.time_modules({
+        "loss_gauss": criterion_gauss,
+        "loss_ce": criterion_ce,
+        "loss_l1": criterion_l1,
+        "loss_l2": criterion_l2})
     total_train_loss = defaultdict(list)
     total_eval_loss = defaultdict(list)
 
@@ -861,6 +888,13 @@ def main():
     logging.info(args.interval)
     logging.info(densities)
     idx_stage = 0
+    sparse_models = ["encoder_melsp", "encoder_excit", "decoder_melsp"]
+    sparsity_encoder_melsp = BlockSparsity(model_encoder_melsp, t_starts, t_ends, densities, args.interval,
+        extra_densities=parse_extra_densities(args.sparse_extra, "encoder_melsp", sparse_models))
+    sparsity_encoder_excit = BlockSparsity(model_encoder_excit, t_starts, t_ends, densities, args.interval,
+        extra_densities=parse_extra_densities(args.sparse_extra, "encoder_excit", sparse_models))
+    sparsity_decoder_melsp = BlockSparsity(model_decoder_melsp, t_starts, t_ends, densities, args.interval,
+        extra_densities=parse_extra_densities(args.sparse_extra, "decoder_melsp", sparse_models))
 
     # train
     logging.info(f'n_cyc: {args.n_half_cyc}')
@@ -1199,61 +1233,75 @@ def main():
     logging.info("Training data")
     while True:
         start = time.time()
-        batch_feat, batch_sc, batch_sc_cv_data, batch_feat_cv_data, c_idx, utt_idx, featfile, \
-            f_bs, f_ss, flens, n_batch_utt, del_index_utt, max_flen, spk_cv, idx_select, idx_select_full, flens_acc = next(generator)
+        if args.eval_mode == "evaluator":
+            # wait for the next snapshot of the training process, and evaluate it as its epoch summary
+            checkpoint_path = snapshot_queue.next()
+            if checkpoint_path is None:
+                break
+            snapshot_meta = load_snapshot(checkpoint_path, {"model_encoder_melsp": model_encoder_melsp, "model_decoder_melsp": model_decoder_melsp,
+                "model_encoder_excit": model_encoder_excit, "model_decoder_excit": model_decoder_excit,
+                "model_spkidtr": model_spkidtr, "model_classifier": model_classifier}, device)
+            iter_idx = snapshot_meta["iter_idx"]
+            epoch_idx = snapshot_meta["iterations"] - 1
+            c_idx = -1
+        else:
+            batch_feat, batch_sc, batch_sc_cv_data, batch_feat_cv_data, c_idx, utt_idx, featfile, \
+                f_bs, f_ss, flens, n_batch_utt, del_index_utt, max_flen, spk_cv, idx_select, idx_select_full, flens_acc = next(generator)
+        profiler.lap("data")
         if c_idx < 0: # summarize epoch
             # save current epoch model
             numpy_random_state = np.random.get_state()
             torch_random_state = torch.get_rng_state()
-            # report current epoch
-            text_log = "(EPOCH:%d) average optimization loss = %.6f (+- %.6f) ; " % (epoch_idx + 1, np.mean(loss_sc_feat_in), np.std(loss_sc_feat_in))
-            for i in range(args.n_half_cyc):
-                if i % 2 == 0:
-                    if i == 0:
-                        text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; " % (i+1,
-                            np.mean(loss_elbo[i]), np.std(loss_elbo[i]), np.mean(loss_px[i]), np.std(loss_px[i]),
-                            np.mean(loss_qy_py[i]), np.std(loss_qy_py[i]), np.mean(loss_qy_py_err[i]), np.std(loss_qy_py_err[i]), np.mean(loss_qz_pz[i]), np.std(loss_qz_pz[i]),
-                            np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]))
+            if args.eval_mode != "evaluator": # no training steps in the evaluator
+                # report current epoch
+                text_log = "(EPOCH:%d) average optimization loss = %.6f (+- %.6f) ; " % (epoch_idx + 1, np.mean(loss_sc_feat_in), np.std(loss_sc_feat_in))
+                for i in range(args.n_half_cyc):
+                    if i % 2 == 0:
+                        if i == 0:
+                            text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; " % (i+1,
+                                np.mean(loss_elbo[i]), np.std(loss_elbo[i]), np.mean(loss_px[i]), np.std(loss_px[i]),
+                                np.mean(loss_qy_py[i]), np.std(loss_qy_py[i]), np.mean(loss_qy_py_err[i]), np.std(loss_qy_py_err[i]), np.mean(loss_qz_pz[i]), np.std(loss_qz_pz[i]),
+                                np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]))
+                        else:
+                            text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; " % (i+1,
+                                np.mean(loss_elbo[i]), np.std(loss_elbo[i]), np.mean(loss_px[i]), np.std(loss_px[i]),
+                                np.mean(loss_lat_cossim[i]), np.std(loss_lat_cossim[i]), np.mean(loss_lat_rmse[i]), np.std(loss_lat_rmse[i]),
+                                np.mean(loss_qy_py[i]), np.std(loss_qy_py[i]), np.mean(loss_qy_py_err[i]), np.std(loss_qy_py_err[i]), np.mean(loss_qz_pz[i]), np.std(loss_qz_pz[i]),
+                                np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]))
+                        if args.n_half_cyc == 1:
+                            text_log += "%.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " % (
+                                np.mean(loss_qy_py[i+1]), np.std(loss_qy_py[i+1]), np.mean(loss_qy_py_err[i+1]), np.std(loss_qy_py_err[i+1]), np.mean(loss_qz_pz[i+1]), np.std(loss_qz_pz[i+1]),
+                                np.mean(loss_qy_py_e[i+1]), np.std(loss_qy_py_e[i+1]), np.mean(loss_qy_py_err_e[i+1]), np.std(loss_qy_py_err_e[i+1]), np.mean(loss_qz_pz_e[i+1]), np.std(loss_qz_pz_e[i+1]))
+                        text_log += "%.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " \
+                                "%.6f (+- %.6f) %.6f (+- %.6f) , " \
+                                "%.6f (+- %.6f) %.6f (+- %.6f) %.6f (+- %.6f) dB ; " \
+                                "%.6f (+- %.6f) %% %.6f (+- %.6f) %% , %.6f (+- %.6f) Hz %.6f (+- %.6f) Hz , " \
+                                "%.6f (+- %.6f) %% %.6f (+- %.6f) %% , %.6f (+- %.6f) dB %.6f (+- %.6f) dB ;; " % (
+                            np.mean(loss_sc_z[i]), np.std(loss_sc_z[i]),
+                            np.mean(loss_sc_feat[i]), np.std(loss_sc_feat[i]), np.mean(loss_sc_feat_cv[i//2]), np.std(loss_sc_feat_cv[i//2]),
+                            np.mean(loss_gauss[i]), np.std(loss_gauss[i]), np.mean(loss_gauss_cv[i//2]), np.std(loss_gauss_cv[i//2]),
+                            np.mean(loss_melsp[i]), np.std(loss_melsp[i]), np.mean(loss_melsp_cv[i//2]), np.std(loss_melsp_cv[i//2]), np.mean(loss_melsp_dB[i]), np.std(loss_melsp_dB[i]),
+                            np.mean(loss_uv[i]), np.std(loss_uv[i]), np.mean(loss_uv_cv[i//2]), np.std(loss_uv_cv[i//2]),
+                            np.mean(loss_f0[i]), np.std(loss_f0[i]), np.mean(loss_f0_cv[i//2]), np.std(loss_f0_cv[i//2]),
+                            np.mean(loss_uvcap[i]), np.std(loss_uvcap[i]), np.mean(loss_uvcap_cv[i//2]), np.std(loss_uvcap_cv[i//2]),
+                            np.mean(loss_cap[i]), np.std(loss_cap[i]), np.mean(loss_cap_cv[i//2]), np.std(loss_cap_cv[i//2]))
                     else:
-                        text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; " % (i+1,
+                        text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; "\
+                            "%.6f (+- %.6f) , %.6f (+- %.6f) ; " \
+                            "%.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) dB ; " \
+                            "%.6f (+- %.6f) %% %.6f (+- %.6f) Hz , " \
+                            "%.6f (+- %.6f) %% %.6f (+- %.6f) dB ;; " % (i+1,
                             np.mean(loss_elbo[i]), np.std(loss_elbo[i]), np.mean(loss_px[i]), np.std(loss_px[i]),
                             np.mean(loss_lat_cossim[i]), np.std(loss_lat_cossim[i]), np.mean(loss_lat_rmse[i]), np.std(loss_lat_rmse[i]),
                             np.mean(loss_qy_py[i]), np.std(loss_qy_py[i]), np.mean(loss_qy_py_err[i]), np.std(loss_qy_py_err[i]), np.mean(loss_qz_pz[i]), np.std(loss_qz_pz[i]),
-                            np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]))
-                    if args.n_half_cyc == 1:
-                        text_log += "%.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " % (
-                            np.mean(loss_qy_py[i+1]), np.std(loss_qy_py[i+1]), np.mean(loss_qy_py_err[i+1]), np.std(loss_qy_py_err[i+1]), np.mean(loss_qz_pz[i+1]), np.std(loss_qz_pz[i+1]),
-                            np.mean(loss_qy_py_e[i+1]), np.std(loss_qy_py_e[i+1]), np.mean(loss_qy_py_err_e[i+1]), np.std(loss_qy_py_err_e[i+1]), np.mean(loss_qz_pz_e[i+1]), np.std(loss_qz_pz_e[i+1]))
-                    text_log += "%.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) ; " \
-                            "%.6f (+- %.6f) %.6f (+- %.6f) , " \
-                            "%.6f (+- %.6f) %.6f (+- %.6f) %.6f (+- %.6f) dB ; " \
-                            "%.6f (+- %.6f) %% %.6f (+- %.6f) %% , %.6f (+- %.6f) Hz %.6f (+- %.6f) Hz , " \
-                            "%.6f (+- %.6f) %% %.6f (+- %.6f) %% , %.6f (+- %.6f) dB %.6f (+- %.6f) dB ;; " % (
-                        np.mean(loss_sc_z[i]), np.std(loss_sc_z[i]),
-                        np.mean(loss_sc_feat[i]), np.std(loss_sc_feat[i]), np.mean(loss_sc_feat_cv[i//2]), np.std(loss_sc_feat_cv[i//2]),
-                        np.mean(loss_gauss[i]), np.std(loss_gauss[i]), np.mean(loss_gauss_cv[i//2]), np.std(loss_gauss_cv[i//2]),
-                        np.mean(loss_melsp[i]), np.std(loss_melsp[i]), np.mean(loss_melsp_cv[i//2]), np.std(loss_melsp_cv[i//2]), np.mean(loss_melsp_dB[i]), np.std(loss_melsp_dB[i]),
-                        np.mean(loss_uv[i]), np.std(loss_uv[i]), np.mean(loss_uv_cv[i//2]), np.std(loss_uv_cv[i//2]),
-                        np.mean(loss_f0[i]), np.std(loss_f0[i]), np.mean(loss_f0_cv[i//2]), np.std(loss_f0_cv[i//2]),
-                        np.mean(loss_uvcap[i]), np.std(loss_uvcap[i]), np.mean(loss_uvcap_cv[i//2]), np.std(loss_uvcap_cv[i//2]),
-                        np.mean(loss_cap[i]), np.std(loss_cap[i]), np.mean(loss_cap_cv[i//2]), np.std(loss_cap_cv[i//2]))
-                else:
-                    text_log += "[%ld] %.6f (+- %.6f) , %.6f (+- %.6f) ; %.6f (+- %.6f) %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) %% %.6f (+- %.6f) ; "\
-                        "%.6f (+- %.6f) , %.6f (+- %.6f) ; " \
-                        "%.6f (+- %.6f) , %.6f (+- %.6f) %.6f (+- %.6f) dB ; " \
-                        "%.6f (+- %.6f) %% %.6f (+- %.6f) Hz , " \
-                        "%.6f (+- %.6f) %% %.6f (+- %.6f) dB ;; " % (i+1,
-                        np.mean(loss_elbo[i]), np.std(loss_elbo[i]), np.mean(loss_px[i]), np.std(loss_px[i]),
-                        np.mean(loss_lat_cossim[i]), np.std(loss_lat_cossim[i]), np.mean(loss_lat_rmse[i]), np.std(loss_lat_rmse[i]),
-                        np.mean(loss_qy_py[i]), np.std(loss_qy_py[i]), np.mean(loss_qy_py_err[i]), np.std(loss_qy_py_err[i]), np.mean(loss_qz_pz[i]), np.std(loss_qz_pz[i]),
-                        np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]), 
-                        np.mean(loss_sc_z[i]), np.std(loss_sc_z[i]), np.mean(loss_sc_feat[i]), np.std(loss_sc_feat[i]),
-                        np.mean(loss_gauss[i]), np.std(loss_gauss[i]), np.mean(loss_melsp[i]), np.std(loss_melsp[i]), np.mean(loss_melsp_dB[i]), np.std(loss_melsp_dB[i]),
-                        np.mean(loss_uv[i]), np.std(loss_uv[i]), np.mean(loss_f0[i]), np.std(loss_f0[i]),
-                        np.mean(loss_uvcap[i]), np.std(loss_uvcap[i]), np.mean(loss_cap[i]), np.std(loss_cap[i]))
-            logging.info("%s (%.3f min., %.3f sec / batch)" % (text_log, total / 60.0, total / iter_count))
-            logging.info("estimated time until max. steps = {0.days:02}:{0.hours:02}:{0.minutes:02}:"\
-            "{0.seconds:02}".format(relativedelta(seconds=int((args.step_count - (iter_idx + 1)) * total))))
+                            np.mean(loss_qy_py_e[i]), np.std(loss_qy_py_e[i]), np.mean(loss_qy_py_err_e[i]), np.std(loss_qy_py_err_e[i]), np.mean(loss_qz_pz_e[i]), np.std(loss_qz_pz_e[i]), 
+                            np.mean(loss_sc_z[i]), np.std(loss_sc_z[i]), np.mean(loss_sc_feat[i]), np.std(loss_sc_feat[i]),
+                            np.mean(loss_gauss[i]), np.std(loss_gauss[i]), np.mean(loss_melsp[i]), np.std(loss_melsp[i]), np.mean(loss_melsp_dB[i]), np.std(loss_melsp_dB[i]),
+                            np.mean(loss_uv[i]), np.std(loss_uv[i]), np.mean(loss_f0[i]), np.std(loss_f0[i]),
+                            np.mean(loss_uvcap[i]), np.std(loss_uvcap[i]), np.mean(loss_cap[i]), np.std(loss_cap[i]))
+                logging.info("%s (%.3f min., %.3f sec / batch)" % (text_log, total / 60.0, total / max(iter_count, 1)))
+                logging.info("estimated time until max. steps = {0.days:02}:{0.hours:02}:{0.minutes:02}:"\
+                "{0.seconds:02}".format(relativedelta(seconds=int((args.step_count - (iter_idx + 1)) * total))))
             # compute loss in evaluation data
             total = 0
             iter_count = 0
@@ -1329,7 +1377,7 @@ def main():
                         batch_sc_cv_data, batch_feat_cv_data, c_idx, utt_idx, featfile, \
                         f_bs, f_ss, flens, n_batch_utt, del_index_utt, max_flen, spk_cv, src_trg_flag, \
                             spcidx_src, spcidx_src_trg, flens_spc_src, flens_spc_src_trg, \
-                                batch_feat_data_full, batch_sc_data_full, batch_sc_cv_data_full, \
+                                batch_feat_data_full, batch_sc_data_full, batch_sc_cv_data_full, flens_full, flens_trg, \
                                     idx_select, idx_select_full = next(generator_eval)
                     if c_idx < 0:
                         break
@@ -1427,39 +1475,23 @@ def main():
                             j = i+1
                             if len(del_index_utt) > 0:
                                 if i == 0:
-                                    h_feat_in_sc = torch.FloatTensor(np.delete(h_feat_in_sc.cpu().data.numpy(),
-                                                                    del_index_utt, axis=1)).to(device)
-                                h_z[i] = torch.FloatTensor(np.delete(h_z[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z_e[i] = torch.FloatTensor(np.delete(h_z_e[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z_sc[i] = torch.FloatTensor(np.delete(h_z_sc[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_lf0[i] = torch.FloatTensor(np.delete(h_lf0[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_lf0_cv[i_cv] = torch.FloatTensor(np.delete(h_lf0_cv[i_cv].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_melsp[i] = torch.FloatTensor(np.delete(h_melsp[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_melsp_cv[i_cv] = torch.FloatTensor(np.delete(h_melsp_cv[i_cv].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_feat_sc[i] = torch.FloatTensor(np.delete(h_feat_sc[i].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_feat_cv_sc[i_cv] = torch.FloatTensor(np.delete(h_feat_cv_sc[i_cv].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z[j] = torch.FloatTensor(np.delete(h_z[j].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
-                                h_z_e[j] = torch.FloatTensor(np.delete(h_z_e[j].cpu().data.numpy(),
-                                                                del_index_utt, axis=1)).to(device)
+                                    h_feat_in_sc = index_delete(h_feat_in_sc, del_index_utt, dim=1)
+                                h_z[i] = index_delete(h_z[i], del_index_utt, dim=1)
+                                h_z_e[i] = index_delete(h_z_e[i], del_index_utt, dim=1)
+                                h_z_sc[i] = index_delete(h_z_sc[i], del_index_utt, dim=1)
+                                h_lf0[i] = index_delete(h_lf0[i], del_index_utt, dim=1)
+                                h_lf0_cv[i_cv] = index_delete(h_lf0_cv[i_cv], del_index_utt, dim=1)
+                                h_melsp[i] = index_delete(h_melsp[i], del_index_utt, dim=1)
+                                h_melsp_cv[i_cv] = index_delete(h_melsp_cv[i_cv], del_index_utt, dim=1)
+                                h_feat_sc[i] = index_delete(h_feat_sc[i], del_index_utt, dim=1)
+                                h_feat_cv_sc[i_cv] = index_delete(h_feat_cv_sc[i_cv], del_index_utt, dim=1)
+                                h_z[j] = index_delete(h_z[j], del_index_utt, dim=1)
+                                h_z_e[j] = index_delete(h_z_e[j], del_index_utt, dim=1)
                                 if n_half_cyc_eval > 1:
-                                    h_z_sc[j] = torch.FloatTensor(np.delete(h_z_sc[j].cpu().data.numpy(),
-                                                                    del_index_utt, axis=1)).to(device)
-                                    h_lf0[j] = torch.FloatTensor(np.delete(h_lf0[j].cpu().data.numpy(),
-                                                                    del_index_utt, axis=1)).to(device)
-                                    h_melsp[j] = torch.FloatTensor(np.delete(h_melsp[j].cpu().data.numpy(),
-                                                                    del_index_utt, axis=1)).to(device)
-                                    h_feat_sc[j] = torch.FloatTensor(np.delete(h_feat_sc[j].cpu().data.numpy(),
-                                                                    del_index_utt, axis=1)).to(device)
+                                    h_z_sc[j] = index_delete(h_z_sc[j], del_index_utt, dim=1)
+                                    h_lf0[j] = index_delete(h_lf0[j], del_index_utt, dim=1)
+                                    h_melsp[j] = index_delete(h_melsp[j], del_index_utt, dim=1)
+                                    h_feat_sc[j] = index_delete(h_feat_sc[j], del_index_utt, dim=1)
                             ## latent infer.
                             if i > 0:
                                 idx_in += 1
@@ -1477,13 +1509,14 @@ def main():
                                 batch_feat_in_sc, h_feat_in_sc = model_classifier(feat=batch_melsp, h=h_feat_in_sc)
                             ## speaker embeddings
                             idx_in += 1
-                            weight_in, spk_code_in = model_spkidtr(batch_sc_in[idx_in])
-                            weight_cv_in, spk_cv_code_in = model_spkidtr(batch_sc_cv_in[i_cv_in])
+                            weight_in, spk_code_in = model_spkidtr(torch.cat((batch_sc_in[idx_in], batch_sc_cv_in[i_cv_in]), 0))
+                            weight_in, weight_cv_in = torch.chunk(weight_in, 2, 0)
+                            spk_code_in, spk_cv_code_in = torch.chunk(spk_code_in, 2, 0)
                             ## excit reconstruction & conversion
                             batch_lf0_rec[i], h_lf0[i] \
-                                    = model_decoder_excit(z_e[i], y=spk_code_in, outpad_right=outpad_rights[idx_in], h=h_lf0[i])
-                            batch_lf0_cv[i_cv], h_lf0_cv[i_cv] \
-                                    = model_decoder_excit(z_e[i], y=spk_cv_code_in, outpad_right=outpad_rights[idx_in], h=h_lf0_cv[i_cv])
+                                    = model_decoder_excit(z_e[i].repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0), outpad_right=outpad_rights[idx_in], h=torch.cat((h_lf0[i], h_lf0_cv[i_cv]), 1))
+                            batch_lf0_rec[i], batch_lf0_cv[i_cv] = torch.chunk(batch_lf0_rec[i], 2, 0)
+                            h_lf0[i], h_lf0_cv[i_cv] = torch.chunk(h_lf0[i], 2, 1)
                             z_cat = torch.cat((z_e[i], z[i]), 2)
                             feat_len = qy_logits[i].shape[1]
                             idx_in_1 = idx_in-1
@@ -1505,10 +1538,11 @@ def main():
                                 z_cat = z_cat[:,lf0_pad_left:]
                                 spk_code_in = spk_code_in[:,lf0_pad_left:]
                                 spk_cv_code_in = spk_cv_code_in[:,lf0_pad_left:]
-                            batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat, y=spk_code_in,
-                                                e=batch_lf0_rec[i][:,:,:args.excit_dim], outpad_right=outpad_rights[idx_in], h=h_melsp[i])
-                            batch_pdf_cv[i_cv], batch_melsp_cv[i_cv], h_melsp_cv[i_cv] = model_decoder_melsp(z_cat, y=spk_cv_code_in,
-                                                e=batch_lf0_cv[i_cv][:,:,:args.excit_dim], outpad_right=outpad_rights[idx_in], h=h_melsp_cv[i_cv])
+                            batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat.repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0),
+                                                e=torch.cat((batch_lf0_rec[i][:,:,:args.excit_dim], batch_lf0_cv[i_cv][:,:,:args.excit_dim]), 0), outpad_right=outpad_rights[idx_in], h=torch.cat((h_melsp[i], h_melsp_cv[i_cv]), 1))
+                            batch_pdf_rec[i], batch_pdf_cv[i_cv] = torch.chunk(batch_pdf_rec[i], 2, 0)
+                            batch_melsp_rec[i], batch_melsp_cv[i_cv] = torch.chunk(batch_melsp_rec[i], 2, 0)
+                            h_melsp[i], h_melsp_cv[i_cv] = torch.chunk(h_melsp[i], 2, 1)
                             idx_in_1 = idx_in-1
                             feat_len_e = batch_lf0_rec[i].shape[1]
                             batch_lf0_rec[i] = batch_lf0_rec[i][:,outpad_lefts[idx_in_1]:feat_len_e-outpad_rights[idx_in_1]]
@@ -1524,8 +1558,9 @@ def main():
                             batch_melsp_rec[i] = batch_melsp_rec[i][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                             batch_pdf_cv[i_cv] = batch_pdf_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                             batch_melsp_cv[i_cv] = batch_melsp_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
-                            batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=batch_melsp_rec[i], h=h_feat_sc[i])
-                            batch_feat_cv_sc[i_cv], h_feat_cv_sc[i_cv] = model_classifier(feat=batch_melsp_cv[i_cv], h=h_feat_cv_sc[i_cv])
+                            batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=torch.cat((batch_melsp_rec[i], batch_melsp_cv[i_cv]), 0), h=torch.cat((h_feat_sc[i], h_feat_cv_sc[i_cv]), 1))
+                            batch_feat_rec_sc[i], batch_feat_cv_sc[i_cv] = torch.chunk(batch_feat_rec_sc[i], 2, 0)
+                            h_feat_sc[i], h_feat_cv_sc[i_cv] = torch.chunk(h_feat_sc[i], 2, 1)
                             if n_half_cyc_eval > 1:
                                 ## speaker embeddings
                                 idx_in += 1
@@ -1575,15 +1610,17 @@ def main():
                                 pair_exist = True
                                 break
                         batch_melsp_data_full = F.pad(batch_melsp_data_full.transpose(1,2), (first_pad_left_eval_utt,first_pad_right_eval_utt), "replicate").transpose(1,2)
-                        _, _, trj_lat_src, _ = model_encoder_melsp(batch_melsp_data_full, sampling=False)
-                        _, _, trj_lat_src_e, _ = model_encoder_excit(batch_melsp_data_full, sampling=False)
+                        # valid frames of the encoder outputs of the mixed-length batch, i.e., with the receptive fields of the decoders
+                        flens_full_enc = flens_full + first_pad_left_eval_utt_dec + first_pad_right_eval_utt_dec
+                        _, _, trj_lat_src, _ = model_encoder_melsp(batch_melsp_data_full, sampling=False, lengths=flens_full_enc)
+                        _, _, trj_lat_src_e, _ = model_encoder_excit(batch_melsp_data_full, sampling=False, lengths=flens_full_enc)
                         batch_sc_data_full = F.pad(batch_sc_data_full.unsqueeze(1).float(), (first_pad_left_eval_utt_dec,first_pad_right_eval_utt_dec), "replicate").squeeze(1).long()
                         batch_sc_cv_data_full = F.pad(batch_sc_cv_data_full.unsqueeze(1).float(), (first_pad_left_eval_utt_dec,first_pad_right_eval_utt_dec), "replicate").squeeze(1).long()
                         z_cat = torch.cat((trj_lat_src_e, trj_lat_src), 2)
-                        _, trj_spk_code = model_spkidtr(batch_sc_data_full)
-                        _, trj_spk_cv_code = model_spkidtr(batch_sc_cv_data_full)
-                        trj_src_src_uvlf0, _ = model_decoder_excit(trj_lat_src_e, y=trj_spk_code)
-                        trj_src_trg_uvlf0, _ = model_decoder_excit(trj_lat_src_e, y=trj_spk_cv_code)
+                        _, trj_spk_code = model_spkidtr(torch.cat((batch_sc_data_full, batch_sc_cv_data_full), 0))
+                        trj_spk_code, trj_spk_cv_code = torch.chunk(trj_spk_code, 2, 0)
+                        trj_src_src_uvlf0, _ = model_decoder_excit(trj_lat_src_e, y=trj_spk_code, lengths=flens_full+dec_pad_left+dec_pad_right)
+                        trj_src_trg_uvlf0, _ = model_decoder_excit(trj_lat_src_e, y=trj_spk_cv_code, lengths=flens_full+dec_pad_left+dec_pad_right)
                         if lf0_pad_right > 0:
                             z_cat = z_cat[:,lf0_pad_left:-lf0_pad_right]
                             trj_spk_code = trj_spk_code[:,lf0_pad_left:-lf0_pad_right]
@@ -1592,8 +1629,8 @@ def main():
                             z_cat = z_cat[:,lf0_pad_left:]
                             trj_spk_code = trj_spk_code[:,lf0_pad_left:]
                             trj_spk_cv_code = trj_spk_cv_code[:,lf0_pad_left:]
-                        _, trj_src_src, _ = model_decoder_melsp(z_cat, y=trj_spk_code, e=trj_src_src_uvlf0[:,:,:args.excit_dim])
-                        _, trj_src_trg, _ = model_decoder_melsp(z_cat, y=trj_spk_cv_code, e=trj_src_trg_uvlf0[:,:,:args.excit_dim])
+                        _, trj_src_src, _ = model_decoder_melsp(z_cat, y=trj_spk_code, e=trj_src_src_uvlf0[:,:,:args.excit_dim], lengths=flens_full)
+                        _, trj_src_trg, _ = model_decoder_melsp(z_cat, y=trj_spk_cv_code, e=trj_src_trg_uvlf0[:,:,:args.excit_dim], lengths=flens_full)
 
                         for k in range(n_batch_utt):
                             spk_src = os.path.basename(os.path.dirname(featfile[k]))
@@ -1612,83 +1649,21 @@ def main():
                                 trj_lat_src = z_cat[:,dec_pad_left:]
                                 trj_src_trg_uvlf0 = trj_src_trg_uvlf0[:,dec_pad_left:]
                             batch_melsp_trg_data_in = F.pad(batch_melsp_trg_data.transpose(1,2), (enc_pad_left,enc_pad_right), "replicate").transpose(1,2)
-                            _, _, trj_lat_trg, _ = model_encoder_melsp(batch_melsp_trg_data_in,sampling=False)
-                            _, _, trj_lat_trg_e, _ = model_encoder_excit(batch_melsp_trg_data_in, sampling=False)
+                            _, _, trj_lat_trg, _ = model_encoder_melsp(batch_melsp_trg_data_in, sampling=False, lengths=flens_trg)
+                            _, _, trj_lat_trg_e, _ = model_encoder_excit(batch_melsp_trg_data_in, sampling=False, lengths=flens_trg)
                             trj_lat_trg = torch.cat((trj_lat_trg_e, trj_lat_trg), 2)
 
                             for k in range(n_batch_utt):
                                 if src_trg_flag[k]:
-                                    # spcidx lat
-                                    trj_lat_src_ = np.array(torch.index_select(trj_lat_src[k],0,spcidx_src[k,:flens_spc_src[k]]).cpu().data.numpy(), dtype=np.float64)
-                                    trj_lat_trg_ = np.array(torch.index_select(trj_lat_trg[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]]).cpu().data.numpy(), dtype=np.float64)
-                                    # spcidx melsp, excit, trg
-                                    trj_src_trg_ = (torch.exp(torch.index_select(trj_src_trg[k],0,spcidx_src[k,:flens_spc_src[k]]))-1)/10000
-                                    trj_src_trg_uvlf0_ = torch.index_select(trj_src_trg_uvlf0[k],0,spcidx_src[k,:flens_spc_src[k]])
-                                    trj_trg_ = (torch.exp(torch.index_select(batch_melsp_trg_data[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]]))-1)/10000
-                                    trj_trg_uvlf0_ = torch.index_select(batch_excit_trg_data[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]])
-                                    # excit feats
-                                    trj_src_trg_uv = trj_src_trg_uvlf0_[:,0]
-                                    trj_src_trg_f0 = torch.exp(trj_src_trg_uvlf0_[:,1])
-                                    trj_src_trg_uvcap = trj_src_trg_uvlf0_[:,2]
-                                    trj_src_trg_cap = -torch.exp(trj_src_trg_uvlf0_[:,3:])
-                                    trj_trg_uv = trj_trg_uvlf0_[:,0]
-                                    trj_trg_f0 = torch.exp(trj_trg_uvlf0_[:,1])
-                                    trj_trg_uvcap = trj_trg_uvlf0_[:,2]
-                                    trj_trg_cap = -torch.exp(trj_trg_uvlf0_[:,3:])
-                                    # spec dtw
-                                    # MCD of spectral
-                                    _, twf_melsp, _, _ = dtw.dtw_org_to_trg(\
-                                        np.array(trj_src_trg_.cpu().data.numpy(), dtype=np.float64), \
-                                        np.array(trj_trg_.cpu().data.numpy(), dtype=np.float64), mcd=-1)
-                                    twf_melsp = torch.LongTensor(twf_melsp[:,0]).cuda()
-                                    batch_melsp_dB_src_trg = torch.mean(torch.sqrt(torch.mean((20*(torch.log10(torch.clamp(torch.index_select(trj_src_trg_,0,twf_melsp), min=1e-16))
-                                                                -torch.log10(torch.clamp(trj_trg_, min=1e-16))))**2, -1))).item()
-                                    # excit dtw
-                                    trj_src_trg_uv = torch.index_select(trj_src_trg_uv,0,twf_melsp)
-                                    trj_src_trg_f0 = torch.index_select(trj_src_trg_f0,0,twf_melsp)
-                                    batch_uv_src_trg = torch.mean(100*torch.abs(trj_src_trg_uv-trj_trg_uv)).item()
-                                    batch_f0_src_trg = torch.sqrt(torch.mean((trj_src_trg_f0-trj_trg_f0)**2)).item()
-                                    trj_src_trg_uvcap = torch.index_select(trj_src_trg_uvcap,0,twf_melsp)
-                                    trj_src_trg_cap = torch.index_select(trj_src_trg_cap,0,twf_melsp)
-                                    batch_uvcap_src_trg = torch.mean(100*torch.abs(trj_src_trg_uvcap-trj_trg_uvcap)).item()
-                                    batch_cap_src_trg = torch.mean(torch.sum(torch.abs(trj_src_trg_cap-trj_trg_cap), -1)).item()
-                                    # time-warping of latent source-to-target for RMSE
-                                    aligned_lat_srctrg1, _, _, _ = dtw.dtw_org_to_trg(trj_lat_src_, trj_lat_trg_)
-                                    batch_lat_dist_srctrg1 = np.mean(np.sqrt(np.mean((\
-                                        aligned_lat_srctrg1-trj_lat_trg_)**2, axis=0)))
-                                    # Cos-sim of latent source-to-target
-                                    _, _, batch_lat_cdist_srctrg1, _ = dtw.dtw_org_to_trg(\
-                                        trj_lat_trg_, trj_lat_src_, mcd=0)
-                                    # time-warping of latent target-to-source for RMSE
-                                    aligned_lat_srctrg2, _, _, _ = dtw.dtw_org_to_trg(trj_lat_trg_, trj_lat_src_)
-                                    batch_lat_dist_srctrg2 = np.mean(np.sqrt(np.mean((\
-                                        aligned_lat_srctrg2-trj_lat_src_)**2, axis=0)))
-                                    # Cos-sim of latent target-to-source
-                                    _, _, batch_lat_cdist_srctrg2, _ = dtw.dtw_org_to_trg(\
-                                        trj_lat_src_, trj_lat_trg_, mcd=0)
-                                    # RMSE
-                                    batch_lat_dist_rmse = (batch_lat_dist_srctrg1+batch_lat_dist_srctrg2)/2
-                                    # Cos-sim
-                                    batch_lat_dist_cossim = (batch_lat_cdist_srctrg1+batch_lat_cdist_srctrg2)/2
-                                    loss_melsp_dB_src_trg.append(batch_melsp_dB_src_trg)
-                                    loss_uv_src_trg.append(batch_uv_src_trg)
-                                    loss_f0_src_trg.append(batch_f0_src_trg)
-                                    loss_uvcap_src_trg.append(batch_uvcap_src_trg)
-                                    loss_cap_src_trg.append(batch_cap_src_trg)
-                                    loss_lat_dist_rmse.append(batch_lat_dist_rmse)
-                                    loss_lat_dist_cossim.append(batch_lat_dist_cossim)
-                                    total_eval_loss["eval/loss_melsp_dB_src_trg"].append(batch_melsp_dB_src_trg)
-                                    total_eval_loss["eval/loss_uv_src_trg"].append(batch_uv_src_trg)
-                                    total_eval_loss["eval/loss_f0_src_trg"].append(batch_f0_src_trg)
-                                    total_eval_loss["eval/loss_uvcap_src_trg"].append(batch_uvcap_src_trg)
-                                    total_eval_loss["eval/loss_cap_src_trg"].append(batch_cap_src_trg)
-                                    total_eval_loss["eval/loss_lat_dist_rmse"].append(batch_lat_dist_rmse)
-                                    total_eval_loss["eval/loss_lat_dist_cossim"].append(batch_lat_dist_cossim)
-                                    logging.info('acc cv %s %s %.3f dB %.3f %% %.3f Hz ' \
-                                    '%.3f %% %.3f dB %.3f %.3f' % (featfile[k],
-                                        spk_cv[k], batch_melsp_dB_src_trg,
-                                            batch_uv_src_trg, batch_f0_src_trg, batch_uvcap_src_trg,
-                                            batch_cap_src_trg, batch_lat_dist_rmse, batch_lat_dist_cossim))
+                                    # spcidx lat, melsp, excit, trg; DTW-based metrics are computed by eval pool
+                                    trj_lat_src_ = torch.index_select(trj_lat_src[k],0,spcidx_src[k,:flens_spc_src[k]]).cpu().data.numpy()
+                                    trj_lat_trg_ = torch.index_select(trj_lat_trg[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]]).cpu().data.numpy()
+                                    trj_src_trg_ = ((torch.exp(torch.index_select(trj_src_trg[k],0,spcidx_src[k,:flens_spc_src[k]]))-1)/10000).cpu().data.numpy()
+                                    trj_trg_ = ((torch.exp(torch.index_select(batch_melsp_trg_data[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]]))-1)/10000).cpu().data.numpy()
+                                    trj_src_trg_uvlf0_ = torch.index_select(trj_src_trg_uvlf0[k],0,spcidx_src[k,:flens_spc_src[k]]).cpu().data.numpy()
+                                    trj_trg_uvlf0_ = torch.index_select(batch_excit_trg_data[k],0,spcidx_src_trg[k,:flens_spc_src_trg[k]]).cpu().data.numpy()
+                                    dtw_eval_pool.submit((featfile[k], spk_cv[k]), trj_src_trg_, trj_trg_, trj_lat_src_, trj_lat_trg_,
+                                        excit_cv=trj_src_trg_uvlf0_, excit_trg=trj_trg_uvlf0_)
                         idx_in = 0
                         i_cv_in = 0
                         for i in range(0,n_half_cyc_eval,2):
@@ -1711,13 +1686,14 @@ def main():
                                 batch_feat_in_sc, h_feat_in_sc = model_classifier(feat=batch_melsp)
                             ## speaker embeddings
                             idx_in += 1
-                            weight_in, spk_code_in = model_spkidtr(batch_sc_in[idx_in])
-                            weight_cv_in, spk_cv_code_in = model_spkidtr(batch_sc_cv_in[i_cv_in])
+                            weight_in, spk_code_in = model_spkidtr(torch.cat((batch_sc_in[idx_in], batch_sc_cv_in[i_cv_in]), 0))
+                            weight_in, weight_cv_in = torch.chunk(weight_in, 2, 0)
+                            spk_code_in, spk_cv_code_in = torch.chunk(spk_code_in, 2, 0)
                             ## excit reconstruction & conversion
                             batch_lf0_rec[i], h_lf0[i] \
-                                    = model_decoder_excit(z_e[i], y=spk_code_in, outpad_right=outpad_rights[idx_in])
-                            batch_lf0_cv[i_cv], h_lf0_cv[i_cv] \
-                                    = model_decoder_excit(z_e[i], y=spk_cv_code_in, outpad_right=outpad_rights[idx_in])
+                                    = model_decoder_excit(z_e[i].repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0), outpad_right=outpad_rights[idx_in])
+                            batch_lf0_rec[i], batch_lf0_cv[i_cv] = torch.chunk(batch_lf0_rec[i], 2, 0)
+                            h_lf0[i], h_lf0_cv[i_cv] = torch.chunk(h_lf0[i], 2, 1)
                             z_cat = torch.cat((z_e[i], z[i]), 2)
                             feat_len = qy_logits[i].shape[1]
                             idx_in_1 = idx_in-1
@@ -1739,10 +1715,11 @@ def main():
                                 z_cat = z_cat[:,lf0_pad_left:]
                                 spk_code_in = spk_code_in[:,lf0_pad_left:]
                                 spk_cv_code_in = spk_cv_code_in[:,lf0_pad_left:]
-                            batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat, y=spk_code_in,
-                                                e=batch_lf0_rec[i][:,:,:args.excit_dim], outpad_right=outpad_rights[idx_in])
-                            batch_pdf_cv[i_cv], batch_melsp_cv[i_cv], h_melsp_cv[i_cv] = model_decoder_melsp(z_cat, y=spk_cv_code_in,
-                                                e=batch_lf0_cv[i_cv][:,:,:args.excit_dim], outpad_right=outpad_rights[idx_in])
+                            batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat.repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0),
+                                                e=torch.cat((batch_lf0_rec[i][:,:,:args.excit_dim], batch_lf0_cv[i_cv][:,:,:args.excit_dim]), 0), outpad_right=outpad_rights[idx_in])
+                            batch_pdf_rec[i], batch_pdf_cv[i_cv] = torch.chunk(batch_pdf_rec[i], 2, 0)
+                            batch_melsp_rec[i], batch_melsp_cv[i_cv] = torch.chunk(batch_melsp_rec[i], 2, 0)
+                            h_melsp[i], h_melsp_cv[i_cv] = torch.chunk(h_melsp[i], 2, 1)
                             idx_in_1 = idx_in-1
                             feat_len_e = batch_lf0_rec[i].shape[1]
                             batch_lf0_rec[i] = batch_lf0_rec[i][:,outpad_lefts[idx_in_1]:feat_len_e-outpad_rights[idx_in_1]]
@@ -1758,8 +1735,9 @@ def main():
                             batch_melsp_rec[i] = batch_melsp_rec[i][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                             batch_pdf_cv[i_cv] = batch_pdf_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                             batch_melsp_cv[i_cv] = batch_melsp_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
-                            batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=batch_melsp_rec[i])
-                            batch_feat_cv_sc[i_cv], h_feat_cv_sc[i_cv] = model_classifier(feat=batch_melsp_cv[i_cv])
+                            batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=torch.cat((batch_melsp_rec[i], batch_melsp_cv[i_cv]), 0))
+                            batch_feat_rec_sc[i], batch_feat_cv_sc[i_cv] = torch.chunk(batch_feat_rec_sc[i], 2, 0)
+                            h_feat_sc[i], h_feat_cv_sc[i_cv] = torch.chunk(h_feat_sc[i], 2, 1)
                             if n_half_cyc_eval > 1:
                                 ## time-varying speaker conditionings
                                 idx_in += 1
@@ -2127,6 +2105,33 @@ def main():
                     logging.info("%s (%.3f sec)" % (text_log, time.time() - start))
                     iter_count += 1
                     total += time.time() - start
+            # DTW-based metrics of the converted / target pairs
+            for (featfile_k, spk_cv_k), metrics in dtw_eval_pool.collect():
+                loss_melsp_dB_src_trg.append(metrics["melsp_dB"])
+                loss_uv_src_trg.append(metrics["uv"])
+                loss_f0_src_trg.append(metrics["f0"])
+                loss_uvcap_src_trg.append(metrics["uvcap"])
+                loss_cap_src_trg.append(metrics["cap"])
+                loss_lat_dist_rmse.append(metrics["lat_dist_rmse"])
+                loss_lat_dist_cossim.append(metrics["lat_dist_cossim"])
+                total_eval_loss["eval/loss_melsp_dB_src_trg"].append(metrics["melsp_dB"])
+                total_eval_loss["eval/loss_uv_src_trg"].append(metrics["uv"])
+                total_eval_loss["eval/loss_f0_src_trg"].append(metrics["f0"])
+                total_eval_loss["eval/loss_uvcap_src_trg"].append(metrics["uvcap"])
+                total_eval_loss["eval/loss_cap_src_trg"].append(metrics["cap"])
+                total_eval_loss["eval/loss_lat_dist_rmse"].append(metrics["lat_dist_rmse"])
+                total_eval_loss["eval/loss_lat_dist_cossim"].append(metrics["lat_dist_cossim"])
+                logging.info('acc cv %s %s %.3f dB %.3f %% %.3f Hz ' \
+                '%.3f %% %.3f dB %.3f %.3f' % (featfile_k, spk_cv_k, metrics["melsp_dB"],
+                    metrics["uv"], metrics["f0"], metrics["uvcap"], metrics["cap"],
+                    metrics["lat_dist_rmse"], metrics["lat_dist_cossim"]))
+            # per-utterance development losses of all ranks
+            all_gather_lists_(total_eval_loss, loss_melsp_dB_src_trg, loss_uv_src_trg, loss_f0_src_trg, loss_uvcap_src_trg, loss_cap_src_trg,
+                loss_lat_dist_rmse, loss_lat_dist_cossim, gv_src_src, gv_src_trg, loss_sc_feat_in, loss_elbo,
+                loss_px, loss_lat_cossim, loss_lat_rmse, loss_qy_py, loss_qy_py_err, loss_qz_pz, loss_qy_py_e,
+                loss_qy_py_err_e, loss_qz_pz_e, loss_sc_z, loss_sc_feat, loss_sc_feat_cv, loss_uv, loss_f0,
+                loss_uvcap, loss_cap, loss_gauss, loss_melsp, loss_gauss_cv, loss_melsp_cv, loss_melsp_dB,
+                loss_uv_cv, loss_f0_cv, loss_uvcap_cv, loss_cap_cv)
             tmp_gv_1 = []
             tmp_gv_2 = []
             for j in range(n_spk):
@@ -2144,7 +2149,7 @@ def main():
             for key in total_eval_loss.keys():
                 total_eval_loss[key] = np.mean(total_eval_loss[key])
                 logging.info(f"(Steps: {iter_idx}) {key} = {total_eval_loss[key]:.4f}.")
-            write_to_tensorboard(writer, iter_idx, total_eval_loss)
+            write_to_tensorboard(writer, iter_idx, subset_tags(total_eval_loss) if args.eval_mode == "trainer" else total_eval_loss)
             total_eval_loss = defaultdict(list)
             eval_loss_sc_feat_in = np.mean(loss_sc_feat_in)
             eval_loss_sc_feat_in_std = np.std(loss_sc_feat_in)
@@ -2446,13 +2451,15 @@ def main():
                             min_eval_loss_uvcap[i], min_eval_loss_uvcap_std[i], min_eval_loss_cap[i], min_eval_loss_cap_std[i])
                 logging.info("%s min_idx=%d" % (text_log, min_idx+1))
             #if ((epoch_idx + 1) % args.save_interval_epoch == 0) or (epoch_min_flag):
-            if True:
+            if args.eval_mode != "evaluator":
                 logging.info('save epoch:%d' % (epoch_idx+1))
-                save_checkpoint(args.expdir, model_encoder_melsp, model_decoder_melsp, model_encoder_excit, model_decoder_excit,
+                save_checkpoint(checkpoint_writer, model_encoder_melsp, model_decoder_melsp, model_encoder_excit, model_decoder_excit,
                     model_spkidtr, model_classifier, min_eval_loss_melsp_dB[0], min_eval_loss_melsp_dB_std[0], min_eval_loss_melsp_cv[0],
                     min_eval_loss_melsp[0], min_eval_loss_gauss_cv[0], min_eval_loss_gauss[0],
                     min_eval_loss_melsp_dB_src_trg, min_eval_loss_melsp_dB_src_trg_std, min_eval_loss_gv_src_trg,
-                    iter_idx, min_idx, optimizer, numpy_random_state, torch_random_state, epoch_idx + 1)
+                    iter_idx, min_idx, optimizer, numpy_random_state, torch_random_state, epoch_idx + 1, eval_loss=eval_loss_melsp_dB[0])
+            else:
+                snapshot_queue.report(epoch_idx + 1, eval_loss_melsp_dB[0])
             total = 0
             iter_count = 0
             loss_sc_feat_in = []
@@ -2523,13 +2530,17 @@ def main():
                 param.requires_grad = True
             for param in model_classifier.parameters():
                 param.requires_grad = True
+            if args.eval_mode == "evaluator":
+                continue
             # start next epoch
             if iter_idx < args.step_count:
                 start = time.time()
                 logging.info("==%d EPOCH==" % (epoch_idx+1))
                 logging.info("Training data")
+                profiler.skip() # exclude epoch summary and evaluation
                 batch_feat, batch_sc, batch_sc_cv_data, batch_feat_cv_data, c_idx, utt_idx, featfile, \
                     f_bs, f_ss, flens, n_batch_utt, del_index_utt, max_flen, spk_cv, idx_select, idx_select_full, flens_acc = next(generator)
+                profiler.lap("data")
             else:
                 break
         # feedforward and backpropagate current batch
@@ -2618,6 +2629,7 @@ def main():
             batch_sc_cv[i] = batch_sc_cv_data[i][:,f_ss:f_es]
             batch_excit_cv[i] = batch_feat_cv_data[i][:,f_ss:f_es]
 
+        profiler.lap("slicing")
         if f_ss > 0:
             idx_in = 0
             i_cv_in = 0
@@ -2626,39 +2638,23 @@ def main():
                 j = i+1
                 if len(del_index_utt) > 0:
                     if i == 0:
-                        h_feat_in_sc = torch.FloatTensor(np.delete(h_feat_in_sc.cpu().data.numpy(),
-                                                        del_index_utt, axis=1)).to(device)
-                    h_z[i] = torch.FloatTensor(np.delete(h_z[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z_e[i] = torch.FloatTensor(np.delete(h_z_e[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z_sc[i] = torch.FloatTensor(np.delete(h_z_sc[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_lf0[i] = torch.FloatTensor(np.delete(h_lf0[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_lf0_cv[i_cv] = torch.FloatTensor(np.delete(h_lf0_cv[i_cv].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_melsp[i] = torch.FloatTensor(np.delete(h_melsp[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_melsp_cv[i_cv] = torch.FloatTensor(np.delete(h_melsp_cv[i_cv].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_feat_sc[i] = torch.FloatTensor(np.delete(h_feat_sc[i].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_feat_cv_sc[i_cv] = torch.FloatTensor(np.delete(h_feat_cv_sc[i_cv].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z[j] = torch.FloatTensor(np.delete(h_z[j].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
-                    h_z_e[j] = torch.FloatTensor(np.delete(h_z_e[j].cpu().data.numpy(),
-                                                    del_index_utt, axis=1)).to(device)
+                        h_feat_in_sc = index_delete(h_feat_in_sc, del_index_utt, dim=1)
+                    h_z[i] = index_delete(h_z[i], del_index_utt, dim=1)
+                    h_z_e[i] = index_delete(h_z_e[i], del_index_utt, dim=1)
+                    h_z_sc[i] = index_delete(h_z_sc[i], del_index_utt, dim=1)
+                    h_lf0[i] = index_delete(h_lf0[i], del_index_utt, dim=1)
+                    h_lf0_cv[i_cv] = index_delete(h_lf0_cv[i_cv], del_index_utt, dim=1)
+                    h_melsp[i] = index_delete(h_melsp[i], del_index_utt, dim=1)
+                    h_melsp_cv[i_cv] = index_delete(h_melsp_cv[i_cv], del_index_utt, dim=1)
+                    h_feat_sc[i] = index_delete(h_feat_sc[i], del_index_utt, dim=1)
+                    h_feat_cv_sc[i_cv] = index_delete(h_feat_cv_sc[i_cv], del_index_utt, dim=1)
+                    h_z[j] = index_delete(h_z[j], del_index_utt, dim=1)
+                    h_z_e[j] = index_delete(h_z_e[j], del_index_utt, dim=1)
                     if args.n_half_cyc > 1:
-                        h_z_sc[j] = torch.FloatTensor(np.delete(h_z_sc[j].cpu().data.numpy(),
-                                                        del_index_utt, axis=1)).to(device)
-                        h_lf0[j] = torch.FloatTensor(np.delete(h_lf0[j].cpu().data.numpy(),
-                                                        del_index_utt, axis=1)).to(device)
-                        h_melsp[j] = torch.FloatTensor(np.delete(h_melsp[j].cpu().data.numpy(),
-                                                        del_index_utt, axis=1)).to(device)
-                        h_feat_sc[j] = torch.FloatTensor(np.delete(h_feat_sc[j].cpu().data.numpy(),
-                                                        del_index_utt, axis=1)).to(device)
+                        h_z_sc[j] = index_delete(h_z_sc[j], del_index_utt, dim=1)
+                        h_lf0[j] = index_delete(h_lf0[j], del_index_utt, dim=1)
+                        h_melsp[j] = index_delete(h_melsp[j], del_index_utt, dim=1)
+                        h_feat_sc[j] = index_delete(h_feat_sc[j], del_index_utt, dim=1)
                 ## latent infer.
                 if i > 0:
                     idx_in += 1
@@ -2676,13 +2672,14 @@ def main():
                     batch_feat_in_sc, h_feat_in_sc = model_classifier(feat=batch_melsp, h=h_feat_in_sc, do=True)
                 ## speaker embeddings
                 idx_in += 1
-                weight_in, spk_code_in = model_spkidtr(batch_sc_in[idx_in])
-                weight_cv_in, spk_cv_code_in = model_spkidtr(batch_sc_cv_in[i_cv_in])
+                weight_in, spk_code_in = model_spkidtr(torch.cat((batch_sc_in[idx_in], batch_sc_cv_in[i_cv_in]), 0))
+                weight_in, weight_cv_in = torch.chunk(weight_in, 2, 0)
+                spk_code_in, spk_cv_code_in = torch.chunk(spk_code_in, 2, 0)
                 ## excit reconstruction & conversion
                 batch_lf0_rec[i], h_lf0[i] \
-                        = model_decoder_excit(z_e[i], y=spk_code_in, outpad_right=outpad_rights[idx_in], h=h_lf0[i], do=True)
-                batch_lf0_cv[i_cv], h_lf0_cv[i_cv] \
-                        = model_decoder_excit(z_e[i], y=spk_cv_code_in, outpad_right=outpad_rights[idx_in], h=h_lf0_cv[i_cv], do=True)
+                        = model_decoder_excit(z_e[i].repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0), outpad_right=outpad_rights[idx_in], h=torch.cat((h_lf0[i], h_lf0_cv[i_cv]), 1), do=True)
+                batch_lf0_rec[i], batch_lf0_cv[i_cv] = torch.chunk(batch_lf0_rec[i], 2, 0)
+                h_lf0[i], h_lf0_cv[i_cv] = torch.chunk(h_lf0[i], 2, 1)
                 z_cat = torch.cat((z_e[i], z[i]), 2)
                 feat_len = qy_logits[i].shape[1]
                 idx_in_1 = idx_in-1
@@ -2704,10 +2701,11 @@ def main():
                     z_cat = z_cat[:,lf0_pad_left:]
                     spk_code_in = spk_code_in[:,lf0_pad_left:]
                     spk_cv_code_in = spk_cv_code_in[:,lf0_pad_left:]
-                batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat, y=spk_code_in,
-                                    e=batch_lf0_rec[i][:,:,:args.excit_dim], outpad_right=outpad_rights[idx_in], h=h_melsp[i], do=True)
-                batch_pdf_cv[i_cv], batch_melsp_cv[i_cv], h_melsp_cv[i_cv] = model_decoder_melsp(z_cat, y=spk_cv_code_in,
-                                    e=batch_lf0_cv[i_cv][:,:,:args.excit_dim], outpad_right=outpad_rights[idx_in], h=h_melsp_cv[i_cv], do=True)
+                batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat.repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0),
+                                    e=torch.cat((batch_lf0_rec[i][:,:,:args.excit_dim], batch_lf0_cv[i_cv][:,:,:args.excit_dim]), 0), outpad_right=outpad_rights[idx_in], h=torch.cat((h_melsp[i], h_melsp_cv[i_cv]), 1), do=True)
+                batch_pdf_rec[i], batch_pdf_cv[i_cv] = torch.chunk(batch_pdf_rec[i], 2, 0)
+                batch_melsp_rec[i], batch_melsp_cv[i_cv] = torch.chunk(batch_melsp_rec[i], 2, 0)
+                h_melsp[i], h_melsp_cv[i_cv] = torch.chunk(h_melsp[i], 2, 1)
                 idx_in_1 = idx_in-1
                 feat_len_e = batch_lf0_rec[i].shape[1]
                 batch_lf0_rec[i] = batch_lf0_rec[i][:,outpad_lefts[idx_in_1]:feat_len_e-outpad_rights[idx_in_1]]
@@ -2723,8 +2721,9 @@ def main():
                 batch_melsp_rec[i] = batch_melsp_rec[i][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                 batch_pdf_cv[i_cv] = batch_pdf_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                 batch_melsp_cv[i_cv] = batch_melsp_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
-                batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=batch_melsp_rec[i], h=h_feat_sc[i], do=True)
-                batch_feat_cv_sc[i_cv], h_feat_cv_sc[i_cv] = model_classifier(feat=batch_melsp_cv[i_cv], h=h_feat_cv_sc[i_cv], do=True)
+                batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=torch.cat((batch_melsp_rec[i], batch_melsp_cv[i_cv]), 0), h=torch.cat((h_feat_sc[i], h_feat_cv_sc[i_cv]), 1), do=True)
+                batch_feat_rec_sc[i], batch_feat_cv_sc[i_cv] = torch.chunk(batch_feat_rec_sc[i], 2, 0)
+                h_feat_sc[i], h_feat_cv_sc[i_cv] = torch.chunk(h_feat_sc[i], 2, 1)
                 if args.n_half_cyc > 1:
                     ## speaker embeddings
                     idx_in += 1
@@ -2789,13 +2788,14 @@ def main():
                     batch_feat_in_sc, h_feat_in_sc = model_classifier(feat=batch_melsp, do=True)
                 ## speaker embeddings
                 idx_in += 1
-                weight_in, spk_code_in = model_spkidtr(batch_sc_in[idx_in])
-                weight_cv_in, spk_cv_code_in = model_spkidtr(batch_sc_cv_in[i_cv_in])
+                weight_in, spk_code_in = model_spkidtr(torch.cat((batch_sc_in[idx_in], batch_sc_cv_in[i_cv_in]), 0))
+                weight_in, weight_cv_in = torch.chunk(weight_in, 2, 0)
+                spk_code_in, spk_cv_code_in = torch.chunk(spk_code_in, 2, 0)
                 ## excit reconstruction & conversion
                 batch_lf0_rec[i], h_lf0[i] \
-                        = model_decoder_excit(z_e[i], y=spk_code_in, outpad_right=outpad_rights[idx_in], do=True)
-                batch_lf0_cv[i_cv], h_lf0_cv[i_cv] \
-                        = model_decoder_excit(z_e[i], y=spk_cv_code_in, outpad_right=outpad_rights[idx_in], do=True)
+                        = model_decoder_excit(z_e[i].repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0), outpad_right=outpad_rights[idx_in], do=True)
+                batch_lf0_rec[i], batch_lf0_cv[i_cv] = torch.chunk(batch_lf0_rec[i], 2, 0)
+                h_lf0[i], h_lf0_cv[i_cv] = torch.chunk(h_lf0[i], 2, 1)
                 z_cat = torch.cat((z_e[i], z[i]), 2)
                 feat_len = qy_logits[i].shape[1]
                 idx_in_1 = idx_in-1
@@ -2817,10 +2817,11 @@ def main():
                     z_cat = z_cat[:,lf0_pad_left:]
                     spk_code_in = spk_code_in[:,lf0_pad_left:]
                     spk_cv_code_in = spk_cv_code_in[:,lf0_pad_left:]
-                batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat, y=spk_code_in,
-                                    e=batch_lf0_rec[i][:,:,:args.excit_dim], outpad_right=outpad_rights[idx_in], do=True)
-                batch_pdf_cv[i_cv], batch_melsp_cv[i_cv], h_melsp_cv[i_cv] = model_decoder_melsp(z_cat, y=spk_cv_code_in,
-                                    e=batch_lf0_cv[i_cv][:,:,:args.excit_dim], outpad_right=outpad_rights[idx_in], do=True)
+                batch_pdf_rec[i], batch_melsp_rec[i], h_melsp[i] = model_decoder_melsp(z_cat.repeat(2,1,1), y=torch.cat((spk_code_in, spk_cv_code_in), 0),
+                                    e=torch.cat((batch_lf0_rec[i][:,:,:args.excit_dim], batch_lf0_cv[i_cv][:,:,:args.excit_dim]), 0), outpad_right=outpad_rights[idx_in], do=True)
+                batch_pdf_rec[i], batch_pdf_cv[i_cv] = torch.chunk(batch_pdf_rec[i], 2, 0)
+                batch_melsp_rec[i], batch_melsp_cv[i_cv] = torch.chunk(batch_melsp_rec[i], 2, 0)
+                h_melsp[i], h_melsp_cv[i_cv] = torch.chunk(h_melsp[i], 2, 1)
                 idx_in_1 = idx_in-1
                 feat_len_e = batch_lf0_rec[i].shape[1]
                 batch_lf0_rec[i] = batch_lf0_rec[i][:,outpad_lefts[idx_in_1]:feat_len_e-outpad_rights[idx_in_1]]
@@ -2836,8 +2837,9 @@ def main():
                 batch_melsp_rec[i] = batch_melsp_rec[i][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                 batch_pdf_cv[i_cv] = batch_pdf_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
                 batch_melsp_cv[i_cv] = batch_melsp_cv[i_cv][:,outpad_lefts[idx_in_1]:feat_len-outpad_rights[idx_in_1]]
-                batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=batch_melsp_rec[i], do=True)
-                batch_feat_cv_sc[i_cv], h_feat_cv_sc[i_cv] = model_classifier(feat=batch_melsp_cv[i_cv], do=True)
+                batch_feat_rec_sc[i], h_feat_sc[i] = model_classifier(feat=torch.cat((batch_melsp_rec[i], batch_melsp_cv[i_cv]), 0), do=True)
+                batch_feat_rec_sc[i], batch_feat_cv_sc[i_cv] = torch.chunk(batch_feat_rec_sc[i], 2, 0)
+                h_feat_sc[i], h_feat_cv_sc[i_cv] = torch.chunk(h_feat_sc[i], 2, 1)
                 if args.n_half_cyc > 1:
                     ## speaker embeddings
                     idx_in += 1
@@ -2922,6 +2924,7 @@ def main():
             #unique, counts = np.unique(torch.max(z[0][i], -1)[1].cpu().data.numpy(), return_counts=True)
             #logging.info(dict(zip(unique, counts)))
 
+        profiler.lap("forward")
         # Losses computation
         batch_loss = 0
 
@@ -3050,19 +3053,15 @@ def main():
             else:
                 optimizer.zero_grad()
                 batch_loss.backward()
+                all_reduce_gradients(module_list)
                 optimizer.step()
 
                 with torch.no_grad():
                     if idx_stage < args.n_stage-1 and iter_idx + 1 == t_starts[idx_stage+1]:
                         idx_stage += 1
-                    if idx_stage > 0:
-                        sparsify(model_encoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                        sparsify(model_encoder_excit, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                        sparsify(model_decoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                    else:
-                        sparsify(model_encoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
-                        sparsify(model_encoder_excit, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
-                        sparsify(model_decoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
+                    sparsity_encoder_melsp.step(iter_idx + 1)
+                    sparsity_encoder_excit.step(iter_idx + 1)
+                    sparsity_decoder_melsp.step(iter_idx + 1)
 
                 text_log = "batch loss_select %lf " % (batch_loss.item())
                 logging.info("%s (%.3f sec)" % (text_log, time.time() - start))
@@ -3080,6 +3079,7 @@ def main():
                     write_to_tensorboard(writer, iter_idx, total_train_loss)
                     total_train_loss = defaultdict(list)
                 total += time.time() - start
+                profiler.step(iter_idx)
                 continue
 
         # loss_compute
@@ -3297,23 +3297,23 @@ def main():
 
         logging.info(model_spkidtr.embed_spk.weight[:4][:,:4])
 
+        profiler.lap("loss")
         optimizer.zero_grad()
         batch_loss.backward()
+        all_reduce_gradients(module_list)
+        profiler.lap("backward")
         optimizer.step()
+        profiler.lap("optimizer")
 
         logging.info(model_spkidtr.embed_spk.weight[:4][:,:4])
 
         with torch.no_grad():
             if idx_stage < args.n_stage-1 and iter_idx + 1 == t_starts[idx_stage+1]:
                 idx_stage += 1
-            if idx_stage > 0:
-                sparsify(model_encoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                sparsify(model_encoder_excit, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-                sparsify(model_decoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage], densities_p=densities[idx_stage-1])
-            else:
-                sparsify(model_encoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
-                sparsify(model_encoder_excit, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
-                sparsify(model_decoder_melsp, iter_idx + 1, t_starts[idx_stage], t_ends[idx_stage], args.interval, densities[idx_stage])
+            sparsity_encoder_melsp.step(iter_idx + 1)
+            sparsity_encoder_excit.step(iter_idx + 1)
+            sparsity_decoder_melsp.step(iter_idx + 1)
+        profiler.lap("sparsify")
 
         text_log = "batch loss [%d] %d %d %.3f " % (c_idx+1, f_ss, f_bs, batch_loss_sc_feat_in.item())
         for i in range(args.n_half_cyc):
@@ -3369,9 +3369,18 @@ def main():
             write_to_tensorboard(writer, iter_idx, total_train_loss)
             total_train_loss = defaultdict(list)
         total += time.time() - start
+        profiler.step(iter_idx)
 
 
     logging.info("Maximum step is reached, please check the development optimum index, or continue training by increasing maximum step.")
+    profiler.close()
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+        if args.eval_mode == "trainer":
+            snapshot_queue.end_training()
+    dtw_eval_pool.close()
+    if cache is not None:
+        cache.clear()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+
+import logging
+
+import torch
+import torch.nn.functional as F
+
+from torch import nn
+
+
+BLOCK_SIZE = 16
+
+
+def block_sparse_layout(weight_hh, block_size=BLOCK_SIZE, eps=1e-10):
+    """FUNCTION TO GATHER NON-ZERO BLOCKS OF A BLOCK-SPARSIFIED GRU RECURRENT MATRIX
+
+    Same layout as printSparseVector of the dump scripts, i.e., diagonal of each gate + blocks of
+    block_size consecutive outputs x 1 input. The blocks of each output group are padded with zero blocks
+    to the maximum number of non-zero blocks of the groups.
+
+    Args:
+        weight_hh (Tensor): recurrent weight matrix (3*H x H)
+        block_size (int): number of outputs in a block
+        eps (float): threshold of absolute sum of a zero block
+
+    Return:
+        (Tensor): diagonal of each gate (3*H)
+        (Tensor): input index of the blocks of each output group (3*H/block_size x K)
+        (Tensor): values of the blocks of each output group (3*H/block_size x K x block_size)
+        (float): density of the non-zero blocks
+    """
+    H = weight_hh.shape[1]
+    nb = weight_hh.shape[0] // H
+    A = weight_hh.reshape(nb, H, H)
+    diag = torch.diagonal(A, dim1=1, dim2=2)
+    A = A - torch.diag_embed(diag)
+    blocks = A.reshape(-1, block_size, H) # n_groups x block_size x H
+    nonzero = torch.sum(torch.abs(blocks), 1) > eps # n_groups x H
+    counts = torch.sum(nonzero, 1)
+    K = max(int(torch.max(counts)), 1)
+    # non-zero inputs first, in ascending order
+    key = nonzero.long()*H + (H-1-torch.arange(H, device=weight_hh.device))
+    idx = torch.argsort(key, dim=1, descending=True)[:,:K]
+    valid = torch.arange(K, device=weight_hh.device).unsqueeze(0) < counts.unsqueeze(-1)
+    idx = idx*valid
+    vals = torch.gather(blocks, 2, idx.unsqueeze(1).expand(-1, block_size, -1)) * valid.unsqueeze(1)
+    density = float(torch.sum(counts)) / nonzero.numel()
+    return diag.reshape(-1), idx, vals.transpose(1, 2).contiguous(), density
+
+
+class BlockSparseGRU(nn.Module):
+    """INFERENCE GRU WITH BLOCK-SPARSE RECURRENT MATRIX
+
+    Drop-in for a single-layer unidirectional batch_first nn.GRU. The input part is computed densely for the whole
+    sequence, and the recurrent part of each step is the diagonal plus a batched product of the gathered non-zero blocks.
+
+    Args:
+        gru (nn.GRU): trained GRU with block-sparsified weight_hh_l0
+        block_size (int): number of outputs in a block
+    """
+
+    def __init__(self, gru, block_size=BLOCK_SIZE):
+        super(BlockSparseGRU, self).__init__()
+        self.input_size = gru.input_size
+        self.hidden_size = gru.hidden_size
+        self.num_layers = 1
+        self.batch_first = True
+        self.block_size = block_size
+        with torch.no_grad():
+            diag, idx, vals, self.density = block_sparse_layout(gru.weight_hh_l0, block_size=block_size)
+            self.register_buffer("weight_ih", gru.weight_ih_l0.detach().clone())
+            self.register_buffer("bias_ih", gru.bias_ih_l0.detach().clone())
+            self.register_buffer("bias_hh", gru.bias_hh_l0.detach().clone())
+            self.register_buffer("diag", diag.clone())
+            self.register_buffer("idx", idx)
+            self.register_buffer("vals", vals)
+
+    def recurrent(self, h):
+        """Recurrent matrix-vector product
+
+        Args:
+            h (Tensor): hidden state (B x H)
+
+        Return:
+            (Tensor): recurrent part of the gates (B x 3*H)
+        """
+        B = h.shape[0]
+        # n_groups x B x K @ n_groups x K x block_size
+        out = torch.bmm(h[:,self.idx].transpose(0, 1), self.vals).transpose(0, 1).reshape(B, -1)
+        return torch.addcmul(out + self.bias_hh, self.diag, h.repeat(1, 3))
+
+    def forward(self, x, h=None):
+        """Forward calculation
+
+        Args:
+            x (Tensor): input sequence (B x T x C)
+            h (Tensor): initial hidden state (1 x B x H)
+
+        Return:
+            (Tensor): output sequence (B x T x H)
+            (Tensor): last hidden state (1 x B x H)
+        """
+        if h is None:
+            h = x.new_zeros(x.shape[0], self.hidden_size)
+        else:
+            h = h[0]
+        x_r, x_z, x_n = F.linear(x, self.weight_ih, self.bias_ih).chunk(3, dim=-1)
+        out = x.new_empty(x.shape[0], x.shape[1], self.hidden_size)
+        for t in range(x.shape[1]):
+            h_r, h_z, h_n = self.recurrent(h).chunk(3, dim=-1)
+            r = torch.sigmoid(x_r[:,t] + h_r)
+            z = torch.sigmoid(x_z[:,t] + h_z)
+            n = torch.tanh(x_n[:,t] + r*h_n)
+            h = n + z*(h - n)
+            out[:,t] = h
+        return out, h.unsqueeze(0)
+
+    def extra_repr(self):
+        return "%d, %d, batch_first=True, block_size=%d, density=%.3f" % (self.input_size, self.hidden_size,
+                    self.block_size, self.density)
+
+
+def replace_sparse_gru(model, max_density=0.5, block_size=BLOCK_SIZE):
+    """FUNCTION TO REPLACE BLOCK-SPARSIFIED GRU LAYERS OF A MODEL WITH BlockSparseGRU FOR CPU INFERENCE
+
+    Only single-layer unidirectional batch_first GRUs on cpu are replaced, and only if the density of the non-zero
+    blocks of the recurrent matrix is not more than max_density, otherwise the dense matrix-vector product is faster.
+
+    Args:
+        model (nn.Module): model in evaluation mode
+        max_density (float): maximum density of the recurrent matrix to be replaced
+        block_size (int): number of outputs in a block
+
+    Return:
+        (list): names of the replaced layers
+    """
+    replaced = []
+    for module_name, module in list(model.named_modules()):
+        for name, child in list(module.named_children()):
+            if not isinstance(child, nn.GRU) or child.num_layers != 1 or child.bidirectional \
+                or not child.batch_first or not child.bias or child.hidden_size % block_size != 0 \
+                    or child.weight_hh_l0.device.type != "cpu":
+                continue
+            sparse_gru = BlockSparseGRU(child, block_size=block_size)
+            full_name = module_name+"."+name if module_name else name
+            if sparse_gru.density > max_density:
+                logging.info("%s is kept dense, density %.3f" % (full_name, sparse_gru.density))
+                continue
+            setattr(module, name, sparse_gru)
+            replaced.append(full_name)
+            logging.info("%s is replaced with block-sparse gru, density %.3f" % (full_name, sparse_gru.density))
+    return replaced
@@ -5,6 +5,9 @@
 
 from __future__ import division
 
+import contextlib
+import copy
+import functools
 import logging
 import sys
 import time
@@ -29,6 +32,52 @@ MIN_CLAMP = -103
 MAX_CLAMP = 85
 
 
+def autocast_enabled():
+    """FUNCTION TO CHECK WHETHER AN AUTOCAST (LOW-PRECISION) REGION IS ACTIVE ON CPU OR CUDA"""
+    if torch.is_autocast_enabled():
+        return True
+    if hasattr(torch, "is_autocast_cpu_enabled") and torch.is_autocast_cpu_enabled():
+        return True
+    return False
+
+
+def to_fp32(x):
+    """FUNCTION TO CAST FLOATING TENSORS TO FLOAT32, RECURSIVELY OVER TUPLES / LISTS
+
+    Arg:
+        x: tensor, tuple / list of tensors, or any other object (returned as is)
+    """
+    if torch.is_tensor(x) and x.is_floating_point():
+        return x.float()
+    if isinstance(x, (tuple, list)):
+        return type(x)(to_fp32(y) for y in x)
+    return x
+
+
+def fp32_island(func):
+    """DECORATOR TO EXECUTE A NUMERICALLY SENSITIVE FUNCTION IN FLOAT32 INSIDE AN AUTOCAST REGION
+
+    Floating tensor arguments are cast to float32 and autocast is disabled while the function runs.
+    Outside of autocast, the function is called as is.
+
+    Arg:
+        func (function): function or module forward
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not autocast_enabled():
+            return func(*args, **kwargs)
+        args = [to_fp32(x) for x in args]
+        kwargs = {key: to_fp32(value) for key, value in kwargs.items()}
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(torch.cuda.amp.autocast(enabled=False))
+            if hasattr(torch, "cpu") and hasattr(torch.cpu, "amp"):
+                stack.enter_context(torch.cpu.amp.autocast(enabled=False))
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
 def initialize(m):
     """FUNCTION TO INITILIZE CONV WITH XAVIER
 
@@ -94,6 +143,7 @@ def decode_mu_law(y, mu=1024):
     return np.clip(x, a_min=-1, a_max=0.999969482421875)
 
 
+@fp32_island
 def decode_mu_law_torch(y, mu=1024):
     """FUNCTION TO PERFORM MU-LAW DECODING
 
@@ -341,6 +391,7 @@ class DualFC_(nn.Module):
         self.fact = EmbeddingZero(1, self.mid_out_bands2+self.lpc4bands)
         self.out = nn.Conv1d(self.lpc2+self.mid_out, self.lpc2+self.out_dim, 1, bias=self.bias)
 
+    @fp32_island  # logits of the softmax sampling and cross-entropy
     def forward(self, x):
         """Forward calculation
 
@@ -425,6 +476,7 @@ class DualFC(nn.Module):
                 self.conv = nn.Conv1d(self.in_dim, self.out_dim2*self.n_bands+self.lpc4bands, 1, bias=self.bias)
                 self.fact = EmbeddingZero(1, self.out_dim2+self.lpc4)
 
+    @fp32_island  # logits of the softmax sampling and cross-entropy
     def forward(self, x):
         """Forward calculation
 
@@ -594,7 +646,7 @@ def sampling_laplace_wave(loc, scale):
 
  
 def sampling_normal(mu, var):
-    eps = torch.randn(mu.shape).cuda()
+    eps = torch.randn_like(mu)
 
     return mu + torch.sqrt(var) * eps # var
 
@@ -697,6 +749,7 @@ def kl_laplace_laplace_param(mu_q, sigma_q, mu_p, sigma_p):
     return torch.mean(torch.sum(torch.log(scale_p/scale_q) + mu_abs/scale_p + (scale_q/scale_p)*torch.exp(-mu_abs/scale_q) - 1, -1), -1) # B / 1
 
 
+@fp32_island
 def kl_laplace_laplace(q, p, sum_flag=True):
     """ ln(λ_j/λ_i) + |θ_i-θ_j|/λ_j + λ_i/λ_j * exp(−|θ_i-θ_j|/λ_i) − 1 """
 
@@ -723,6 +776,366 @@ def kl_laplace_laplace(q, p, sum_flag=True):
             return torch.mean(torch.mean(torch.log(scale_p/scale_q) + mu_abs/scale_p + (scale_q/scale_p)*torch.exp(-mu_abs/scale_q) - 1, -1)) # T x C --> T --> 1
 
 
+def length_mask(lengths, max_len):
+    """FUNCTION TO GET MASK OF VALID FRAMES OF MIXED-LENGTH BATCH
+
+    Args:
+        lengths (Tensor): numbers of valid frames (B)
+        max_len (int): number of frames of the padded batch
+
+    Return:
+        (Tensor): bool mask (B x T x 1)
+    """
+    return (torch.arange(max_len, device=lengths.device).unsqueeze(0) < lengths.unsqueeze(1)).unsqueeze(-1)
+
+
+def gru_lengths(gru, x, lengths, h=None, outpad_right=0):
+    """FUNCTION TO RUN GRU OVER ONLY THE VALID FRAMES OF MIXED-LENGTH BATCH (PACKED SEQUENCES)
+
+    The input frames after the lengths, i.e., conv. outputs of the batch padding, are masked, the hidden state is taken
+    at the last valid frame of each sequence, and the output frames after it are zeros. As in the padded forward,
+    the last outpad_right valid frames of each sequence are computed from the hidden state before them without
+    updating it. A GRU that does not take packed sequences, e.g., BlockSparseGRU of inference, is run over
+    the whole padded batch, and its (single-layer) hidden state is gathered at the last valid frames.
+
+    Args:
+        gru (nn.Module): GRU layer(s) with batch_first
+        x (Tensor): input sequences (B x T x C)
+        lengths (Tensor or list): numbers of valid frames including outpad_right (B)
+        h (Tensor): initial hidden state (n_layers x B x H)
+        outpad_right (int): number of frames after the returned hidden state
+
+    Return:
+        (Tensor): output sequences (B x T x H)
+        (Tensor): hidden state (n_layers x B x H)
+    """
+    T = x.shape[1]
+    lengths = torch.as_tensor(lengths, dtype=torch.long, device=x.device)
+    mask = length_mask(lengths, T)
+    x = x.masked_fill(~mask, 0)
+    lengths_h = (lengths - outpad_right).clamp(min=1, max=T) # frames until the hidden state
+    if not isinstance(gru, nn.GRU):
+        if h is None:
+            out, _ = gru(x)
+        else:
+            out, _ = gru(x, h)
+        h = out.gather(1, (lengths_h-1).view(-1,1,1).expand(-1,1,out.shape[2])).transpose(0,1).contiguous()
+        return out.masked_fill(~mask, 0), h
+    packed = nn.utils.rnn.pack_padded_sequence(x, lengths_h.cpu(), batch_first=True, enforce_sorted=False)
+    if h is None:
+        out, h = gru(packed)
+    else:
+        out, h = gru(packed, h)
+    out, _ = nn.utils.rnn.pad_packed_sequence(out, batch_first=True, total_length=T)
+    if outpad_right > 0:
+        idx = (lengths_h.unsqueeze(1) + torch.arange(outpad_right, device=x.device)).clamp(max=T-1) # B x outpad_right
+        out_, _ = gru(x.gather(1, idx.unsqueeze(-1).expand(-1,-1,x.shape[2])), h)
+        out = out.scatter(1, idx.unsqueeze(-1).expand(-1,-1,out.shape[2]), out_)
+    return out.masked_fill(~mask, 0), h
+
+
+@torch.no_grad()
+def embedding_input_table(weight_emb, weight_in, n_bands):
+    """FUNCTION TO PRECOMPUTE INPUT-WEIGHT CONTRIBUTIONS OF BAND-WISE EMBEDDINGS FOR ALL CODES
+
+    The input x = cat(E[code_1], ..., E[code_n_bands]) contributes x * W_in = sum_b table[b, code_b],
+    i.e., the same tables as the EmbeddingLayer of the C dumps.
+
+    Args:
+        weight_emb (Tensor): embedding weight (V x D)
+        weight_in (Tensor): input weight rows of the embeddings (n_bands*D x 3*H)
+        n_bands (int): number of bands
+
+    Return:
+        (Tensor): lookup table (n_bands x V x 3*H)
+    """
+    return torch.einsum('vd,bdh->bvh', weight_emb, weight_in.reshape(n_bands, weight_emb.shape[1], -1))
+
+
+class GRUStep(object):
+    """SINGLE-STEP GRU WITH FRAME-RATE CONDITIONING INPUT
+
+    The input of the GRU is cat(cond, embeddings of sample codes, x), where cond is constant within a frame,
+    e.g., upsampled conditioning features of the waveform models. The conditioning part of the input projection
+    W_ih[:, :cond_dim] * cond + b_ih is computed for all frames at once by precompute(). The embedding parts are
+    precomputed as lookup tables of all codes of each band (embedding_input_table), so that each step gathers and sums
+    their rows instead of the embedding, concatenation, and matmul. Each step then computes only the dense part of
+    the input projection and the recurrent part, with the gates of nn.GRU (r, z, n). The weights are taken from
+    the GRU, either single-layer batch_first nn.GRU or BlockSparseGRU (recurrent part with the gathered non-zero blocks),
+    so the instance should be built after the weights are final.
+
+    Args:
+        gru (nn.Module): GRU layer
+        cond_dim (int): number of conditioning input channels, i.e., the first ones of the input
+        embeds (list): (embedding, n_bands) of the inputs following the conditioning, in order
+    """
+
+    def __init__(self, gru, cond_dim, embeds=()):
+        if isinstance(gru, nn.GRU):
+            assert(gru.num_layers == 1 and not gru.bidirectional)
+            weight_ih, self.bias_ih = gru.weight_ih_l0, gru.bias_ih_l0
+            self.recurrent = lambda h: F.linear(h, gru.weight_hh_l0, gru.bias_hh_l0)
+        else:
+            weight_ih, self.bias_ih = gru.weight_ih, gru.bias_ih
+            self.recurrent = gru.recurrent
+        self.hidden_size = gru.hidden_size
+        self.weight_cond = weight_ih[:,:cond_dim]
+        self.tables = []
+        self.offsets = []
+        offset = cond_dim
+        for embed, n_bands in embeds:
+            dim = embed.embedding_dim*n_bands
+            self.tables.append(embedding_input_table(embed.weight, weight_ih[:,offset:offset+dim].t(), n_bands).reshape(
+                                n_bands*embed.num_embeddings, -1)) # n_bands*V x 3*H
+            self.offsets.append(torch.arange(n_bands, device=weight_ih.device)*embed.num_embeddings)
+            offset += dim
+        if offset < weight_ih.shape[1]:
+            self.weight_x = weight_ih[:,offset:].t().contiguous() # C_x x 3*H
+        else:
+            self.weight_x = None
+
+    def precompute(self, cond):
+        """Conditioning part of the input projection
+
+        Args:
+            cond (Tensor): conditioning input (B x T_frm x cond_dim)
+
+        Return:
+            (Tensor): conditioning part of the gates including the input bias (B x T_frm x 3*H)
+        """
+        return F.linear(cond, self.weight_cond, self.bias_ih)
+
+    def step(self, cond, h, codes=(), x=None):
+        """One GRU step
+
+        Args:
+            cond (Tensor): conditioning part of the gates of the current frame (B x 3*H)
+            h (Tensor): hidden state (B x H)
+            codes (list): codes of the embedded inputs (B x n_bands), in the order of embeds
+            x (Tensor): dense input after the embedded ones (B x C_x)
+
+        Return:
+            (Tensor): next hidden state (B x H)
+        """
+        H = self.hidden_size
+        gi = cond
+        for table, offset, code in zip(self.tables, self.offsets, codes):
+            gi = gi + F.embedding_bag(code + offset, table, mode="sum")
+        if x is not None:
+            gi = torch.addmm(gi, x, self.weight_x)
+        gh = self.recurrent(h)
+        r, z = torch.sigmoid(gi[:,:2*H] + gh[:,:2*H]).chunk(2, dim=1)
+        n = torch.tanh(gi[:,2*H:] + r*gh[:,2*H:])
+        return n + z*(h - n)
+
+
+def fold_conv_in(scale_in, conv, offset=0):
+    """FUNCTION TO FOLD 1x1 CONV. INTO THE INPUT CHANNELS OF THE FOLLOWING CONV.
+
+    conv(cat(x[:offset], scale_in(x[offset:offset+C]), x[offset+C:])) = conv_folded(x),
+    which is exact only if conv has no zero padding, i.e., pad_first.
+
+    Args:
+        scale_in (nn.Conv1d): 1x1 conv. of C channels, e.g., input normalization
+        conv (nn.Conv1d): following conv.
+        offset (int): first input channel of conv taking the output of scale_in
+
+    Return:
+        (nn.Conv1d): folded conv.
+    """
+    weight = conv.weight.data
+    weight_in = weight[:,offset:offset+scale_in.out_channels] # O x C x K
+    folded = copy.deepcopy(conv)
+    folded.weight = nn.Parameter(torch.cat((weight[:,:offset], torch.einsum('ock,cj->ojk', weight_in, scale_in.weight.data[:,:,0]),
+                        weight[:,offset+scale_in.out_channels:]), 1))
+    bias = conv.bias.data if conv.bias is not None else torch.zeros_like(weight[:,0,0])
+    if scale_in.bias is not None:
+        bias = bias + torch.einsum('ock,c->o', weight_in, scale_in.bias.data)
+    folded.bias = nn.Parameter(bias)
+    return folded
+
+
+def fold_conv_out(conv, dense):
+    """FUNCTION TO FOLD 1x1 CONV. INTO THE OUTPUT CHANNELS OF THE PRECEDING CONV., i.e., dense(conv(x)) = conv_folded(x)
+
+    Args:
+        conv (nn.Conv1d): conv. (O x I x K)
+        dense (nn.Conv1d): following 1x1 conv. (H x O x 1)
+
+    Return:
+        (nn.Conv1d): folded conv. (H x I x K)
+    """
+    weight = dense.weight.data[:,:,0]
+    folded = nn.Conv1d(conv.in_channels, dense.out_channels, conv.kernel_size[0], padding=conv.padding[0],
+                dilation=conv.dilation[0]).to(device=conv.weight.device, dtype=conv.weight.dtype)
+    folded.weight = nn.Parameter(torch.einsum('ho,oik->hik', weight, conv.weight.data))
+    bias = torch.mv(weight, conv.bias.data) if conv.bias is not None else torch.zeros_like(weight[:,0])
+    if dense.bias is not None:
+        bias = bias + dense.bias.data
+    folded.bias = nn.Parameter(bias)
+    return folded
+
+
+def _conv_layers(conv):
+    # containers and keys of the layers of TwoSidedDilConv1d / CausalDilConv1d / SkewedConv1d, None if not linear
+    if isinstance(conv.conv, nn.Sequential):
+        layers = [(conv.conv, i) for i in range(len(conv.conv))]
+    else:
+        layers = [(conv, "conv")]
+    if not all(isinstance(_get_layer(*layer), nn.Conv1d) for layer in layers):
+        return None
+    return layers
+
+
+def _get_layer(parent, key):
+    return parent[key] if isinstance(key, int) else getattr(parent, key)
+
+
+def _set_layer(parent, key, layer):
+    if isinstance(key, int):
+        parent[key] = layer
+    else:
+        setattr(parent, key, layer)
+
+
+def _tensors(output):
+    # tensors of (nested) tuple / list output, e.g., outputs and hidden states
+    if isinstance(output, torch.Tensor):
+        return [output]
+    if isinstance(output, (tuple, list)):
+        return [x for y in output for x in _tensors(y)]
+    return []
+
+
+def _random_run(model, n_frames=8, batch_size=2):
+    # forward of the whole model on random input, None if the inputs of the model are not known
+    param = next(model.parameters())
+    if isinstance(model, GRU_VAE_ENCODER):
+        x = torch.randn(batch_size, model.pad_left+model.pad_right+n_frames, model.in_dim, device=param.device, dtype=param.dtype)
+        return lambda m: m(x)
+    if isinstance(model, GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF) and not model.res_flag \
+            and all(getattr(model, key) is None for key in ("red_dim", "spk_dim", "aux_dim", "n_spk", "scale_in_aux_dim")):
+        c = torch.randn(batch_size, model.pad_left+model.pad_right+n_frames, model.in_dim, device=param.device, dtype=param.dtype)
+        n_samples = n_frames*model.upsampling_factor
+        codes = [torch.randint(model.cf_dim, (batch_size, n_samples, model.n_bands), device=param.device) for _ in range(3)]
+        if model.lpc > 0:
+            codes_lpc = [torch.randint(model.cf_dim, (batch_size, n_samples+model.lpc-1, model.n_bands), device=param.device)
+                            for _ in range(2)]
+            return lambda m: m(c, *codes, x_c_lpc=codes_lpc[0], x_f_lpc=codes_lpc[1])
+        return lambda m: m(c, *codes)
+    return None
+
+
+@torch.no_grad()
+def _max_error(reference, model, run, seed=1):
+    # relative max. error of the outputs of model against reference, with the same random state for sampling
+    param = next(model.parameters())
+    outputs = []
+    for m in (reference, model):
+        with torch.random.fork_rng(devices=[param.device] if param.is_cuda else []):
+            torch.manual_seed(seed)
+            outputs.append(_tensors(run(m)))
+    if len(outputs[0]) == 0 or len(outputs[0]) != len(outputs[1]):
+        return float("inf")
+    err = 0
+    for ref, out in zip(*outputs):
+        if ref.shape != out.shape:
+            return float("inf")
+        ref, out = ref.double(), out.double()
+        err = max(err, ((out - ref).abs().max() / ref.abs().max().clamp(min=1)).item())
+    return err
+
+
+def _scale_in_target(module):
+    # first layer taking the output of scale_in, which is concatenated after the other inputs, e.g., speaker code
+    if isinstance(module, GRU_SPEC_DECODER) and (module.excit_dim is not None or module.red_dim_upd is not None):
+        return None # scale_in is followed by other inputs or not taken by the first layer
+    if getattr(module, "red_dim", None) is not None and hasattr(module, "in_red"):
+        return module.in_red, 0
+    layers = _conv_layers(module.conv)
+    if layers is None or _get_layer(*layers[0]).padding[0] != 0:
+        return None
+    return layers[0]
+
+
+@torch.no_grad()
+def optimize_for_inference(model, fold=True, tol=1e-4, run=None):
+    """FUNCTION TO PREPARE MODEL FOR INFERENCE BY REMOVING WEIGHT NORM AND FOLDING CONSECUTIVE LINEAR LAYERS
+
+    Weight norm is removed from all of the layers. If fold, the 1x1 scale_in (input normalization) is folded into
+    the first layer taking it, i.e., the first conv. layer or the input reduction layer, and the 1x1 conv. of conv_s_c
+    in the waveform models into the last conv. layer, so that the conv. output is of the smaller dimension.
+    The outputs of the whole model are compared with those of a copy taken before folding, and the folded layers
+    are reverted if they do not match within tol (relative max. error). Without run, random input is used for
+    the models of known inputs (GRU_VAE_ENCODER and GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF), and the other
+    models are not folded. scale_out is applied after tanhshrink in every module, so it is kept.
+    Modules read by the C exporters, e.g., scale_in of NormStats, are not folded with fold=False.
+
+    Args:
+        model (nn.Module): model instance
+        fold (bool): flag to fold linear layers
+        tol (float): tolerance of relative error of the model outputs
+        run (func): function of model instance returning its outputs on real or random input, e.g., lambda m: m(x)
+
+    Return:
+        (list): names of folded layers
+    """
+    model.eval()
+    for module in model.modules():
+        try:
+            torch.nn.utils.remove_weight_norm(module)
+        except ValueError:
+            pass
+    folded = []
+    if not fold:
+        return folded
+    reference = copy.deepcopy(model)
+    replaced = [] # (container, key) and unfused layer
+    for name, module in list(model.named_modules()):
+        prefix = name + "." if name else ""
+        if isinstance(getattr(module, "scale_in", None), nn.Conv1d) and hasattr(module, "conv"):
+            target = _scale_in_target(module)
+            if target is not None:
+                layer = _get_layer(*target)
+                offset = layer.in_channels - module.scale_in.out_channels
+                if offset >= 0:
+                    replaced.append((target, layer))
+                    replaced.append(((module, "scale_in"), module.scale_in))
+                    _set_layer(*target, fold_conv_in(module.scale_in, layer, offset))
+                    module.scale_in = nn.Identity()
+                    folded.append(prefix + "scale_in")
+        if isinstance(getattr(module, "conv_s_c", None), nn.Sequential) and isinstance(module.conv_s_c[0], nn.Conv1d):
+            layers = _conv_layers(module.conv)
+            if layers is not None:
+                layer = _get_layer(*layers[-1])
+                dense = module.conv_s_c[0]
+                k = layer.in_channels*layer.kernel_size[0]
+                if k*dense.out_channels <= (k + dense.out_channels)*layer.out_channels:
+                    replaced.append((layers[-1], layer))
+                    replaced.append(((module.conv_s_c, 0), dense))
+                    _set_layer(*layers[-1], fold_conv_out(layer, dense))
+                    module.conv_s_c[0] = nn.Identity()
+                    folded.append(prefix + "conv_s_c")
+    if len(folded) == 0:
+        return folded
+    if run is None:
+        param = next(model.parameters())
+        with torch.random.fork_rng(devices=[param.device] if param.is_cuda else []): # keep the random state of the caller
+            torch.manual_seed(1)
+            run = _random_run(model)
+    err = _max_error(reference, model, run) if run is not None else None
+    if err is None or err > tol:
+        for target, layer in reversed(replaced):
+            _set_layer(*target, layer)
+        if err is None:
+            logging.warning("%s is not folded, no input to compare the model outputs" % (str(folded)))
+        else:
+            logging.warning("%s is not folded, relative error of the model outputs %.3e" % (str(folded), err))
+        return []
+    logging.info("folded layers for inference: %s (relative error of the model outputs %.3e)" % (str(folded), err))
+    return folded
+
+
 class GRU_VAE_ENCODER(nn.Module):
     def __init__(self, in_dim=80, lat_dim=96, hidden_layers=1, hidden_units=512, kernel_size=5,
             dilation_size=1, do_prob=0, use_weight_norm=True, causal_conv=False, right_size=0,
@@ -796,7 +1209,7 @@ class GRU_VAE_ENCODER(nn.Module):
         else:
             self.apply(initialize)
 
-    def forward(self, x, h=None, do=False, sampling=True, outpad_right=0):
+    def forward(self, x, h=None, do=False, sampling=True, outpad_right=0, lengths=None):
         if self.scale_in_flag:
             x_in = self.conv(self.scale_in(x.transpose(1,2))).transpose(1,2)
         else:
@@ -806,7 +1219,10 @@ class GRU_VAE_ENCODER(nn.Module):
             s = self.conv_drop(x_in) # B x C x T --> B x T x C
         else:
             s = x_in # B x C x T --> B x T x C
-        if outpad_right > 0:
+        if lengths is not None:
+            # valid frames of mixed-length batch (B), i.e., without receptive-field padding
+            s, h = gru_lengths(self.gru, s, lengths, h=h, outpad_right=outpad_right)
+        elif outpad_right > 0:
             # GRU s layers
             if h is None:
                 out, h = self.gru(s[:,:-outpad_right]) # B x T x C
@@ -1005,7 +1421,8 @@ class GRU_SPEC_DECODER(nn.Module):
         else:
             self.apply(initialize)
 
-    def forward(self, z, y=None, aux=None, h=None, do=False, e=None, outpad_right=0, sampling=True, scale_fact=None, ret_mid_feat=False, org_in=False, do_conv=False, temp=None):
+    def forward(self, z, y=None, aux=None, h=None, do=False, e=None, outpad_right=0, sampling=True, scale_fact=None, ret_mid_feat=False, org_in=False, do_conv=False, temp=None,
+            lengths=None):
         if aux is not None:
             if y is not None:
                 if len(y.shape) == 2:
@@ -1084,7 +1501,10 @@ class GRU_SPEC_DECODER(nn.Module):
                 e = self.conv_drop(self.conv(z.transpose(1,2)).transpose(1,2)) # B x C x T --> B x T x C
             else:
                 e = self.conv(z.transpose(1,2)).transpose(1,2) # B x C x T --> B x T x C
-        if outpad_right > 0:
+        if lengths is not None:
+            # valid frames of mixed-length batch (B), i.e., without receptive-field padding
+            e, h = gru_lengths(self.gru, e, lengths, h=h, outpad_right=outpad_right)
+        elif outpad_right > 0:
             # GRU e layers
             if h is None:
                 out, h = self.gru(e[:,:-outpad_right]) # B x T x C
@@ -1430,7 +1850,7 @@ class GRU_LAT_FEAT_CLASSIFIER(nn.Module):
         else:
             self.apply(initialize)
 
-    def forward(self, lat=None, feat=None, feat_aux=None, spk_aux=None, h=None, do=False):
+    def forward(self, lat=None, feat=None, feat_aux=None, spk_aux=None, h=None, do=False, lengths=None):
         # Input layers
         if lat is not None:
             c = self.conv_lat(lat.transpose(1,2)).transpose(1,2)
@@ -1441,7 +1861,10 @@ class GRU_LAT_FEAT_CLASSIFIER(nn.Module):
         else:
             c = self.conv_feat(feat.transpose(1,2)).transpose(1,2)
         # GRU layers
-        if h is not None:
+        if lengths is not None:
+            # valid frames of mixed-length batch (B)
+            out, h = gru_lengths(self.gru, c, lengths, h=h)
+        elif h is not None:
             out, h = self.gru(c, h) # B x T x C
         else:
             out, h = self.gru(c) # B x T x C
@@ -1551,7 +1974,7 @@ class GRU_SPK(nn.Module):
         else:
             self.apply(initialize)
 
-    def forward(self, y, z=None, h=None, do=False, outpad_right=0):
+    def forward(self, y, z=None, h=None, do=False, outpad_right=0, lengths=None):
         if len(y.shape) == 2:
             y = F.one_hot(y, num_classes=self.n_spk).float()
         if self.scale_in_flag:
@@ -1570,7 +1993,10 @@ class GRU_SPK(nn.Module):
             else:
                 z = self.conv(z.transpose(1,2)).transpose(1,2) # B x C x T --> B x T x C
         # GRU layers
-        if outpad_right > 0:
+        if lengths is not None:
+            # valid frames of mixed-length batch (B), i.e., without receptive-field padding
+            e, h = gru_lengths(self.gru, z, lengths, h=h, outpad_right=outpad_right)
+        elif outpad_right > 0:
             if h is None:
                 out, h = self.gru(z[:,:-outpad_right]) # B x T x C
             else:
@@ -1590,10 +2016,8 @@ class GRU_SPK(nn.Module):
 
         if self.n_weight_emb is not None:
             weight_emb = torch.tanh(torch.clamp(e, min=MIN_CLAMP, max=MAX_CLAMP)) # B x T x n_weight
-            out = self.embed_spk.weight[0].unsqueeze(0).unsqueeze(1)*weight_emb[:,:,:1] # 1 x 1 x emb_dim * B x T x 1
-            for i in range(1,self.n_weight_emb):
-                out = torch.cat((out, self.embed_spk.weight[i].unsqueeze(0).unsqueeze(1)*weight_emb[:,:,i:i+1]), 2) # 1 x 1 x emb_dim * B x T x 1
-            # B x T x emb_dim*n_weight
+            # B x T x n_weight x 1 * n_weight x emb_dim --> B x T x emb_dim*n_weight
+            out = (weight_emb.unsqueeze(-1)*self.embed_spk.weight).reshape(weight_emb.shape[0], weight_emb.shape[1], -1)
             return out, h.detach()
         else:
             return F.tanhshrink(torch.clamp(e, min=MIN_CLAMP, max=MAX_CLAMP)), h.detach()
@@ -1637,6 +2061,7 @@ class SPKID_TRANSFORM_LAYER(nn.Module):
         if self.conv_emb_flag and self.emb_dim is None:
             self.emb_dim = self.n_spk
         self.use_weight_norm = use_weight_norm
+        self.spk_code_table = None
 
         if self.spkidtr_dim is not None:
             if self.conv_emb_flag:
@@ -1677,40 +2102,63 @@ class SPKID_TRANSFORM_LAYER(nn.Module):
         else:
             self.apply(initialize)
 
-    def forward(self, x):
-        # in: B x T
+    def transform(self, y):
+        # in: B x n_spk x T (one-hot)
         # out: B x T x C
         if self.spkidtr_dim is not None:
             if self.n_weight_emb is not None:
                 if self.conv_emb_flag:
-                    weight_emb = torch.tanh(torch.clamp(self.deconv(F.tanhshrink(torch.clamp(self.conv(self.conv_emb(F.one_hot(x, num_classes=self.n_spk).float().transpose(1,2))),
+                    weight_emb = torch.tanh(torch.clamp(self.deconv(F.tanhshrink(torch.clamp(self.conv(self.conv_emb(y)),
                                                 min=MIN_CLAMP, max=MAX_CLAMP))), min=MIN_CLAMP, max=MAX_CLAMP)).transpose(1,2) # B x T x n_weight
                 else:
-                    weight_emb = torch.tanh(torch.clamp(self.deconv(F.tanhshrink(torch.clamp(self.conv(F.one_hot(x, num_classes=self.n_spk).float().transpose(1,2)),
+                    weight_emb = torch.tanh(torch.clamp(self.deconv(F.tanhshrink(torch.clamp(self.conv(y),
                                                 min=MIN_CLAMP, max=MAX_CLAMP))), min=MIN_CLAMP, max=MAX_CLAMP)).transpose(1,2) # B x T x n_weight
-                out = self.embed_spk.weight[0].unsqueeze(0).unsqueeze(1)*weight_emb[:,:,:1] # 1 x 1 x emb_dim * B x T x 1
-                for i in range(1,self.n_weight_emb):
-                    out = torch.cat((out, self.embed_spk.weight[i].unsqueeze(0).unsqueeze(1)*weight_emb[:,:,i:i+1]), 2) # 1 x 1 x emb_dim * B x T x 1
-                # B x T x emb_dim*n_weight
+                # B x T x n_weight x 1 * n_weight x emb_dim --> B x T x emb_dim*n_weight
+                out = (weight_emb.unsqueeze(-1)*self.embed_spk.weight).reshape(weight_emb.shape[0], weight_emb.shape[1], -1)
                 return weight_emb, out
             else:
                 if self.conv_emb_flag:
-                    return self.deconv(F.tanhshrink(torch.clamp(self.conv(self.conv_emb(F.one_hot(x, num_classes=self.n_spk).float().transpose(1,2))), min=MIN_CLAMP, max=MAX_CLAMP))).transpose(1,2)
+                    return self.deconv(F.tanhshrink(torch.clamp(self.conv(self.conv_emb(y)), min=MIN_CLAMP, max=MAX_CLAMP))).transpose(1,2)
                 else:
-                    return self.deconv(F.tanhshrink(torch.clamp(self.conv(F.one_hot(x, num_classes=self.n_spk).float().transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP))).transpose(1,2)
+                    return self.deconv(F.tanhshrink(torch.clamp(self.conv(y), min=MIN_CLAMP, max=MAX_CLAMP))).transpose(1,2)
         else:
             if self.n_weight_emb is not None:
                 if self.conv_emb_flag:
-                    weight_emb = torch.tanh(torch.clamp(self.conv(self.conv_emb(F.one_hot(x, num_classes=self.n_spk).float().transpose(1,2))), min=MIN_CLAMP, max=MAX_CLAMP)).transpose(1,2) # B x T x n_weight
+                    weight_emb = torch.tanh(torch.clamp(self.conv(self.conv_emb(y)), min=MIN_CLAMP, max=MAX_CLAMP)).transpose(1,2) # B x T x n_weight
                 else:
-                    weight_emb = torch.tanh(torch.clamp(self.conv(F.one_hot(x, num_classes=self.n_spk).float().transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP)).transpose(1,2) # B x T x n_weight
-                out = self.embed_spk.weight[0].unsqueeze(0).unsqueeze(1)*weight_emb[:,:,:1] # 1 x 1 x emb_dim * B x T x 1
-                for i in range(1,self.n_weight_emb):
-                    out = torch.cat((out, self.embed_spk.weight[i].unsqueeze(0).unsqueeze(1)*weight_emb[:,:,i:i+1]), 2) # 1 x 1 x emb_dim * B x T x 1
-                # B x T x emb_dim*n_weight
+                    weight_emb = torch.tanh(torch.clamp(self.conv(y), min=MIN_CLAMP, max=MAX_CLAMP)).transpose(1,2) # B x T x n_weight
+                # B x T x n_weight x 1 * n_weight x emb_dim --> B x T x emb_dim*n_weight
+                out = (weight_emb.unsqueeze(-1)*self.embed_spk.weight).reshape(weight_emb.shape[0], weight_emb.shape[1], -1)
                 return weight_emb, out
             else:
-                return self.conv(F.one_hot(x, num_classes=self.n_spk).float().transpose(1,2)).transpose(1,2)
+                return self.conv(y).transpose(1,2)
+
+    def forward(self, x):
+        # in: B x T
+        # out: B x T x C
+        # all layers are frame-wise, so the codes are computed once for every speaker id [1 x n_spk x C]
+        # and gathered with the input ids, instead of transforming a B x T one-hot matrix
+        if self.spk_code_table is not None and not self.training and not torch.is_grad_enabled():
+            table = self.spk_code_table
+        else:
+            table = self.transform(torch.eye(self.n_spk, device=x.device).unsqueeze(0))
+            if not self.training and not torch.is_grad_enabled():
+                self.spk_code_table = table # memoized in eval mode, cleared on mode/device change or params loading
+        if isinstance(table, tuple):
+            return table[0][0][x], table[1][0][x]
+        return table[0][x]
+
+    def train(self, mode=True):
+        self.spk_code_table = None
+        return super(SPKID_TRANSFORM_LAYER, self).train(mode)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.spk_code_table = None
+        return super(SPKID_TRANSFORM_LAYER, self)._load_from_state_dict(*args, **kwargs)
+
+    def _apply(self, fn):
+        self.spk_code_table = None
+        return super(SPKID_TRANSFORM_LAYER, self)._apply(fn)
 
     def apply_weight_norm(self):
         """Apply weight normalization module from all of the layers."""
@@ -1811,7 +2259,7 @@ class GRU_EXCIT_DECODER(nn.Module):
         else:
             self.apply(initialize)
 
-    def forward(self, z, y=None, aux=None, h=None, do=False, outpad_right=0):
+    def forward(self, z, y=None, aux=None, h=None, do=False, outpad_right=0, lengths=None):
         if y is not None:
             if aux is not None:
                 if len(y.shape) == 2:
@@ -1836,7 +2284,10 @@ class GRU_EXCIT_DECODER(nn.Module):
                 e = self.conv_drop(self.conv(z.transpose(1,2)).transpose(1,2)) # B x C x T --> B x T x C
             else:
                 e = self.conv(z.transpose(1,2)).transpose(1,2) # B x C x T --> B x T x C
-        if outpad_right > 0:
+        if lengths is not None:
+            # valid frames of mixed-length batch (B), i.e., without receptive-field padding
+            e, h = gru_lengths(self.gru, e, lengths, h=h, outpad_right=outpad_right)
+        elif outpad_right > 0:
             # GRU e layers
             if h is None:
                 out, h = self.gru(e[:,:-outpad_right]) # B x T x C
@@ -2228,9 +2679,29 @@ class GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF(nn.Module):
 
             return seg_conv.transpose(1,2), conv_sc, out, out_2, out_f, logits_c, logits_f, h, h_2, h_f
 
-    def generate(self, c, intervals=4000, spk_code=None, spk_aux=None, aux=None, outpad_left=None, outpad_right=None, pad_first=True):
-        start = time.time()
-        time_sample = []
+    def generate(self, c, intervals=4000, spk_code=None, spk_aux=None, aux=None, outpad_left=None, outpad_right=None, pad_first=True,
+            time_samples=False):
+        """Sample multiband waveform codes autoregressively
+
+        The output codes are written into preallocated tensors, and the last K (lpc) samples are kept in ring buffers
+        of 2K length, where each sample is written at pos and pos+K, so that [pos:pos+K] is the window of
+        the most recent first without shifting. The conditioning parts of the input projections of the GRUs
+        are computed once for all frames, and each sample step computes only the sample-dependent parts (GRUStep),
+        with the embeddings of the previous codes as lookup tables of their input-weight contributions.
+        The tables are built by build_gru_steps() once after loading, otherwise in every call,
+        and rebuilt if the weights, the layers, or the device of the GRUs are changed after they are built.
+
+        Args:
+            c (Tensor): conditioning features (B x T_frm x C)
+            intervals (int): number of samples between progress logs
+            pad_first (bool): flag to replicate-pad the receptive field of the input conv.
+            time_samples (bool): flag to measure the time of every sample, i.e., per-sample statistics
+
+        Return:
+            (Tensor): multiband waveform (B x n_bands x T)
+        """
+        start = start_total = time.time()
+        time_sample = [] if time_samples else None
         #intervals /= self.n_bands
         intervals = 1000
 
@@ -2252,141 +2723,135 @@ class GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND_CF(nn.Module):
         #c = F.pad(c.transpose(1,2), (self.pad_left,self.pad_right), "replicate").transpose(1,2)
         #c = self.conv_s_c(self.conv(self.scale_in(c.transpose(1,2)))).transpose(1,2)
 
-        if self.lpc > 0:
-            x_c_lpc = torch.empty(B,1,self.n_bands,self.lpc).cuda().fill_(c_pad).long() # B x 1 x n_bands x K
-            x_f_lpc = torch.empty(B,1,self.n_bands,self.lpc).cuda().fill_(f_pad).long() # B x 1 x n_bands x K
         T = c.shape[1]*upsampling_factor
-
-        c_f = c[:,:1]
-        out, h = self.gru(torch.cat((c_f,self.embed_c_wav(torch.empty(B,1,self.n_bands).cuda().fill_(c_pad).long()).reshape(B,1,-1),
-                                        self.embed_f_wav(torch.empty(B,1,self.n_bands).cuda().fill_(f_pad).long()).reshape(B,1,-1)),2))
-        out, h_2 = self.gru_2(torch.cat((c_f,out), 2))
-        if self.lpc > 0:
-            # coarse part
-            signs_c, scales_c, logits_c = self.out(out.transpose(1,2)) # B x 1 x n_bands x K or 32
-            if self.emb_flag:
-                dist = OneHotCategorical(F.softmax(torch.clamp(logits_c + torch.sum(self.logits(x_c_lpc)*(signs_c*scales_c).unsqueeze(-1)\
-                            *self.logits_c(x_c_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-                            #*torch.tanh(self.logits_sgns_c(x_c_lpc))*torch.exp(self.logits_mags_c(x_c_lpc)), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-            else:
-                dist = OneHotCategorical(F.softmax(torch.clamp(logits_c + torch.sum((signs_c*scales_c).unsqueeze(-1)*self.logits(x_c_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-            # B x 1 x n_bands x 256, B x 1 x n_bands x K x 256 --> B x 1 x n_bands x 2 x 256
-            x_c_out = x_c_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
-            x_c_lpc[:,:,:,1:] = x_c_lpc[:,:,:,:-1]
-            x_c_lpc[:,:,:,0] = x_c_wav
-            # fine part
-            embed_x_c_wav = self.embed_c_wav(x_c_wav).reshape(B,1,-1)
-            out, h_f = self.gru_f(torch.cat((c_f, embed_x_c_wav, out), 2))
-            signs_f, scales_f, logits_f = self.out_f(out.transpose(1,2)) # B x 1 x n_bands x K or 32
-            if self.emb_flag:
-                dist = OneHotCategorical(F.softmax(torch.clamp(logits_f + torch.sum(self.logits(x_f_lpc)*(signs_f*scales_f).unsqueeze(-1)\
-                            *self.logits_f(x_f_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-                            #*torch.tanh(self.logits_sgns_f(x_f_lpc))*torch.exp(self.logits_mags_f(x_f_lpc)), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-            else:
-                dist = OneHotCategorical(F.softmax(torch.clamp(logits_f + torch.sum((signs_f*scales_f).unsqueeze(-1)*self.logits(x_f_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-            x_f_out = x_f_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
-            x_f_lpc[:,:,:,1:] = x_f_lpc[:,:,:,:-1]
-            x_f_lpc[:,:,:,0] = x_f_wav
-        else:
-            # coarse part
-            dist = OneHotCategorical(F.softmax(torch.clamp(self.out(out.transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-            x_c_out = x_c_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
-            # fine part
-            embed_x_c_wav = self.embed_c_wav(x_c_wav).reshape(B,1,-1)
-            out, h_f = self.gru_f(torch.cat((c_f, embed_x_c_wav, out), 2))
-            dist = OneHotCategorical(F.softmax(torch.clamp(self.out_f(out.transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-            x_f_out = x_f_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
-
-        time_sample.append(time.time()-start)
+        x_c_out = torch.empty(B,T,self.n_bands, dtype=torch.long, device=c.device) # B x T x n_bands
+        x_f_out = torch.empty(B,T,self.n_bands, dtype=torch.long, device=c.device) # B x T x n_bands
         if self.lpc > 0:
-            for t in range(1,T):
+            x_c_ring = torch.empty(B,1,self.n_bands,self.lpc*2, dtype=torch.long, device=c.device).fill_(c_pad) # B x 1 x n_bands x 2K
+            x_f_ring = torch.empty(B,1,self.n_bands,self.lpc*2, dtype=torch.long, device=c.device).fill_(f_pad) # B x 1 x n_bands x 2K
+            pos = 0
+            x_c_lpc = x_c_ring[:,:,:,pos:pos+self.lpc] # B x 1 x n_bands x K
+            x_f_lpc = x_f_ring[:,:,:,pos:pos+self.lpc] # B x 1 x n_bands x K
+
+        # conditioning parts of the input projections of the GRUs for all frames, the steps compute only the sample parts
+        if getattr(self, "gru_steps", None) is None:
+            gru, gru_2, gru_f = self.build_gru_steps(cache=False)
+        elif self.gru_steps_key != self.get_gru_steps_key():
+            logging.info("weights, layers, or device of the GRUs are changed, gru_steps are rebuilt")
+            gru, gru_2, gru_f = self.build_gru_steps()
+        else:
+            gru, gru_2, gru_f = self.gru_steps
+        c_gru = gru.precompute(c) # B x T_frm x 3*hidden_units
+        c_gru_2 = gru_2.precompute(c) # B x T_frm x 3*hidden_units_2
+        c_gru_f = gru_f.precompute(c) # B x T_frm x 3*hidden_units_2
+
+        x_c_wav = torch.empty(B,1,self.n_bands, dtype=torch.long, device=c.device).fill_(c_pad)
+        x_f_wav = torch.empty(B,1,self.n_bands, dtype=torch.long, device=c.device).fill_(f_pad)
+        h = c.new_zeros(B,self.hidden_units)
+        h_2 = c.new_zeros(B,self.hidden_units_2)
+        h_f = c.new_zeros(B,self.hidden_units_2)
+        for t in range(T):
+            if time_samples:
                 start_sample = time.time()
 
-                if t % upsampling_factor  == 0:
-                    idx_t_f = t//upsampling_factor
-                    c_f = c[:,idx_t_f:idx_t_f+1]
+            if t % upsampling_factor  == 0:
+                idx_t_f = t//upsampling_factor
+                c_gru_t, c_gru_2_t, c_gru_f_t = c_gru[:,idx_t_f], c_gru_2[:,idx_t_f], c_gru_f[:,idx_t_f]
 
-                out, h = self.gru(torch.cat((c_f, embed_x_c_wav, self.embed_f_wav(x_f_wav).reshape(B,1,-1)),2), h)
-                out, h_2 = self.gru_2(torch.cat((c_f,out), 2), h_2)
+            h = gru.step(c_gru_t, h, codes=(x_c_wav[:,0], x_f_wav[:,0]))
+            h_2 = gru_2.step(c_gru_2_t, h_2, x=h)
+            out = h_2.unsqueeze(-1) # B x C x 1
 
-                # coarse part
-                signs_c, scales_c, logits_c = self.out(out.transpose(1,2)) # B x 1 x n_bands x K or 32
+            # coarse part
+            if self.lpc > 0:
+                signs_c, scales_c, logits_c = self.out(out) # B x 1 x n_bands x K or 32
                 if self.emb_flag:
                     dist = OneHotCategorical(F.softmax(torch.clamp(logits_c + torch.sum(self.logits(x_c_lpc)*(signs_c*scales_c).unsqueeze(-1)\
                                 *self.logits_c(x_c_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-                                #*torch.tanh(self.logits_sgns_c(x_c_lpc))*torch.exp(self.logits_mags_c(x_c_lpc)), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
                 else:
                     dist = OneHotCategorical(F.softmax(torch.clamp(logits_c + torch.sum((signs_c*scales_c).unsqueeze(-1)*self.logits(x_c_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-                x_c_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands x 2
-                x_c_out = torch.cat((x_c_out, x_c_wav), 1) # B x t+1 x n_bands
-                x_c_lpc[:,:,:,1:] = x_c_lpc[:,:,:,:-1]
-                x_c_lpc[:,:,:,0] = x_c_wav
-
-                # fine part
-                embed_x_c_wav = self.embed_c_wav(x_c_wav).reshape(B,1,-1)
-                out, h_f = self.gru_f(torch.cat((c_f, embed_x_c_wav, out), 2), h_f)
-                signs_f, scales_f, logits_f = self.out_f(out.transpose(1,2)) # B x 1 x n_bands x K or 32
+                # B x 1 x n_bands x 256, B x 1 x n_bands x K x 256 --> B x 1 x n_bands x 2 x 256
+            else:
+                dist = OneHotCategorical(F.softmax(torch.clamp(self.out(out), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+            x_c_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
+            x_c_out[:,t] = x_c_wav[:,0]
+
+            # fine part
+            h_f = gru_f.step(c_gru_f_t, h_f, codes=(x_c_wav[:,0],), x=h_2)
+            out = h_f.unsqueeze(-1) # B x C x 1
+            if self.lpc > 0:
+                signs_f, scales_f, logits_f = self.out_f(out) # B x 1 x n_bands x K or 32
                 if self.emb_flag:
                     dist = OneHotCategorical(F.softmax(torch.clamp(logits_f + torch.sum(self.logits(x_f_lpc)*(signs_f*scales_f).unsqueeze(-1)\
                                 *self.logits_f(x_f_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-                                #*torch.tanh(self.logits_sgns_f(x_f_lpc))*torch.exp(self.logits_mags_f(x_f_lpc)), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
                 else:
                     dist = OneHotCategorical(F.softmax(torch.clamp(logits_f + torch.sum((signs_f*scales_f).unsqueeze(-1)*self.logits(x_f_lpc), 3), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-                x_f_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
-                x_f_out = torch.cat((x_f_out, x_f_wav), 1) # B x t+1 x n_bands
-                x_f_lpc[:,:,:,1:] = x_f_lpc[:,:,:,:-1]
-                x_f_lpc[:,:,:,0] = x_f_wav
-
-                time_sample.append(time.time()-start_sample)
-                if (t + 1) % intervals == 0:
-                    logging.info("%d/%d estimated time = %.6f sec (%.6f sec / sample)" % (
-                        (t + 1), T,
-                        ((T - t - 1) / intervals) * (time.time() - start),
-                        (time.time() - start) / intervals))
-                    start = time.time()
-        else:
-            for t in range(1,T):
-                start_sample = time.time()
-
-                if t % upsampling_factor  == 0:
-                    idx_t_f = t//upsampling_factor
-                    c_f = c[:,idx_t_f:idx_t_f+1]
-
-                out, h = self.gru(torch.cat((c_f, embed_x_c_wav, self.embed_f_wav(x_f_wav).reshape(B,1,-1)),2), h)
-                out, h_2 = self.gru_2(torch.cat((c_f,out),2), h_2)
-
-                # coarse part
-                dist = OneHotCategorical(F.softmax(torch.clamp(self.out(out.transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-                x_c_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
-                x_c_out = torch.cat((x_c_out, x_c_wav), 1) # B x t+1 x n_bands
-
-                # fine part
-                embed_x_c_wav = self.embed_c_wav(x_c_wav).reshape(B,1,-1)
-                out, h_f = self.gru_f(torch.cat((c_f, embed_x_c_wav, out), 2), h_f)
-                dist = OneHotCategorical(F.softmax(torch.clamp(self.out_f(out.transpose(1,2)), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
-                x_f_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
-                x_f_out = torch.cat((x_f_out, x_f_wav), 1) # B x t+1 x n_bands
+            else:
+                dist = OneHotCategorical(F.softmax(torch.clamp(self.out_f(out), min=MIN_CLAMP, max=MAX_CLAMP), dim=-1))
+            x_f_wav = dist.sample().argmax(dim=-1) # B x 1 x n_bands
+            x_f_out[:,t] = x_f_wav[:,0]
 
+            if self.lpc > 0:
+                # most recent sample at the head of the window
+                pos = (pos - 1) % self.lpc
+                x_c_ring[:,:,:,pos] = x_c_ring[:,:,:,pos+self.lpc] = x_c_wav
+                x_f_ring[:,:,:,pos] = x_f_ring[:,:,:,pos+self.lpc] = x_f_wav
+                x_c_lpc = x_c_ring[:,:,:,pos:pos+self.lpc]
+                x_f_lpc = x_f_ring[:,:,:,pos:pos+self.lpc]
+
+            if time_samples:
                 time_sample.append(time.time()-start_sample)
-                if (t + 1) % intervals == 0:
-                    logging.info("%d/%d estimated time = %.6f sec (%.6f sec / sample)" % (
-                        (t + 1), T,
-                        ((T - t - 1) / intervals) * (time.time() - start),
-                        (time.time() - start) / intervals))
-                    start = time.time()
-
-        time_sample = np.array(time_sample)
-        logging.info("average time / sample = %.6f sec (%ld samples) [%.3f kHz/s]" % \
-                        (np.mean(time_sample), len(time_sample), 1.0/(1000*np.mean(time_sample))))
+            if (t + 1) % intervals == 0:
+                logging.info("%d/%d estimated time = %.6f sec (%.6f sec / sample)" % (
+                    (t + 1), T,
+                    ((T - t - 1) / intervals) * (time.time() - start),
+                    (time.time() - start) / intervals))
+                start = time.time()
+
+        if time_samples:
+            time_sample = np.array(time_sample)
+            logging.info("average time / sample = %.6f sec (%ld samples) [%.3f kHz/s]" % \
+                            (np.mean(time_sample), len(time_sample), 1.0/(1000*np.mean(time_sample))))
+        time_total = time.time() - start_total
         logging.info("average throughput / sample = %.6f sec (%ld samples * %ld) [%.3f kHz/s]" % \
-                        (np.sum(time_sample)/(len(time_sample)*c.shape[0]), len(time_sample), c.shape[0], \
-                            len(time_sample)*c.shape[0]/(1000*np.sum(time_sample))))
+                        (time_total/(T*B), T, B, T*B/(1000*time_total)))
 
         if self.n_quantize == 65536:
             return ((x_c_out*self.cf_dim+x_f_out).transpose(1,2).float() - 32768.0) / 32768.0 # B x T x n_bands --> B x n_bands x T
         else:
             return decode_mu_law_torch((x_c_out*self.cf_dim+x_f_out).transpose(1,2).float(), mu=self.n_quantize) # B x T x n_bands --> B x n_bands x T
 
+    def build_gru_steps(self, cache=True):
+        """Build single-step GRUs of generate() with the lookup tables of the sample embeddings
+
+        Should be called after the weights and the GRU layers are final, e.g., after loading and replace_sparse_gru,
+        otherwise the cached ones are rebuilt by generate().
+
+        Args:
+            cache (bool): flag to keep them for the following generate() calls
+
+        Return:
+            (tuple): GRUStep of gru, gru_2, and gru_f
+        """
+        gru_steps = (GRUStep(self.gru, self.s_dim, embeds=[(self.embed_c_wav, self.n_bands), (self.embed_f_wav, self.n_bands)]),
+                        GRUStep(self.gru_2, self.s_dim),
+                        GRUStep(self.gru_f, self.s_dim, embeds=[(self.embed_c_wav, self.n_bands)]))
+        if cache:
+            self.gru_steps = gru_steps
+            self.gru_steps_key = self.get_gru_steps_key()
+        return gru_steps
+
+    def get_gru_steps_key(self):
+        """Key of the weights taken by build_gru_steps(), which is changed by loading (in-place copy, i.e., version),
+        replacing the GRU layers (module), e.g., replace_sparse_gru, or moving / casting them (storage, dtype, device)
+
+        Return:
+            (tuple): module, and storage pointer, version, dtype, and device of each parameter / buffer
+        """
+        return tuple((id(module),) + tuple((tensor.data_ptr(), tensor._version, tensor.dtype, tensor.device) \
+                        for tensor in list(module.parameters()) + list(module.buffers())) \
+                            for module in (self.gru, self.gru_2, self.gru_f, self.embed_c_wav, self.embed_f_wav))
+
     def apply_weight_norm(self):
         """Apply weight normalization module from all of the layers."""
         def _apply_weight_norm(m):
@@ -2525,11 +2990,11 @@ class GRU_WAVE_DECODER_DUALGRU_COMPACT_MBAND(nn.Module):
         c = F.pad(c.transpose(1,2), (self.pad_left,self.pad_right), "replicate").transpose(1,2)
         c = self.conv_s_c(self.conv(self.scale_in(c.transpose(1,2)))).transpose(1,2)
         if self.lpc > 0:
-            x_lpc = torch.empty(B,1,self.n_bands,self.lpc).cuda().fill_(self.n_quantize // 2).long() # B x 1 x n_bands x K
+            x_lpc = torch.empty(B,1,self.n_bands,self.lpc, dtype=torch.long, device=c.device).fill_(self.n_quantize // 2) # B x 1 x n_bands x K
         T = c.shape[1]*upsampling_factor
 
         c_f = c[:,:1]
-        out, h = self.gru(torch.cat((c_f,self.embed_wav(torch.empty(B,1,self.n_bands).cuda().fill_(self.n_quantize//2).long()).reshape(B,1,-1)),2))
+        out, h = self.gru(torch.cat((c_f,self.embed_wav(torch.empty(B,1,self.n_bands, dtype=torch.long, device=c.device).fill_(self.n_quantize//2)).reshape(B,1,-1)),2))
         out, h_2 = self.gru_2(torch.cat((c_f,out),2))
         if self.lpc > 0:
             signs, scales, logits = self.out(out.transpose(1,2)) # B x T x C -> B x C x T -> B x T x C
@@ -2694,6 +3159,7 @@ class GaussLoss(nn.Module):
             self.c = self.dim*0.91893853320467274178032973640562 #-(k/2)log(2*pi)
     #    self.sum =sum
 
+    @fp32_island
     def forward(self, mu, s, target):
         #logdet = -0.5*torch.sum(torch.log(s), -1)
         #mhndist = -0.5*torch.sum((mu-target)**2/s, -1)
@@ -3033,6 +3499,25 @@ class DSWNV(nn.Module):
             return samples_list
 
 
+def stft_loss_terms(mag):
+    """FUNCTION TO COMPUTE STFT MAGNITUDE LOSS TERMS OF PREDICTED / GROUNDTRUTH PAIRS
+
+    Args:
+        mag (Tensor): clamped magnitudes of predicted signals stacked on top of groundtruth signals (2*B x N x T)
+
+    Return:
+        (Tensor): frobenius-norm + L1-norm (spectral convergence) loss (B)
+        (Tensor): log-spectral distance in dB (B)
+    """
+    x_mag, y_mag = mag.chunk(2)
+    x_log, y_log = torch.log10(mag).chunk(2)
+    err = y_mag - x_mag
+    fro = torch.norm(err, 'fro', dim=(1,2)) / torch.norm(y_mag, 'fro', dim=(1,2))
+    l1 = err.abs().sum((1,2)) / y_mag.sum((1,2))
+    dB = torch.mean(torch.sqrt(torch.mean((20*(x_log-y_log))**2, 1)), -1)
+    return fro+l1, dB
+
+
 class STFTLoss(torch.nn.Module):
     """STFT loss module."""
 
@@ -3042,7 +3527,13 @@ class STFTLoss(torch.nn.Module):
         self.fft_size = fft_size
         self.shift_size = shift_size
         self.win_length = win_length
-        self.window = getattr(torch, window)(win_length).cuda()
+        self.register_buffer("window", getattr(torch, window)(win_length), persistent=False)
+
+    def magnitude(self, x, center=True):
+        """Clamped STFT magnitude of signals (B, T) --> (B, N, T') [N: freq_bins, T': frames]"""
+        x_stft = torch.stft(x, self.fft_size, self.shift_size, self.win_length, self.window, center=center,
+                    return_complex=True)
+        return torch.clamp(x_stft.abs(), min=1e-16)
 
     def forward(self, x, y):
         """Calculate forward propagation.
@@ -3052,44 +3543,14 @@ class STFTLoss(torch.nn.Module):
             y (Tensor): Groundtruth signal (B, T) or (T).
 
         Returns:
-            Tensor: Frobenius-norm STFT magnitude loss (B) or (1)
-            Tensor: L1-norm STFT magnitude loss (B) or (1)
+            Tensor: Frobenius-norm + L1-norm STFT magnitude loss (B) or (1)
+            Tensor: log-spectral distance in dB (B) or (1)
 
         """
-        # torch.stft --> * x N x T x 2 [N: freq_bins, T: frames, 2: real-imag]
-        #logging.info(x.shape)
-        #logging.info(y.shape)
-        x_stft = torch.stft(x, self.fft_size, self.shift_size, self.win_length, self.window, return_complex=False)
-        #logging.info(x_stft.shape)
-        y_stft = torch.stft(y, self.fft_size, self.shift_size, self.win_length, self.window, return_complex=False)
-        #logging.info(y_stft.shape)
-        if len(x.shape) > 1:
-            x_mag = torch.clamp(torch.sqrt(x_stft[..., 0]**2 + x_stft[..., 1]**2).transpose(2, 1), min=1e-16)
-            y_mag = torch.clamp(torch.sqrt(y_stft[..., 0]**2 + y_stft[..., 1]**2).transpose(2, 1), min=1e-16)
-            #x_mag = torch.clamp(torch.sqrt(x_stft[..., 0]**2 + x_stft[..., 1]**2).transpose(2, 1), min=1.2e-7)
-            #y_mag = torch.clamp(torch.sqrt(y_stft[..., 0]**2 + y_stft[..., 1]**2).transpose(2, 1), min=1.2e-7)
-        #    logging.info("BxT")
-        #    logging.info(x_mag.shape)
-        #    logging.info(y_mag.shape)
-            err = y_mag - x_mag
-            fro = torch.norm(err, 'fro', dim=(1,2)) / torch.norm(y_mag, 'fro', dim=(1,2)) # (B)
-            l1 = err.abs().sum(-1).sum(-1) / y_mag.sum(-1).sum(-1)
-            dB = torch.mean(torch.sqrt(torch.mean((20*(torch.log10(x_mag)-torch.log10(y_mag)))**2, -1)), -1)
-        else:
-            x_mag = torch.clamp(torch.sqrt(x_stft[..., 0]**2 + x_stft[..., 1]**2).transpose(1, 0), min=1e-16)
-            y_mag = torch.clamp(torch.sqrt(y_stft[..., 0]**2 + y_stft[..., 1]**2).transpose(1, 0), min=1e-16)
-            #x_mag = torch.clamp(torch.sqrt(x_stft[..., 0]**2 + x_stft[..., 1]**2).transpose(1, 0), min=1.2e-7)
-            #y_mag = torch.clamp(torch.sqrt(y_stft[..., 0]**2 + y_stft[..., 1]**2).transpose(1, 0), min=1.2e-7)
-        #    logging.info("T")
-        #    logging.info(x_mag.shape)
-        #    logging.info(y_mag.shape)
-            err = y_mag - x_mag
-            fro = torch.norm(err, 'fro') / torch.norm(y_mag, 'fro') # (1)
-            l1 = err.abs().sum() / y_mag.sum()
-            dB = torch.mean(torch.sqrt(torch.mean((20*(torch.log10(x_mag)-torch.log10(y_mag)))**2, -1)))
-
-        #return fro, l1
-        return fro+l1, dB
+        T = x.shape[-1]
+        # predicted and groundtruth signals in one stft call
+        fro_l1, dB = stft_loss_terms(self.magnitude(torch.cat((x.reshape(-1, T), y.reshape(-1, T)))))
+        return fro_l1.reshape(x.shape[:-1]), dB.reshape(x.shape[:-1])
 
 
 class MultiResolutionSTFTLoss(torch.nn.Module):
@@ -3136,77 +3597,41 @@ class MultiResolutionSTFTLoss(torch.nn.Module):
     def forward(self, x, y):
         """Calculate forward propagation.
 
+        The predicted and groundtruth signals are stacked into one batch and reflect-padded once for the largest
+        FFT size, the padding of each resolution being a slice of it. The resolutions with non-finite loss are
+        masked out of the average on the device, instead of being checked on the host.
+
         Args:
-            x (Tensor): Predicted signal (B, T) or (T).
-            y (Tensor): Groundtruth signal (B, T) or (T).
+            x (Tensor): Predicted signal (B, N, T), (B, T), or (T).
+            y (Tensor): Groundtruth signal (B, N, T), (B, T), or (T).
 
         Returns:
-            Tensor: Multi resolution frobenius-norm STFT magnitude loss (B) or (1)
-            Tensor: Multi resolution L1-norm STFT magnitude loss (B) or (1)
+            Tensor: Multi resolution frobenius-norm + L1-norm STFT magnitude loss (B, N), (B), or (1)
+            Tensor: Multi resolution log-spectral distance in dB (B, N), (B), or (1)
 
         """
-        fro_count = 0
-        l1_count = 0
-        if len(x.shape) > 1:
-            B = x.shape[0]
-            if len(x.shape) > 2:
-                N = x.shape[1]
-                x = x.reshape(B*N,-1)
-                y = y.reshape(B*N,-1)
-            else:
-                N = 0
-        else:
-            B = 0
-            N = 0
-        for i in range(self.n_fft_confs):
-            #logging.info(x.shape[-1])
-            #logging.info(self.fft_sizes[i])
-            #logging.info(self.win_lengths[i])
-            #logging.info(self.pad_sizes[i])
-            if x.shape[-1] > (self.fft_sizes[i]//2):
-            #if x.shape[-1] > self.pad_sizes[i]:
-            #    logging.info("pad-%d"%(i))
-                fro, l1 = self.stft_losses[i](x, y)
-                if fro_count > 0:
-                    if not torch.isinf(fro.sum()) and not torch.isnan(fro.sum()):
-                        fro_loss = torch.cat((fro_loss, fro.unsqueeze(-1)), -1)
-                        fro_count += 1
-                    else:
-                        logging.info("nan_1")
-                else:
-                    if not torch.isinf(fro.sum()) and not torch.isnan(fro.sum()):
-                        fro_loss = fro.unsqueeze(-1)
-                        fro_count += 1
-                    else:
-                        logging.info("nan_2")
-                if l1_count > 0:
-                    if not torch.isinf(l1.sum()) and not torch.isnan(l1.sum()):
-                        l1_loss = torch.cat((l1_loss, l1.unsqueeze(-1)), -1)
-                        l1_count += 1
-                    else:
-                        logging.info("nan_3")
-                else:
-                    if not torch.isinf(l1.sum()) and not torch.isnan(l1.sum()):
-                        l1_loss = l1.unsqueeze(-1)
-                        l1_count += 1
-                    else:
-                        logging.info("nan_4")
-        if fro_count == 0:
-            if len(x.shape) > 1:
-                fro_loss = torch.zeros_like(x[..., 0])
-            else:
-                fro_loss = torch.zeros(1, device=x.device)[0]
-        else:
-            fro_loss = torch.mean(fro_loss, -1)
-        if l1_count == 0:
-            if len(x.shape) > 1:
-                l1_loss = torch.zeros_like(x[..., 0])
-            else:
-                l1_loss = torch.zeros(1, device=x.device)[0]
-        else:
-            l1_loss = torch.mean(l1_loss, -1)
-        if N > 0:
-            fro_loss = fro_loss.reshape(B,N)
-            l1_loss = l1_loss.reshape(B,N)
-
-        return fro_loss, l1_loss
+        shape = x.shape[:-1]
+        T = x.shape[-1]
+        # the reflect padding of torch.stft needs more samples than half of the fft size
+        confs = [i for i in range(self.n_fft_confs) if T > (self.fft_sizes[i]//2)]
+        if len(confs) == 0:
+            return x.new_zeros(shape), x.new_zeros(shape)
+        xy = torch.cat((x.reshape(-1, T), y.reshape(-1, T)))
+        pad = max([self.fft_sizes[i]//2 for i in confs])
+        xy = F.pad(xy.unsqueeze(1), (pad, pad), mode='reflect').squeeze(1)
+        fro_l1_loss = []
+        dB_loss = []
+        for i in confs:
+            pad_i = self.fft_sizes[i]//2
+            fro_l1, dB = stft_loss_terms(self.stft_losses[i].magnitude(xy[:, pad-pad_i:pad+T+pad_i], center=False))
+            fro_l1_loss.append(fro_l1)
+            dB_loss.append(dB)
+        fro_l1_loss = torch.stack(fro_l1_loss) # n_confs x B
+        dB_loss = torch.stack(dB_loss)
+        # average over the resolutions with finite loss of all signals in the batch
+        mask = torch.isfinite(fro_l1_loss).all(-1, keepdim=True)
+        fro_l1_loss = torch.where(mask, fro_l1_loss, torch.zeros_like(fro_l1_loss)).sum(0) / mask.sum().clamp(min=1)
+        mask = torch.isfinite(dB_loss).all(-1, keepdim=True)
+        dB_loss = torch.where(mask, dB_loss, torch.zeros_like(dB_loss)).sum(0) / mask.sum().clamp(min=1)
+
+        return fro_l1_loss.reshape(shape), dB_loss.reshape(shape)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+MCD_CONST = 10.0/np.log(10.0)*np.sqrt(2.0)
+
+
+def _prepare_features(orgdata, trgdata, mcd=1):
+    """FUNCTION TO TRANSFORM FEATURES BEFORE THE FRAME-PAIR DISTANCE (DB FOR LSD, UNIT NORM FOR COSINE)"""
+    if mcd == -1:
+        orgdata = 20*np.log10(np.clip(orgdata, a_min=1e-16, a_max=None))
+        trgdata = 20*np.log10(np.clip(trgdata, a_min=1e-16, a_max=None))
+    elif mcd == 0:
+        orgdata = orgdata / np.clip(np.linalg.norm(orgdata, axis=-1, keepdims=True), a_min=1e-16, a_max=None)
+        trgdata = trgdata / np.clip(np.linalg.norm(trgdata, axis=-1, keepdims=True), a_min=1e-16, a_max=None)
+    return orgdata, trgdata
+
+
+def _distance(orgdata, trgdata, mcd=1):
+    """FUNCTION TO COMPUTE FRAME-PAIR DISTANCE OF TRANSFORMED FEATURES (B x T_org x T_trg)"""
+    if mcd == 0:
+        return 1 - np.matmul(orgdata, trgdata.transpose(0,2,1))
+    sqdist = np.sum(orgdata**2, -1)[:,:,None] + np.sum(trgdata**2, -1)[:,None,:] \
+                - 2*np.matmul(orgdata, trgdata.transpose(0,2,1))
+    sqdist = np.clip(sqdist, a_min=0, a_max=None)
+    if mcd == -1:
+        return np.sqrt(sqdist / orgdata.shape[-1])
+    return MCD_CONST*np.sqrt(sqdist)
+
+
+def local_distance(orgdata, trgdata, mcd=1):
+    """FUNCTION TO COMPUTE FRAME-PAIR DISTANCE MATRICES OF A BATCH
+
+    Args:
+        orgdata (ndarray): original sequences (B x T_org x D)
+        trgdata (ndarray): target sequences (B x T_trg x D)
+        mcd (int): 1 for mel-cepstral distortion, 0 for cosine distance, -1 for log-spectral distortion [dB]
+            (magnitude spectrum input)
+
+    Return:
+        (ndarray): distance matrices (B x T_org x T_trg)
+    """
+    return _distance(*_prepare_features(orgdata, trgdata, mcd=mcd), mcd=mcd)
+
+
+def _band_row_mask(i, T_trg, org_lens, trg_lens, band=None):
+    """FUNCTION TO GET VALID TARGET FRAMES OF ORIGINAL FRAME i OF EACH PAIR (B x T_trg)"""
+    idx_trg = np.arange(T_trg)[None,:]
+    mask = (i < org_lens)[:,None] & (idx_trg < trg_lens[:,None])
+    if band is not None:
+        # distance to the length-normalized diagonal along either axis, so that a band of >= 1 frame
+        # always contains a staircase path from (0,0) to the end for any length ratio
+        slope_org = ((org_lens-1) / np.maximum(trg_lens-1, 1))[:,None]
+        slope_trg = ((trg_lens-1) / np.maximum(org_lens-1, 1))[:,None]
+        mask &= np.minimum(np.abs(i - idx_trg*slope_org), np.abs(idx_trg - i*slope_trg)) <= max(band, 1)
+    return mask
+
+
+def _band_get(acc, offset, b, r, c):
+    """FUNCTION TO READ ACCUMULATED COST AT ROW r / BORDERED TARGET INDEX c, INF OUTSIDE OF THE STORED BAND"""
+    col = c - offset[r]
+    valid = (col >= 0) & (col < acc.shape[2])
+    return np.where(valid, acc[b,r,np.clip(col, 0, acc.shape[2]-1)], np.inf)
+
+
+def batch_dtw_org_to_trg(orgdata, trgdata, org_lens=None, trg_lens=None, mcd=1, band=None):
+    """FUNCTION TO TIME-WARP A BATCH OF ORIGINAL SEQUENCES TO TARGET SEQUENCES
+
+    The accumulated cost of the symmetric step pattern (diagonal, horizontal, vertical) is computed along
+    anti-diagonals, each of which is a single vectorized update for the whole batch. Every target frame
+    is then aligned to the original frame with the lowest distance among those on the path, as in dtw_org_to_trg.
+
+    Only the band is stored: for each original frame, the distances and the accumulated costs are kept for
+    the span of target frames that is within the band of any pair of the batch (B x T_org x W instead of
+    B x T_org x T_trg). Without band, the span is the whole target.
+
+    Args:
+        orgdata (ndarray): padded original sequences (B x T_org x D)
+        trgdata (ndarray): padded target sequences (B x T_trg x D)
+        org_lens (list): lengths of original sequences (if None, T_org for all)
+        trg_lens (list): lengths of target sequences (if None, T_trg for all)
+        mcd (int): 1 for mel-cepstral distortion, 0 for cosine (similarity) , -1 for log-spectral distortion [dB]
+        band (int): Sakoe-Chiba band width in frames around the length-normalized diagonal (if None, no band)
+
+    Return:
+        (list): aligned original sequences (T_trg_b x D)
+        (list): time-warping functions, [original index, target index] for each target frame (T_trg_b x 2)
+        (list): mean of distance of aligned frames (cosine similarity in case of mcd=0)
+        (list): standard deviation of distance of aligned frames (cosine similarity in case of mcd=0)
+    """
+    orgdata = np.asarray(orgdata, dtype=np.float64)
+    trgdata = np.asarray(trgdata, dtype=np.float64)
+    B, T_org, _ = orgdata.shape
+    T_trg = trgdata.shape[1]
+    org_lens = np.full(B, T_org, dtype=np.int64) if org_lens is None else np.asarray(org_lens, dtype=np.int64)
+    trg_lens = np.full(B, T_trg, dtype=np.int64) if trg_lens is None else np.asarray(trg_lens, dtype=np.int64)
+
+    # span of target frames within the band of any pair, [start, start+width), for each original frame
+    start = np.zeros(T_org, dtype=np.int64)
+    end = np.zeros(T_org, dtype=np.int64)
+    for i in range(T_org):
+        valid = np.nonzero(np.any(_band_row_mask(i, T_trg, org_lens, trg_lens, band=band), 0))[0]
+        if len(valid) > 0:
+            start[i] = valid[0]
+            end[i] = valid[-1] + 1
+    width = max(int(np.max(end - start)), 1)
+
+    # banded local cost, cost[b,i,w] for frame pair (i,start[i]+w), inf outside of band / lengths
+    org_feat, trg_feat = _prepare_features(orgdata, trgdata, mcd=mcd)
+    cost = np.full((B, T_org, width), np.inf)
+    for i in range(T_org):
+        n = end[i] - start[i]
+        if n > 0:
+            dist = _distance(org_feat[:,i:i+1], trg_feat[:,start[i]:end[i]], mcd=mcd)[:,0]
+            mask = _band_row_mask(i, T_trg, org_lens, trg_lens, band=band)[:,start[i]:end[i]]
+            cost[:,i,:n] = np.where(mask, dist, np.inf)
+
+    # banded accumulated cost with 1-frame inf border, D[b,i+1,j+1] for frame pair (i,j) is stored
+    # at acc[b,i+1,j+1-offset[i+1]], the row of the border (i=-1) only holds D[b,0,0] = 0
+    offset = np.zeros(T_org+1, dtype=np.int64)
+    offset[1:] = start
+    acc = np.full((B, T_org+1, width+2), np.inf)
+    acc[:,0,0] = 0
+    batch = np.arange(B)
+    for k in range(T_org+T_trg-1):
+        i = np.arange(max(0, k-T_trg+1), min(T_org, k+1))
+        j = k - i
+        in_band = (j >= start[i]) & (j < end[i]) # only the cells within the band of any of the pairs
+        i = i[in_band]
+        j = j[in_band]
+        if len(i) == 0:
+            continue
+        b = batch[:,None]
+        prev = np.minimum(np.minimum(_band_get(acc, offset, b, i, j), _band_get(acc, offset, b, i, j+1)),
+                            _band_get(acc, offset, b, i+1, j))
+        acc[:,i+1,j+1-offset[i+1]] = cost[:,i,j-start[i]] + prev
+
+    # backtracking of the whole batch, one step per iteration
+    i = org_lens - 1
+    j = trg_lens - 1
+    if np.any(np.isinf(_band_get(acc, offset, batch, i+1, j+1))):
+        raise ValueError("end of sequence is not reachable, check lengths and band.")
+    path_b = [batch]
+    path_i = [i]
+    path_j = [j]
+    active = (i > 0) | (j > 0)
+    while np.any(active):
+        b = batch[active]
+        i_a = i[active]
+        j_a = j[active]
+        steps = np.stack((_band_get(acc, offset, b, i_a, j_a), _band_get(acc, offset, b, i_a, j_a+1),
+                            _band_get(acc, offset, b, i_a+1, j_a)), 1)
+        step = np.argmin(steps, 1)
+        i_b = i_a - (step != 2)
+        j_b = j_a - (step != 1)
+        i = i.copy()
+        j = j.copy()
+        i[active] = i_b
+        j[active] = j_b
+        path_b.append(b)
+        path_i.append(i_b)
+        path_j.append(j_b)
+        active = (i > 0) | (j > 0)
+    path_b = np.concatenate(path_b)
+    path_i = np.concatenate(path_i)
+    path_j = np.concatenate(path_j)
+    path_d = cost[path_b,path_i,path_j-start[path_i]]
+
+    aligned_list = []
+    twf_list = []
+    mean_list = []
+    std_list = []
+    for b in range(B):
+        sel = path_b == b
+        p_i = path_i[sel]
+        p_j = path_j[sel]
+        order = np.lexsort((path_d[sel], p_j))
+        _, first = np.unique(p_j[order], return_index=True)
+        twf = np.stack((p_i[order][first], p_j[order][first]), 1)
+        d = path_d[sel][order][first]
+        if mcd == 0:
+            d = 1 - d
+        aligned_list.append(orgdata[b,twf[:,0]])
+        twf_list.append(twf)
+        mean_list.append(np.mean(d))
+        std_list.append(np.std(d))
+
+    return aligned_list, twf_list, mean_list, std_list
+
+
+def dtw_org_to_trg(orgdata, trgdata, mcd=1, band=None):
+    """FUNCTION TO TIME-WARP ORIGINAL SEQUENCE TO TARGET SEQUENCE
+
+    Drop-in for dtw_c.dtw_org_to_trg with an optional Sakoe-Chiba band.
+
+    Args:
+        orgdata (ndarray): original sequence (T_org x D)
+        trgdata (ndarray): target sequence (T_trg x D)
+        mcd (int): 1 for mel-cepstral distortion, 0 for cosine (similarity) , -1 for log-spectral distortion [dB]
+        band (int): Sakoe-Chiba band width in frames (if None, no band)
+
+    Return:
+        (ndarray): aligned original sequence (T_trg x D)
+        (ndarray): time-warping function, [original index, target index] for each target frame (T_trg x 2)
+        (float): mean of distance of aligned frames (cosine similarity in case of mcd=0)
+        (float): standard deviation of distance of aligned frames
+    """
+    aligned, twf, mean, std = batch_dtw_org_to_trg(np.asarray(orgdata)[None], np.asarray(trgdata)[None], mcd=mcd, band=band)
+    return aligned[0], twf[0], mean[0], std[0]
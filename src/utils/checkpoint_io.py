@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+
+import numpy as np
+import six
+import torch
+
+from six.moves import queue
+
+
+def snapshot_state(state):
+    """FUNCTION TO SNAPSHOT (NESTED) STATE WITH DEVICE-SIDE TENSOR COPIES
+
+    Args:
+        state: state_dict / dict / list / tuple (possibly nested) containing tensors
+
+    Return:
+        state with the same structure, where every tensor is detached and cloned on its own device
+    """
+    if torch.is_tensor(state):
+        return state.detach().clone()
+    if isinstance(state, dict):
+        return type(state)((key, snapshot_state(value)) for key, value in state.items())
+    if isinstance(state, list):
+        return [snapshot_state(value) for value in state]
+    if isinstance(state, tuple) and not hasattr(state, "_fields"):
+        return tuple(snapshot_state(value) for value in state)
+    return state
+
+
+def state_to_cpu(state):
+    """FUNCTION TO MOVE (NESTED) STATE TENSORS TO CPU
+
+    Args:
+        state: state_dict / dict / list / tuple (possibly nested) containing tensors
+
+    Return:
+        state with the same structure, where every tensor is on cpu
+    """
+    if torch.is_tensor(state):
+        return state.cpu()
+    if isinstance(state, dict):
+        return type(state)((key, state_to_cpu(value)) for key, value in state.items())
+    if isinstance(state, list):
+        return [state_to_cpu(value) for value in state]
+    if isinstance(state, tuple) and not hasattr(state, "_fields"):
+        return tuple(state_to_cpu(value) for value in state)
+    return state
+
+
+def meta_path(checkpoint_path):
+    """FUNCTION TO GET PATH OF METADATA SIDECAR OF CHECKPOINT (checkpoint-N.pkl --> checkpoint-N.json)"""
+    return os.path.splitext(checkpoint_path)[0] + ".json"
+
+
+def inference_path(checkpoint_path):
+    """FUNCTION TO GET PATH OF INFERENCE ARTIFACT OF CHECKPOINT (checkpoint-N.pkl --> checkpoint-N.inf.pkl)"""
+    return os.path.splitext(checkpoint_path)[0] + ".inf.pkl"
+
+
+def config_hash(config_file):
+    """FUNCTION TO GET HASH OF MODEL CONFIG FILE
+
+    Args:
+        config_file (str): path of model config (e.g., <expdir>/model.conf)
+
+    Return:
+        (str): sha1 hexdigest of the config file, None if not exist
+    """
+    if not os.path.isfile(config_file):
+        return None
+    with open(config_file, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def checkpoint_meta(checkpoint):
+    """FUNCTION TO GET SCALAR METADATA OF CHECKPOINT
+
+    Args:
+        checkpoint (dict): checkpoint dictionary
+
+    Return:
+        (dict): scalar entries, e.g., iterations, min_idx, min_eval_loss_*, without any state
+    """
+    meta = {}
+    for key, value in checkpoint.items():
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, (bool, float) + six.integer_types) or value is None:
+            meta[key] = value
+    return meta
+
+
+def write_checkpoint_meta(checkpoint_path, meta):
+    """FUNCTION TO WRITE METADATA SIDECAR OF CHECKPOINT
+
+    Args:
+        checkpoint_path (str): path of checkpoint
+        meta (dict): metadata of checkpoint
+    """
+    path = meta_path(checkpoint_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint_meta(checkpoint_path):
+    """FUNCTION TO READ METADATA SIDECAR OF CHECKPOINT
+
+    Args:
+        checkpoint_path (str): path of checkpoint
+
+    Return:
+        (dict): metadata of checkpoint, None if the sidecar does not exist
+    """
+    path = meta_path(checkpoint_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def fold_weight_norm(state_dict):
+    """FUNCTION TO FOLD WEIGHT NORMALIZATION PARAMETERS OF STATE_DICT INTO WEIGHTS
+
+    weight = weight_g * weight_v / ||weight_v||, where the norm is over all of the axes except the one of weight_g,
+    i.e., the same as torch.nn.utils.remove_weight_norm, but without building the model.
+
+    Args:
+        state_dict (dict): model state_dict with *_g / *_v weight norm parameters
+
+    Return:
+        (dict): state_dict without weight norm parameters
+    """
+    folded = type(state_dict)()
+    for key, value in state_dict.items():
+        if key.endswith("_g") and key[:-2] + "_v" in state_dict:
+            v = state_dict[key[:-2] + "_v"]
+            if value.dim() == v.dim():
+                axes = [i for i in range(v.dim()) if value.shape[i] == 1]
+                if len(axes) == v.dim(): # single output channel with dim=0
+                    axes = axes[1:]
+            else: # dim=None, i.e., norm over the whole tensor
+                axes = list(range(v.dim()))
+            folded[key[:-2]] = v * (value / v.norm(2, dim=axes, keepdim=True))
+        elif not (key.endswith("_v") and key[:-2] + "_g" in state_dict):
+            folded[key] = value
+    return folded
+
+
+def export_inference_checkpoint(checkpoint_path, out_path=None):
+    """FUNCTION TO EXPORT WEIGHTS-ONLY INFERENCE ARTIFACT OF CHECKPOINT
+
+    Only the model state_dicts are kept, with weight norm folded into fp32 contiguous weights,
+    so that decoding does not need to deserialize optimizer and training states.
+
+    Args:
+        checkpoint_path (str): path of checkpoint
+        out_path (str): path of inference artifact (default: checkpoint-N.inf.pkl)
+
+    Return:
+        (str): path of inference artifact
+    """
+    if out_path is None:
+        out_path = inference_path(checkpoint_path)
+    checkpoint = torch.load(checkpoint_path, map_location=torch.device("cpu"))
+    artifact = {"weight_norm_folded": True}
+    for key, value in checkpoint.items():
+        if key.startswith("model_") and isinstance(value, dict):
+            artifact[key] = type(value)((name, param.float().contiguous() if param.is_floating_point() else param.contiguous()) \
+                                for name, param in fold_weight_norm(value).items())
+    tmp_path = out_path + ".tmp"
+    torch.save(artifact, tmp_path)
+    os.replace(tmp_path, out_path)
+    meta = read_checkpoint_meta(checkpoint_path)
+    if meta is None:
+        meta = checkpoint_meta(checkpoint)
+    meta["weight_norm_folded"] = True
+    write_checkpoint_meta(out_path, meta)
+    logging.info("inference artifact %s created." % out_path)
+    return out_path
+
+
+def load_model_states(checkpoint_path, map_location=None):
+    """FUNCTION TO LOAD MODEL STATE_DICTS OF CHECKPOINT ONCE
+
+    The inference artifact of the checkpoint (checkpoint-N.inf.pkl) is used if it is not older than the checkpoint,
+    and is memory-mapped if supported by the installed pytorch.
+
+    Args:
+        checkpoint_path (str): path of checkpoint or inference artifact
+        map_location (torch.device): device to load the states to
+
+    Return:
+        (dict): checkpoint dictionary, including model state_dicts
+        (bool): flag of weight norm folded states, i.e., remove_weight_norm should be called before load_state_dict
+    """
+    path = inference_path(checkpoint_path)
+    if checkpoint_path.endswith(".inf.pkl") or not os.path.isfile(path) \
+            or (os.path.isfile(checkpoint_path) and os.path.getmtime(path) < os.path.getmtime(checkpoint_path)):
+        path = checkpoint_path
+    try:
+        checkpoint = torch.load(path, map_location=map_location, mmap=True)
+    except (TypeError, RuntimeError):
+        # mmap is not supported (pytorch < 2.1) or legacy serialization format
+        checkpoint = torch.load(path, map_location=map_location)
+    logging.info("model states are loaded from %s" % path)
+    return checkpoint, checkpoint.get("weight_norm_folded", False)
+
+
+class AsyncCheckpointWriter(object):
+    """BACKGROUND CHECKPOINT WRITER
+
+    The checkpoint is snapshotted with device-side copies in the training thread, so that the models stay on
+    their device, and is serialized by a worker thread while training continues. Every checkpoint is written once,
+    checkpoint-last.pkl is then created as a hard link of it with an atomic rename.
+    If a retention policy is set, only the best keep_best checkpoints by evaluation loss, the last keep_last checkpoints,
+    and the explicitly kept ones (e.g., the current min_idx) that are written by this writer are retained.
+    Each checkpoint gets a JSON sidecar (checkpoint-N.json) of its scalar states and the hash of model.conf,
+    so that the model indices can be read without deserializing the checkpoint.
+
+    Args:
+        checkpoint_dir (str): directory to save checkpoint
+        keep_best (int): number of best checkpoints by evaluation loss to be kept (if keep_best and keep_last are 0, keep all)
+        keep_last (int): number of last checkpoints to be kept (if keep_best and keep_last are 0, keep all)
+        max_pending (int): maximum number of snapshots waiting for serialization
+        retained (func): function returning iterations of checkpoints that should not be removed by the retention policy,
+            e.g., snapshots not evaluated yet by the evaluator process
+    """
+
+    def __init__(self, checkpoint_dir, keep_best=0, keep_last=0, max_pending=1, retained=None):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_best = keep_best
+        self.keep_last = keep_last
+        self.retained = retained
+        if self.keep_best > 0 or self.keep_last > 0:
+            self.keep_last = max(self.keep_last, 1) # checkpoint-last.pkl should always have its source
+        self.history = []
+        self.error = None
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def checkpoint_path(self, iterations):
+        return os.path.join(self.checkpoint_dir, "checkpoint-%d.pkl" % iterations)
+
+    def save(self, checkpoint, iterations, eval_loss=None, keep=None):
+        """Snapshot checkpoint and queue it for serialization
+
+        Args:
+            checkpoint (dict): checkpoint dictionary, e.g., model/optimizer state_dicts and training states
+            iterations (int): number of current iterations
+            eval_loss (float): evaluation loss of the checkpoint for the retention policy (lower is better)
+            keep (list): iterations of checkpoints that should not be removed by the retention policy
+        """
+        self._check_error()
+        snapshot = snapshot_state(checkpoint)
+        self.queue.put((snapshot, iterations, eval_loss, keep))
+
+    def flush(self):
+        """Wait until all of the queued checkpoints are written"""
+        self.queue.join()
+        self._check_error()
+
+    def close(self):
+        """Write the queued checkpoints and stop the worker thread"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._check_error()
+
+    def _check_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            six.reraise(*error)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                self._write(*item)
+            except Exception:
+                self.error = sys.exc_info()
+                logging.error("failed to write checkpoint", exc_info=self.error)
+            finally:
+                self.queue.task_done()
+
+    def _write(self, checkpoint, iterations, eval_loss, keep):
+        path = self.checkpoint_path(iterations)
+        tmp_path = path + ".tmp"
+        torch.save(state_to_cpu(checkpoint), tmp_path)
+        os.replace(tmp_path, path)
+        meta = checkpoint_meta(checkpoint)
+        meta["config_hash"] = config_hash(os.path.join(self.checkpoint_dir, "model.conf"))
+        write_checkpoint_meta(path, meta)
+        last_path = os.path.join(self.checkpoint_dir, "checkpoint-last.pkl")
+        tmp_last_path = last_path + ".tmp"
+        if os.path.lexists(tmp_last_path):
+            os.remove(tmp_last_path)
+        try:
+            os.link(path, tmp_last_path)
+        except OSError:
+            # hard links are not supported by the file system
+            shutil.copyfile(path, tmp_last_path)
+        os.replace(tmp_last_path, last_path)
+        write_checkpoint_meta(last_path, meta)
+        logging.info("%d-iter and last checkpoints created." % iterations)
+        self.history = [x for x in self.history if x[0] != iterations]
+        self.history.append((iterations, eval_loss))
+        self._apply_retention(keep)
+
+    def _apply_retention(self, keep):
+        if self.keep_best <= 0 and self.keep_last <= 0:
+            return
+        retained = set()
+        if keep is not None:
+            retained.update(keep)
+        if self.retained is not None:
+            retained.update(self.retained())
+        retained.update([x[0] for x in self.history[-self.keep_last:]])
+        if self.keep_best > 0:
+            scored = [x for x in self.history if x[1] is not None]
+            scored.sort(key=lambda x: x[1])
+            retained.update([x[0] for x in scored[:self.keep_best]])
+        history = []
+        for iterations, eval_loss in self.history:
+            if iterations in retained:
+                history.append((iterations, eval_loss))
+            else:
+                path = self.checkpoint_path(iterations)
+                for rm_path in [meta_path(path), inference_path(path)]:
+                    if os.path.exists(rm_path):
+                        os.remove(rm_path)
+                if os.path.exists(path):
+                    os.remove(path)
+                    logging.info("%d-iter checkpoint removed by retention policy." % iterations)
+        self.history = history
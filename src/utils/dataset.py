@@ -32,6 +32,23 @@ def padding(x, flen, value=0):
     return x
 
 
+def compact_wav_code(x, n_levels):
+    """FUNCTION TO STORE QUANTIZED WAVEFORM CODES WITH THE SMALLEST SUFFICIENT INTEGER DTYPE
+
+    Args:
+        x (LongTensor): quantized waveform codes within [0, n_levels-1]
+        n_levels (int): number of code levels, e.g., cf_dim of coarse/fine split
+
+    Returns:
+        (Tensor): uint8 tensor if n_levels <= 256, int16 if n_levels <= 32768, otherwise int64
+    """
+    if n_levels <= 256:
+        return x.to(torch.uint8)
+    elif n_levels <= 32768:
+        return x.to(torch.int16)
+    return x
+
+
 def validate_length(x, y, upsampling_factor=0):
     """FUNCTION TO VALIDATE LENGTH
 
@@ -63,7 +80,63 @@ def validate_length(x, y, upsampling_factor=0):
     return x, y
 
 
-class FeatureDatasetNeuVoco(Dataset):
+def spcidx_crop_range(spcidx, frm_len, pad_left=0, pad_right=0):
+    """FUNCTION TO GET FRAME RANGE OF SPEECH SEGMENT WITH PADDING, AS CROPPED BY FeatureDatasetCycMceplf0WavVAE WITH WAVEFORM
+
+    Args:
+        spcidx (ndarray): indices of speech frames
+        frm_len (int): number of frames (after length validation with waveform)
+        pad_left (int): number of frames of left padding
+        pad_right (int): number of frames of right padding
+
+    Returns:
+        (int): start frame
+        (int): end frame (exclusive)
+    """
+    f_ss = spcidx[0]-pad_left
+    idx_end = -1
+    spcidx_end = spcidx[idx_end]
+    while spcidx_end >= frm_len:
+        idx_end -= 1
+        spcidx_end = spcidx[idx_end]
+    f_es = spcidx_end+pad_right
+    if f_ss < 0:
+        f_ss = 0
+    if f_es >= frm_len:
+        f_es = frm_len-1
+    f_es += 1
+    return f_ss, f_es
+
+
+class CachedFeatureDataset(Dataset):
+    """Base dataset reading feature/waveform files, optionally through a shared in-memory cache
+    """
+
+    cache = None
+
+    def read_hdf5(self, hdf5_name, hdf5_path):
+        if self.cache is not None:
+            return self.cache.read_hdf5(hdf5_name, hdf5_path)
+        return read_hdf5(hdf5_name, hdf5_path)
+
+    def check_hdf5(self, hdf5_name, hdf5_path):
+        if self.cache is not None:
+            return self.cache.check_hdf5(hdf5_name, hdf5_path)
+        return check_hdf5(hdf5_name, hdf5_path)
+
+    def shape_hdf5(self, hdf5_name, hdf5_path):
+        if self.cache is not None:
+            return self.cache.shape_hdf5(hdf5_name, hdf5_path)
+        return shape_hdf5(hdf5_name, hdf5_path)
+
+    def read_wav(self, wavfile):
+        if self.cache is not None:
+            return self.cache.read_wav(wavfile)
+        x, _ = sf.read(wavfile, dtype=np.float32)
+        return x
+
+
+class FeatureDatasetNeuVoco(CachedFeatureDataset):
     """Dataset for neural vocoder
     """
 
@@ -71,7 +144,8 @@ class FeatureDatasetNeuVoco(Dataset):
                     string_path, pad_wav_f_transform=None, wav_transform=None, wav_transform_in=None, spcidx=False, string_path_ft=None,
                         wav_transform_out=None, with_excit=False, codeap_dim=None, n_bands=1, spk_list=None, cf_dim=None, magsp_flag=False,
                             pad_left=0, pad_right=0, wlat_flag=False, wspk_flag=False, worg_flag=False, worgx_flag=False, worgx_band_flag=False,
-                                wrec_flag=True, wf0_flag=False, worgx_rec_flag=None, pad_wav_org_transform=None):
+                                wrec_flag=True, wf0_flag=False, worgx_rec_flag=None, pad_wav_org_transform=None, cache=None):
+        self.cache = cache
         self.wav_list = wav_list
         self.feat_list = feat_list
         self.pad_wav_transform = pad_wav_transform
@@ -128,29 +202,29 @@ class FeatureDatasetNeuVoco(Dataset):
         x_org = None
         x_org_band = None
         
-        if (self.spcidx and not check_hdf5(featfile, '/spcidx_range')) or (self.wlat_flag and self.worg_flag):
+        if (self.spcidx and not self.check_hdf5(featfile, '/spcidx_range')) or (self.wlat_flag and self.worg_flag):
             file_org = os.path.join(os.path.dirname(os.path.dirname(featfile)), os.path.basename(os.path.dirname(featfile)).split("-")[0], os.path.basename(featfile))
         if self.spcidx:
-            if not check_hdf5(featfile, '/spcidx_range'):
-                spcidx = read_hdf5(file_org, '/spcidx_range')[0]
+            if not self.check_hdf5(featfile, '/spcidx_range'):
+                spcidx = self.read_hdf5(file_org, '/spcidx_range')[0]
             else:
-                spcidx = read_hdf5(featfile, '/spcidx_range')[0]
-            if check_hdf5(featfile, self.string_path_org):
-                frm_len = len(read_hdf5(featfile, '/f0_range'))
+                spcidx = self.read_hdf5(featfile, '/spcidx_range')[0]
+            if self.check_hdf5(featfile, self.string_path_org):
+                frm_len = len(self.read_hdf5(featfile, '/f0_range'))
             else:
-                frm_len = shape_hdf5(featfile, self.string_path)[0]
+                frm_len = self.shape_hdf5(featfile, self.string_path)[0]
 
         if self.n_bands > 1:
             wavfile_pqmf_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(wavfile)))+"_pqmf_"+str(self.n_bands), \
                 os.path.basename(os.path.dirname(os.path.dirname(wavfile))), os.path.basename(os.path.dirname(wavfile)))
             #wavfile_pqmf_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(wavfile)))+"_pqmf_fsb_"+str(self.n_bands), \
             if self.worgx_flag:
-                x_org, _ = sf.read(wavfile, dtype=np.float32)
+                x_org = self.read_wav(wavfile)
             elif self.worgx_rec_flag:
                 wavfile_org = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(wavfile)))+"_pqmf_"+str(self.n_bands)+"_rec", \
                     os.path.basename(os.path.dirname(os.path.dirname(wavfile))), os.path.basename(os.path.dirname(wavfile)), os.path.basename(wavfile))
                 #wavfile_org = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(wavfile)))+"_pqmf_fsb_"+str(self.n_bands)+"_rec", \
-                x_org, _ = sf.read(wavfile_org, dtype=np.float32)
+                x_org = self.read_wav(wavfile_org)
             for i in range(self.n_bands):
                 if self.n_bands >= 10:
                     if i < self.n_bands - 1:
@@ -159,36 +233,36 @@ class FeatureDatasetNeuVoco(Dataset):
                         wavfile_pqmf = os.path.join(wavfile_pqmf_dir, os.path.basename(wavfile).replace(".wav", "_B-"+str(i+1)+".wav"))
                 else:
                     wavfile_pqmf = os.path.join(wavfile_pqmf_dir, os.path.basename(wavfile).replace(".wav", "_B-"+str(i+1)+".wav"))
-                x_pqmf, _ = sf.read(wavfile_pqmf, dtype=np.float32)
+                x_pqmf = self.read_wav(wavfile_pqmf)
                 if i > 0:
                     x_pqmf, _ = validate_length(x_pqmf, h, self.upsampling_factor_bands)
                     x = np.c_[x, np.expand_dims(x_pqmf,-1)]
                 else:
                     if not self.with_excit:
                         if self.wrec_flag:
-                            if check_hdf5(featfile, self.string_path):
-                                h = read_hdf5(featfile, self.string_path)
+                            if self.check_hdf5(featfile, self.string_path):
+                                h = self.read_hdf5(featfile, self.string_path)
                             else:
-                                h = read_hdf5(featfile, self.string_path_org)
+                                h = self.read_hdf5(featfile, self.string_path_org)
                         if self.wlat_flag:
                             if not self.wrec_flag:
-                                h = read_hdf5(featfile, self.string_path_lat)
+                                h = self.read_hdf5(featfile, self.string_path_lat)
                             else:
-                                h_lat = read_hdf5(featfile, self.string_path_lat)
+                                h_lat = self.read_hdf5(featfile, self.string_path_lat)
                             if self.wspk_flag:
-                                h_spk = read_hdf5(featfile, self.string_path_spk)
+                                h_spk = self.read_hdf5(featfile, self.string_path_spk)
                             if self.wf0_flag:
-                                h_f0 = read_hdf5(featfile, self.string_path_f0)
+                                h_f0 = self.read_hdf5(featfile, self.string_path_f0)
                             if self.worg_flag:
-                                h_org = read_hdf5(file_org, self.string_path_org)
-                                h_magsp_org = read_hdf5(file_org, '/magsp')
+                                h_org = self.read_hdf5(file_org, self.string_path_org)
+                                h_magsp_org = self.read_hdf5(file_org, '/magsp')
                     else:
-                        h = np.c_[read_hdf5(featfile, self.string_path_org)[:,:self.excit_dim], read_hdf5(featfile, self.string_path)]
+                        h = np.c_[self.read_hdf5(featfile, self.string_path_org)[:,:self.excit_dim], self.read_hdf5(featfile, self.string_path)]
                     x_pqmf, h = validate_length(x_pqmf, h, self.upsampling_factor_bands)
                     if self.worgx_flag or self.worgx_rec_flag:
                         x_org, _ = validate_length(x_org, h, self.upsampling_factor)
                     if self.magsp_flag:
-                        h_magsp = read_hdf5(featfile, '/magsp')
+                        h_magsp = self.read_hdf5(featfile, '/magsp')
                         _, h_magsp = validate_length(x_pqmf, h_magsp, self.upsampling_factor_bands)
                     if self.wlat_flag:
                         if self.wrec_flag:
@@ -207,7 +281,7 @@ class FeatureDatasetNeuVoco(Dataset):
             if self.wav_transform is not None:
                 if self.wav_transform_out is not None:
                     x = self.wav_transform_out(self.wav_transform(x)) # cont -> disc -> cont trg n_bands
-                    x_f, _ = sf.read(wavfile, dtype=np.float32)
+                    x_f = self.read_wav(wavfile)
                     x_f, _ = validate_length(x_f, h, self.upsampling_factor)
                     x_f = self.wav_transform_out(self.wav_transform(x_f)) # cont -> disc -> cont trg full
                     slen_f = x_f.shape[0]
@@ -317,13 +391,13 @@ class FeatureDatasetNeuVoco(Dataset):
                 x_t = torch.LongTensor(self.pad_wav_transform(x_t)) # disc in/trg_n_bands
                 if self.spk_list is not None:
                     if self.cf_dim is not None and self.wav_transform is not None and self.wav_transform_out is None:
-                        return {'x_t_c': x_t // self.cf_dim, 'x_t_f': x_t % self.cf_dim, 'x': x, 'x': x_f, 'feat': h, \
+                        return {'x_t_c': compact_wav_code(x_t // self.cf_dim, self.cf_dim), 'x_t_f': compact_wav_code(x_t % self.cf_dim, self.cf_dim), 'x': x, 'x': x_f, 'feat': h, \
                                     'slen': slen, 'slen_f': slen_f, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                     else:
                         return {'x_t': x_t, 'x': x, 'x_f': x_f, 'feat': h, 'slen': slen, 'slen_f': slen_f, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                 else:
                     if self.cf_dim is not None and self.wav_transform is not None and self.wav_transform_out is None:
-                        return {'x_t_c': x_t // self.cf_dim, 'x_t_f': x_t % self.cf_dim, 'x': x, 'x_f': x_f, 'feat': h, \
+                        return {'x_t_c': compact_wav_code(x_t // self.cf_dim, self.cf_dim), 'x_t_f': compact_wav_code(x_t % self.cf_dim, self.cf_dim), 'x': x, 'x_f': x_f, 'feat': h, \
                                     'slen': slen, 'slen_f': slen_f, 'flen': flen, 'featfile': featfile}
                     else:
                         return {'x_t': x_t, 'x': x, 'x_f': x_f, 'feat': h, 'slen': slen, 'slen_f': slen_f, 'flen': flen, 'featfile': featfile}
@@ -333,13 +407,13 @@ class FeatureDatasetNeuVoco(Dataset):
                         if self.worgx_flag or self.worgx_rec_flag:
                             if self.worgx_band_flag:
                                 if not self.magsp_flag:
-                                    return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
+                                    return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                                 else:
-                                    return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'feat_magsp': h_magsp, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
+                                    return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'feat_magsp': h_magsp, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                             else:
-                                return {'x_org': x_org, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
+                                return {'x_org': x_org, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                         else:
-                            return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
+                            return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                     else:
                         return {'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                 else:
@@ -349,36 +423,36 @@ class FeatureDatasetNeuVoco(Dataset):
                                 if self.wspk_flag:
                                     if not self.wrec_flag:
                                         if not self.wf0_flag:
-                                            return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, \
+                                            return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), \
                                                 'feat': h, 'feat_org': h_org, 'feat_magsp_org': h_magsp_org, 'spk': h_spk, 'slen': slen, 'flen': flen, 'featfile': featfile}
                                         else:
-                                            return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, \
+                                            return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), \
                                                 'feat': h, 'feat_org': h_org, 'feat_magsp_org': h_magsp_org, 'f0': h_f0, 'spk': h_spk, 'slen': slen, 'flen': flen, 'featfile': featfile}
                                     else:
                                         if not self.wf0_flag:
-                                            return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'lat': h_lat,
+                                            return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'lat': h_lat,
                                                 'feat': h, 'feat_org': h_org, 'feat_magsp_org': h_magsp_org, 'spk': h_spk, 'slen': slen, 'flen': flen, 'featfile': featfile}
                                         else:
-                                            return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'lat': h_lat,
+                                            return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'lat': h_lat,
                                                 'feat': h, 'feat_org': h_org, 'feat_magsp_org': h_magsp_org, 'f0': h_f0, 'spk': h_spk, 'slen': slen, 'flen': flen, 'featfile': featfile}
                                 else:
-                                    return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'feat_org': h_org, 'feat_magsp_org': h_magsp_org, 'lat': h_lat, 'slen': slen, 'flen': flen, 'featfile': featfile}
+                                    return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'feat_org': h_org, 'feat_magsp_org': h_magsp_org, 'lat': h_lat, 'slen': slen, 'flen': flen, 'featfile': featfile}
                             else:
                                 if self.wspk_flag:
-                                    return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'lat': h_lat, 'spk': h_spk, 'slen': slen, 'flen': flen, 'featfile': featfile}
+                                    return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'lat': h_lat, 'spk': h_spk, 'slen': slen, 'flen': flen, 'featfile': featfile}
                                 else:
-                                    return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'lat': h_lat, 'slen': slen, 'flen': flen, 'featfile': featfile}
+                                    return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'lat': h_lat, 'slen': slen, 'flen': flen, 'featfile': featfile}
                         else:
                             if self.worgx_flag or self.worgx_rec_flag:
                                 if self.worgx_band_flag:
                                     if not self.magsp_flag:
-                                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
+                                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
                                     else:
-                                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'feat_magsp': h_magsp, 'slen': slen, 'flen': flen, 'featfile': featfile}
+                                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'feat_magsp': h_magsp, 'slen': slen, 'flen': flen, 'featfile': featfile}
                                 else:
-                                    return {'x_org': x_org, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
+                                    return {'x_org': x_org, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
                             else:
-                                return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
+                                return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
                     else:
                         if self.wlat_flag:
                             if self.worg_flag:
@@ -394,14 +468,14 @@ class FeatureDatasetNeuVoco(Dataset):
                         else:
                             return {'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
         else:
-            x, _ = sf.read(wavfile, dtype=np.float32)
+            x = self.read_wav(wavfile)
             if not self.with_excit:
-                if check_hdf5(featfile, self.string_path):
-                    h = read_hdf5(featfile, self.string_path)
+                if self.check_hdf5(featfile, self.string_path):
+                    h = self.read_hdf5(featfile, self.string_path)
                 else:
-                    h = read_hdf5(featfile, self.string_path_org)
+                    h = self.read_hdf5(featfile, self.string_path_org)
             else:
-                h = np.c_[read_hdf5(featfile, self.string_path_org)[:,:self.excit_dim], read_hdf5(featfile, self.string_path)]
+                h = np.c_[self.read_hdf5(featfile, self.string_path_org)[:,:self.excit_dim], self.read_hdf5(featfile, self.string_path)]
 
             x, h = validate_length(x, h, self.upsampling_factor)
 
@@ -430,28 +504,28 @@ class FeatureDatasetNeuVoco(Dataset):
                 x_t = torch.LongTensor(self.pad_wav_transform(x_t))
                 if self.spk_list is not None:
                     if self.cf_dim is not None and self.wav_transform is not None and self.wav_transform_out is None:
-                        return {'x_t_c': x_t // self.cf_dim, 'x_t_f': x_t % self.cf_dim, 'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
+                        return {'x_t_c': compact_wav_code(x_t // self.cf_dim, self.cf_dim), 'x_t_f': compact_wav_code(x_t % self.cf_dim, self.cf_dim), 'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                     else:
                         return {'x_t': x_t, 'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                 else:
                     if self.cf_dim is not None and self.wav_transform is not None and self.wav_transform_out is None:
-                        return {'x_t_c': x_t // self.cf_dim, 'x_t_f': x_t % self.cf_dim, 'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
+                        return {'x_t_c': compact_wav_code(x_t // self.cf_dim, self.cf_dim), 'x_t_f': compact_wav_code(x_t % self.cf_dim, self.cf_dim), 'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
                     else:
                         return {'x_t': x_t, 'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
             else:
                 if self.spk_list is not None:
                     if self.cf_dim is not None and self.wav_transform is not None and self.wav_transform_out is None:
-                        return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
+                        return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                     else:
                         return {'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile, 'c': spk_code}
                 else:
                     if self.cf_dim is not None and self.wav_transform is not None and self.wav_transform_out is None:
-                        return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
+                        return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
                     else:
                         return {'x': x, 'feat': h, 'slen': slen, 'flen': flen, 'featfile': featfile}
 
 
-def proc_random_spkcv_statcvexcit(src_idx, spk_list, n_cv, n_frm, n_spk, stat_spk_list, mean_path, scale_path, excit_flag=True):
+def proc_random_spkcv_statcvexcit(src_idx, spk_list, n_cv, n_frm, n_spk, stat_spk_list, mean_path, scale_path, excit_flag=True, read_fn=read_hdf5):
     if excit_flag:
         mean_trg_list = [None]*n_cv
         std_trg_list = [None]*n_cv
@@ -462,8 +536,8 @@ def proc_random_spkcv_statcvexcit(src_idx, spk_list, n_cv, n_frm, n_spk, stat_sp
             while pair_idx == src_idx:
                 pair_idx = np.random.randint(0,n_spk)
             trg_code_list[i] = np.ones(n_frm, dtype=np.int64)*pair_idx
-            mean_trg_list[i] = read_hdf5(stat_spk_list[pair_idx], mean_path)[1:2]
-            std_trg_list[i] = read_hdf5(stat_spk_list[pair_idx], scale_path)[1:2]
+            mean_trg_list[i] = read_fn(stat_spk_list[pair_idx], mean_path)[1:2]
+            std_trg_list[i] = read_fn(stat_spk_list[pair_idx], scale_path)[1:2]
             pair_spk_list[i] = spk_list[pair_idx]
 
         return mean_trg_list, std_trg_list, trg_code_list, pair_spk_list
@@ -480,13 +554,16 @@ def proc_random_spkcv_statcvexcit(src_idx, spk_list, n_cv, n_frm, n_spk, stat_sp
         return trg_code_list, pair_spk_list
 
 
-class FeatureDatasetCycMceplf0WavVAE(Dataset):
+class FeatureDatasetCycMceplf0WavVAE(CachedFeatureDataset):
     """Dataset for cyclic mceplf0-waveform VAE-based VC
     """
 
     def __init__(self, feat_list, pad_feat_transform, spk_list, stat_spk_list, n_cyc, string_path, excit_dim=None, cap_exc_dim=None,
             upsampling_factor=None, wav_list=None, pad_wav_transform=None, wav_transform=None, spcidx=True, uvcap_flag=True,
-                n_bands=1, cf_dim=None, pad_left=0, pad_right=0, magsp=False, worgx_flag=False, pad_wav_org_transform=None):
+                n_bands=1, cf_dim=None, pad_left=0, pad_right=0, magsp=False, worgx_flag=False, pad_wav_org_transform=None, cache=None,
+                    lat_fix_path=None):
+        self.cache = cache
+        self.lat_fix_path = lat_fix_path
         self.wav_list = wav_list
         self.feat_list = feat_list
         self.pad_wav_transform = pad_wav_transform
@@ -530,20 +607,37 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
         return len(self.feat_list)
 
     def __getitem__(self, idx):
+        item = self._getitem(idx)
+        if self.lat_fix_path is not None:
+            # precomputed latents of the fixed encoders (calc_fix_latents.py), on the same frames as feat
+            # stored for the frame range <path>_range, its start should be the start of the crop of feat
+            featfile = item['featfile']
+            if self.spcidx:
+                f_ss = max(self.read_hdf5(featfile, '/spcidx_range')[0][0]-self.pad_left, 0)
+            else:
+                f_ss = 0
+            lat_fix_range = self.read_hdf5(featfile, self.lat_fix_path+"_range")
+            assert(lat_fix_range[0]==f_ss)
+            lat_fix = self.read_hdf5(featfile, self.lat_fix_path)[:item['flen']]
+            assert(lat_fix.shape[0]==item['flen'])
+            item['lat_fix'] = torch.FloatTensor(self.pad_feat_transform(lat_fix))
+        return item
+
+    def _getitem(self, idx):
         featfile = self.feat_list[idx]
         if self.mel:
             if self.excit_dim is not None:
-                feat = np.c_[read_hdf5(featfile, '/feat_mceplf0cap')[:,:self.excit_dim], read_hdf5(featfile, self.string_path)]
+                feat = np.c_[self.read_hdf5(featfile, '/feat_mceplf0cap')[:,:self.excit_dim], self.read_hdf5(featfile, self.string_path)]
             else:
-                feat = read_hdf5(featfile, self.string_path)
+                feat = self.read_hdf5(featfile, self.string_path)
             if self.magsp:
-                feat_magsp = read_hdf5(featfile, '/magsp')
+                feat_magsp = self.read_hdf5(featfile, '/magsp')
         else:
             if self.cap_exc_dim is None:
-                feat = read_hdf5(featfile, self.string_path)
+                feat = self.read_hdf5(featfile, self.string_path)
             else:
-                feat = np.c_[read_hdf5(featfile, '/feat_mceplf0cap')[:,:2], read_hdf5(featfile, '/feat_mceplf0cap')[:,self.cap_exc_dim:]]
-        frm_len = len(read_hdf5(featfile, '/f0_range'))
+                feat = np.c_[self.read_hdf5(featfile, '/feat_mceplf0cap')[:,:2], self.read_hdf5(featfile, '/feat_mceplf0cap')[:,self.cap_exc_dim:]]
+        frm_len = len(self.read_hdf5(featfile, '/f0_range'))
         featfile_spk = os.path.basename(os.path.dirname(featfile))
         src_idx = self.spk_list.index(featfile_spk)
 
@@ -553,7 +647,7 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                 wavfile_pqmf_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(wavfile)))+"_pqmf_"+str(self.n_bands), \
                     os.path.basename(os.path.dirname(os.path.dirname(wavfile))), os.path.basename(os.path.dirname(wavfile)))
                 if self.worgx_flag:
-                    x_org, _ = sf.read(wavfile, dtype=np.float32)
+                    x_org = self.read_wav(wavfile)
                 for i in range(self.n_bands):
                     if self.n_bands >= 10:
                         if i < self.n_bands - 1:
@@ -562,7 +656,7 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                             wavfile_pqmf = os.path.join(wavfile_pqmf_dir, os.path.basename(wavfile).replace(".wav", "_B-"+str(i+1)+".wav"))
                     else:
                         wavfile_pqmf = os.path.join(wavfile_pqmf_dir, os.path.basename(wavfile).replace(".wav", "_B-"+str(i+1)+".wav"))
-                    x_pqmf, _ = sf.read(wavfile_pqmf, dtype=np.float32)
+                    x_pqmf = self.read_wav(wavfile_pqmf)
                     if i > 0:
                         x_pqmf, _ = validate_length(x_pqmf, feat, self.upsampling_factor_bands)
                         x = np.c_[x, np.expand_dims(x_pqmf,-1)]
@@ -578,7 +672,7 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                 assert(x.shape[0]==feat.shape[0]*self.upsampling_factor_bands)
                 frm_len = feat.shape[0]
                 if self.spcidx:
-                    spcidx = read_hdf5(featfile, '/spcidx_range')[0]
+                    spcidx = self.read_hdf5(featfile, '/spcidx_range')[0]
                     f_ss = spcidx[0]-self.pad_left
                     idx_end = -1
                     spcidx_end = spcidx[idx_end]
@@ -606,12 +700,12 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                         feat_magsp = feat_magsp[spcidx_s_e[0]:spcidx_s_e[-1]]
                         assert(x.shape[0]==feat_magsp.shape[0]*self.upsampling_factor_bands)
             else:
-                x, _ = sf.read(wavfile, dtype=np.float32)
+                x = self.read_wav(wavfile)
                 x, feat = validate_length(x, feat, self.upsampling_factor)
                 assert(x.shape[0]==feat.shape[0]*self.upsampling_factor)
                 frm_len = feat.shape[0]
                 if self.spcidx:
-                    spcidx = read_hdf5(featfile, '/spcidx_range')[0]
+                    spcidx = self.read_hdf5(featfile, '/spcidx_range')[0]
                     f_ss = spcidx[0]-self.pad_left
                     idx_end = -1
                     spcidx_end = spcidx[idx_end]
@@ -635,7 +729,7 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                 x = self.wav_transform(x)
             slen = x.shape[0]
         elif self.spcidx:
-            spcidx = read_hdf5(featfile, '/spcidx_range')[0]
+            spcidx = self.read_hdf5(featfile, '/spcidx_range')[0]
             f_ss = spcidx[0]-self.pad_left
             spcidx_end = spcidx[-1]
             f_es = spcidx_end+self.pad_right
@@ -653,9 +747,9 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
         if not self.mel or (self.mel and self.excit_dim is not None):
             mean_trg_list, std_trg_list, trg_code_list, pair_spk_list = \
                 proc_random_spkcv_statcvexcit(src_idx, self.spk_list, self.n_cv, flen, self.n_spk, \
-                    self.stat_spk_list, self.mean_path, self.scale_path)
-            mean_src = read_hdf5(self.stat_spk_list[src_idx], self.mean_path)[1:2]
-            std_src = read_hdf5(self.stat_spk_list[src_idx], self.scale_path)[1:2]
+                    self.stat_spk_list, self.mean_path, self.scale_path, read_fn=self.read_hdf5)
+            mean_src = self.read_hdf5(self.stat_spk_list[src_idx], self.mean_path)[1:2]
+            std_src = self.read_hdf5(self.stat_spk_list[src_idx], self.scale_path)[1:2]
 
             cv_src_list = [None]*self.n_cv
             if self.excit_dim is not None:
@@ -674,7 +768,7 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
         else:
             trg_code_list, pair_spk_list = \
                 proc_random_spkcv_statcvexcit(src_idx, self.spk_list, self.n_cv, flen, self.n_spk, \
-                    self.stat_spk_list, self.mean_path, self.scale_path, False)
+                    self.stat_spk_list, self.mean_path, self.scale_path, False, read_fn=self.read_hdf5)
 
         for i in range(self.n_cv):
             trg_code_list[i] = torch.LongTensor(self.pad_feat_transform(trg_code_list[i]))
@@ -682,11 +776,11 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
         if self.uvcap:
             if self.spcidx:
                 if self.wav_list is not None:
-                    uvcap = read_hdf5(featfile, '/feat_mceplf0cap')[:spcidx_end+1,2:3]
+                    uvcap = self.read_hdf5(featfile, '/feat_mceplf0cap')[:spcidx_end+1,2:3]
                 else:
-                    uvcap = read_hdf5(featfile, '/feat_mceplf0cap')[spcidx[0]:spcidx_end+1,2:3]
+                    uvcap = self.read_hdf5(featfile, '/feat_mceplf0cap')[spcidx[0]:spcidx_end+1,2:3]
             else:
-                uvcap = read_hdf5(featfile, '/feat_mceplf0cap')[:,2:3]
+                uvcap = self.read_hdf5(featfile, '/feat_mceplf0cap')[:,2:3]
             feat = torch.FloatTensor(self.pad_feat_transform(np.c_[feat,uvcap]))
         else:
             feat = torch.FloatTensor(self.pad_feat_transform(feat))
@@ -703,7 +797,7 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                 else:
                     x = torch.LongTensor(self.pad_wav_transform(x))
                     if self.cf_dim is not None:
-                        return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'slen': slen, 'flen': flen, 'src_codes': src_codes, 'src_trg_codes_list': trg_code_list, \
+                        return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'slen': slen, 'flen': flen, 'src_codes': src_codes, 'src_trg_codes_list': trg_code_list, \
                                 'pair_spk_list': pair_spk_list, 'feat_cv_list': cv_src_list, 'featfile_spk': featfile_spk, \
                                     'featfile': featfile, 'feat': feat}
                     else:
@@ -724,7 +818,7 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                         x_org = None
                         x_org_band = None
                     if self.cf_dim is not None:
-                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'slen': slen, 'flen': flen, 'src_codes': src_codes, 'src_trg_codes_list': trg_code_list, \
+                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'slen': slen, 'flen': flen, 'src_codes': src_codes, 'src_trg_codes_list': trg_code_list, \
                                 'pair_spk_list': pair_spk_list, 'feat_cv_list': cv_src_list, 'featfile_spk': featfile_spk, \
                                     'featfile': featfile, 'feat': feat, 'feat_magsp': feat_magsp}
                     else:
@@ -740,7 +834,7 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                 else:
                     x = torch.LongTensor(self.pad_wav_transform(x))
                     if self.cf_dim is not None:
-                        return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'slen': slen, 'flen': flen, 'src_codes': src_codes, 'src_trg_codes_list': trg_code_list, \
+                        return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'slen': slen, 'flen': flen, 'src_codes': src_codes, 'src_trg_codes_list': trg_code_list, \
                                 'pair_spk_list': pair_spk_list, 'featfile_spk': featfile_spk, \
                                     'featfile': featfile, 'feat': feat}
                     else:
@@ -762,7 +856,7 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                         x_org_band = None
                     x = torch.LongTensor(self.pad_wav_transform(x))
                     if self.cf_dim is not None:
-                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'slen': slen, 'flen': flen, 'src_codes': src_codes, 'src_trg_codes_list': trg_code_list, \
+                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'slen': slen, 'flen': flen, 'src_codes': src_codes, 'src_trg_codes_list': trg_code_list, \
                                 'pair_spk_list': pair_spk_list, 'featfile_spk': featfile_spk, \
                                     'featfile': featfile, 'feat': feat, 'feat_magsp': feat_magsp}
                     else:
@@ -771,13 +865,14 @@ class FeatureDatasetCycMceplf0WavVAE(Dataset):
                                     'featfile': featfile, 'feat': feat, 'feat_magsp': feat_magsp}
 
 
-class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
+class FeatureDatasetEvalCycMceplf0WavVAE(CachedFeatureDataset):
     """Dataset for evaluation cyclic mceplf0-waveform VAE-based VC
     """
 
     def __init__(self, file_list, pad_transform, spk_list, stat_spk_list, string_path, excit_dim=None, cap_exc_dim=None,
             upsampling_factor=None, wav_list=None, pad_wav_transform=None, wav_transform=None, spcidx=True, worgx_flag=False,
-                uvcap_flag=True, n_bands=1, cf_dim=None, pad_left=0, pad_right=0, magsp=False, pad_wav_org_transform=None, n_spk_data=None):
+                uvcap_flag=True, n_bands=1, cf_dim=None, pad_left=0, pad_right=0, magsp=False, pad_wav_org_transform=None, n_spk_data=None, cache=None):
+        self.cache = cache
         self.wav_list = wav_list
         self.file_list = file_list
         self.pad_transform = pad_transform
@@ -925,30 +1020,30 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
 
         if self.mel:
             if self.excit_dim is not None:
-                h_src = np.c_[read_hdf5(featfile_src, '/feat_mceplf0cap')[:,:self.excit_dim], read_hdf5(featfile_src, self.string_path)]
+                h_src = np.c_[self.read_hdf5(featfile_src, '/feat_mceplf0cap')[:,:self.excit_dim], self.read_hdf5(featfile_src, self.string_path)]
             else:
-                h_src = read_hdf5(featfile_src, self.string_path)
+                h_src = self.read_hdf5(featfile_src, self.string_path)
             if self.magsp:
-                h_src_magsp = read_hdf5(featfile_src, '/magsp')
+                h_src_magsp = self.read_hdf5(featfile_src, '/magsp')
         else:
             if self.cap_exc_dim is None:
-                h_src = read_hdf5(featfile_src, self.string_path)
+                h_src = self.read_hdf5(featfile_src, self.string_path)
             else:
-                h_src = np.c_[read_hdf5(featfile_src, '/feat_mceplf0cap')[:,:2], read_hdf5(featfile_src, '/feat_mceplf0cap')[:,self.cap_exc_dim:]]
+                h_src = np.c_[self.read_hdf5(featfile_src, '/feat_mceplf0cap')[:,:2], self.read_hdf5(featfile_src, '/feat_mceplf0cap')[:,self.cap_exc_dim:]]
         spk_src = os.path.basename(os.path.dirname(featfile_src))
         spk_trg = os.path.basename(os.path.dirname(featfile_src_trg))
         idx_src = self.spk_list.index(spk_src)
         idx_trg = self.spk_list.index(spk_trg)
 
-        spcidx_src = read_hdf5(featfile_src, '/spcidx_range')[0]
-        frm_len = len(read_hdf5(featfile_src, '/f0_range'))
+        spcidx_src = self.read_hdf5(featfile_src, '/spcidx_range')[0]
+        frm_len = len(self.read_hdf5(featfile_src, '/f0_range'))
         if self.wav_list is not None:
             wavfile = self.wav_list_src[idx]            
             if self.n_bands > 1:
                 wavfile_pqmf_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(wavfile)))+"_pqmf_"+str(self.n_bands), \
                     os.path.basename(os.path.dirname(os.path.dirname(wavfile))), os.path.basename(os.path.dirname(wavfile)))
                 if self.worgx_flag:
-                    x_org, _ = sf.read(wavfile, dtype=np.float32)
+                    x_org = self.read_wav(wavfile)
                 for i in range(self.n_bands):
                     if self.n_bands >= 10:
                         if i < self.n_bands - 1:
@@ -957,7 +1052,7 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
                             wavfile_pqmf = os.path.join(wavfile_pqmf_dir, os.path.basename(wavfile).replace(".wav", "_B-"+str(i+1)+".wav"))
                     else:
                         wavfile_pqmf = os.path.join(wavfile_pqmf_dir, os.path.basename(wavfile).replace(".wav", "_B-"+str(i+1)+".wav"))
-                    x_pqmf, _ = sf.read(wavfile_pqmf, dtype=np.float32)
+                    x_pqmf = self.read_wav(wavfile_pqmf)
                     if i > 0:
                         x_pqmf, _ = validate_length(x_pqmf, h_src, self.upsampling_factor_bands)
                         x = np.c_[x, np.expand_dims(x_pqmf,-1)]
@@ -1003,7 +1098,7 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
                         h_src_magsp = h_src_magsp[spcidx_s_e[0]:spcidx_s_e[-1]]
                         assert(x.shape[0]==h_src_magsp.shape[0]*self.upsampling_factor_bands)
             else:
-                x, _ = sf.read(wavfile, dtype=np.float32)
+                x = self.read_wav(wavfile)
                 x, h_src = validate_length(x, h_src, self.upsampling_factor)
                 assert(x.shape[0]==h_src.shape[0]*self.upsampling_factor)
                 frm_len = h_src.shape[0]
@@ -1056,10 +1151,10 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
         flen = h_src.shape[0]
 
         if not self.mel or (self.mel and self.excit_dim is not None):
-            mean_src = read_hdf5(self.stat_spk_list[idx_src], self.mean_path)[1:2]
-            std_src = read_hdf5(self.stat_spk_list[idx_src], self.scale_path)[1:2]
-            mean_trg = read_hdf5(self.stat_spk_list[idx_trg], self.mean_path)[1:2]
-            std_trg = read_hdf5(self.stat_spk_list[idx_trg], self.scale_path)[1:2]
+            mean_src = self.read_hdf5(self.stat_spk_list[idx_src], self.mean_path)[1:2]
+            std_src = self.read_hdf5(self.stat_spk_list[idx_src], self.scale_path)[1:2]
+            mean_trg = self.read_hdf5(self.stat_spk_list[idx_trg], self.mean_path)[1:2]
+            std_trg = self.read_hdf5(self.stat_spk_list[idx_trg], self.scale_path)[1:2]
 
         flen_src = h_src.shape[0]
         flen_spc_src = spcidx_src.shape[0]
@@ -1083,19 +1178,19 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
         if file_src_trg_flag:
             if self.mel:
                 if self.excit_dim is not None:
-                    h_src_trg = np.c_[read_hdf5(featfile_src_trg, '/feat_mceplf0cap')[:,:self.excit_dim], read_hdf5(featfile_src_trg, self.string_path)]
+                    h_src_trg = np.c_[self.read_hdf5(featfile_src_trg, '/feat_mceplf0cap')[:,:self.excit_dim], self.read_hdf5(featfile_src_trg, self.string_path)]
                 else:
-                    h_src_trg = read_hdf5(featfile_src_trg, self.string_path)
+                    h_src_trg = self.read_hdf5(featfile_src_trg, self.string_path)
             else:
                 if self.cap_exc_dim is None:
-                    h_src_trg = read_hdf5(featfile_src_trg, self.string_path)
+                    h_src_trg = self.read_hdf5(featfile_src_trg, self.string_path)
                 else:
-                    h_src_trg = np.c_[read_hdf5(featfile_src_trg, '/feat_mceplf0cap')[:,:2], read_hdf5(featfile_src_trg, '/feat_mceplf0cap')[:,self.cap_exc_dim:]]
-            spcidx_src_trg = read_hdf5(featfile_src_trg, "/spcidx_range")[0]
+                    h_src_trg = np.c_[self.read_hdf5(featfile_src_trg, '/feat_mceplf0cap')[:,:2], self.read_hdf5(featfile_src_trg, '/feat_mceplf0cap')[:,self.cap_exc_dim:]]
+            spcidx_src_trg = self.read_hdf5(featfile_src_trg, "/spcidx_range")[0]
             flen_src_trg = h_src_trg.shape[0]
             flen_spc_src_trg = spcidx_src_trg.shape[0]
             if self.uvcap:
-                uvcap_trg = read_hdf5(featfile_src_trg, '/feat_mceplf0cap')[:,2:3]
+                uvcap_trg = self.read_hdf5(featfile_src_trg, '/feat_mceplf0cap')[:,2:3]
                 h_src_trg = torch.FloatTensor(self.pad_transform(np.c_[h_src_trg,uvcap_trg]))
             else:
                 h_src_trg = torch.FloatTensor(self.pad_transform(h_src_trg))
@@ -1103,14 +1198,14 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
 
         if self.uvcap:
             if self.spcidx:
-                uvcap_full = read_hdf5(featfile, '/feat_mceplf0cap')
+                uvcap_full = self.read_hdf5(featfile, '/feat_mceplf0cap')
                 if self.wav_list is not None:
                     uvcap = uvcap_full[:spcidx_src_end+1,2:3]
                 else:
                     uvcap = uvcap_full[spcidx_src[0]:spcidx_src_end+1,2:3]
                 h_src_full = torch.FloatTensor(self.pad_transform(np.c_[h_src_full,uvcap_full]))
             else:
-                uvcap = read_hdf5(featfile_src, '/feat_mceplf0cap')[:,2:3]
+                uvcap = self.read_hdf5(featfile_src, '/feat_mceplf0cap')[:,2:3]
             h_src = torch.FloatTensor(self.pad_transform(np.c_[h_src,uvcap]))
         else:
             h_src = torch.FloatTensor(self.pad_transform(h_src))
@@ -1146,7 +1241,7 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
                                 'src_code_full': src_code_full, 'src_trg_code_full': src_trg_code_full}
                     else:
                         x = torch.LongTensor(self.pad_wav_transform(x))
-                        return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
+                        return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
                                 'cv_src': cv_src, 'h_src_trg': h_src_trg, 'flen_src_trg': flen_src_trg, 'featfile': featfile_src, \
                                 'file_src_trg_flag': file_src_trg_flag, 'spk_trg': spk_trg, 'spcidx_src': spcidx_src, \
                                 'spcidx_src_trg': spcidx_src_trg, 'flen_spc_src': flen_spc_src, 'flen_spc_src_trg': flen_spc_src_trg, \
@@ -1169,7 +1264,7 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
                         else:
                             x_org = None
                             x_org_band = None
-                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
+                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
                                 'cv_src': cv_src, 'h_src_trg': h_src_trg, 'flen_src_trg': flen_src_trg, 'featfile': featfile_src, \
                                 'file_src_trg_flag': file_src_trg_flag, 'spk_trg': spk_trg, 'spcidx_src': spcidx_src, \
                                 'spcidx_src_trg': spcidx_src_trg, 'flen_spc_src': flen_spc_src, 'flen_spc_src_trg': flen_spc_src_trg, \
@@ -1187,7 +1282,7 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
                                 'src_code_full': src_code_full, 'src_trg_code_full': src_trg_code_full}
                     else:
                         x = torch.LongTensor(self.pad_wav_transform(x))
-                        return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
+                        return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
                                 'h_src_trg': h_src_trg, 'flen_src_trg': flen_src_trg, 'featfile': featfile_src, \
                                 'file_src_trg_flag': file_src_trg_flag, 'spk_trg': spk_trg, 'spcidx_src': spcidx_src, \
                                 'spcidx_src_trg': spcidx_src_trg, 'flen_spc_src': flen_spc_src, 'flen_spc_src_trg': flen_spc_src_trg, \
@@ -1210,7 +1305,7 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
                         else:
                             x_org = None
                             x_org_band = None
-                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
+                        return {'x_org': x_org, 'x_org_band': x_org_band, 'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
                                 'h_src_trg': h_src_trg, 'flen_src_trg': flen_src_trg, 'featfile': featfile_src, \
                                 'file_src_trg_flag': file_src_trg_flag, 'spk_trg': spk_trg, 'spcidx_src': spcidx_src, \
                                 'spcidx_src_trg': spcidx_src_trg, 'flen_spc_src': flen_spc_src, 'flen_spc_src_trg': flen_spc_src_trg, \
@@ -1225,17 +1320,18 @@ class FeatureDatasetEvalCycMceplf0WavVAE(Dataset):
                         'spcidx_src_trg': spcidx_src_trg, 'flen_spc_src': flen_spc_src, 'flen_spc_src_trg': flen_spc_src_trg}
             else:
                 x = torch.LongTensor(self.pad_wav_transform(x))
-                return {'x_c': x // self.cf_dim, 'x_f': x % self.cf_dim, 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
+                return {'x_c': compact_wav_code(x // self.cf_dim, self.cf_dim), 'x_f': compact_wav_code(x % self.cf_dim, self.cf_dim), 'slen_src': slen, 'h_src': h_src, 'flen_src': flen_src, 'src_code': src_code, 'src_trg_code': src_trg_code, \
                         'cv_src': cv_src, 'h_src_trg': h_src_trg, 'flen_src_trg': flen_src_trg, 'featfile': featfile_src, \
                         'file_src_trg_flag': file_src_trg_flag, 'spk_trg': spk_trg, 'spcidx_src': spcidx_src, \
                         'spcidx_src_trg': spcidx_src_trg, 'flen_spc_src': flen_spc_src, 'flen_spc_src_trg': flen_spc_src_trg}
 
 
-class FeatureDatasetVAE(Dataset):
+class FeatureDatasetVAE(CachedFeatureDataset):
     """Dataset for VAE
     """
 
-    def __init__(self, feat_list, pad_feat_transform, string_path, magsp=False, spk_list=None):
+    def __init__(self, feat_list, pad_feat_transform, string_path, magsp=False, spk_list=None, cache=None):
+        self.cache = cache
         self.feat_list = feat_list
         self.pad_feat_transform = pad_feat_transform
         self.string_path = string_path
@@ -1251,12 +1347,12 @@ class FeatureDatasetVAE(Dataset):
 
     def __getitem__(self, idx):
         featfile = self.feat_list[idx]
-        feat = read_hdf5(featfile, self.string_path)
+        feat = self.read_hdf5(featfile, self.string_path)
         #if self.excit_dim is not None:
-        #    feat = np.c_[read_hdf5(featfile, '/feat_mceplf0cap')[:,:self.excit_dim], read_hdf5(featfile, self.string_path)]
-        frm_len = len(read_hdf5(featfile, '/f0_range'))
+        #    feat = np.c_[self.read_hdf5(featfile, '/feat_mceplf0cap')[:,:self.excit_dim], self.read_hdf5(featfile, self.string_path)]
+        frm_len = len(self.read_hdf5(featfile, '/f0_range'))
 
-        spcidx = read_hdf5(featfile, '/spcidx_range')[0]
+        spcidx = self.read_hdf5(featfile, '/spcidx_range')[0]
         f_ss = spcidx[0]
         f_es = spcidx[-1]
         if f_ss < 0:
@@ -1277,9 +1373,9 @@ class FeatureDatasetVAE(Dataset):
         feat = torch.FloatTensor(self.pad_feat_transform(feat))
         if self.magsp:
             if self.mel:
-                feat_magsp = read_hdf5(featfile, '/magsp')[spcidx_s_e[0]:spcidx_s_e[-1]]
+                feat_magsp = self.read_hdf5(featfile, '/magsp')[spcidx_s_e[0]:spcidx_s_e[-1]]
             else:
-                feat_magsp = read_hdf5(featfile, '/worldsp')[spcidx_s_e[0]:spcidx_s_e[-1]]
+                feat_magsp = self.read_hdf5(featfile, '/worldsp')[spcidx_s_e[0]:spcidx_s_e[-1]]
             feat_magsp = torch.FloatTensor(self.pad_feat_transform(feat_magsp))
             if self.spk_list is not None:
                 return {'flen': flen, 'featfile': featfile, 'feat': feat, 'feat_magsp': feat_magsp, 'sc': spk_code}
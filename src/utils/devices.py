@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import logging
+import os
+
+import torch
+
+
+def n_available_cores():
+    """FUNCTION TO GET NUMBER OF CPU CORES AVAILABLE TO THIS PROCESS
+
+    Return:
+        (int): number of cores in the affinity mask (cpu_count if not supported)
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def set_cpu_threads(n_threads=0, n_interop_threads=0, n_procs=1, n_workers=0):
+    """FUNCTION TO SET CPU THREAD POLICY
+
+    Intra-op threads default to the available cores shared among the parallel processes,
+    minus the dataloader workers, so that the compute threads do not oversubscribe the cores.
+    Inter-op threads default to 1, since the recurrent models are executed as a sequential graph.
+
+    Args:
+        n_threads (int): number of intra-op threads (if set 0, automatic)
+        n_interop_threads (int): number of inter-op threads (if set 0, automatic)
+        n_procs (int): number of parallel (decoding) processes sharing the cores
+        n_workers (int): number of dataloader workers per process
+
+    Return:
+        (int): number of intra-op threads
+        (int): number of inter-op threads
+    """
+    if n_threads is None or n_threads <= 0:
+        n_threads = max(1, n_available_cores() // max(1, n_procs) - n_workers)
+    if n_interop_threads is None or n_interop_threads <= 0:
+        n_interop_threads = 1
+    torch.set_num_threads(n_threads)
+    try:
+        torch.set_num_interop_threads(n_interop_threads)
+    except RuntimeError:
+        # can only be set once per process, before any inter-op parallel work has started
+        logging.warning("number of inter-op threads is already set to %d" % torch.get_num_interop_threads())
+    logging.info("cpu threads: intra-op %d, inter-op %d" % (torch.get_num_threads(), torch.get_num_interop_threads()))
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def get_device(device=None, gpu=None, n_threads=0, n_interop_threads=0, n_procs=1, n_workers=0):
+    """FUNCTION TO GET COMPUTE DEVICE
+
+    Args:
+        device (str): "cuda" or "cpu" (if None, cuda if available, otherwise cpu)
+        gpu (int): index of visible gpu in case of cuda
+        n_threads (int): number of cpu intra-op threads (if set 0, automatic)
+        n_interop_threads (int): number of cpu inter-op threads (if set 0, automatic)
+        n_procs (int): number of parallel processes sharing the cpu cores
+        n_workers (int): number of dataloader workers per process
+
+    Return:
+        (torch.device): compute device
+    """
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cuda" and not torch.cuda.is_available():
+        logging.warning("cuda is not available, cpu will be used.")
+        device = "cpu"
+    if device == "cuda":
+        if gpu is not None:
+            device = torch.device("cuda", gpu)
+        else:
+            device = torch.device("cuda")
+        if n_threads is not None and n_threads > 0:
+            set_cpu_threads(n_threads, n_interop_threads, n_procs, n_workers)
+    else:
+        device = torch.device("cpu")
+        set_cpu_threads(n_threads, n_interop_threads, n_procs, n_workers)
+    logging.info("device: %s" % str(device))
+    return device
+
+
+def device_context(device):
+    """FUNCTION TO GET CONTEXT MANAGER OF COMPUTE DEVICE
+
+    Args:
+        device (torch.device): compute device
+
+    Return:
+        torch.cuda.device context in case of cuda, otherwise null context
+    """
+    if device.type == "cuda":
+        return torch.cuda.device(device)
+    return contextlib.suppress() # no-op context, nullcontext is not available in python 3.6
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import os
+import socket
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+from torch.utils.data import Sampler
+
+
+def is_distributed():
+    """FUNCTION TO CHECK WHETHER MORE THAN ONE TRAINING PROCESS IS RUNNING
+
+    Return:
+        (bool): True if the process group is initialized with world size > 1
+    """
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def init_distributed(backend="gloo"):
+    """FUNCTION TO INITIALIZE DATA-PARALLEL PROCESS GROUP FROM ENVIRONMENT
+
+    The environment variables RANK, WORLD_SIZE, MASTER_ADDR, and MASTER_PORT are set by the launcher, e.g.,
+    python -m torch.distributed.launch --use_env --nnodes=2 --node_rank=0 --nproc_per_node=4
+        --master_addr=node0 --master_port=29500 train_xxx.py ...
+    Without WORLD_SIZE (or with WORLD_SIZE=1), a single process is used and nothing is initialized.
+    The number of processes on this node is read from LOCAL_WORLD_SIZE if set (torchrun / elastic launch),
+    otherwise, e.g., torch.distributed.launch of pytorch 1.8, the ranks on the same hostname are counted.
+
+    Args:
+        backend (str): backend of torch.distributed, gloo for cpu nodes
+
+    Return:
+        (int): rank of this process
+        (int): number of processes
+        (int): number of processes on this node (sharing the cpu cores)
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size <= 1:
+        return 0, 1, 1
+    if not dist.is_available():
+        raise RuntimeError("torch.distributed is not available in this pytorch build.")
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend, init_method="env://")
+    if "LOCAL_WORLD_SIZE" in os.environ:
+        local_world_size = int(os.environ["LOCAL_WORLD_SIZE"])
+    else:
+        hostname = socket.gethostname()
+        hostnames = [None]*dist.get_world_size()
+        dist.all_gather_object(hostnames, hostname)
+        local_world_size = hostnames.count(hostname)
+    logging.info("rank %d of %d, %d processes on %s" % (dist.get_rank(), dist.get_world_size(), local_world_size,
+        socket.gethostname()))
+    return dist.get_rank(), dist.get_world_size(), local_world_size
+
+
+class ShardedSampler(Sampler):
+    """DETERMINISTIC PER-RANK SHARD OF DATASET INDICES
+
+    Every rank draws the same permutation from seed + epoch and takes every world_size-th index from its rank,
+    so that the shards of one epoch are disjoint and cover the whole dataset. The epoch is advanced after each pass,
+    i.e., each new iterator of the DataLoader. The shards are not padded, the ranks may differ by one utterance.
+
+    Args:
+        dataset (Dataset): dataset
+        shuffle (bool): flag to shuffle the indices in each epoch
+        seed (int): seed of the permutation, shared by all ranks
+        rank (int): rank of this process (if None, from process group)
+        world_size (int): number of processes (if None, from process group)
+    """
+
+    def __init__(self, dataset, shuffle=True, seed=1, rank=None, world_size=None):
+        self.n_data = len(dataset)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = get_rank() if rank is None else rank
+        self.world_size = get_world_size() if world_size is None else world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """Set epoch of the next pass, e.g., after resuming"""
+        self.epoch = epoch
+
+    def __iter__(self):
+        if self.shuffle:
+            indices = np.random.RandomState(self.seed + self.epoch).permutation(self.n_data)
+        else:
+            indices = np.arange(self.n_data)
+        self.epoch += 1
+        return iter(indices[self.rank::self.world_size].tolist())
+
+    def __len__(self):
+        return len(range(self.rank, self.n_data, self.world_size))
+
+
+@torch.no_grad()
+def broadcast_parameters(models, src=0):
+    """FUNCTION TO REPLICATE PARAMETERS AND BUFFERS OF MODELS FROM ONE RANK
+
+    Args:
+        models (list): model instances
+        src (int): source rank
+    """
+    if not is_distributed():
+        return
+    for model in models:
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            dist.broadcast(tensor.data, src)
+
+
+def broadcast_object(obj, src=0):
+    """FUNCTION TO SHARE A PICKLABLE OBJECT OF ONE RANK WITH ALL RANKS, e.g., settings decided by rank 0
+
+    Args:
+        obj (object): object of the source rank (ignored on the other ranks)
+        src (int): source rank
+
+    Return:
+        (object): object of the source rank
+    """
+    if not is_distributed():
+        return obj
+    objs = [obj]
+    dist.broadcast_object_list(objs, src)
+    return objs[0]
+
+
+@torch.no_grad()
+def all_reduce_gradients(params):
+    """FUNCTION TO AVERAGE GRADIENTS OVER RANKS AFTER BACKWARD
+
+    The gradients are flattened into one buffer, i.e., one all-reduce per iteration.
+    Trainable parameters without gradient in this iteration contribute zeros, as in DistributedDataParallel.
+
+    Args:
+        params (list): parameters of the optimizer
+    """
+    if not is_distributed():
+        return
+    params = [param for param in params if param.requires_grad]
+    if len(params) == 0:
+        return
+    for param in params:
+        if param.grad is None:
+            param.grad = torch.zeros_like(param)
+    flat = torch.cat([param.grad.reshape(-1) for param in params])
+    dist.all_reduce(flat)
+    flat /= dist.get_world_size()
+    offset = 0
+    for param in params:
+        numel = param.grad.numel()
+        param.grad.copy_(flat[offset:offset+numel].view_as(param.grad))
+        offset += numel
+
+
+def epoch_end(batch):
+    """End-of-pass batch of the data generators, i.e., the first item is an empty list"""
+    return isinstance(batch[0], list) and len(batch[0]) == 0
+
+
+def synchronize_epochs(generator, idle_step, is_end=epoch_end):
+    """FUNCTION TO KEEP TRAINING GENERATORS OF ALL RANKS IN THE SAME EPOCH
+
+    The number of segment batches of a shard differs among ranks, while every iteration needs all of the ranks
+    for the gradient all-reduce. A rank that reaches the end of its pass holds its end-of-pass batch and calls
+    idle_step once for each iteration of the other ranks, i.e., an optimizer step with zero-gradient contribution
+    to the all-reduce, until all of the ranks reach the end. No batch is dropped, and all ranks summarize the epoch
+    and start the next one together with the same number of steps.
+
+    Args:
+        generator (generator): training batch generator
+        idle_step (func): function of one training step without batch, i.e., all-reduce of zero gradients,
+            optimizer and sparsification step, and step count
+        is_end (func): function to check end-of-pass batch
+
+    Return:
+        (object): generator instance
+    """
+    while True:
+        batch = next(generator)
+        if is_distributed():
+            n_idle = 0
+            while True:
+                active = torch.tensor([float(not is_end(batch))])
+                dist.all_reduce(active)
+                if active.item() == 0 or not is_end(batch):
+                    break
+                idle_step()
+                n_idle += 1
+            if n_idle > 0:
+                logging.info("%d idle steps of this rank until the end of the other passes" % (n_idle))
+        yield batch
+
+
+def _merge(values):
+    first = values[0]
+    if isinstance(first, dict):
+        keys = []
+        for value in values:
+            keys.extend([key for key in value.keys() if key not in keys])
+        return dict((key, _merge([value.get(key, []) for value in values])) for key in keys)
+    if isinstance(first, list):
+        if any(isinstance(x, list) for x in first):
+            # per-index structure, e.g., [[...] for i in range(n_half_cyc)]
+            return [_merge([value[i] for value in values]) if isinstance(first[i], list) else first[i] \
+                        for i in range(len(first))]
+        return [x for value in values for x in value]
+    return first
+
+
+def all_gather_lists_(*objs):
+    """FUNCTION TO GATHER PER-UTTERANCE EVALUATION VALUES OF ALL RANKS IN PLACE
+
+    The values are gathered instead of reduced to their sums, so that the mean, the standard deviation,
+    and the development model selection computed from them are identical on all ranks.
+
+    Args:
+        objs: lists of values, (nested) lists of such lists, or dicts of such lists, e.g., total_eval_loss
+    """
+    if not is_distributed():
+        return
+    gathered = [None]*dist.get_world_size()
+    dist.all_gather_object(gathered, objs)
+    for i, obj in enumerate(objs):
+        merged = _merge([values[i] for values in gathered])
+        if isinstance(obj, dict):
+            obj.clear()
+            obj.update(merged)
+        else:
+            obj[:] = merged
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import multiprocessing
+
+import numpy as np
+
+try:
+    from dtw_c import dtw_c as dtw
+    DTW_BACKEND = "dtw_c"
+except ImportError:
+    # in-repo implementation with the same interface if the dtw_c extension is not built,
+    # its parity with dtw_c is checked by src/bin/benchmark_dtw.py --check true
+    import banded_dtw as dtw
+    DTW_BACKEND = "banded_dtw"
+
+
+def melsp_dB_dist(melsp, melsp_ref):
+    """FUNCTION TO COMPUTE FRAME-WISE LOG-SPECTRAL DISTORTION [dB] OF ALIGNED MAGNITUDE MEL-SPECTROGRAMS
+
+    Args:
+        melsp (ndarray): magnitude mel-spectrogram (T x D)
+        melsp_ref (ndarray): reference magnitude mel-spectrogram (T x D)
+
+    Return:
+        (ndarray): distortion of each frame (T)
+    """
+    return np.sqrt(np.mean((20*(np.log10(np.clip(melsp, a_min=1e-16, a_max=None)) \
+                            -np.log10(np.clip(melsp_ref, a_min=1e-16, a_max=None))))**2, axis=-1))
+
+
+def dtw_eval_metrics(melsp_cv, melsp_trg, lat_src, lat_trg, excit_cv=None, excit_trg=None):
+    """FUNCTION TO COMPUTE DTW-BASED METRICS OF A CONVERTED / TARGET UTTERANCE PAIR
+
+    Args:
+        melsp_cv (ndarray): converted magnitude mel-spectrogram at speech frames of source (T_src x D)
+        melsp_trg (ndarray): target magnitude mel-spectrogram at speech frames of target (T_trg x D)
+        lat_src (ndarray): latent of source at speech frames of source (T_src x D_lat)
+        lat_trg (ndarray): latent of target at speech frames of target (T_trg x D_lat)
+        excit_cv (ndarray): converted uv / log-f0 / codeap-uv / log-neg-codeap at speech frames of source (T_src x D_e)
+        excit_trg (ndarray): target uv / log-f0 / codeap-uv / log-neg-codeap at speech frames of target (T_trg x D_e)
+
+    Return:
+        (dict): melsp_dB (+ _std), lat_dist_rmse, lat_dist_cossim, their directional values,
+            and uv, f0, uvcap, cap if excitation features are given
+    """
+    melsp_cv = np.array(melsp_cv, dtype=np.float64)
+    melsp_trg = np.array(melsp_trg, dtype=np.float64)
+    lat_src = np.array(lat_src, dtype=np.float64)
+    lat_trg = np.array(lat_trg, dtype=np.float64)
+    metrics = {}
+
+    # MCD of spectral
+    _, twf_melsp, _, _ = dtw.dtw_org_to_trg(melsp_cv, melsp_trg, mcd=-1)
+    twf_melsp = np.array(twf_melsp[:,0])
+    melsp_dB = melsp_dB_dist(melsp_cv[twf_melsp], melsp_trg)
+    metrics["melsp_dB"] = np.mean(melsp_dB)
+    metrics["melsp_dB_std"] = np.std(melsp_dB)
+
+    # excitation at time-warping of spectral
+    if excit_cv is not None and excit_trg is not None:
+        excit_cv = np.array(excit_cv, dtype=np.float64)[twf_melsp]
+        excit_trg = np.array(excit_trg, dtype=np.float64)
+        metrics["uv"] = np.mean(100*np.abs(excit_cv[:,0]-excit_trg[:,0]))
+        metrics["f0"] = np.sqrt(np.mean((np.exp(excit_cv[:,1])-np.exp(excit_trg[:,1]))**2))
+        metrics["uvcap"] = np.mean(100*np.abs(excit_cv[:,2]-excit_trg[:,2]))
+        metrics["cap"] = np.mean(np.sum(np.abs(np.exp(excit_trg[:,3:])-np.exp(excit_cv[:,3:])), -1))
+
+    # time-warping of latent source-to-target for RMSE
+    aligned_lat_srctrg, _, _, _ = dtw.dtw_org_to_trg(lat_src, lat_trg)
+    metrics["lat_dist_srctrg"] = np.mean(np.sqrt(np.mean((aligned_lat_srctrg-lat_trg)**2, axis=0)))
+    # Cos-sim of latent source-to-target
+    _, _, metrics["lat_cdist_srctrg"], _ = dtw.dtw_org_to_trg(lat_trg, lat_src, mcd=0)
+    # time-warping of latent target-to-source for RMSE
+    aligned_lat_trgsrc, _, _, _ = dtw.dtw_org_to_trg(lat_trg, lat_src)
+    metrics["lat_dist_trgsrc"] = np.mean(np.sqrt(np.mean((aligned_lat_trgsrc-lat_src)**2, axis=0)))
+    # Cos-sim of latent target-to-source
+    _, _, metrics["lat_cdist_trgsrc"], _ = dtw.dtw_org_to_trg(lat_src, lat_trg, mcd=0)
+    # RMSE
+    metrics["lat_dist_rmse"] = (metrics["lat_dist_srctrg"]+metrics["lat_dist_trgsrc"])/2
+    # Cos-sim
+    metrics["lat_dist_cossim"] = (metrics["lat_cdist_srctrg"]+metrics["lat_cdist_trgsrc"])/2
+
+    return metrics
+
+
+class DTWEvalPool(object):
+    """WORKER POOL OF DTW-BASED EVALUATION METRICS
+
+    Utterance pairs are submitted during the evaluation loop and their metrics are computed by worker processes,
+    so that the model computation does not wait for the DTW. The metrics are collected at the end of the evaluation.
+    The workers are started with spawn, as the parent process may have initialized cuda / OpenMP thread pools.
+
+    Args:
+        n_workers (int): number of worker processes (if set 0, metrics are computed synchronously in the caller)
+    """
+
+    def __init__(self, n_workers=2):
+        if DTW_BACKEND != "dtw_c":
+            logging.warning("dtw_c extension is not built, DTW metrics are computed with in-repo %s." % DTW_BACKEND)
+        if n_workers > 0:
+            self.pool = multiprocessing.get_context("spawn").Pool(n_workers)
+        else:
+            self.pool = None
+        self.pending = []
+
+    def submit(self, info, *args, **kwargs):
+        """Queue an utterance pair, args/kwargs are those of dtw_eval_metrics
+
+        Args:
+            info: any information to be returned together with the metrics, e.g., feature file and target speaker
+        """
+        if self.pool is not None:
+            result = self.pool.apply_async(dtw_eval_metrics, args, kwargs)
+        else:
+            result = dtw_eval_metrics(*args, **kwargs)
+        self.pending.append((info, result))
+
+    def collect(self):
+        """Get the metrics of all of the submitted pairs in the submission order
+
+        Return:
+            generator of (info, metrics dict)
+        """
+        pending, self.pending = self.pending, []
+        for info, result in pending:
+            if self.pool is not None:
+                result = result.get()
+            yield info, result
+
+    def close(self):
+        """Stop the worker processes"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
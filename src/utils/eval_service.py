@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import json
+import logging
+import os
+import re
+import time
+
+import numpy as np
+import torch
+
+from checkpoint_io import load_model_states, read_checkpoint_meta
+
+
+EVAL_MODES = ["inline", "trainer", "evaluator"]
+
+
+def eval_subset_indices(n_data, n_subset):
+    """FUNCTION TO GET FIXED SUBSET OF EVALUATION UTTERANCES FOR FAST PROXY EVALUATION
+
+    The indices are evenly spaced over the evaluation list, i.e., over the speakers of the sorted lists,
+    and are the same in every epoch, so that the proxy losses are comparable between epochs.
+
+    Args:
+        n_data (int): number of evaluation utterances
+        n_subset (int): number of utterances of the subset (if not less than n_data, all)
+
+    Return:
+        (list): indices of the subset
+    """
+    if n_subset <= 0 or n_subset >= n_data:
+        return list(range(n_data))
+    return np.unique(np.linspace(0, n_data-1, n_subset).round().astype(np.int64)).tolist()
+
+
+def subset_tags(loss):
+    """FUNCTION TO RENAME EVALUATION TAGS OF PROXY EVALUATION (eval/xxx --> eval_subset/xxx)"""
+    return dict((key.replace("eval/", "eval_subset/", 1), value) for key, value in loss.items())
+
+
+def load_snapshot(checkpoint_path, models, device):
+    """FUNCTION TO LOAD MODEL STATES OF CHECKPOINT SNAPSHOT INTO EVALUATION MODELS
+
+    Weight norm of a module is removed during loading if the snapshot has its plain weight,
+    e.g., scale_in of waveform model saved without weight norm, or a weight norm folded inference artifact.
+
+    Args:
+        checkpoint_path (str): path of checkpoint
+        models (dict): models by checkpoint key, e.g., {"model_waveform": model_waveform}
+        device (torch.device): device of the models
+
+    Return:
+        (dict): metadata of checkpoint, e.g., iterations, iter_idx
+    """
+    meta = read_checkpoint_meta(checkpoint_path)
+    checkpoint, _ = load_model_states(checkpoint_path, map_location=device)
+    if meta is None:
+        meta = {"iterations": checkpoint["iterations"], "iter_idx": checkpoint["iter_idx"]}
+    for key, model in models.items():
+        state_dict = checkpoint[key]
+        removed = []
+        for name, module in model.named_modules():
+            prefix = name + "." if name else ""
+            if hasattr(module, "weight_g") and prefix + "weight" in state_dict and prefix + "weight_g" not in state_dict:
+                torch.nn.utils.remove_weight_norm(module)
+                removed.append(module)
+        model.load_state_dict(state_dict)
+        for module in removed:
+            torch.nn.utils.weight_norm(module)
+    logging.info("evaluation of %d-iter snapshot (Steps: %d)" % (meta["iterations"], meta["iter_idx"]))
+    return meta
+
+
+class SnapshotQueue(object):
+    """QUEUE OF CHECKPOINT SNAPSHOTS BETWEEN TRAINING PROCESS AND EVALUATOR PROCESS
+
+    The training process (eval_mode=trainer) writes a checkpoint every epoch and continues immediately,
+    the evaluator process (eval_mode=evaluator) evaluates every checkpoint whose JSON sidecar exists, i.e., is completely
+    written, and has not been evaluated yet. The evaluated losses are kept in expdir/eval_service.json,
+    and the best-model index is written to expdir/eval.idx as "<last evaluated index> <min index>",
+    i.e., the same format as conf/*.idx of the recipes.
+    Pending snapshots and the current best one are retained from the checkpoint retention policy of the training process.
+
+    Args:
+        expdir (str): experiment directory of checkpoints
+        poll_interval (float): seconds between checks of new snapshots in the evaluator
+    """
+
+    def __init__(self, expdir, poll_interval=30):
+        self.expdir = expdir
+        self.poll_interval = poll_interval
+        self.state_file = os.path.join(expdir, "eval_service.json")
+        self.index_file = os.path.join(expdir, "eval.idx")
+        self.done_file = os.path.join(expdir, "train.done")
+
+    def _read_state(self):
+        if not os.path.isfile(self.state_file):
+            return {"evaluated": {}, "min_idx": None}
+        with open(self.state_file, "r") as f:
+            return json.load(f)
+
+    def _write(self, path, text):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def snapshots(self):
+        """Indices of written checkpoints, in ascending order"""
+        indices = []
+        for path in glob.glob(os.path.join(self.expdir, "checkpoint-*.json")):
+            match = re.match(r"checkpoint-(\d+)\.json$", os.path.basename(path))
+            if match is not None:
+                indices.append(int(match.group(1)))
+        return sorted(indices)
+
+    def pending(self):
+        """Indices of written checkpoints that are not evaluated yet"""
+        evaluated = self._read_state()["evaluated"]
+        return [idx for idx in self.snapshots() if str(idx) not in evaluated]
+
+    def retained(self):
+        """Indices to be retained by the checkpoint retention policy of the training process"""
+        state = self._read_state()
+        if state["min_idx"] is None:
+            return self.pending()
+        return self.pending() + [state["min_idx"]]
+
+    def begin_training(self):
+        """Mark start of the training process, i.e., the evaluator waits for new snapshots"""
+        if os.path.exists(self.done_file):
+            os.remove(self.done_file)
+
+    def end_training(self):
+        """Mark end of the training process, i.e., the evaluator stops after the remaining snapshots"""
+        self._write(self.done_file, "%f\n" % time.time())
+
+    def next(self):
+        """Wait for the next snapshot to be evaluated
+
+        Return:
+            (str): path of the oldest pending checkpoint, None if the training has ended and all are evaluated
+        """
+        while True:
+            done = os.path.exists(self.done_file) # checked before listing, so that the last snapshot is not missed
+            pending = self.pending()
+            if len(pending) > 0:
+                return os.path.join(self.expdir, "checkpoint-%d.pkl" % pending[0])
+            if done:
+                return None
+            time.sleep(self.poll_interval)
+
+    def report(self, iterations, eval_loss):
+        """Record the evaluation loss of a snapshot and update the best-model index
+
+        Args:
+            iterations (int): index of the evaluated checkpoint
+            eval_loss (float): development loss of the checkpoint (lower is better)
+        """
+        state = self._read_state()
+        state["evaluated"][str(iterations)] = float(eval_loss)
+        finite = [(value, int(idx)) for idx, value in state["evaluated"].items() if np.isfinite(value)]
+        if len(finite) > 0:
+            state["min_idx"] = min(finite)[1]
+        self._write(self.state_file, json.dumps(state, indent=1, sort_keys=True))
+        if state["min_idx"] is not None:
+            self._write(self.index_file, "%d %d\n" % (iterations, state["min_idx"]))
+            logging.info("eval_loss %d-iter = %.6f , min_idx=%d --> %s" % (iterations, eval_loss, state["min_idx"], self.index_file))
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import atexit
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+
+import numpy as np
+import soundfile as sf
+
+from utils import read_hdf5, check_hdf5, shape_hdf5
+
+
+def default_cache_dir(expdir):
+    """FUNCTION TO GET DEFAULT CACHE DIRECTORY OF AN EXPERIMENT, SHARED BY ALL PROCESSES / RANKS OF THE NODE
+
+    Args:
+        expdir (str): experiment directory
+
+    Return:
+        (str): /dev/shm/featcache_<hash of expdir>
+    """
+    return "/dev/shm/featcache_" + hashlib.sha1(os.path.abspath(expdir).encode("utf-8")).hexdigest()[:16]
+
+
+class SharedFeatureCache(object):
+    """SHARED IN-MEMORY CACHE OF DECODED PER-UTTERANCE ARRAYS
+
+    Arrays are stored as .npy files in a tmpfs directory (/dev/shm by default), so that the cache is shared
+    by all DataLoader workers and survives across epochs. The total cached size is kept in a size file updated
+    under a file lock on every put, and only when it exceeds the memory budget, the directory is scanned and
+    the least recently used entries are evicted down to EVICT_RATIO of the budget (which also corrects the size
+    of concurrent puts of the same entry). The keys include the modification time and size of the source file,
+    so that entries of re-extracted features, e.g., left by a crashed run, are not read.
+    Small metadata (dataset existence / shape) is memoized per process.
+    The cache directory is removed at exit (or clear) of the process that created it.
+
+    Args:
+        cache_dir (str): directory of the cache, should be on a tmpfs (e.g., /dev/shm/...)
+        max_mbytes (float): memory budget of the cache in MB
+    """
+
+    EVICT_RATIO = 0.9
+
+    def __init__(self, cache_dir, max_mbytes=4096):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mbytes*1024*1024)
+        # the process creating the directory owns it, the other ranks / evaluator of the experiment share it
+        try:
+            os.makedirs(self.cache_dir)
+            self.owner_pid = os.getpid()
+        except FileExistsError:
+            self.owner_pid = None
+        self.lock_file = os.path.join(self.cache_dir, ".lock")
+        self.size_file = os.path.join(self.cache_dir, ".size")
+        self.meta = {}
+        # entries left by a previous run of the same experiment are kept (read only if their source files are unchanged),
+        # their size is counted once
+        with self._locked():
+            self._write_size(self._scan()[1])
+        atexit.register(self.clear)
+        logging.info("feature cache at %s with budget %.1f MB" % (self.cache_dir, self.max_bytes/(1024*1024)))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['meta'] = {}
+        return state
+
+    def _source_key(self, filename):
+        # modification time and size of the source file, changed by re-extraction
+        stat = os.stat(filename)
+        return "%s:%d:%d" % (filename, stat.st_mtime_ns, stat.st_size)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+
+    def get(self, key):
+        """Get cached array, None if not cached or already evicted"""
+        path = self._path(key)
+        try:
+            data = np.load(path, allow_pickle=False)
+            os.utime(path, None) #LRU stamp
+        except (IOError, OSError, ValueError):
+            return None
+        return data
+
+    def put(self, key, data):
+        """Cache array and evict least recently used entries if over budget"""
+        data = np.ascontiguousarray(data)
+        if data.nbytes > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = path + ".%d.tmp" % os.getpid()
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, data, allow_pickle=False)
+            size = os.path.getsize(tmp_path)
+            with self._locked():
+                if os.path.exists(path):
+                    size -= os.path.getsize(path)
+                os.replace(tmp_path, path)
+                total = self._read_size() + size
+                if total > self.max_bytes:
+                    total = self._evict()
+                self._write_size(total)
+        except (IOError, OSError): # cache directory removed at exit of the owner
+            return
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_size(self):
+        try:
+            with open(self.size_file, "r") as f:
+                return int(f.read())
+        except (IOError, OSError, ValueError):
+            return self._scan()[1]
+
+    def _write_size(self, total):
+        with open(self.size_file, "w") as f:
+            f.write("%d" % total)
+
+    def _scan(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return entries, total
+
+    def _evict(self):
+        # called under the lock, returns the total size after eviction
+        entries, total = self._scan()
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+                if total <= self.EVICT_RATIO*self.max_bytes:
+                    break
+        return total
+
+    def read_hdf5(self, hdf5_name, hdf5_path):
+        try:
+            key = self._source_key(hdf5_name) + ":" + hdf5_path
+        except OSError:
+            return read_hdf5(hdf5_name, hdf5_path)
+        data = self.get(key)
+        if data is None:
+            data = read_hdf5(hdf5_name, hdf5_path)
+            self.put(key, data)
+        return data
+
+    def check_hdf5(self, hdf5_name, hdf5_path):
+        key = ("check", hdf5_name, hdf5_path)
+        if key not in self.meta:
+            self.meta[key] = check_hdf5(hdf5_name, hdf5_path)
+        return self.meta[key]
+
+    def shape_hdf5(self, hdf5_name, hdf5_path):
+        key = ("shape", hdf5_name, hdf5_path)
+        if key not in self.meta:
+            self.meta[key] = shape_hdf5(hdf5_name, hdf5_path)
+        return self.meta[key]
+
+    def read_wav(self, wavfile):
+        try:
+            key = self._source_key(wavfile) + ":wav"
+        except OSError:
+            return sf.read(wavfile, dtype=np.float32)[0]
+        data = self.get(key)
+        if data is None:
+            data, _ = sf.read(wavfile, dtype=np.float32)
+            self.put(key, data)
+        return data
+
+    def clear(self):
+        """Remove the cache directory, only by the process that created the directory"""
+        if os.getpid() == self.owner_pid and os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
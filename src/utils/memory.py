@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import ctypes
+import functools
+import logging
+import math
+import resource
+import time
+
+import torch
+
+from torch.utils.checkpoint import checkpoint
+
+
+def checkpoint_modules(modules, methods=("forward",)):
+    """FUNCTION TO RECOMPUTE ACTIVATIONS OF MODULES IN BACKWARD INSTEAD OF KEEPING THEM (ACTIVATION CHECKPOINTING)
+
+    Only the inputs and the outputs of each call are kept for backward, the intermediate activations, e.g., GRU states
+    of every time step, convolution and output layers, are recomputed in backward from the kept inputs
+    with the same random state, i.e., the same latent / dropout samples.
+    The calls are checkpointed with gradient enabled if the module has trainable parameters or any tensor input
+    requires grad, e.g., a fixed waveform model on the output of a trained decoder, whose losses are backpropagated
+    through its activations. Otherwise, e.g., evaluation and fixed encoders on the input features,
+    the methods are called as usual.
+    Hidden-state inputs (h, h_2, ...) are detached, as the hidden-state outputs of the models are always detached
+    (truncated BPTT), while the outputs of a checkpointed call cannot tell which of them were detached.
+    If autocast of bf16 precision is used, the modules should be wrapped after autocast_methods,
+    so that the recomputation is done in the same precision.
+
+    Args:
+        modules (dict): modules by name, e.g., {"encoder_melsp": model_encoder_melsp, "waveform": model_waveform}
+        methods (list): names of methods to be checkpointed, those not defined by a module are skipped
+    """
+    # dummy input requiring grad, so that the parameter gradients are computed even if no input requires grad,
+    # e.g., input features of the first cycle
+    dummy = torch.ones(1, requires_grad=True)
+    for name, module in modules.items():
+        for method_name in methods:
+            if not hasattr(module, method_name):
+                continue
+            method = getattr(module, method_name)
+
+            def wrapper(*args, _method=method, _module=module, **kwargs):
+                if not (torch.is_grad_enabled() and (any(param.requires_grad for param in _module.parameters()) \
+                        or any(torch.is_tensor(value) and value.requires_grad for value in list(args) + list(kwargs.values())))):
+                    return _method(*args, **kwargs)
+                # tensor arguments are passed to checkpoint, so that their gradients are computed in backward
+                keys = [key for key, value in kwargs.items() if torch.is_tensor(value)]
+                static = dict((key, value) for key, value in kwargs.items() if not torch.is_tensor(value))
+                tensors = [kwargs[key].detach() if key.startswith("h") else kwargs[key] for key in keys]
+                n_args = len(args)
+
+                def run(_dummy, *inputs):
+                    call_kwargs = dict(static)
+                    call_kwargs.update(zip(keys, inputs[n_args:]))
+                    return _method(*inputs[:n_args], **call_kwargs)
+
+                return checkpoint(run, dummy, *(list(args) + tensors))
+
+            setattr(module, method_name, functools.wraps(method)(wrapper))
+        logging.info("%s: %s with activation checkpointing" % (name, str(list(methods))))
+
+
+class MemoryMeter(object):
+    """PEAK MEMORY AND THROUGHPUT OF TRAINING STEPS
+
+    Every log_interval steps, the peak memory and the number of training frames per second since the last report
+    are written to tensorboard (memory/...) and printed, e.g., to compare runs with and without activation
+    checkpointing for the choice of segment / batch size. On cpu, the peak is the maximum resident set size
+    of the process so far (it cannot be reset), on cuda, the peak of allocated memory since the last report.
+
+    Args:
+        device (torch.device): compute device
+        writer (SummaryWriter): tensorboard writer (if None, no scalars)
+        log_interval (int): number of steps between reports
+    """
+
+    def __init__(self, device, writer=None, log_interval=50):
+        self.cuda = device.type == "cuda"
+        self.writer = writer
+        self.log_interval = log_interval
+        self.n_frames = 0
+        self.n_steps = 0
+        self.mark = time.time()
+
+    def peak_mb(self):
+        """Peak memory [MB]"""
+        if self.cuda:
+            return torch.cuda.max_memory_allocated() / 1048576
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB in linux
+
+    def skip(self):
+        """Exclude the time so far from the throughput, e.g., epoch summary and evaluation"""
+        self.mark = time.time()
+
+    def step(self, iter_idx, n_frames):
+        """Close the iteration
+
+        Args:
+            iter_idx (int): number of iterations so far
+            n_frames (int): number of training frames of the iteration, i.e., batch size x segment length
+        """
+        self.n_frames += n_frames
+        self.n_steps += 1
+        if iter_idx % self.log_interval == 0:
+            self.report(iter_idx)
+
+    def report(self, iter_idx):
+        """Write and print the peak memory and the throughput since the last report"""
+        if self.n_steps == 0:
+            return
+        elapsed = max(time.time() - self.mark, 1e-12)
+        peak = self.peak_mb()
+        logging.info("memory (Steps: %d) peak %.1f MB , %.1f frames / sec , %.3f sec / step over %d steps" % (iter_idx,
+                        peak, self.n_frames / elapsed, elapsed / self.n_steps, self.n_steps))
+        if self.writer is not None:
+            self.writer.add_scalar("memory/peak_mb", peak, iter_idx)
+            self.writer.add_scalar("memory/frames_per_sec", self.n_frames / elapsed, iter_idx)
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+        self.n_frames = 0
+        self.n_steps = 0
+        self.mark = time.time()
+
+
+def current_rss_mb():
+    """Resident set size of the process [MB]"""
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1048576
+
+
+def _release_cpu_memory():
+    # return the freed heap of glibc to the system, so that the resident set size follows the live tensors
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def measure_peak_mb(probe, device):
+    """FUNCTION TO MEASURE PEAK MEMORY OF A FORWARD / BACKWARD PROBE
+
+    On cuda, the peak of allocated memory is given by the allocator. On cpu, the resident set size is sampled
+    at the points of maximum live memory marked by the probe, i.e., after forward (all activations are kept for
+    backward) and after backward (gradients).
+
+    Args:
+        probe (func): probe(mark), calls mark() at its points of maximum live memory
+        device (torch.device): compute device
+
+    Return:
+        (float): peak memory [MB] of the process during the probe, inf if out of memory on cuda
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        try:
+            probe(lambda: None)
+        except RuntimeError as e:
+            if "out of memory" not in str(e):
+                raise
+            torch.cuda.empty_cache()
+            return float("inf")
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 1048576
+        torch.cuda.empty_cache()
+        return peak
+    _release_cpu_memory()
+    peaks = [current_rss_mb()]
+    probe(lambda: peaks.append(current_rss_mb()))
+    _release_cpu_memory()
+    return max(peaks)
+
+
+def auto_batch_size(probe, device, budget_mb, n_utt_max, n_frames, max_frames, min_frames=1, extra_mb=0, margin=0.9):
+    """FUNCTION TO PICK THE LARGEST UTTERANCE BATCH AND FRAME SEGMENT WITHIN A MEMORY BUDGET
+
+    The peak memory is modeled as base + k x n_utt x n_frames, fitted from the probes of 1 and 2 utterances
+    with n_frames segment. The utterance batch is maximized first (up to n_utt_max), then the remaining budget
+    is used for longer segments (up to max_frames). If a single utterance of n_frames does not fit, the segment
+    is shortened. The picked sizes are verified with another probe and reduced if the measured peak exceeds the budget.
+    The probes are small first, so that the process is not killed on cpu, where out of memory cannot be caught.
+
+    Args:
+        probe (func): probe(n_utt, n_frames, mark), one forward / backward of a synthetic training batch
+        device (torch.device): compute device
+        budget_mb (float): memory budget [MB] of the training process
+        n_utt_max (int): maximum number of utterances of a batch
+        n_frames (int): number of frames of a segment, i.e., --batch_size
+        max_frames (int): maximum number of frames of a segment
+        min_frames (int): minimum number of frames of a segment
+        extra_mb (float): memory [MB] not covered by the probe, e.g., optimizer states, loaded utterance batch
+        margin (float): fraction of budget to be used, the rest for the parts of a training step not in the probe
+
+    Return:
+        (int): number of utterances of a batch
+        (int): number of frames of a segment
+        (float): measured peak memory [MB] of the picked sizes
+    """
+    budget = budget_mb * margin - extra_mb
+    peak_1 = measure_peak_mb(lambda mark: probe(1, n_frames, mark), device)
+    peak_2 = measure_peak_mb(lambda mark: probe(2, n_frames, mark), device)
+    if peak_2 > budget:
+        peak_2 = float("inf") # linear estimate from n_frames of one utterance only
+    if math.isinf(peak_1) or peak_1 > budget:
+        # shorten the segment until one utterance fits
+        n_utt = 1
+        while True:
+            n_frames = n_frames // 2
+            if n_frames < min_frames:
+                raise ValueError("memory budget of %.1f MB is too small for a segment of %d frames." % (budget_mb, min_frames))
+            peak_1 = measure_peak_mb(lambda mark: probe(1, n_frames, mark), device)
+            if peak_1 <= budget:
+                logging.info("auto batch size: %d utterance(s) x %d frames (%.1f MB)" % (n_utt, n_frames, peak_1 + extra_mb))
+                return n_utt, n_frames, peak_1
+    if math.isinf(peak_2):
+        per_frame = peak_1 / n_frames
+        base = 0
+    else:
+        per_frame = max(peak_2 - peak_1, 1e-3) / n_frames # MB per utterance-frame
+        base = peak_1 - per_frame * n_frames
+    logging.info("auto batch size: base %.1f MB , %.4f MB / utterance-frame" % (base, per_frame))
+    n_utt = min(max(int((budget - base) / (per_frame * n_frames)), 1), n_utt_max)
+    if n_utt == n_utt_max:
+        n_frames = min(max(int((budget - base) / (per_frame * n_utt)), n_frames), max_frames)
+    for _ in range(4):
+        peak = measure_peak_mb(lambda mark: probe(n_utt, n_frames, mark), device)
+        logging.info("auto batch size: %d utterance(s) x %d frames --> %.1f MB (budget %.1f MB)" % (n_utt, n_frames,
+                        peak + extra_mb, budget_mb))
+        if peak <= budget:
+            return n_utt, n_frames, peak
+        ratio = 0.5 if math.isinf(peak) else max(min((budget - base) / max(peak - base, 1e-3), 0.9), 0.5)
+        if n_utt > 1:
+            n_utt = max(int(n_utt * ratio), 1)
+        else:
+            n_frames = max(int(n_frames * ratio), min_frames)
+    raise ValueError("memory budget of %.1f MB is not reached by the probes, please set smaller --batch_size." % (budget_mb))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import functools
+import logging
+
+import numpy as np
+import torch
+
+from vcneuvoco import to_fp32
+
+
+PRECISIONS = ["fp32", "bf16"]
+
+
+def autocast(device, precision="fp32"):
+    """FUNCTION TO GET AUTOCAST CONTEXT MANAGER OF A COMPUTE PRECISION
+
+    The parameters (master weights) stay in float32, only the autocast-eligible ops, e.g., convolution, linear,
+    matmul, are computed in bfloat16. Loss scaling is not needed, as bfloat16 has the exponent range of float32.
+
+    Args:
+        device (torch.device): compute device
+        precision (str): "fp32" or "bf16"
+
+    Return:
+        autocast context in case of bf16, otherwise null context
+
+    Raise:
+        RuntimeError: if bf16 autocast is not supported on the device by the installed pytorch, instead of silently
+            running in fp32
+    """
+    if precision not in PRECISIONS:
+        raise ValueError("precision should be one of %s, got %s." % (str(PRECISIONS), precision))
+    if precision == "fp32":
+        return contextlib.suppress() # no-op context, nullcontext is not available in python 3.6
+    if device.type == "cpu":
+        if hasattr(torch, "cpu") and hasattr(torch.cpu, "amp"):
+            return torch.cpu.amp.autocast(dtype=torch.bfloat16)
+    else:
+        try:
+            if not hasattr(torch.cuda, "is_bf16_supported") or torch.cuda.is_bf16_supported():
+                return torch.cuda.amp.autocast(dtype=torch.bfloat16)
+        except TypeError: # no dtype argument in older version
+            pass
+    raise RuntimeError("bf16 autocast on %s is not supported by pytorch %s, use --precision fp32 or "
+                        "a pytorch version with bf16 autocast (>= 1.10)." % (device.type, torch.__version__))
+
+
+def autocast_methods(model, device, precision="fp32", methods=("forward",)):
+    """FUNCTION TO RUN METHODS OF A MODEL UNDER AUTOCAST
+
+    The floating outputs are cast back to float32, so that the losses and the metrics computed outside of the model
+    are kept in float32 without changing the training / decoding scripts.
+
+    Args:
+        model (torch.nn.Module): model instance
+        device (torch.device): compute device
+        precision (str): "fp32" or "bf16"
+        methods (list): names of methods to be wrapped, e.g., forward, generate
+
+    Return:
+        (torch.nn.Module): the same model instance
+    """
+    if precision not in PRECISIONS:
+        raise ValueError("precision should be one of %s, got %s." % (str(PRECISIONS), precision))
+    if precision == "fp32":
+        return model
+    autocast(device, precision) # fail early if bf16 autocast is not available
+    for name in methods:
+        method = getattr(model, name)
+
+        def wrapper(*args, _method=method, **kwargs):
+            with autocast(device, precision):
+                outputs = _method(*args, **kwargs)
+            return to_fp32(outputs)
+
+        setattr(model, name, functools.wraps(method)(wrapper))
+    logging.info("%s: %s in %s" % (model.__class__.__name__, str(list(methods)), precision))
+    return model
+
+
+def deviation_report(losses_ref, losses, name_ref="fp32", name="bf16"):
+    """FUNCTION TO REPORT PER-LOSS DEVIATION OF A LOW-PRECISION RUN FROM A REFERENCE RUN
+
+    Args:
+        losses_ref (dict): list of per-utterance values of each loss of reference run
+        losses (dict): list of per-utterance values of each loss of low-precision run
+        name_ref (str): name of reference precision
+        name (str): name of low-precision
+
+    Return:
+        (str): report text, one line per loss
+    """
+    lines = ["%-24s %12s %12s %12s %12s %12s" % ("loss", name_ref, name, "abs_dev", "rel_dev[%]", "max_utt_dev")]
+    for key in losses_ref.keys():
+        ref = np.array(losses_ref[key], dtype=np.float64)
+        val = np.array(losses[key], dtype=np.float64)
+        mean_ref = np.mean(ref)
+        mean_val = np.mean(val)
+        abs_dev = np.abs(mean_val - mean_ref)
+        rel_dev = 100*abs_dev/max(np.abs(mean_ref), 1e-12)
+        lines.append("%-24s %12.6f %12.6f %12.6f %12.4f %12.6f" % (key, mean_ref, mean_val, abs_dev, rel_dev,
+                        np.max(np.abs(val - ref))))
+    return "\n".join(lines)
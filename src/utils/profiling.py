@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import functools
+import logging
+import os
+import time
+
+from collections import OrderedDict
+
+import torch
+
+
+class StepProfiler(object):
+    """HOT-PATH TIMERS OF TRAINING ITERATIONS
+
+    An iteration is split into consecutive sections by lap(name), each section being the time since the previous lap,
+    and the remainder until step() is counted as "other". The calls of registered modules, e.g., model forwards and
+    criteria, are timed as a breakdown within the sections. Every log_interval steps, the average time per step
+    is written to tensorboard (profile/...) and printed as a table.
+    Optionally, a torch.profiler trace of a window of steps is written to trace_dir (viewable in tensorboard).
+    If not enabled, nothing is wrapped and every call returns immediately.
+
+    Args:
+        device (torch.device): compute device, cuda kernels are synchronized at each timer
+        writer (SummaryWriter): tensorboard writer (if None, no scalars)
+        enabled (bool): flag to enable the timers
+        log_interval (int): number of steps between reports
+        trace_dir (str): directory of torch.profiler trace
+        trace_start (int): number of steps before the traced window
+        trace_steps (int): number of traced steps (if set 0, no trace)
+    """
+
+    def __init__(self, device, writer=None, enabled=False, log_interval=50, trace_dir=None, trace_start=0, trace_steps=0):
+        self.enabled = enabled
+        self.sync = enabled and device.type == "cuda"
+        self.writer = writer
+        self.log_interval = log_interval
+        self.sections = OrderedDict()
+        self.calls = OrderedDict()
+        self.step_sections = OrderedDict()
+        self.step_calls = OrderedDict()
+        self.n_steps = 0
+        self.mark = None
+        self.trace = None
+        if enabled and trace_steps > 0:
+            self.trace = self._start_trace(device, trace_dir, trace_start, trace_steps)
+
+    def _start_trace(self, device, trace_dir, trace_start, trace_steps):
+        try:
+            from torch import profiler
+        except ImportError:
+            logging.warning("torch.profiler is not available in pytorch %s, no trace is written." % (torch.__version__))
+            return None
+        activities = [profiler.ProfilerActivity.CPU]
+        if device.type == "cuda":
+            activities.append(profiler.ProfilerActivity.CUDA)
+        if not os.path.exists(trace_dir):
+            os.makedirs(trace_dir)
+        trace = profiler.profile(activities=activities,
+                    schedule=profiler.schedule(wait=trace_start, warmup=1, active=trace_steps, repeat=1),
+                        on_trace_ready=profiler.tensorboard_trace_handler(trace_dir))
+        trace.__enter__()
+        logging.info("profiler trace of steps %d-%d --> %s" % (trace_start+2, trace_start+trace_steps+1, trace_dir))
+        return trace
+
+    def _now(self):
+        if self.sync:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def time_modules(self, modules, methods=("forward",)):
+        """Time the calls of modules
+
+        Args:
+            modules (dict): modules by name, e.g., {"encoder_melsp": model_encoder_melsp, "ce": criterion_ce}
+            methods (list): names of methods to be timed, those not defined by a module are skipped
+        """
+        if not self.enabled:
+            return
+        for name, module in modules.items():
+            for method_name in methods:
+                if not hasattr(module, method_name):
+                    continue
+                method = getattr(module, method_name)
+                key = name if method_name == "forward" else name+"."+method_name
+
+                def wrapper(*args, _method=method, _key=key, **kwargs):
+                    start = self._now()
+                    outputs = _method(*args, **kwargs)
+                    self.step_calls[_key] = self.step_calls.get(_key, 0.0) + self._now() - start
+                    return outputs
+
+                setattr(module, method_name, functools.wraps(method)(wrapper))
+
+    def lap(self, name):
+        """Close the current section of the iteration"""
+        if not self.enabled:
+            return
+        now = self._now()
+        if self.mark is not None:
+            self.step_sections[name] = self.step_sections.get(name, 0.0) + now - self.mark
+        self.mark = now
+
+    def skip(self):
+        """Drop the current iteration so far, e.g., epoch summary and evaluation"""
+        if not self.enabled:
+            return
+        self.step_sections = OrderedDict()
+        self.step_calls = OrderedDict()
+        self.mark = self._now()
+
+    def step(self, iter_idx):
+        """Close the iteration
+
+        Args:
+            iter_idx (int): number of iterations so far
+        """
+        if not self.enabled:
+            return
+        self.lap("other")
+        for name, value in self.step_sections.items():
+            self.sections[name] = self.sections.get(name, 0.0) + value
+        for name, value in self.step_calls.items():
+            self.calls[name] = self.calls.get(name, 0.0) + value
+        self.step_sections = OrderedDict()
+        self.step_calls = OrderedDict()
+        self.n_steps += 1
+        if self.trace is not None:
+            self.trace.step()
+        if iter_idx % self.log_interval == 0:
+            self.report(iter_idx)
+
+    def report(self, iter_idx):
+        """Write and print the average time per step of the sections and the module calls since the last report"""
+        if self.n_steps == 0:
+            return
+        total = sum(self.sections.values())
+        text_log = "profile (Steps: %d) %.2f ms / step over %d steps" % (iter_idx, 1000*total/self.n_steps, self.n_steps)
+        text_log += "\n%-32s %12s %8s" % ("section", "ms / step", "%")
+        for name, value in self.sections.items():
+            text_log += "\n%-32s %12.2f %8.2f" % (name, 1000*value/self.n_steps, 100*value/max(total, 1e-12))
+            if self.writer is not None:
+                self.writer.add_scalar("profile/%s" % (name), 1000*value/self.n_steps, iter_idx)
+        if len(self.calls) > 0:
+            text_log += "\n%-32s %12s %8s" % ("call (within sections)", "ms / step", "%")
+            for name, value in self.calls.items():
+                text_log += "\n%-32s %12.2f %8.2f" % (name, 1000*value/self.n_steps, 100*value/max(total, 1e-12))
+                if self.writer is not None:
+                    self.writer.add_scalar("profile/call/%s" % (name), 1000*value/self.n_steps, iter_idx)
+        if self.writer is not None:
+            self.writer.add_scalar("profile/total", 1000*total/self.n_steps, iter_idx)
+        logging.info(text_log)
+        self.sections = OrderedDict()
+        self.calls = OrderedDict()
+        self.n_steps = 0
+
+    def close(self):
+        """Stop the trace"""
+        if self.trace is not None:
+            self.trace.__exit__(None, None, None)
+            self.trace = None
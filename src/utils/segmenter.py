@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import torch
+
+
+def index_delete(x, del_index_utt, dim=0):
+    """FUNCTION TO DELETE FINISHED UTTERANCES FROM A BATCH TENSOR ON ITS OWN DEVICE
+
+    Args:
+        x (Tensor/ndarray/list): batch data, e.g., B x T x D features or n_layers x B x D recurrent states
+        del_index_utt (list): indices of the utterances to be deleted
+        dim (int): batch axis of x
+
+    Return:
+        batch data without the deleted utterances
+    """
+    if len(del_index_utt) == 0:
+        return x
+    if not torch.is_tensor(x):
+        return np.delete(x, del_index_utt, axis=dim)
+    keep = torch.ones(x.shape[dim], dtype=torch.bool)
+    keep[del_index_utt] = False
+    return torch.index_select(x, dim, keep.nonzero().squeeze(1).to(x.device))
+
+
+class BatchSegmenter(object):
+    """DEVICE-RESIDENT BATCH SEGMENTER
+
+    Tracks the live utterances of a padded utterance batch that is consumed in segments of batch_size frames
+    with a mask over the original batch indices. Finished utterances are dropped from batch tensors
+    and recurrent states with index_select on the tensor's own device, i.e., without host round-trips.
+
+    Args:
+        flens (ndarray): frame lengths of the utterances in the batch
+        batch_size (int): number of frames per segment
+        slens (ndarray): sample lengths (per band) of the utterances in the batch
+        upsampling_factor_bands (int): number of samples (per band) per frame
+    """
+
+    def __init__(self, flens, batch_size, slens=None, upsampling_factor_bands=1):
+        self.flens_acc = np.array(flens)
+        if slens is not None:
+            self.slens_acc = np.array(slens)
+        else:
+            self.slens_acc = None
+        self.f_bs = batch_size
+        self.x_bs = batch_size*upsampling_factor_bands
+        self.f_ss = 0
+        self.x_ss = 0
+        self.len_frm = np.max(self.flens_acc)
+        self.mask = np.ones(len(self.flens_acc), dtype=bool)
+        self.del_index_utt = []
+
+    @property
+    def n_batch_utt(self):
+        return len(self.flens_acc)
+
+    @property
+    def live_index(self):
+        """indices of the live utterances w.r.t. the original batch"""
+        return np.nonzero(self.mask)[0]
+
+    def update(self):
+        """Drop utterances whose frames have all been consumed
+
+        Return:
+            (list): indices of the dropped utterances w.r.t. the current (previous segment) batch
+        """
+        del_index_utt = np.nonzero(self.flens_acc <= 0)[0].tolist()
+        if len(del_index_utt) > 0:
+            self.mask[self.live_index[del_index_utt]] = False
+            self.flens_acc = np.delete(self.flens_acc, del_index_utt, axis=0)
+            if self.slens_acc is not None:
+                self.slens_acc = np.delete(self.slens_acc, del_index_utt, axis=0)
+        self.del_index_utt = del_index_utt
+        return del_index_utt
+
+    def shrink(self, x, dim=0):
+        """Apply the latest utterance deletion to batch data (tensor on any device, ndarray, or list)"""
+        return index_delete(x, self.del_index_utt, dim=dim)
+
+    def shrink_list(self, x_list, dim=0):
+        """Apply the latest utterance deletion to every element of a list of batch data"""
+        for i in range(len(x_list)):
+            x_list[i] = index_delete(x_list[i], self.del_index_utt, dim=dim)
+        return x_list
+
+    def select_short(self, device):
+        """Get utterances ending within the current segment
+
+        Return:
+            indices of the utterances with less than batch_size remaining frames ([] if none)
+            indices of the rest of the utterances ([] if none ends)
+        """
+        idx_select = np.nonzero(self.flens_acc < self.f_bs)[0]
+        if len(idx_select) > 0:
+            idx_select_full = torch.LongTensor(np.delete(np.arange(self.n_batch_utt), idx_select, axis=0)).to(device)
+            idx_select = torch.LongTensor(idx_select).to(device)
+            return idx_select, idx_select_full
+        return [], []
+
+    def advance(self):
+        """Move to the next segment
+
+        Return:
+            (bool): False if the whole batch has been consumed
+        """
+        self.flens_acc -= self.f_bs
+        if self.slens_acc is not None:
+            self.slens_acc -= self.x_bs
+        self.len_frm -= self.f_bs
+        if self.len_frm > 0:
+            self.x_ss += self.x_bs
+            self.f_ss += self.f_bs
+            return True
+        return False
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Patrick Lumban Tobing (Nagoya University)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+from __future__ import division
+from __future__ import print_function
+
+import logging
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+
+from distributed import is_distributed
+
+
+BLOCK_SIZE = 16
+
+
+def scheduled_density(iter_idx, t_start, t_end, density, density_p=None):
+    """FUNCTION TO COMPUTE DENSITY OF A SPARSIFICATION STAGE AT AN ITERATION
+
+    Args:
+        iter_idx (int): iteration index
+        t_start (int): start iteration of the stage
+        t_end (int): end iteration of the stage
+        density (float): target density at the end of the stage
+        density_p (float): density at the end of the previous stage (if None, 1)
+
+    Return:
+        (float): density
+    """
+    if iter_idx >= t_end:
+        return density
+    r = 1 - (iter_idx-t_start)/(t_end - t_start)
+    if density_p is not None:
+        return density_p - (density_p-density)*(1 - r)**5
+    return 1 - (1-density)*(1 - r)**5
+
+
+def stage_densities(density, n_stage):
+    """FUNCTION TO SPLIT A TARGET DENSITY INTO EVENLY DECREASING STAGE DENSITIES
+
+    Args:
+        density (float): target density at the end of the last stage
+        n_stage (int): number of stages
+
+    Return:
+        (list): density at the end of each stage
+    """
+    delta = (1-density)/n_stage
+    densities = [1-delta*(i+1) for i in range(n_stage-1)]
+    densities.append(density)
+    return densities
+
+
+def parse_extra_densities(text, model_name=None, model_names=()):
+    """FUNCTION TO PARSE ADDITIONAL MATRICES TO BE SPARSIFIED
+
+    The items are separated by @, so that densities such as 1e-1 are kept. A parameter name starting with
+    one of model_names, e.g., decoder_melsp.gru.weight_ih_l0, is only taken for that model, the other names
+    are taken for every model (and skipped with a warning by the models without the parameter).
+
+    Args:
+        text (str): parameter names and final densities, e.g., decoder_melsp.gru.weight_ih_l0:0.5@out.weight:0.25
+        model_name (str): name of the model of the returned densities (if None, all of the items)
+        model_names (list): names of the sparsified models of the trainer, e.g., ["encoder_melsp", "decoder_melsp"]
+
+    Return:
+        (dict): final density of each parameter name of the model (None if empty)
+    """
+    if text is None or len(text) == 0:
+        return None
+    extra_densities = {}
+    scoped_densities = {}
+    for item in text.split('@'):
+        name, density = item.rsplit(':', 1)
+        scope = name.split('.', 1)[0]
+        if model_name is not None and scope in model_names:
+            if scope == model_name:
+                scoped_densities[name.split('.', 1)[1]] = float(density)
+        else:
+            extra_densities[name] = float(density)
+    extra_densities.update(scoped_densities) # scoped names override the names for every model
+    if len(extra_densities) == 0:
+        return None
+    return extra_densities
+
+
+def _has_param(model, name):
+    # check whether model has the (weight-normalized) parameter of a dotted name
+    module_name, param_name = name.rsplit(".", 1)
+    module = model
+    for attr in module_name.split("."):
+        module = getattr(module, attr, None)
+        if module is None:
+            return False
+    return hasattr(module, param_name) or hasattr(module, param_name+"_v")
+
+
+## Based on lpcnet.py [https://github.com/mozilla/LPCNet/blob/master/src/lpcnet.py]
+## Modified to accomodate PyTorch model, n-stages of sparsification, and additional matrices
+def block_mask(weight, densities, block_size=BLOCK_SIZE, keep_diag=False):
+    """FUNCTION TO COMPUTE BLOCK-SPARSE MASK OF A GATED WEIGHT MATRIX
+
+    The matrix is split into len(densities) gates along the output dimension. Within each gate,
+    blocks of block_size consecutive outputs x 1 input are scored by their energy, and the blocks above
+    the (1-density) quantile are kept, i.e., the horizontal block structure that is computed for each
+    block_size outputs simultaneously in real-time.
+
+    Args:
+        weight (Tensor): weight matrix (n_gates*N x M) or 1x1 convolution weight (n_gates*N x M x 1)
+        densities (list): density of each gate
+        block_size (int): number of outputs in a block
+        keep_diag (bool): flag to always keep the diagonal of each gate (recurrent matrix, N == M),
+            the diagonal is not included in the block scores
+
+    Return:
+        (Tensor): mask with the shape of weight
+    """
+    nb = len(densities)
+    N = weight.shape[0] // nb
+    M = weight[0].numel() # inputs (x kernel size) of convolution
+    N_blk = N // block_size
+    A = weight.reshape(nb, N, M)
+    if keep_diag:
+        A = A - torch.diag_embed(torch.diagonal(A, dim1=1, dim2=2))
+    #horizontal block structure in input part
+    S = torch.sum(A.transpose(1, 2).reshape(nb, M, N_blk, block_size)**2, -1).reshape(nb, -1)
+    n_blocks = S.shape[1]
+    thresh = S.new_empty(nb)
+    for k in range(nb):
+        # k-th smallest block energy instead of sorting all of the blocks
+        idx = min(max(round(n_blocks*(1-densities[k])), 0), n_blocks-1)
+        thresh[k] = torch.kthvalue(S[k], idx+1)[0]
+    mask = (S >= thresh.unsqueeze(-1)).reshape(nb, M, N_blk, 1).expand(-1, -1, -1, block_size)
+    mask = mask.reshape(nb, M, N).transpose(1, 2) # outputxinput
+    if keep_diag:
+        mask = mask | torch.eye(N, dtype=torch.bool, device=weight.device).unsqueeze(0)
+    return mask.reshape(weight.shape).to(weight.dtype)
+
+
+class BlockSparsity(nn.Module):
+    """MANAGER OF STAGED BLOCK-SPARSIFICATION OF MODEL WEIGHT MATRICES
+
+    The masks are kept as buffers and refreshed every interval iterations of the schedule, while in between,
+    the sparsified matrices are only multiplied in place by their current masks.
+    The recurrent matrix gru.weight_hh_l0 is always sparsified with the stage densities of each gate.
+    Additional matrices, e.g., gru.weight_ih_l0 or 1x1 convolutions of DualFC, are sparsified with the same block layout
+    towards their own target density, evenly split into the same number of stages.
+    For weight-normalized modules, the direction parameter (weight_v) is masked.
+    In data-parallel training, the masks of rank 0 are broadcast, so that all replicas keep identical masks.
+
+    Args:
+        model (nn.Module): model with the recurrent layer gru
+        t_starts (list): start iteration of each stage
+        t_ends (list): end iteration of each stage
+        densities (list): per-gate densities at the end of each stage of the recurrent matrix
+        interval (int): number of iterations between mask refreshes
+        extra_densities (dict): target density of additional parameters, e.g., {"gru.weight_ih_l0": 0.5}
+        block_size (int): number of outputs in a block
+    """
+
+    def __init__(self, model, t_starts, t_ends, densities, interval, extra_densities=None, block_size=BLOCK_SIZE):
+        super(BlockSparsity, self).__init__()
+        self.t_starts = t_starts
+        self.t_ends = t_ends
+        self.interval = interval
+        self.block_size = block_size
+        self.targets = []
+        self.initialized = False
+
+        p = model.gru.weight_hh_l0
+        self._add_target(model, "gru.weight_hh_l0", densities, len(densities), keep_diag=True)
+        if extra_densities is not None:
+            n_stage = len(t_starts)
+            for name, density in extra_densities.items():
+                if not _has_param(model, name):
+                    logging.warning("%s is not a parameter of %s, not sparsified" % (name, type(model).__name__))
+                    continue
+                n_gates = 1
+                if name.startswith("gru.weight_ih"):
+                    n_gates = p.shape[0] // p.shape[1]
+                self._add_target(model, name, [[x]*n_gates for x in stage_densities(density, n_stage)], n_gates)
+
+    def _add_target(self, model, name, densities, n_gates, keep_diag=False):
+        module_name, param_name = name.rsplit(".", 1)
+        module = model
+        for attr in module_name.split("."):
+            module = getattr(module, attr)
+        if hasattr(module, param_name+"_v"): # weight norm
+            param_name = param_name+"_v"
+        param = getattr(module, param_name)
+        if param.shape[0] % (n_gates*self.block_size) != 0:
+            raise ValueError("%s: %d outputs are not divisible into %d gates of %d-blocks" % (
+                name, param.shape[0], n_gates, self.block_size))
+        buffer_name = name.replace(".", "_") + "_mask"
+        self.register_buffer(buffer_name, torch.ones_like(param))
+        self.targets.append((name, param, buffer_name, densities, keep_diag))
+        logging.info("sparsify %s %s, gates: %d" % (name, str(tuple(param.shape)), n_gates))
+
+    def stage(self, iter_idx):
+        """Get index of the sparsification stage of an iteration"""
+        idx_stage = 0
+        while idx_stage < len(self.t_starts)-1 and iter_idx >= self.t_starts[idx_stage+1]:
+            idx_stage += 1
+        return idx_stage
+
+    @torch.no_grad()
+    def refresh(self, iter_idx):
+        """Recompute the masks with the scheduled densities of an iteration and apply them"""
+        idx_stage = self.stage(iter_idx)
+        t_start = self.t_starts[idx_stage]
+        t_end = self.t_ends[idx_stage]
+        logging.info('sparsify: %ld %ld %ld %ld' % (iter_idx, t_start, t_end, self.interval))
+        for name, param, buffer_name, densities, keep_diag in self.targets:
+            densities_p = densities[idx_stage-1] if idx_stage > 0 else [None]*len(densities[idx_stage])
+            density = [scheduled_density(iter_idx, t_start, t_end, densities[idx_stage][k], densities_p[k]) \
+                            for k in range(len(densities[idx_stage]))]
+            logging.info('%s: %s %s %s' % (name, str(densities_p), str(densities[idx_stage]), str(density)))
+            mask = block_mask(param, density, block_size=self.block_size, keep_diag=keep_diag)
+            if is_distributed():
+                # masks of rank 0 on all ranks, block-energy ties may be broken differently on other cpus
+                dist.broadcast(mask, 0)
+            getattr(self, buffer_name).copy_(mask)
+            param.mul_(mask)
+        self.initialized = True
+
+    @torch.no_grad()
+    def apply_masks(self):
+        """Multiply the sparsified matrices by their current masks"""
+        for _, param, buffer_name, _, _ in self.targets:
+            param.mul_(getattr(self, buffer_name))
+
+    def step(self, iter_idx):
+        """Sparsify after an optimizer step of an iteration
+
+        Args:
+            iter_idx (int): iteration index
+        """
+        if iter_idx < self.t_starts[0]:
+            return
+        t_start = self.t_starts[self.stage(iter_idx)]
+        if not self.initialized or (iter_idx-t_start) % self.interval == 0:
+            # first step after resuming has no mask yet
+            self.refresh(iter_idx)
+        else:
+            self.apply_masks()